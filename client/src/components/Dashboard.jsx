@@ -8,6 +8,7 @@ import { useNavigate, useLocation } from 'react-router-dom';
 import axios from 'axios';
 import { Line } from 'react-chartjs-2';
 import { Chart as ChartJS, CategoryScale, LinearScale, PointElement, LineElement, Title, Tooltip, Legend } from 'chart.js';
+import useLiveFeed from '../hooks/useLiveFeed';
 
 // Set default credentials for Axios to include cookies in requests (important for authentication)
 axios.defaults.withCredentials = true;
@@ -54,6 +55,7 @@ function Dashboard({ account, logout, subscription }) {
   const [voteResult, setVoteResult] = useState('');
   const [graphLoading, setGraphLoading] = useState(true);
   const [graphError, setGraphError] = useState(null);
+  const { prices: livePrices, heads: liveHeads } = useLiveFeed();
 
   // Fetch existing contracts
   useEffect(() => {
@@ -113,6 +115,25 @@ function Dashboard({ account, logout, subscription }) {
     return () => { mounted = false; };
   }, [account, selectedCoin]);
 
+  // Keep today's point on the graph in step with live price ticks
+  const livePrice = livePrices[selectedCoin]?.price;
+  useEffect(() => {
+    if (!livePrice) return;
+    setGraphData((current) => {
+      if (!current) return current;
+      const today = new Date().toISOString().slice(0, 10);
+      const labels = [...current.labels];
+      const data = [...current.datasets[0].data];
+      if (labels[labels.length - 1] === today) {
+        data[data.length - 1] = parseFloat(livePrice);
+      } else {
+        labels.push(today);
+        data.push(parseFloat(livePrice));
+      }
+      return { labels, datasets: [{ ...current.datasets[0], data }] };
+    });
+  }, [livePrice]);
+
   const requireLoginOrSubscription = (returnPath = '/dashboard') => {
     if (!account) {
       navigate(`/login?return=${returnPath}`);
@@ -554,7 +575,7 @@ function Dashboard({ account, logout, subscription }) {
       <div className="mt-4">
         <h2 className="text-xl font-bold text-primary">Top Coins</h2>
         <div className="grid grid-cols-1 sm:grid-cols-2 md:grid-cols-4 gap-4">
-          {topCoins.map((coin) => (
+          {topCoins.map((listed) => ({ ...listed, ...(livePrices[listed.id] || {}) })).map((coin) => (
             <div key={coin.id} className="bg-gray-800 p-4 rounded">
               <img src={coin.image} alt={coin.name} className="w-8 h-8 mb-2" />
               <p>{coin.name}: ${coin.price}</p>
@@ -563,6 +584,12 @@ function Dashboard({ account, logout, subscription }) {
             </div>
           ))}
         </div>
+        {/* Latest blocks pushed by the server's chain head tracker */}
+        <p className="mt-2 text-sm text-gray-400">
+          {liveHeads.ethereum && `ETH block #${liveHeads.ethereum.block} · Gas ${(liveHeads.ethereum.gas_price / 1e9).toFixed(1)} Gwei`}
+          {liveHeads.solana && ` · SOL slot #${liveHeads.solana.slot}`}
+          {liveHeads.bitcoin && ` · BTC block #${liveHeads.bitcoin.height}`}
+        </p>
       </div>
 
       <div className="mt-4">
@@ -1,9 +1,11 @@
 import React, { useState, useEffect } from 'react';
 import { useNavigate } from 'react-router-dom';
+import useLiveFeed from '../hooks/useLiveFeed';
 
 function Prices() {
   const [topCoins, setTopCoins] = useState([]);
   const navigate = useNavigate();
+  const { prices: livePrices } = useLiveFeed();
 
   useEffect(() => {
     // Switch between localhost and Render based on environment
@@ -17,6 +19,9 @@ function Prices() {
       .catch((err) => console.error('Error fetching prices:', err));
   }, []);
 
+  // Live ticks from the server replace the fields that changed, no more polling
+  const coins = topCoins.map((coin) => ({ ...coin, ...(livePrices[coin.id] || {}) }));
+
   const handleTrade = (coinName) => {
     // Navigate to dashboard and pass the coin name for graph selection, no auto-fill
     navigate('/dashboard', { state: { selectedCoin: coinName.toLowerCase() } });
@@ -26,7 +31,7 @@ function Prices() {
     <div className="prices-page p-6 bg-gray-900 text-white min-h-screen">
       <h1 className="text-3xl font-bold mb-8 text-purple-400">Cryptocurrency Prices</h1>
       <div className="grid grid-cols-1 sm:grid-cols-2 lg:grid-cols-3 gap-6">
-        {topCoins.map((coin) => (
+        {coins.map((coin) => (
           <div key={coin.id} className="coin-card bg-gray-800 p-4 rounded-lg shadow-lg">
             <div className="flex items-center justify-between">
               <div className="flex items-center">
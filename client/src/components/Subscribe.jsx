@@ -77,16 +77,27 @@ function Subscribe({ account, subscription, setSubscription }) {
   };
 
   // Notify backend of ETH transaction
-  const notifyBackend = async (plan, txHash) => {
-    const response = await axios.post(
-      `${BASE_URL}/api/subscribe_eth`,
-      new URLSearchParams({ plan, tx_hash: txHash }),
-      {
-        headers: { 'Content-Type': 'application/x-www-form-urlencoded' },
-        withCredentials: true,
-      },
-    );
-    if (!response.data.success) {
+  // The backend records it and answers 202 while it waits for confirmations, pollSubscriptionStatus picks up the upgrade
+  const notifyBackend = async (plan, txHash, attempt = 0) => {
+    let response;
+    try {
+      response = await axios.post(
+        `${BASE_URL}/api/subscribe_eth`,
+        new URLSearchParams({ plan, tx_hash: txHash }),
+        {
+          headers: { 'Content-Type': 'application/x-www-form-urlencoded' },
+          withCredentials: true,
+        },
+      );
+    } catch (error) {
+      // 404 means the node hasn't seen the transaction yet, give it a few seconds
+      if (error.response?.status === 404 && attempt < 5) {
+        await new Promise((resolve) => setTimeout(resolve, 3000));
+        return notifyBackend(plan, txHash, attempt + 1);
+      }
+      throw new Error(error.response?.data?.error || 'Backend verification failed.');
+    }
+    if (!response.data.success && !response.data.pending) {
       throw new Error(response.data.error || 'Backend verification failed.');
     }
   };
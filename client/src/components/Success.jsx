@@ -13,7 +13,10 @@ function Success({ account, setAccount, setSubscription }) {
 
   // Confirm subscription on load
   // Verifies the subscription with the backend and updates the subscription state.
+  // The plan is set by Stripe's webhook, so it can take a few seconds, ask again while it's pending.
   useEffect(() => {
+    let timer;
+    let attempts = 0;
     const confirmSubscription = async () => {
       try {
         const plan = new URLSearchParams(window.location.search).get('plan');
@@ -25,7 +28,10 @@ function Success({ account, setAccount, setSubscription }) {
           setSubscription(plan);
           const storedAccount = localStorage.getItem('account');
           if (storedAccount && !account) setAccount(storedAccount);
-          setTimeout(() => navigate('/dashboard'), 2000);
+          timer = setTimeout(() => navigate('/dashboard'), 2000);
+        } else if (response.data.pending && attempts < 20) {
+          attempts += 1;
+          timer = setTimeout(confirmSubscription, 2000);
         } else {
           console.error('Subscription confirmation failed:', response.data);
         }
@@ -34,6 +40,7 @@ function Success({ account, setAccount, setSubscription }) {
       }
     };
     confirmSubscription();
+    return () => clearTimeout(timer);
   }, [navigate, account, setAccount, setSubscription]);
 
   return (
@@ -0,0 +1,52 @@
+// useLiveFeed.js
+// Purpose: Subscribes to the backend's Server-Sent Events feed for live prices and chain heads.
+// The server sends one full snapshot, then only the fields that changed, so we merge diffs into state.
+
+import { useState, useEffect } from 'react';
+
+const BASE_URL = window.location.hostname === 'localhost' ? 'http://127.0.0.1:8080' : 'https://blockspeak.onrender.com';
+
+// Applies a {section: {key: {field: value} | null}} diff on top of the current state
+function applyChanges(state, changes) {
+  const next = { ...state };
+  Object.entries(changes).forEach(([section, items]) => {
+    const merged = { ...(next[section] || {}) };
+    Object.entries(items).forEach(([key, fields]) => {
+      if (fields === null) {
+        delete merged[key]; // Key disappeared on the server
+      } else {
+        merged[key] = { ...(merged[key] || {}), ...fields };
+      }
+    });
+    next[section] = merged;
+  });
+  return next;
+}
+
+export default function useLiveFeed() {
+  const [feed, setFeed] = useState({ prices: {}, heads: {} });
+
+  useEffect(() => {
+    const source = new EventSource(`${BASE_URL}/api/stream`);
+    let version = 0;
+
+    source.addEventListener('snapshot', (e) => {
+      const data = JSON.parse(e.data);
+      version = data.version;
+      setFeed({ prices: {}, heads: {}, ...data.state });
+    });
+
+    source.addEventListener('diff', (e) => {
+      const data = JSON.parse(e.data);
+      if (data.version <= version) return; // Already included in the snapshot
+      version = data.version;
+      setFeed((current) => applyChanges(current, data.changes));
+    });
+
+    source.onerror = () => console.warn('Live feed disconnected, the browser will retry');
+
+    return () => source.close();
+  }, []);
+
+  return feed;
+}
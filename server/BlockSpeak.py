@@ -11,39 +11,119 @@ import json  # For working with JSON data like API responses to React
 import re  # Regular expressions for parsing contract requests like send 1 eth to...
 import sqlite3  # Our simple database for users to store emails and subscriptions
 import requests  # For fetching external data like news and prices from APIs
-import feedparser  # Parses RSS feeds for news like CoinTelegraph
+import threading  # Guards the one-time table setup
 import logging  # Logs for debugging to see whats happening when things break
-import stripe  # Payment processing for subscriptions via Stripe for card payments
-import uuid  # Unique IDs for nonces to secure login with MetaMask
 import time  # For adding delays in retries
+import functools  # Keeps view names on rate-limited routes
 from decimal import Decimal  # floating-point precision
 from dotenv import load_dotenv  # Loads secrets from .env file to keep keys safe
 from flask import Flask  # Flask is our API engine
 from flask import request  # Grabs data from frontend requests
-from flask import session  # Stores temporary data like nonces
 from flask import jsonify  # Makes JSON responses for React
 from flask import redirect  # HTTP redirect for non-API requests to frontend
 from flask import send_from_directory  # Serve static files like images
-from web3 import Web3 as Web3Py  # Blockchain interaction to connect to Hardhat or Mainnet
-from openai import OpenAI  # ChatGPT integration for answering crypto questions
+from flask import Response  # Streams Server-Sent Events to the frontend
+from flask import g  # Per-request start time for metrics
 from datetime import datetime  # Time handling for caching data
 from datetime import timedelta  # Helps calculate time differences
 from datetime import timezone  # Ensures times are UTC
 from flask_cors import CORS  # Lets React talk to us from different domains
-from web3.exceptions import ContractLogicError  # Catches blockchain reverts like Already a member
 from flask_login import LoginManager  # Manages user sessions
 from flask_login import UserMixin  # Base class for User objects
 from flask_login import login_user  # Logs users in
 from flask_login import login_required  # Restricts routes to logged-in users
 from flask_login import logout_user  # Logs users out
 from flask_login import current_user  # Tracks the current logged-in user
-from eth_account.messages import encode_defunct  # For MetaMask login signing messages
-from werkzeug.security import generate_password_hash  # Secures passwords
-from werkzeug.security import check_password_hash  # Checks hashed passwords
 import random  # For randomizing titles and attributes
 from requests.exceptions import HTTPError
-from redis import Redis
-from flask_session import Session
+from forecast import init_forecast_tables  # Price history and forecast tables
+from forecast import get_forecast  # O(1) lookup of precomputed price forecasts
+from forecast import refresh_forecasts  # Scheduled history refresh and model fit
+from balance_history import init_balance_tables  # Daily balance and day -> block tables
+from balance_history import get_balance_history  # Incremental per-address balance history
+from balance_history import block_for_day  # Day -> block lookups, memoized and shared with the balance chart
+from block_index import ethereum_index  # Local block timestamp index for Ethereum
+from block_index import solana_index  # Local slot timestamp index for Solana
+from analytics import analytics_cache  # Short TTL cache of per-address wallet stats
+from analytics import bulk_wallet_analytics  # Chain-grouped, batched wallet stats
+from sol_signatures import init_signature_tables  # Per-address Solana signature cursors
+from sol_signatures import count_signatures  # Exact, incremental Solana tx counts
+from portfolio import get_token_portfolio  # Batched ERC-20 balances ranked by USD value
+from portfolio import format_top_tokens  # Short top_tokens string for the dashboard
+from btc import is_valid_btc_address  # Local base58check and bech32/bech32m validation
+from btc import get_btc_balances  # Bitcoin balances cached until the next block
+from btc import set_height_source  # Lets the BTC cache follow our chain head tracker
+from chain_head import ChainHeadTracker  # Background polls for latest block, gas and slot
+from live_feed import LiveFeed  # Pushes price and block diffs to every connected browser
+from live_feed import TICK_SECONDS  # How often the live feed looks for changes
+from market_data import COINCAP_API_URL  # CoinCap base URL, overridable for benchmarks
+from indexer import init_indexer_tables  # DAO registry and indexed contract event tables
+from indexer import register_contract  # Adds a deployed contract to the log scan
+from indexer import record_dao  # Saves DAOs we deploy
+from indexer import is_indexed  # Is the indexer caught up for an address
+from indexer import get_indexed_proposals  # Proposals and tallies from indexed logs
+from indexer import get_contract_states  # Payments and cancellations from indexed logs
+from indexer import run_forever as run_indexer  # The --index loop
+from db import connect as db_connect  # sqlite3.connect with per-statement timings
+from metrics import registry as metrics_registry  # In-process counters and histograms
+from metrics import upstream_session  # Pooled HTTP session that times every upstream call
+from metrics import cache_collector  # Exposes TTLCache hit ratios
+from metrics import ensure_writer as ensure_metrics_writer  # Per-worker snapshot thread
+from metrics import render as render_metrics  # Prometheus text summed across workers
+from market_data import price_cache  # CoinCap spot price cache
+from btc import height_cache  # Bitcoin height cache
+from btc import balance_cache  # Bitcoin balances by address
+from tracing import start_trace  # Per-request trace ID, spans and profiler
+from tracing import finish_trace  # Reports slow requests
+from tracing import span  # Times work that isnt an upstream call or query
+from tracing import install_log_ids  # Adds trace_id to log records
+from lazy import LazyObject  # Builds heavy clients on first use
+from lazy import lazy_module  # Imports heavy libraries on first use
+from cache import TTLCache  # Coin graph cache shared by every user
+from entitlements import init_entitlement_tables  # Processed Stripe events and per-user plans
+from entitlements import plan_for  # In-process plan lookup, never calls Stripe
+from entitlements import parse_event as parse_stripe_event  # Stripe-Signature check and JSON parse
+from entitlements import apply_event as apply_stripe_event  # Idempotent subscription sync
+from entitlements import WebhookSignatureError  # Bad or missing webhook signature
+from entitlements import STRIPE_PRICES  # Plan -> Stripe price for Checkout
+from payments import init_payment_tables  # ETH payment ledger keyed by tx_hash
+from payments import submit_payment  # Records a payment, or returns the stored one
+from payments import payment_result  # Response for a ledger row
+from payments import PaymentRejected  # Submissions that dont get a ledger row
+from payments import PaymentConfirmer  # Batched receipt checks once per block
+from payments import CONFIRMATIONS as PAYMENT_CONFIRMATIONS  # Blocks on top of a payment on Mainnet
+from jobs import init_job_tables  # Durable background job queue
+from jobs import enqueue as enqueue_job  # Producers for --cron and --auto
+from jobs import register as register_job  # Handler per job kind
+from jobs import PermanentJobError  # Jobs that go straight to the dead letters
+from jobs import JobWorkers  # The --worker N consumers
+from jobs import queue_stats  # --jobs
+from jobs import retry_dead  # --jobs --retry-dead
+from sessions import make_store  # Redis or SQLite key-value store for sessions and nonces
+from sessions import ServerSessionInterface  # Session data server-side, only an ID in the cookie
+from sessions import NonceStore  # One-time MetaMask login nonces
+from history import init_history_tables  # Append-only query history table
+from history import record_query  # Queues a history row for the batch writer
+from history import get_history  # Newest-first history pages
+from history import PAGE_SIZE as HISTORY_PAGE_SIZE  # Default /api/history page
+from history import MAX_PAGE_SIZE as HISTORY_MAX_PAGE_SIZE  # Largest /api/history page
+from crypto_pool import hash_password  # PBKDF2 in the crypto process pool
+from crypto_pool import verify_password  # Checks a login and rehashes outdated hashes
+from crypto_pool import recover_signer  # MetaMask signature recovery on the fastest backend
+from crypto_pool import CryptoBusy  # Crypto queue full, answer 503
+from limits import Admission  # Tier-aware rate limits and load shedding
+from limits import make_buckets  # Redis or in-process token buckets
+from limits import breakers as upstream_breakers  # Circuit breakers fed by upstream metrics
+from limits import in_flight  # Requests this process is handling
+from limits import rejection_body  # 429 body
+from llm import LLMGateway  # Model routing, concurrency, token budgets and accounting for OpenAI
+from llm import make_provider as make_llm_provider  # OpenAI, or the mock with LLM_PROVIDER=mock
+from rpc_pool import pool_from_env as rpc_pool_from_env  # Ethereum providers with health scoring and failover
+from rpc_pool import web3_provider  # Puts web3 on the provider pool
+
+# Heavy libraries load on first use, so cold starts and --cron/--auto only pay for what they touch
+feedparser = lazy_module("feedparser")  # Parses RSS feeds for news like CoinTelegraph
+web3_exceptions = lazy_module("web3.exceptions")  # ContractLogicError for blockchain reverts like Already a member
 
 # Load .env to keep this file out of Git!
 # Our secrets like API keys and private keys live here, pointing to skillchain_contracts folder
@@ -58,30 +138,60 @@ NETWORK = os.getenv("NETWORK", "hardhat")  # Defaults to hardhat if not set in .
 ALCHEMY_API_KEY = os.getenv("ALCHEMY_API_KEY")
 INFURA_KEY = os.getenv("INFURA_KEY")
 
-# Web3 provider setup with Alchemy as primary and Infura as fallback for mainnet
-if NETWORK == "hardhat":
-    w3 = Web3Py(Web3Py.HTTPProvider("http://127.0.0.1:8545"))  # Connects to local Hardhat node
-    logging.info("Connected to Hardhat local network")
-elif NETWORK == "mainnet":  # connects to mainnet if not hardhat
-    try:
-        # Try Alchemy first
-        w3 = Web3Py(Web3Py.HTTPProvider(f"https://eth-mainnet.g.alchemy.com/v2/{ALCHEMY_API_KEY}"))
-        if w3.is_connected():
-            logging.info("Connected to Ethereum Mainnet via Alchemy")
-        else:
-            raise ConnectionError("Alchemy connection failed")
-    except Exception as e:
-        logging.warning(f"Alchemy connection failed: {str(e)}. Falling back to Infura.")
-        if not INFURA_KEY:
-            raise ValueError("INFURA_KEY must be set for fallback")
-        w3 = Web3Py(Web3Py.HTTPProvider(f"https://mainnet.infura.io/v3/{INFURA_KEY}"))
-        if w3.is_connected():
-            logging.info("Connected to Ethereum Mainnet via Infura")
-        else:
-            raise ConnectionError("Infura connection failed")
-else:
+if NETWORK not in ("hardhat", "mainnet"):
     raise ValueError(f"Unsupported NETWORK: {NETWORK}")  # Oops, typo in .env? Crash with a message!
 
+# Every Ethereum node we can use, ranked per call by live latency, errors and block lag (rpc_pool.py)
+# Reads are hedged to the runner-up after the best providers p95, writes stick to one provider
+# ETH_RPC_URLS="alchemy=https://...,infura=https://..." replaces the defaults, like two local stubs for testing
+eth_rpc = rpc_pool_from_env(os.getenv("ETH_RPC_URLS"), [
+    ("hardhat", os.getenv("ETH_RPC_URL", "http://127.0.0.1:8545")),  # Local Hardhat node (or a stub)
+] if NETWORK == "hardhat" else [
+    ("alchemy", f"https://eth-mainnet.g.alchemy.com/v2/{ALCHEMY_API_KEY}"),
+    ("infura", f"https://mainnet.infura.io/v3/{INFURA_KEY}" if INFURA_KEY else None),  # Only with a key
+], session=upstream_session)  # Provider calls show up in upstream metrics and feed the circuit breakers
+
+
+def connect_web3():
+    # web3 on the provider pool, runs on first use of w3
+    # No startup probe, the pool scores providers from real calls and its own background probe
+    from web3 import Web3 as Web3Py  # Blockchain interaction to connect to Hardhat or Mainnet
+    logging.info(f"Ethereum RPC pool on {NETWORK}: {', '.join(provider.name for provider in eth_rpc.providers)}")
+    return Web3Py(web3_provider(eth_rpc))
+
+
+w3 = LazyObject(connect_web3, "w3")
+
+# Solana JSON-RPC endpoint, overridable so benchmarks can use a local stub
+SOL_RPC_URL = os.getenv("SOL_RPC_URL", f"https://solana-mainnet.g.alchemy.com/v2/{ALCHEMY_API_KEY}")
+
+# Block timestamp indexes answer "which block was at time T" without scanning the chain
+# They load saved samples from disk here and only touch the network on first use
+eth_block_index = ethereum_index(w3)
+sol_block_index = solana_index(SOL_RPC_URL)
+
+# Chain head tracker: background polls keep the latest block, gas price, slot and BTC height in memory
+# User questions and fee logic read from it instead of calling upstream every time
+# Override the URLs (for example with http://127.0.0.1:8545) to run against Hardhat or a stub node
+chain_heads = ChainHeadTracker({
+    "ethereum": os.getenv("ETH_HEAD_RPC_URL") or eth_rpc,
+    "solana": os.getenv("SOL_HEAD_RPC_URL", SOL_RPC_URL),
+    "bitcoin": os.getenv("BTC_HEAD_URL", "https://blockchain.info/latestblock"),
+})
+set_height_source(lambda: chain_heads.value("bitcoin", "height"))
+
+# The contract event indexer (python BlockSpeak.py --index) scans logs from this node, defaults to the pool
+INDEXER_RPC_URL = os.getenv("INDEXER_RPC_URL")
+
+
+def current_gas_price():
+    # Gas price for our own transactions, live from the chain head tracker on Mainnet
+    if NETWORK == "mainnet":
+        tracked = chain_heads.value("ethereum", "gas_price")
+        if tracked:
+            return tracked
+    return w3.to_wei("50", "gwei")  # Hardhat, or the tracker has nothing fresh yet
+
 
 # ETH payment address where users send ETH for subscriptions
 ETH_PAYMENT_ADDRESS = os.getenv("ETH_PAYMENT_ADDRESS")
@@ -90,6 +200,20 @@ if not ETH_PAYMENT_ADDRESS:
 # ETH subscription prices as test values, adjust for live ETH price like $2000 per ETH
 BASIC_PLAN_ETH = 0.005  # About $10 in test mode
 PRO_PLAN_ETH = 0.025    # About $50 in test mode
+PAYMENTS_RPC_URL = os.getenv("PAYMENTS_RPC_URL")  # Node the payment ledger checks transactions on, defaults to the pool
+
+
+def payments_rpc_url():
+    return PAYMENTS_RPC_URL or eth_rpc
+
+
+# Confirms submitted ETH payments in the background, one receipt batch per block
+# Block numbers come from the chain head tracker, Hardhat mines a block per transaction so one confirmation is enough
+payment_confirmer = PaymentConfirmer(
+    payments_rpc_url,
+    head_block=lambda: chain_heads.value("ethereum", "block"),
+    confirmations=1 if NETWORK == "hardhat" else PAYMENT_CONFIRMATIONS,
+)
 
 # Set up Flask app
 app = Flask(__name__)
@@ -99,18 +223,108 @@ app.secret_key = os.getenv("SECRET_KEY")  # Must be set in .env
 APP_ENV = os.getenv("APP_ENV", "development")
 
 
-# Session configuration: Use Flask's default cookie-based sessions
+# Session configuration: server-side sessions, the cookie only holds a session ID
 app.config['SESSION_COOKIE_NAME'] = 'blockspeak_session'
 app.config['SESSION_PERMANENT'] = False
 app.config['SESSION_COOKIE_SAMESITE'] = "None"
 app.config['SESSION_COOKIE_SECURE'] = True  # Set to False for local non-HTTPS testing
 
-# No flask_session initialization; Flask handles sessions natively
+# Redis shares sessions and nonces across workers and nodes, without REDIS_URL they live in users.db
+REDIS_URL = os.getenv("REDIS_URL")
+# Connects on the first request with a cookie
+session_store = LazyObject(lambda: make_store(REDIS_URL), "session_store")
+app.session_interface = ServerSessionInterface(session_store)
+nonce_store = NonceStore(session_store)
+
+# Rate limits and LLM token budgets share REDIS_URL with sessions, so every worker and node draws from the same buckets
+rate_buckets = make_buckets(REDIS_URL)
+admission = Admission(rate_buckets, upstream_breakers, in_flight)
 
 
 # CORS setup - Move this before routes and ensure it applies to all responses
 cors = CORS(app, supports_credentials=True, resources={r"/*": {"origins": ["http://localhost:3000", "https://blockspeak.co"]}})
-logging.basicConfig(level=logging.INFO)
+install_log_ids()
+# Trace ID ties log lines to one request
+logging.basicConfig(level=logging.INFO, format="%(levelname)s:%(name)s:[%(trace_id)s] %(message)s")
+
+# Request metrics, registered before the other hooks so the timing covers them
+# Latency per route lands in the in-process registry and /metrics sums it across gunicorn workers
+METRICS_TOKEN = os.getenv("METRICS_TOKEN")  # Optional bearer token for the scrape endpoint
+metrics_registry.add_collector(cache_collector({"analytics": analytics_cache, "prices": price_cache,
+                                                "btc_height": height_cache, "btc_balances": balance_cache}))
+
+
+@app.before_request
+def start_request_timer():
+    ensure_metrics_writer()  # Once per worker process
+    g.request_started = time.perf_counter()
+
+
+@app.after_request
+def record_request_metrics(response):
+    # after_request hooks run in reverse, so this one runs after the header hooks below
+    started = g.pop("request_started", None)
+    if started is not None and not request.environ.get("blockspeak.async"):  # asgi.py times its own routes
+        # Templates, not raw paths, keep labels bounded
+        route = request.url_rule.rule if request.url_rule else "unmatched"
+        labels = (("route", route), ("method", request.method), ("status", str(response.status_code)))
+        metrics_registry.observe("http_request_duration_seconds", time.perf_counter() - started, labels)
+    return response
+
+
+# Load shedding looks at how many requests this process is already handling
+@app.before_request
+def enter_in_flight():
+    if request.environ.get("blockspeak.async"):
+        return  # asgi.py counts its own routes
+    in_flight.enter()
+    g.in_flight = True
+
+
+@app.teardown_request
+def leave_in_flight(error=None):
+    if g.pop("in_flight", None):
+        in_flight.leave()
+
+
+def rate_limited(group, cost=None):
+    # Admission control for an expensive route, goes under @login_required
+    # cost() returns how many tokens a request takes when it isnt 1, like a bulk lookup
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapper(*args, **kwargs):
+            rejection = admission.check(group, current_user.id, current_user.subscription, cost() if cost else 1)
+            if rejection:
+                return jsonify(rejection_body(*rejection)), 429, {"Retry-After": str(rejection[1])}
+            return view(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+# Request tracing, see tracing.py for switching spans and the profiler on at runtime
+@app.before_request
+def begin_trace():
+    if request.environ.get("blockspeak.async"):
+        return  # asgi.py traces its own routes
+    route = request.url_rule.rule if request.url_rule else "unmatched"
+    g.trace = start_trace(f"{request.method} {route}", request.headers.get("X-Request-ID"), sample_thread=True)
+
+
+@app.after_request
+def tag_trace(response):
+    trace = g.get("trace")
+    if trace:
+        response.headers["X-Trace-Id"] = trace.trace_id
+        trace.skip = response.is_streamed  # SSE streams stay open on purpose
+        g.trace_status = response.status_code
+    return response
+
+
+@app.teardown_request
+def end_trace(error=None):
+    trace = g.pop("trace", None)
+    if trace:
+        finish_trace(trace, g.get("trace_status", 500 if error else None))
 
 @app.after_request
 def add_cors_headers(response):
@@ -126,8 +340,18 @@ ALCHEMY_API_KEY = os.getenv("ALCHEMY_API_KEY")  # For blockchain connections on
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")    # For ChatGPT answers
 STRIPE_SECRET_KEY = os.getenv("STRIPE_SECRET_KEY")  # For Stripe payments on backend
 STRIPE_PUBLISHABLE_KEY = os.getenv("STRIPE_PUBLISHABLE_KEY")  # Frontend Stripe key, React uses this
-stripe.api_key = STRIPE_SECRET_KEY  # Set Stripe API key for payments
-client = OpenAI(api_key=OPENAI_API_KEY)  # Initialize OpenAI client for ChatGPT
+
+
+def setup_stripe(stripe):
+    # Runs once when stripe is first imported
+    stripe.api_key = STRIPE_SECRET_KEY  # Set Stripe API key for payments
+    # Stripe calls show up in upstream metrics
+    stripe.default_http_client = stripe.RequestsClient(session=upstream_session)
+
+
+stripe = lazy_module("stripe", setup=setup_stripe)  # Payment processing for subscriptions via Stripe for card payments
+# Every ChatGPT call, models and budgets live in llm.py
+llm = LLMGateway(make_llm_provider(OPENAI_API_KEY), rate_buckets)
 
 # Set up Flask-Login for managing user sessions
 # Keeps track of whos logged in with email or MetaMask address
@@ -204,17 +428,16 @@ def apply_csp(response):
 # Database setup: Simple SQLite for users, blog posts, and contracts
 def init_db():
     # Creates the users, blog_posts, and contracts tables if they dont exist
-    # Stores user email, password, subscription, Stripe ID, query history
+    # Stores user email, password, subscription, Stripe ID, query history lives in history.py
     # NEW: Also stores blog posts for dynamic content and contracts for recurring payments
-    conn = sqlite3.connect("users.db")
+    conn = db_connect("users.db")
     c = conn.cursor()
     c.execute('''CREATE TABLE IF NOT EXISTS users (
         id INTEGER PRIMARY KEY AUTOINCREMENT,
         email TEXT UNIQUE NOT NULL,
         password TEXT NOT NULL,
         subscription TEXT DEFAULT 'free',
-        stripe_customer_id TEXT,
-        history TEXT DEFAULT '[]')''')
+        stripe_customer_id TEXT)''')
     c.execute('''CREATE TABLE IF NOT EXISTS blog_posts (
         id INTEGER PRIMARY KEY AUTOINCREMENT,
         title TEXT NOT NULL,
@@ -243,12 +466,47 @@ def init_db():
     conn.commit()
     conn.close()
 
-init_db()  # Runs the setup right away
+
+storage_lock = threading.Lock()
+storage_ready = threading.Event()
+
+
+def init_storage():
+    # Creates every table once per process, before the first request or job that needs them
+    if storage_ready.is_set():
+        return
+    with storage_lock:
+        if storage_ready.is_set():
+            return
+        init_db()
+        init_history_tables()  # After users, it moves old history blobs out of it
+        init_entitlement_tables()  # After users too, it carries over plans paid before webhooks
+        init_payment_tables()  # ETH payment ledger
+        init_job_tables()  # Background job queue
+        init_forecast_tables()  # Price history and forecasts live in the same database
+        init_balance_tables()  # Wallet balance history too
+        init_signature_tables()  # And Solana signature cursors
+        init_indexer_tables()  # And DAOs plus indexed contract events
+        storage_ready.set()
+
+
+@app.before_request
+def ensure_storage():
+    init_storage()  # A flag check after the first request
+    payment_confirmer.ensure_started()  # Once per worker, picks up payments left pending by a restart
+
+
+def create_app():
+    # App factory for WSGI servers, gunicorn "BlockSpeak:create_app()"
+    # Routes are registered on the module-level app at import, this does the disk setup up front
+    # Heavy clients (w3, OpenAI, Stripe) still wait for the first request that needs them
+    init_storage()
+    return app
 
 
 # NEW: Seed the blog posts table with sample data (optional)
 def seed_blog_posts():
-    conn = sqlite3.connect("users.db")
+    conn = db_connect("users.db")
     c = conn.cursor()
     # Check if posts already exist to avoid duplicates
     c.execute("SELECT COUNT(*) FROM blog_posts")
@@ -266,14 +524,32 @@ def seed_blog_posts():
 
 # seed_blog_posts()  # Seed the database with initial posts (optional, remove if not needed)
 
+
+HISTORY_SHOWN = 3  # Latest questions on the dashboard, /api/history pages through the rest
+
 # User class for Flask-Login
 class User(UserMixin):
     # Represents a user with email, subscription, Stripe ID, and history
-    def __init__(self, email, subscription="free", stripe_customer_id=None, history=None):
+    def __init__(self, email, subscription="free", stripe_customer_id=None, user_id=None):
         self.email = email  # Email or wallet address like 0x123...
-        self.subscription = subscription  # Free, basic, or pro
+        self._subscription = subscription  # users.subscription as loaded, only used before the user has an id
         self.stripe_customer_id = stripe_customer_id  # For Stripe payments
-        self.history = json.loads(history) if history else []  # Users query history, last 3 questions
+        self.id = user_id  # users.id, history rows are keyed by it so changing the email keeps them
+        self._history = None  # Latest questions, read on first use
+
+    @property
+    def history(self):
+        # The HISTORY_SHOWN latest questions, one indexed query and only when a route asks
+        if self._history is None:
+            self._history = get_history(self.id, HISTORY_SHOWN)
+        return self._history
+
+    @property
+    def subscription(self):
+        # Free, basic, or pro from the entitlement cache, so a Stripe cancellation applies on the next request
+        if self.id is None:
+            return self._subscription
+        return plan_for(self.id)
 
     def get_id(self):
         return self.email  # Unique ID is the email or wallet address
@@ -281,27 +557,19 @@ class User(UserMixin):
 @login_manager.user_loader
 def load_user(email):
     # Loads a user from the database by email when Flask-Login needs them
-    conn = sqlite3.connect("users.db")
+    conn = db_connect("users.db")
     c = conn.cursor()
-    c.execute("SELECT email, subscription, stripe_customer_id, history FROM users WHERE email = ?", (email,))
+    c.execute("SELECT email, subscription, stripe_customer_id, id FROM users WHERE email = ?", (email,))
     user_data = c.fetchone()  # Grabs one row if it exists
     conn.close()
     if user_data:
         return User(user_data[0], user_data[1], user_data[2], user_data[3])  # Returns User object
     return None  # No user found? Return None
 
-def save_user_history(email, history):
-    # Saves the users last 3 queries to the database
-    conn = sqlite3.connect("users.db")
-    c = conn.cursor()
-    c.execute("UPDATE users SET history = ? WHERE email = ?", (json.dumps(history[:3]), email))  # Keeps only 3 latest
-    conn.commit()
-    conn.close()
-
 # Utility Functions: Helpers for our logic
 def is_bitcoin_address(text):
-    # Checks if text is a Bitcoin address, starts with 1, 3, or bc1, length 26 to 35
-    return (text.startswith("1") or text.startswith("3") or text.startswith("bc1")) and 26 <= len(text) <= 35
+    # Checks if text is a real Bitcoin address, including its checksum, without any network call
+    return is_valid_btc_address(text)
 
 def is_wallet_address(text):
     # Checks if text is an Ethereum address, starts with 0x, length 42
@@ -311,6 +579,23 @@ def is_solana_address(text):
     # Checks if text is a Solana address, length 44, specific characters
     return len(text) == 44 and all(c in "123456789ABCDEFGHJKLMNPQRSTUVWXYZabcdefghijkmnopqrstuvwxyz" for c in text)
 
+
+def parse_question_date(text):
+    # Finds a YYYY-MM-DD date in a question and returns it as a UTC timestamp at the end of that day
+    match = re.search(r"(\d{4}-\d{2}-\d{2})", text)
+    if not match:
+        return None
+    try:
+        day = datetime.strptime(match.group(1), "%Y-%m-%d").replace(tzinfo=timezone.utc)
+    except ValueError:
+        return None
+    return int((day + timedelta(days=1)).timestamp()) - 1
+
+
+# normalize_question results kept as the intent in query_history, other text is free-form
+QUERY_INTENTS = {"price_prediction", "gas", "solana block", "solana price", "bitcoin block", "ethereum block",
+                 "ethereum price"}
+
 def normalize_question(text):
     # Turns user questions into standard formats for easier handling
     # Helps decide how to answer like price, analytics, or ChatGPT
@@ -338,62 +623,110 @@ def normalize_question(text):
 
 def get_crypto_price(coin):
     # Fetches current price from CoinCap API like Bitcoin or Ethereum
-    url = f"https://api.coincap.io/v2/assets/{coin}"
+    url = f"{COINCAP_API_URL}/assets/{coin}"
     try:
-        response = requests.get(url).json()
+        response = upstream_session.get(url).json()
         price = float(response["data"]["priceUsd"])
         return f"{price:.2f}"  # Returns price formatted to 2 decimals
     except Exception as e:
         app.logger.error(f"CoinCap price fetch failed for {coin}: {str(e)}")
         return "Price unavailable"  # Fallback if API fails
 
+
+TRENDS_FALLBACK = [{"topic": "Error", "snippet": "Could not fetch trends", "link": "#"}]
+
+
+def trending_from_assets(assets):
+    # Turns a CoinCap assets list into the home page trend cards
+    return [{"topic": coin["name"], "snippet": f"Volume 24h: ${int(float(coin['volumeUsd24Hr'])):,}",
+             "link": f"https://coincap.io/assets/{coin['id']}"} for coin in assets]
+
 def get_trending_crypto():
     # Gets top 3 trending coins by volume from CoinCap
     # Used for the home page trends section
-    url = "https://api.coincap.io/v2/assets?limit=3"
+    url = f"{COINCAP_API_URL}/assets?limit=3"
     try:
-        response = requests.get(url).json()
-        return [{"topic": coin["name"], "snippet": f"Volume 24h: ${int(float(coin['volumeUsd24Hr'])):,}", "link": f"https://coincap.io/assets/{coin['id']}"} for coin in response["data"]]
+        response = upstream_session.get(url).json()
+        return trending_from_assets(response["data"])
     except Exception as e:
         app.logger.error(f"CoinCap trending fetch failed: {str(e)}")
-        return [{"topic": "Error", "snippet": "Could not fetch trends", "link": "#"}]  # Fallback if API fails
+        return TRENDS_FALLBACK  # Fallback if API fails
 
 def get_x_profiles():
     # Returns static list of crypto X profiles
     # Used for the home page social links
     return [{"name": "Bitcoin", "link": "https://x.com/Bitcoin"}, {"name": "Ethereum", "link": "https://x.com/ethereum"}, {"name": "Solana", "link": "https://x.com/Solana"}] #preserving comment
 
+
+NEWS_FEEDS = os.getenv("NEWS_FEEDS", "https://coinjournal.net/feed/,https://cointelegraph.com/rss").split(",")
+# Pretends to be a browser
+NEWS_HEADERS = {"User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) "
+                              "Chrome/91.0.4472.124 Safari/537.36"}
+NEWS_FALLBACK = [{"title": "News unavailable, check back later!", "link": "#"}]
+
+
+def news_from_feed(content):
+    # Top 3 news items from raw RSS bytes, or None if the feed is empty
+    feed = feedparser.parse(content)
+    if not feed.entries:
+        return None
+    return [{"title": entry.title, "link": entry.link} for entry in feed.entries[:3]]
+
 def get_news_items():
     # Fetches latest crypto news from RSS feeds
     # Used for the home page news section
-    headers = {"User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36"}  # Pretends to be a browser
-    urls = ["https://coinjournal.net/feed/", "https://cointelegraph.com/rss"]
-    for url in urls:
+    for url in NEWS_FEEDS:
         for attempt in range(3):  # Retry up to 3 times per URL
             try:
-                response = requests.get(url, headers=headers, timeout=30)  # Increased timeout to 30 seconds
+                # Increased timeout to 30 seconds
+                response = upstream_session.get(url, headers=NEWS_HEADERS, timeout=30)
                 response.raise_for_status()  # Checks if request worked
-                feed = feedparser.parse(response.content)
-                if not feed.entries:
+                with span("rss:parse"):
+                    items = news_from_feed(response.content)
+                if not items:
                     app.logger.warning(f"No entries found in feed: {url}")
                     continue  # Skip if no news items
                 app.logger.info(f"Successfully fetched news from {url}")
-                return [{"title": entry.title, "link": entry.link} for entry in feed.entries[:3]]  # Top 3 news items
+                return items
             except requests.RequestException as e:
                 app.logger.error(f"Attempt {attempt + 1} for {url} failed: {str(e)}")
                 if attempt < 2:  # Dont sleep on the last attempt
-                    time.sleep(2 ** attempt)  # Exponential backoff: 1s, then 2s
+                    with span("rss:backoff"):
+                        time.sleep(2 ** attempt)  # Exponential backoff: 1s, then 2s
     app.logger.error("All RSS fetch attempts failed for both URLs.")
-    return [{"title": "News unavailable, check back later!", "link": "#"}]  # Fallback if all feeds fail
+    return NEWS_FALLBACK  # Fallback if all feeds fail
+
+
+def wallet_chain(address):
+    # Tells which chain an address belongs to, or None if it is not one we support
+    if is_bitcoin_address(address):
+        return "bitcoin"
+    if is_wallet_address(address):
+        return "ethereum"
+    if is_solana_address(address):
+        return "solana"
+    return None
 
 def get_wallet_analytics(address):
     # Gets wallet stats for Bitcoin, Ethereum, or Solana
-    # Used for the analytics section on the dashboard
+    # Used for the analytics section on the dashboard, cached for a minute per address
+    cached = analytics_cache.get(address)
+    if cached:
+        return cached
+    analytics = fetch_wallet_analytics(address)
+    if "error" not in analytics:
+        analytics_cache.set(address, analytics)
+    return analytics
+
+
+def fetch_wallet_analytics(address):
+    # Fetches fresh wallet stats from the chains upstream, no caching here
     analytics = {}
     if is_bitcoin_address(address):
         try:
-            btc_url = f"https://api.blockcypher.com/v1/btc/main/addrs/{address}/balance"
-            btc_response = requests.get(btc_url).json()
+            btc_response = get_btc_balances([address]).get(address)  # Free if we fetched it this block
+            if btc_response is None:
+                return {"error": "Could not fetch Bitcoin analytics"}
             balance_btc = btc_response.get("balance", 0) / 1e8  # Converts satoshis to BTC
             tx_count = btc_response.get("n_tx", 0)
             analytics = {"chain": "Bitcoin", "balance": f"{balance_btc:.8f} BTC", "tx_count": tx_count, "gas_spent": "N/A", "top_tokens": "N/A", "hot_wallet": "Yes" if tx_count > 50 else "No"}
@@ -407,30 +740,47 @@ def get_wallet_analytics(address):
             balance_wei = int(balance_wei)  # Convert from HexBytes to int
             balance_eth = balance_wei / 1e18  # Converts Wei to ETH
             tx_count = w3.eth.get_transaction_count(checksum_address)
+            # Sent transactions since the end of the UTC day 30 days ago, from the nonce at its last block
+            # The day's block is resolved once and stored, the balance chart starts at the same day
+            month_ago = (datetime.now(timezone.utc) - timedelta(days=30)).strftime("%Y-%m-%d")
+            try:
+                month_ago_block = block_for_day(w3, "ethereum", month_ago, index=eth_block_index)
+                tx_count_30d = tx_count
+                if month_ago_block:
+                    tx_count_30d -= w3.eth.get_transaction_count(checksum_address, block_identifier=month_ago_block)
+            except Exception as e:
+                # Non-archive node, or it is lagging
+                app.logger.warning(f"30 day tx count failed for {address}: {str(e)}")
+                tx_count_30d = None
             top_tokens = "ETH only"  # Default for Hardhat
-            if NETWORK == "mainnet":  # Only check USDT on Mainnet
-                usdt_contract = "0xdAC17F958D2ee523a2206206994597C13D831ec7"
-                usdt_balance = w3.eth.call({"to": usdt_contract, "data": f"0x70a08231000000000000000000000000{checksum_address[2:]}"})/ 1e6  # USDT balance call
-                top_tokens = f"ETH, USDT ({usdt_balance:.2f})" if usdt_balance > 0 else "ETH only"
-            analytics = {"chain": "Ethereum", "balance": f"{balance_eth:.4f} ETH", "tx_count": tx_count, "gas_spent": "N/A", "top_tokens": top_tokens, "hot_wallet": "Yes" if tx_count > 50 else "No"}
+            holdings = []
+            if NETWORK == "mainnet":  # Token contracts only exist on Mainnet
+                # Every registry token in one JSON-RPC batch, ranked by cached USD prices
+                holdings = get_token_portfolio(eth_rpc, checksum_address, eth_balance=balance_eth)
+                top_tokens = format_top_tokens(holdings)
+            analytics = {"chain": "Ethereum", "balance": f"{balance_eth:.4f} ETH", "tx_count": tx_count,
+                         "tx_count_30d": tx_count_30d, "gas_spent": "N/A", "top_tokens": top_tokens,
+                         "tokens": holdings, "hot_wallet": "Yes" if tx_count > 50 else "No"}
             return analytics
         except Exception as e:
             app.logger.error(f"ETH analytics failed for {address}: {str(e)}")
             return {"error": "Could not fetch Ethereum analytics"}
     elif is_solana_address(address):
         try:
-            sol_url = f"https://solana-mainnet.g.alchemy.com/v2/{ALCHEMY_API_KEY}"
+            sol_url = SOL_RPC_URL
             payload = {"jsonrpc": "2.0", "method": "getBalance", "params": [address], "id": 1}
-            balance_response = requests.post(sol_url, json=payload).json()
+            balance_response = upstream_session.post(sol_url, json=payload).json()
             if "result" not in balance_response:
                 return {"error": "Invalid Solana address"}
             balance_sol = balance_response["result"]["value"] / 1e9  # Converts lamports to SOL
-            payload = {"jsonrpc": "2.0", "method": "getSignaturesForAddress", "params": [address, {"limit": 1000}], "id": 1}
-            tx_response = requests.post(sol_url, json=payload).json()
-            if "result" not in tx_response:
+            # Exact count from our signature cursor, only signatures newer than the last scan are fetched
+            signatures = count_signatures(sol_url, address)
+            if not signatures:
                 return {"error": "Could not fetch Solana tx data"}
-            tx_count = len(tx_response["result"])
-            analytics = {"chain": "Solana", "balance": f"{balance_sol:.4f} SOL", "tx_count": tx_count, "gas_spent": "N/A", "top_tokens": "SOL only", "hot_wallet": "Yes" if tx_count > 50 else "No"}
+            tx_count = signatures["tx_count"]
+            analytics = {"chain": "Solana", "balance": f"{balance_sol:.4f} SOL", "tx_count": tx_count,
+                         "tx_count_exact": signatures["exact"], "gas_spent": "N/A", "top_tokens": "SOL only",
+                         "hot_wallet": "Yes" if tx_count > 50 else "No"}
             return analytics
         except Exception as e:
             app.logger.error(f"SOL analytics failed: {str(e)}")
@@ -440,66 +790,122 @@ def get_wallet_analytics(address):
     return analytics
 
 def get_historical_balance(address, chain):
-    # Gets 30-day balance history for a wallet, not implemented yet as a future feature!
-    pass
+    # Gets 30-day balance history for a wallet from the incremental balance store
+    # Only Ethereum has archive balances we can query by block, Bitcoin and Solana come later
+    if chain.lower() not in ["ethereum", "eth"] or not is_wallet_address(address):
+        return {"error": "Balance history is only available for Ethereum addresses"}
+    try:
+        history = get_balance_history(w3, address, chain="ethereum", index=eth_block_index)
+        return {"chain": "Ethereum", "address": w3.to_checksum_address(address), "history": history}
+    except Exception as e:
+        app.logger.error(f"Balance history failed for {address}: {str(e)}")
+        return {"error": "Could not fetch balance history"}
 
-def get_top_coins():
-    # Fetches top coins from CoinCap with caching
-    # Used for the top coins section on the dashboard
-    cache_file = "top_coins_cache.json"
-    now = datetime.now(timezone.utc)
-    if os.path.exists(cache_file):
-        with open(cache_file, "r") as f:
+
+TOP_COINS_CACHE = "top_coins_cache.json"
+TOP_COINS_FALLBACK = [{"id": "bitcoin", "name": "Bitcoin", "price": "N/A", "market_cap": "N/A", "change": 0,
+                       "image": "https://assets.coincap.io/assets/icons/btc@2x.png", "graph_color": "#2ecc71"},
+                      {"id": "ethereum", "name": "Ethereum", "price": "N/A", "market_cap": "N/A", "change": 0,
+                       "image": "https://assets.coincap.io/assets/icons/eth@2x.png", "graph_color": "#2ecc71"},
+                      {"id": "solana", "name": "Solana", "price": "N/A", "market_cap": "N/A", "change": 0,
+                       "image": "https://assets.coincap.io/assets/icons/sol@2x.png", "graph_color": "#2ecc71"},
+                      {"id": "tether", "name": "Tether", "price": "N/A", "market_cap": "N/A", "change": 0,
+                       "image": "https://assets.coincap.io/assets/icons/usdt@2x.png", "graph_color": "#2ecc71"}]
+
+
+def read_top_coins_cache(max_age):
+    # Cached top coins if the file is younger than max_age, otherwise None
+    if os.path.exists(TOP_COINS_CACHE):
+        with open(TOP_COINS_CACHE, "r") as f:
             cached = json.load(f)
-        if datetime.fromisoformat(cached["timestamp"]) > now - timedelta(minutes=15):
-            return cached["data"]  # Returns cached data if less than 15 mins old
+        if datetime.fromisoformat(cached["timestamp"]) > datetime.now(timezone.utc) - max_age:
+            return cached["data"]
+    return None
+
+
+def write_top_coins_cache(coins):
+    # Saves fresh top coins for every worker to share
+    with open(TOP_COINS_CACHE, "w") as f:
+        json.dump({"data": coins, "timestamp": datetime.now(timezone.utc).isoformat()}, f)
+
+
+def top_coins_from_assets(all_coins):
+    # Builds the dashboard coin cards: BTC, ETH, SOL and the next biggest coin
     coin_ids = ["bitcoin", "ethereum", "solana"]
     coins = []
-    url = "https://api.coincap.io/v2/assets"
+    for coin_id in coin_ids:
+        coin_data = next((c for c in all_coins if c["id"] == coin_id), None)
+        if coin_data:
+            change = float(coin_data["changePercent24Hr"])
+            coins.append({"id": coin_data["id"], "name": coin_data["name"],
+                          "image": f"https://assets.coincap.io/assets/icons/{coin_data['symbol'].lower()}@2x.png",
+                          "price": f"{float(coin_data['priceUsd']):.2f}",
+                          "market_cap": f"{int(float(coin_data['marketCapUsd'])):,}",
+                          "change": round(change, 2), "graph_color": "#2ecc71" if change > 0 else "#e74c3c"})
+    other_coins = [c for c in all_coins[:10] if c["id"] not in coin_ids]
+    if other_coins:
+        random_coin = other_coins[0]
+        change = float(random_coin["changePercent24Hr"])
+        coins.append({"id": random_coin["id"], "name": random_coin["name"],
+                      "image": f"https://assets.coincap.io/assets/icons/{random_coin['symbol'].lower()}@2x.png",
+                      "price": f"{float(random_coin['priceUsd']):.2f}",
+                      "market_cap": f"{int(float(coin_data['marketCapUsd'])):,}",
+                      "change": round(change, 2), "graph_color": "#2ecc71" if change > 0 else "#e74c3c"})
+    return coins
+
+
+def get_top_coins(max_age=timedelta(minutes=15)):
+    # Fetches top coins from CoinCap with caching
+    # Used for the top coins section on the dashboard, and by the live feed with a shorter max_age
+    cached = read_top_coins_cache(max_age)
+    if cached is not None:
+        return cached  # Returns cached data if less than 15 mins old
+    url = f"{COINCAP_API_URL}/assets"
     try:
-        response = requests.get(url).json()
-        all_coins = response["data"]
-        for coin_id in coin_ids:
-            coin_data = next((c for c in all_coins if c["id"] == coin_id), None)
-            if coin_data:
-                coins.append({"id": coin_data["id"], "name": coin_data["name"], "image": f"https://assets.coincap.io/assets/icons/{coin_data['symbol'].lower()}@2x.png",
-                              "price": f"{float(coin_data['priceUsd']):.2f}", "market_cap": f"{int(float(coin_data['marketCapUsd'])):,}",
-                              "change": round(float(coin_data["changePercent24Hr"]), 2), "graph_color": "#2ecc71" if float(coin_data["changePercent24Hr"]) > 0 else "#e74c3c"})
-        other_coins = [c for c in all_coins[:10] if c["id"] not in coin_ids]
-        if other_coins:
-            random_coin = other_coins[0]
-            coins.append({"id": random_coin["id"], "name": random_coin["name"], "image": f"https://assets.coincap.io/assets/icons/{random_coin['symbol'].lower()}@2x.png",
-                          "price": f"{float(random_coin['priceUsd']):.2f}", "market_cap": f"{int(float(coin_data['marketCapUsd'])):,}",
-                          "change": round(float(random_coin["changePercent24Hr"]), 2), "graph_color": "#2ecc71" if float(random_coin["changePercent24Hr"]) > 0 else "#e74c3c"})
-        with open(cache_file, "w") as f:
-            json.dump({"data": coins, "timestamp": now.isoformat()}, f)  # Caches new data
+        response = upstream_session.get(url).json()
+        coins = top_coins_from_assets(response["data"])
+        write_top_coins_cache(coins)  # Caches new data
         return coins
     except Exception as e:
         app.logger.error(f"CoinCap top coins failed: {str(e)}")
-        return [{"id": "bitcoin", "name": "Bitcoin", "image": "https://assets.coincap.io/assets/icons/btc@2x.png", "price": "N/A", "market_cap": "N/A", "change": 0, "graph_color": "#2ecc71"},
-                {"id": "ethereum", "name": "Ethereum", "image": "https://assets.coincap.io/assets/icons/eth@2x.png", "price": "N/A", "market_cap": "N/A", "change": 0, "graph_color": "#2ecc71"},
-                {"id": "solana", "name": "Solana", "image": "https://assets.coincap.io/assets/icons/sol@2x.png", "price": "N/A", "market_cap": "N/A", "change": 0, "graph_color": "#2ecc71"},
-                {"id": "tether", "name": "Tether", "image": "https://assets.coincap.io/assets/icons/usdt@2x.png", "price": "N/A", "market_cap": "N/A", "change": 0, "graph_color": "#2ecc71"}]
+        return TOP_COINS_FALLBACK
+
+
+def coin_graph_url(coin_id):
+    # CoinCap daily history for the last 7 days
+    now = datetime.now(timezone.utc)
+    start = int((now - timedelta(days=7)).timestamp() * 1000)
+    end = int(now.timestamp() * 1000)
+    return f"{COINCAP_API_URL}/assets/{coin_id}/history?interval=d1&start={start}&end={end}"
+
+
+def coin_graph_from_history(response):
+    # Turns a CoinCap history answer into graph dates and prices, flat zeros if CoinCap has nothing
+    if "data" not in response or not response["data"]:
+        now = datetime.now(timezone.utc)
+        dates = [(now - timedelta(days=x)).strftime("%Y-%m-%d") for x in range(7)][::-1]
+        prices = [0] * 7
+    else:
+        prices_data = response["data"]
+        dates = [datetime.fromtimestamp(p["time"] / 1000).strftime("%Y-%m-%d") for p in prices_data]
+        prices = [float(p["priceUsd"]) for p in prices_data]
+    return {"dates": dates, "prices": prices}
+
+
+COIN_GRAPH_TTL = 300  # Graphs are daily prices, 5 minutes is plenty fresh
+coin_graph_cache = TTLCache(ttl=COIN_GRAPH_TTL)  # Shared by every user instead of stored in each session
+metrics_registry.add_collector(cache_collector({"coin_graph": coin_graph_cache}))
 
 def get_coin_graph(coin_id):
     # Fetches 7-day price history for a coin
     # Used for the price graph on the dashboard
-    cache_key = f"coin_graph_{coin_id}"
-    if cache_key in session and session[cache_key]["timestamp"] > datetime.now(timezone.utc) - timedelta(minutes=5):
-        return session[cache_key]["data"]  # Returns cached graph if less than 5 mins old
-    url = f"https://api.coincap.io/v2/assets/{coin_id}/history?interval=d1&start={(int((datetime.now(timezone.utc) - timedelta(days=7)).timestamp() * 1000))}&end={(int(datetime.now(timezone.utc).timestamp() * 1000))}"
+    graph_data = coin_graph_cache.get(coin_id)
+    if graph_data is not None:
+        return graph_data  # Returns cached graph if less than 5 mins old
     try:
-        response = requests.get(url).json()
-        if "data" not in response or not response["data"]:
-            now = datetime.now(timezone.utc)
-            dates = [(now - timedelta(days=x)).strftime("%Y-%m-%d") for x in range(7)][::-1]
-            prices = [0] * 7
-        else:
-            prices_data = response["data"]
-            dates = [datetime.fromtimestamp(p["time"] / 1000).strftime("%Y-%m-%d") for p in prices_data]
-            prices = [float(p["priceUsd"]) for p in prices_data]
-        graph_data = {"dates": dates, "prices": prices}
-        session[cache_key] = {"data": graph_data, "timestamp": datetime.now(timezone.utc)}
+        response = upstream_session.get(coin_graph_url(coin_id)).json()
+        graph_data = coin_graph_from_history(response)
+        coin_graph_cache.set(coin_id, graph_data)
         return graph_data
     except requests.RequestException as e:
         app.logger.error(f"Graph API request failed for {coin_id}: {str(e)}")
@@ -509,8 +915,9 @@ def get_coin_graph(coin_id):
         return jsonify({"error": f"Invalid response from price API for {coin_id}"}), 500
 
 def predict_price(coin, days):
-    # Predicts future price based on 30-day trend, not implemented yet as a future feature!
-    pass
+    # Predicts future price from the precomputed forecast table
+    # Forecasts are fitted on a schedule (python BlockSpeak.py --forecast), so this never calls CoinCap
+    return get_forecast(coin, days)
 
 
 @app.route("/api/prices", methods=["GET"])
@@ -519,6 +926,33 @@ def get_prices():
     return jsonify({"top_coins": top_coins})
 
 
+def live_prices():
+    # Price section of the live feed, keyed by coin id so diffs stay small
+    coins = get_top_coins(max_age=timedelta(seconds=TICK_SECONDS))
+    return {coin["id"]: coin for coin in coins if coin.get("price") != "N/A"}
+
+
+def live_heads():
+    # Chain head section of the live feed, straight from the tracker (no upstream calls here)
+    heads = {}
+    for chain in ["ethereum", "solana", "bitcoin"]:
+        head = chain_heads.get(chain)
+        if head:
+            heads[chain] = {k: v for k, v in head.items() if k != "updated"}
+    return heads
+
+
+live_feed = LiveFeed({"prices": live_prices, "heads": live_heads})
+
+
+@app.route("/api/stream")
+def live_stream():
+    # Server-Sent Events: one snapshot, then price ticks and new blocks as diffs
+    # Each open stream holds a worker thread, so run gunicorn with threaded (gthread) workers
+    return Response(live_feed.stream(), mimetype="text/event-stream",
+                    headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+
 @app.route("/api/blog-posts", methods=["GET"])
 def get_blog_posts():
     """API endpoint to fetch all blog posts with pagination."""
@@ -528,7 +962,7 @@ def get_blog_posts():
         per_page = 10  # Fixed number of posts per page
 
         # Connect to database
-        conn = sqlite3.connect("users.db")
+        conn = db_connect("users.db")
         c = conn.cursor()
 
         # Fetch paginated posts with category and tags
@@ -574,7 +1008,7 @@ def get_blog_posts():
 @app.route("/api/blog-posts/<slug>", methods=["GET"])
 def get_blog_post(slug):
     """API endpoint to fetch a single blog post by slug."""
-    conn = sqlite3.connect("users.db")
+    conn = db_connect("users.db")
     c = conn.cursor()
     c.execute("SELECT title, content, teaser, created_at, category, tags, image, inline_image FROM blog_posts WHERE slug = ?", (slug,))
     post = c.fetchone()
@@ -597,11 +1031,15 @@ def get_blog_post(slug):
 def get_nonce():
     # Gives React a nonce for secure MetaMask login
     # A random ID to ensure login is legit
-    nonce = str(uuid.uuid4())  # Generates a unique string
-    session["nonce"] = nonce  # Stores it in the session
+    nonce = nonce_store.issue()  # Random, single use, expires in 5 minutes, no session write
     app.logger.info(f"Generated nonce: {nonce}")
     return nonce  # Sends it to the frontend
 
+
+def busy_response():
+    # Too many logins at once, the crypto pool queue is full
+    return jsonify({"error": "Too many logins right now, try again in a moment"}), 503, {"Retry-After": "1"}
+
 @app.route("/api/register", methods=["POST"])
 def register():
     # Registers a new user with email and password
@@ -612,16 +1050,20 @@ def register():
         return jsonify({"error": "Invalid email"}), 400  # Checks for valid email format
     if len(password) < 8:
         return jsonify({"error": "Password too short"}), 400  # Ensures password is strong
-    conn = sqlite3.connect("users.db")
+    try:
+        hashed_password = hash_password(password)  # Hashes password for security, in the crypto pool
+    except CryptoBusy:
+        return busy_response()
+    conn = db_connect("users.db")
     c = conn.cursor()
     try:
-        hashed_password = generate_password_hash(password)  # Hashes password for security
         c.execute("INSERT INTO users (email, password) VALUES (?, ?)", (email, hashed_password))
+        user_id = c.lastrowid
         conn.commit()
         customer = stripe.Customer.create(email=email)  # Creates a Stripe customer
         c.execute("UPDATE users SET stripe_customer_id = ? WHERE email = ?", (customer["id"], email))
         conn.commit()
-        user = User(email)
+        user = User(email, user_id=user_id)
         login_user(user)  # Logs them in right away
         return jsonify({"success": True, "message": "Registered!", "email": email})
     except sqlite3.IntegrityError:
@@ -637,12 +1079,24 @@ def login():
     # Checks credentials and sets up the session
     email = request.form.get("email")
     password = request.form.get("password")
-    conn = sqlite3.connect("users.db")
+    conn = db_connect("users.db")
     c = conn.cursor()
-    c.execute("SELECT email, password, subscription, stripe_customer_id, history FROM users WHERE email = ?", (email,))
+    c.execute("SELECT email, password, subscription, stripe_customer_id, id FROM users WHERE email = ?", (email,))
     user_data = c.fetchone()
     conn.close()
-    if user_data and check_password_hash(user_data[1], password):
+    if not user_data:
+        return jsonify({"error": "Wrong credentials"}), 400  # Bad email or password
+    try:
+        valid, new_hash = verify_password(user_data[1], password)
+    except CryptoBusy:
+        return busy_response()
+    if valid:
+        if new_hash:
+            # Stored with an older method or cost, upgrade it now that we know the password
+            conn = db_connect("users.db")
+            conn.execute("UPDATE users SET password = ? WHERE id = ?", (new_hash, user_data[4]))
+            conn.commit()
+            conn.close()
         user = User(user_data[0], user_data[2], user_data[3], user_data[4])
         login_user(user)
         return jsonify({"success": True, "message": "Logged in!", "email": email})
@@ -665,33 +1119,35 @@ def login_metamask():
     signature = data.get("signature")
     if not address or not signature:
         return jsonify({"error": "Missing data"}), 400
-    nonce = session.pop("nonce", None)
-    if not nonce:
+    nonce = data.get("nonce")
+    if not nonce_store.consume(nonce):  # Works whichever worker or node issued it, and only once
         return jsonify({"error": "Invalid nonce"}), 400
-    message = encode_defunct(text=f"Log in to BlockSpeak: {nonce}")
     try:
-        recovered_address = w3.eth.account.recover_message(message, signature=signature)
+        recovered_address = recover_signer(f"Log in to BlockSpeak: {nonce}", signature)
         if recovered_address.lower() == address.lower():
-            conn = sqlite3.connect("users.db")
+            conn = db_connect("users.db")
             c = conn.cursor()
-            c.execute("SELECT email, subscription, stripe_customer_id, history FROM users WHERE email = ?", (address,))
+            c.execute("SELECT email, subscription, stripe_customer_id, id FROM users WHERE email = ?", (address,))
             user_data = c.fetchone()
             if not user_data:
                 c.execute("INSERT INTO users (email, password) VALUES (?, ?)", (address, "metamask"))  # Dummy password for MetaMask users
                 conn.commit()
-                user = User(address)
+                user = User(address, user_id=c.lastrowid)
             else:
                 user = User(user_data[0], user_data[1], user_data[2], user_data[3])
             login_user(user)
             conn.close()
             return jsonify({"success": True, "address": address})
         return jsonify({"error": "Invalid signature"}), 401  # Signature doesnt match
+    except CryptoBusy:
+        return busy_response()
     except Exception as e:
         return jsonify({"error": "Login failed"}), 500
 
 
 @app.route("/api/create_contract", methods=["POST"])
 @login_required
+@rate_limited("chain_write")
 def create_contract():
     contract_request = request.form.get("contract_request")
     if not contract_request:
@@ -743,7 +1199,7 @@ def create_contract():
             "from": sender_address,
             "nonce": w3_py.eth.get_transaction_count(sender_address),
             "gas": 2000000,
-            "gasPrice": w3_py.to_wei("50", "gwei"),
+            "gasPrice": current_gas_price(),
             "value": total_value
         })
         
@@ -752,13 +1208,15 @@ def create_contract():
         tx_receipt = w3_py.eth.wait_for_transaction_receipt(tx_hash)
         contract_address = tx_receipt.contractAddress
         
-        conn = sqlite3.connect("users.db")
+        conn = db_connect("users.db")
         c = conn.cursor()
         c.execute("CREATE TABLE IF NOT EXISTS contracts (address TEXT PRIMARY KEY, owner TEXT, recipient TEXT, amount INTEGER, interval INTEGER, day INTEGER, next_payment INTEGER, is_active INTEGER DEFAULT 1)")
         c.execute("INSERT INTO contracts VALUES (?, ?, ?, ?, ?, ?, ?, ?)", 
                   (contract_address, sender_address, recipient, amount, interval, day, int(time.time()) + (interval or 2592000), 1))
         conn.commit()
         conn.close()
+        # Index its payments from the deploy block
+        register_contract(contract_address, "payment", tx_receipt.blockNumber)
         
         message = f"You sent {amount} ETH to {recipient}" + (f" every {frequency}" + (f" on the {day}" if day else "") if frequency != "once" else "")
         return jsonify({
@@ -796,7 +1254,7 @@ def send_payment():
         "from": sender_address,
         "nonce": w3_py.eth.get_transaction_count(sender_address),
         "gas": 200000,
-        "gasPrice": w3_py.to_wei("50", "gwei"),
+        "gasPrice": current_gas_price(),
         "value": total_value
     })
     
@@ -806,7 +1264,7 @@ def send_payment():
     
     if tx_receipt.status == 1:
         next_payment = contract.functions.nextPayment().call()
-        conn = sqlite3.connect("users.db")
+        conn = db_connect("users.db")
         c = conn.cursor()
         c.execute("UPDATE contracts SET next_payment = ? WHERE address = ?", (next_payment, contract_address))
         conn.commit()
@@ -818,16 +1276,26 @@ def send_payment():
 @app.route("/api/user_contracts", methods=["GET"])
 @login_required
 def get_user_contracts():
-    conn = sqlite3.connect("users.db")
+    conn = db_connect("users.db")
     c = conn.cursor()
     c.execute("SELECT address, recipient, amount, interval, day, next_payment FROM contracts WHERE owner = ?", (current_user.email,))
     contracts = [{"address": row[0], "recipient": row[1], "amount": row[2], "interval": row[3], "day": row[4], "next_payment": row[5]} for row in c.fetchall()]
     conn.close()
+    # Payments and cancellations made outside our endpoints only show up in the indexed logs
+    states = get_contract_states([contract["address"] for contract in contracts])
+    for contract in contracts:
+        state = states.get(contract["address"], {})
+        contract["payment_count"] = state.get("payment_count", 0)
+        contract["last_payment"] = state.get("last_payment")
+        contract["is_active"] = not state.get("cancelled", False)
+        if state.get("next_payment"):
+            contract["next_payment"] = state["next_payment"]
     return jsonify({"contracts": contracts})
 
 
 @app.route("/api/create_dao", methods=["POST"])
 @login_required
+@rate_limited("chain_write")
 def create_dao():
     dao_name = request.form.get("dao_name")
     dao_description = request.form.get("dao_description")
@@ -863,7 +1331,7 @@ def create_dao():
             "from": sender_address,
             "nonce": w3_py.eth.get_transaction_count(sender_address),
             "gas": 2000000,
-            "gasPrice": w3_py.to_wei("50", "gwei")
+            "gasPrice": current_gas_price()
         })
         app.logger.info("Signing transaction")
         signed_tx = w3_py.eth.account.sign_transaction(tx, sender_private_key)
@@ -872,6 +1340,7 @@ def create_dao():
         app.logger.info("Waiting for transaction receipt")
         receipt = w3_py.eth.wait_for_transaction_receipt(tx_hash)
         dao_address = receipt.contractAddress
+        record_dao(dao_address, dao_name, dao_description, sender_address, current_user.email, receipt.blockNumber)
         app.logger.info(f"DAO created: Name={dao_name}, Address={w3_py.to_checksum_address(dao_address)}")
         return jsonify({"message": f"DAO Created! Name: {dao_name}, Address={w3_py.to_checksum_address(dao_address)}"}), 201
     except FileNotFoundError:
@@ -906,7 +1375,7 @@ def join_dao():
                 "from": sender_address,
                 "nonce": w3_py.eth.get_transaction_count(sender_address),
                 "gas": 200000,
-                "gasPrice": w3_py.to_wei("50", "gwei")
+                "gasPrice": current_gas_price()
             })
             signed_tx = w3_py.eth.account.sign_transaction(tx, sender_private_key)
             app.logger.info("Sending join transaction")
@@ -917,7 +1386,7 @@ def join_dao():
                 return jsonify({"message": f"You are in! Welcome to the DAO at {checksum_dao_address}", "status": "success"}), 200
             else:
                 return jsonify({"error": "Transaction failed unexpectedly"}), 400
-        except ContractLogicError as cle:
+        except web3_exceptions.ContractLogicError as cle:
             revert_reason = str(cle).lower()
             if "already a member" in revert_reason:
                 app.logger.info(f"User {sender_address} tried to join DAO {checksum_dao_address} but is already a member")
@@ -955,7 +1424,7 @@ def create_proposal():
             "from": sender_address,
             "nonce": w3_py.eth.get_transaction_count(sender_address),
             "gas": 300000,
-            "gasPrice": w3_py.to_wei("50", "gwei")
+            "gasPrice": current_gas_price()
         })
         signed_tx = w3_py.eth.account.sign_transaction(tx, sender_private_key)
         tx_hash = w3_py.eth.send_raw_transaction(signed_tx.raw_transaction)
@@ -998,7 +1467,7 @@ def vote():
             "from": sender_address,
             "nonce": w3_py.eth.get_transaction_count(sender_address),
             "gas": 200000,
-            "gasPrice": w3_py.to_wei("50", "gwei")
+            "gasPrice": current_gas_price()
         })
         signed_tx = w3_py.eth.account.sign_transaction(tx, sender_private_key)
         tx_hash = w3_py.eth.send_raw_transaction(signed_tx.raw_transaction)
@@ -1016,6 +1485,10 @@ def get_proposals():
     dao_address = request.form.get("dao_address")
     if not dao_address or not is_wallet_address(dao_address):
         return jsonify({"error": "Valid DAO address required"}), 400
+    # Answer from the event indexer when it is caught up, one indexed query instead of a call per proposal
+    if is_indexed(dao_address):
+        return jsonify({"proposals": get_indexed_proposals(dao_address)}), 200
+    register_contract(dao_address, "dao")  # Not indexed yet, the indexer finds its deploy block and catches up
     try:
         w3_py = w3
         if not w3_py.is_connected():
@@ -1050,13 +1523,19 @@ def automatic_payment():
     contract_address = request.form.get("contract_address")
     if not is_wallet_address(contract_address):
         return jsonify({"error": "Invalid contract address"}), 400
-    
+    body, status = send_auto_payment(contract_address)
+    return jsonify(body), status
+
+
+def send_auto_payment(contract_address):
+    # Sends one recurring payment if it is due, returns (JSON body, status)
+    # Shared by the route and the auto_payment job
     w3_py = w3
     sender_address = ETH_PAYMENT_ADDRESS
     sender_private_key = os.getenv("MAINNET_PRIVATE_KEY")
     if not sender_private_key:
         app.logger.error("Missing MAINNET_PRIVATE_KEY")
-        return jsonify({"error": "Mainnet wallet not configured"}), 500
+        return {"error": "Mainnet wallet not configured"}, 500
     
     with open("../skillchain_contracts/artifacts/contracts/RecurringPayment.sol/RecurringPayment.json") as f:
         contract_data = json.load(f)
@@ -1066,13 +1545,13 @@ def automatic_payment():
     total_value = w3_py.to_wei(amount * 1.01, "ether")
     
     if contract.functions.nextPayment().call() > int(time.time()):
-        return jsonify({"message": "Payment not due yet"}), 200
+        return {"message": "Payment not due yet"}, 200
     
     tx = contract.functions.sendPayment().build_transaction({
         "from": sender_address,
         "nonce": w3_py.eth.get_transaction_count(sender_address),
         "gas": 200000,
-        "gasPrice": w3_py.to_wei("50", "gwei"),
+        "gasPrice": current_gas_price(),
         "value": total_value
     })
     
@@ -1082,17 +1561,17 @@ def automatic_payment():
         tx_receipt = w3_py.eth.wait_for_transaction_receipt(tx_hash)
         if tx_receipt.status == 1:
             next_payment = contract.functions.nextPayment().call()
-            conn = sqlite3.connect("users.db")
+            conn = db_connect("users.db")
             c = conn.cursor()
             c.execute("UPDATE contracts SET next_payment = ? WHERE address = ?", (next_payment, contract_address))
             conn.commit()
             conn.close()
             app.logger.info(f"Auto-payment successful for {contract_address}: {w3_py.to_hex(tx_hash)}")
-            return jsonify({"message": "Auto-payment sent!", "tx_hash": w3_py.to_hex(tx_hash)})
-        return jsonify({"error": "Auto-payment failed"}), 400
+            return {"message": "Auto-payment sent!", "tx_hash": w3_py.to_hex(tx_hash)}, 200
+        return {"error": "Auto-payment failed"}, 400
     except Exception as e:
         app.logger.error(f"Auto-payment failed for {contract_address}: {str(e)}")
-        return jsonify({"error": f"Auto-payment failed: {str(e)}"}), 500
+        return {"error": f"Auto-payment failed: {str(e)}"}, 500
 
 @app.route("/api/cancel_contract", methods=["POST"])
 @login_required
@@ -1116,7 +1595,7 @@ def cancel_contract():
         "from": sender_address,
         "nonce": w3_py.eth.get_transaction_count(sender_address),
         "gas": 100000,
-        "gasPrice": w3_py.to_wei("50", "gwei")
+        "gasPrice": current_gas_price()
     })
     
     signed_tx = w3_py.eth.account.sign_transaction(tx, sender_private_key)
@@ -1124,7 +1603,7 @@ def cancel_contract():
     tx_receipt = w3_py.eth.wait_for_transaction_receipt(tx_hash)
     
     if tx_receipt.status == 1:
-        conn = sqlite3.connect("users.db")
+        conn = db_connect("users.db")
         c = conn.cursor()
         c.execute("UPDATE contracts SET is_active = 0 WHERE address = ?", (contract_address,))
         conn.commit()
@@ -1133,21 +1612,62 @@ def cancel_contract():
     return jsonify({"error": "Cancellation failed"}), 400
 
 
-def run_auto_payments():
-    """Cron job to check and trigger payments."""
-    conn = sqlite3.connect("users.db")
+AUTO_PAYMENT_SCAN_SECONDS = 3600  # --auto looks for due contracts hourly, dedupe keys make a rescan free
+BLOG_POSTS_PER_DAY = 1  # --cron queues this many blog_post jobs a day
+
+
+def queue_auto_payments():
+    # Producer for --auto: one auto_payment job per due contract and billing period, returns how many were new
+    conn = db_connect("users.db")
     c = conn.cursor()
-    c.execute("SELECT address FROM contracts WHERE next_payment <= ? AND is_active = 1", (int(time.time()),))
-    contracts = [row[0] for row in c.fetchall()]
+    c.execute("SELECT address, next_payment FROM contracts WHERE next_payment <= ? AND is_active = 1",
+              (int(time.time()),))
+    due = dict(c.fetchall())
     conn.close()
-    
-    for contract_address in contracts:
-        response = requests.post(
-            "http://127.0.0.1:8080/api/automatic_payment" if APP_ENV == "development" else "https://blockspeak.onrender.com/api/automatic_payment",
-            data={"contract_address": contract_address},
-            headers={"Content-Type": "application/x-www-form-urlencoded"}
-        )
-        app.logger.info(f"Auto-payment result for {contract_address}: {response.json()}")
+
+    # Skip contracts the indexer saw cancelled or paid from outside BlockSpeak
+    states = get_contract_states(list(due))
+    now = int(time.time())
+    queued = 0
+    for address, next_payment in due.items():
+        state = states[address]
+        if state["cancelled"] or (state["next_payment"] or 0) > now:
+            continue
+        period = state["next_payment"] or next_payment
+        dedupe_key = f"auto_payment:{address}:{period}"
+        if enqueue_job("auto_payment", {"contract_address": address}, priority=10, dedupe_key=dedupe_key):
+            queued += 1
+    app.logger.info(f"Queued {queued} auto-payments, {len(due)} contracts due")
+    return queued
+
+
+def auto_payment_job(payload):
+    # Job handler, send_auto_payment checks the contract is still due so a rerun after a crash doesnt pay twice
+    contract_address = payload["contract_address"]
+    if not is_wallet_address(contract_address):
+        raise PermanentJobError("Invalid contract address")
+    body, status = send_auto_payment(contract_address)
+    if status >= 400:
+        raise RuntimeError(body["error"])
+    app.logger.info(f"Auto-payment result for {contract_address}: {body}")
+
+
+def queue_blog_posts(num_posts=BLOG_POSTS_PER_DAY):
+    # Producer for --cron: one blog_post job per post and day, so workers write them side by side
+    day = datetime.now(timezone.utc).strftime("%Y-%m-%d")
+    queued = sum(1 for i in range(num_posts) if enqueue_job("blog_post", dedupe_key=f"blog_post:{day}:{i}"))
+    app.logger.info(f"Queued {queued} blog posts for {day}")
+    return queued
+
+
+def blog_post_job(payload):
+    # Job handler, failures are logged inside add_bulk_blog_posts, raising here gets the job retried
+    if add_bulk_blog_posts(new_posts_only=True, num_posts=1) == 0:
+        raise RuntimeError("No blog post was added, see the log for why")
+
+
+register_job("auto_payment", auto_payment_job, max_running=1)  # One signer, so one nonce sequence at a time
+register_job("blog_post", blog_post_job)
 
 
 def add_bulk_blog_posts(new_posts_only=True, num_posts=1):
@@ -1156,13 +1676,14 @@ def add_bulk_blog_posts(new_posts_only=True, num_posts=1):
     Args:
         new_posts_only (bool): If True, appends posts; if False, replaces all posts.
         num_posts (int): Number of posts to generate (default to 1, max 5 for manual control).
+    Returns:
+        int: Number of posts added, 0 when generation failed.
     """
-    conn = sqlite3.connect("users.db")
+    conn = db_connect("users.db")
     c = conn.cursor()
+    added = 0  # Posts committed, returned for the blog_post job
     try:
-        # Initialize OpenAI client
-        client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
-        if not client:
+        if not llm.ready:
             raise ValueError("OpenAI API key not set in environment variables.")
 
         # Validate num_posts to ensure it stays between 1 and 5
@@ -1210,8 +1731,9 @@ def add_bulk_blog_posts(new_posts_only=True, num_posts=1):
             app.logger.info(f"Cleaned keyword for filename: {cleaned_keyword}")
             for attempt in range(retries):
                 try:
-                    response = requests.get(
-                        f"https://api.unsplash.com/photos/random?query={keyword}&client_id={api_key}",
+                    response = upstream_session.get(
+                        f"{os.getenv('UNSPLASH_API_URL', 'https://api.unsplash.com')}/photos/random"
+                        f"?query={keyword}&client_id={api_key}",
                         timeout=10
                     )
                     response.raise_for_status()
@@ -1223,7 +1745,7 @@ def add_bulk_blog_posts(new_posts_only=True, num_posts=1):
                         image_name = f"{cleaned_keyword}_{datetime.now().strftime('%Y%m%d%H%M%S')}{suffix}.jpg"
                         image_path = os.path.join("static/images", image_name)
                         os.makedirs(os.path.dirname(image_path), exist_ok=True)
-                        image_response = requests.get(image_url)
+                        image_response = upstream_session.get(image_url)
                         image_response.raise_for_status()
                         with open(image_path, "wb") as f:
                             f.write(image_response.content)
@@ -1264,15 +1786,13 @@ def add_bulk_blog_posts(new_posts_only=True, num_posts=1):
                 f"{'for premium insights' if is_premium else ''}. Format as:\n"
                 f"Content:\n<your content>\nTeaser:\n<teaser description>\nKeywords:\n<keyword1>,<keyword2>,<keyword3>,<keyword4>,<keyword5>"
             )
-            response = client.chat.completions.create(
-                model="gpt-4",
-                messages=[{"role": "user", "content": content_prompt}],
+            content = llm.complete(
+                "blog_post", content_prompt, caller="blog",
                 max_tokens=700 if not is_premium else 1200,
                 temperature=0.7,
                 frequency_penalty=0.5,
                 presence_penalty=0.5
             )
-            content = response.choices[0].message.content
             sections = content.split("\nTeaser:\n")
             post_content = sections[0].replace("Content:\n", "").strip()
             if len(sections) < 2:
@@ -1365,6 +1885,7 @@ def add_bulk_blog_posts(new_posts_only=True, num_posts=1):
             posts
         )
         conn.commit()
+        added = len(posts)
         app.logger.info(f"Successfully added {len(posts)} unique blog posts with images. Total posts: {current_count + len(posts)}")
         print(f"Successfully added {len(posts)} unique blog posts with images. Total posts: {current_count + len(posts)}")
     except sqlite3.IntegrityError as e:
@@ -1377,18 +1898,56 @@ def add_bulk_blog_posts(new_posts_only=True, num_posts=1):
         conn.rollback()
     finally:
         conn.close()
+    return added
 
 # Run with new_posts_only=False to replace existing posts above, run this one below for testing then comment out after run.
 # add_bulk_blog_posts(new_posts_only=True) 
 
 
-'''
 @app.route("/api/analytics/<address>")
 @login_required
+@rate_limited("analytics")
 def get_analytics(address):
     analytics = get_wallet_analytics(address)
     return jsonify(analytics) if "error" not in analytics else (jsonify({"error": analytics["error"]}), 400)
-'''
+
+
+def bulk_analytics_cost():
+    # One token per 50 addresses, so a 500-address lookup costs what 10 single ones do
+    addresses = (request.get_json(silent=True) or {}).get("addresses")
+    return 1 + len(addresses) // 50 if isinstance(addresses, list) else 1
+
+
+@app.route("/api/analytics/bulk", methods=["POST"])
+@login_required
+@rate_limited("analytics", cost=bulk_analytics_cost)
+def get_bulk_analytics():
+    # Wallet stats for up to 500 mixed BTC/ETH/SOL addresses in one call
+    # Addresses are grouped by chain and fetched with batched upstream requests
+    addresses = (request.get_json(silent=True) or {}).get("addresses")
+    if not isinstance(addresses, list) or not addresses:
+        return jsonify({"error": "Send a JSON body like {\"addresses\": [...]}"}), 400
+    if len(addresses) > 500:
+        return jsonify({"error": "At most 500 addresses per request"}), 400
+    groups = {"bitcoin": [], "ethereum": [], "solana": []}
+    results = {}
+    for address in addresses:
+        chain = wallet_chain(str(address).strip())
+        if chain:
+            groups[chain].append(str(address).strip())
+        else:
+            results[str(address)] = {"error": "Invalid wallet address"}
+    results.update(bulk_wallet_analytics(groups, eth_rpc, SOL_RPC_URL))
+    return jsonify({"results": results})
+
+
+@app.route("/api/balance_history/<address>")
+@login_required
+@rate_limited("analytics")
+def balance_history(address):
+    # Returns the 30-day daily balance chart for an Ethereum wallet
+    history = get_historical_balance(address, request.args.get("chain", "ethereum"))
+    return jsonify(history) if "error" not in history else (jsonify({"error": history["error"]}), 400)
 
 
 @app.route("/api/news")
@@ -1398,150 +1957,201 @@ def get_news_api():
     return jsonify(get_news_items())
 
 
-@app.route("/api/query", methods=["POST"])
-@login_required
-def query():
-    # Handles user questions about crypto with real-time blockchain data
-    # Answers with prices, block sizes, gas prices, or ChatGPT; no wallet analytics since users use MetaMask
-    user_question = request.form.get("question", "").strip()
-    normalized_question = normalize_question(user_question)
-    history = current_user.history
-    eth_url = f"https://eth-mainnet.g.alchemy.com/v2/{ALCHEMY_API_KEY}"
-    sol_url = f"https://solana-mainnet.g.alchemy.com/v2/{ALCHEMY_API_KEY}"
+def chat_plan(prompt, label, error, route="restate"):
+    # A query plan whose last step is one LLM call, route picks the model and limits in llm.py
+    # label names the branch in logs, error is what the user sees if the call fails (None shows the raw error)
+    return {"chat": {"route": route, "prompt": prompt}, "label": label, "error": error}
+
 
-    if "price" in normalized_question:
+def plan_query(user_question):
+    # Works out how to answer a question, doing only our own cheap lookups (forecasts, chain heads, block index)
+    # Returns {"answer": text} when that is enough, or the one slow upstream step still to run:
+    # {"price": coin}, {"trending": True} or a chat_plan. The Flask route and the async server both use this
+    normalized_question = normalize_question(user_question)
+    text = user_question.lower()
+
+    if normalized_question == "price_prediction":
+        # Answers price predictions from precomputed forecasts, like predict bitcoin price in 7 days
+        coin = "bitcoin" if "bitcoin" in text or "btc" in text else \
+               "ethereum" if "ethereum" in text or "eth" in text else \
+               "solana" if "solana" in text or "sol" in text else None
+        horizon = re.search(r"(\d+)\s*(day|week|month)", text)
+        days = 7  # Default to a week ahead
+        if horizon:
+            days = int(horizon.group(1)) * {"day": 1, "week": 7, "month": 30}[horizon.group(2)]
+        if not coin:
+            return {"answer": "Sorry, I can only predict Bitcoin, Ethereum, or Solana prices for now!"}
+        forecast = predict_price(coin, days)
+        if not forecast:
+            return {"answer": "Our price forecasts are still warming up - try again in a few minutes!"}
+        return {"answer": (f"Forecast for {coin.capitalize()} in {forecast['days']} days: ${forecast['price']:.2f} USD "
+                           f"(last close ${forecast['last_price']:.2f}, {forecast['model']} model). "
+                           "Not financial advice!")}
+    elif "price" in normalized_question:
         # Handles price queries for Bitcoin, Ethereum, or Solana
-        coin = "bitcoin" if "bitcoin" in user_question.lower() or "btc" in user_question.lower() else \
-               "ethereum" if "ethereum" in user_question.lower() or "eth" in user_question.lower() else \
-               "solana" if "solana" in user_question.lower() or "sol" in user_question.lower() else None
+        coin = "bitcoin" if "bitcoin" in text or "btc" in text else \
+               "ethereum" if "ethereum" in text or "eth" in text else \
+               "solana" if "solana" in text or "sol" in text else None
         if coin:
-            price = get_crypto_price(coin)
-            answer = f"Current {coin.capitalize()} price: ${price} USD."
-        else:
-            answer = "Sorry, I can only check Bitcoin, Ethereum, or Solana prices for now!"
-        history.insert(0, {"question": user_question, "answer": answer, "wallet_data": None})
+            return {"price": coin}
+        return {"answer": "Sorry, I can only check Bitcoin, Ethereum, or Solana prices for now!"}
     elif "trending" in normalized_question:
         # Returns trending crypto data from CoinCap
-        trends = get_trending_crypto()
-        answer = "Here is what is trending in crypto:\n" + "\n".join([f"{t['topic']} ({t['snippet']})" for t in trends])
-        history.insert(0, {"question": user_question, "answer": answer, "wallet_data": None})
+        return {"trending": True}
     elif "bitcoin block" in normalized_question:
-        # Fetches latest Bitcoin block height from blockchain.info
+        # Latest Bitcoin block height from the chain head tracker
+        error = "Something went wrong with Bitcoin block data - try again!"
         try:
-            btc_response = requests.get("https://blockchain.info/latestblock").json()
-            if "height" in btc_response:
-                block_number = btc_response["height"]
-                prompt = f"User asked: {user_question}. Latest Bitcoin block number is {block_number}. Answer simply."
-                ai_response = client.chat.completions.create(
-                    model="gpt-3.5-turbo",
-                    messages=[{"role": "user", "content": prompt}]
-                )
-                answer = ai_response.choices[0].message.content
-            else:
-                answer = "Oops! Could not fetch Bitcoin block data."
+            btc_response = chain_heads.get("bitcoin") or {}
         except Exception as e:
             app.logger.error(f"Bitcoin block query failed: {str(e)}")
-            answer = "Something went wrong with Bitcoin block data - try again!"
-        history.insert(0, {"question": user_question, "answer": answer, "wallet_data": None})
+            return {"answer": error}
+        if "height" not in btc_response:
+            return {"answer": "Oops! Could not fetch Bitcoin block data."}
+        block_number = btc_response["height"]
+        return chat_plan(f"User asked: {user_question}. Latest Bitcoin block number is {block_number}. Answer simply.",
+                         "Bitcoin block", error)
     elif "ethereum block" in normalized_question:
-        # Fetches latest Ethereum block number from Alchemy
+        # Latest Ethereum block number from the chain head tracker, or the block at a date from our index
+        error = "Something went wrong with Ethereum block data - try again!"
         try:
-            payload = {"jsonrpc": "2.0", "method": "eth_blockNumber", "params": [], "id": 1}
-            response = requests.post(eth_url, json=payload).json()
-            if "result" in response:
-                block_number = int(response["result"], 16)
-                prompt = f"User asked: {user_question}. Latest Ethereum block number is {block_number}. Answer simply."
-                ai_response = client.chat.completions.create(
-                    model="gpt-3.5-turbo",
-                    messages=[{"role": "user", "content": prompt}]
-                )
-                answer = ai_response.choices[0].message.content
+            asked_time = parse_question_date(user_question)
+            if asked_time:
+                block_number = eth_block_index.block_at(asked_time)
+                asked_day = datetime.fromtimestamp(asked_time, tz=timezone.utc).strftime('%Y-%m-%d')
+                block_label = f"The last Ethereum block on {asked_day} was"
             else:
-                answer = "Oops! Could not fetch Ethereum block data."
+                head = chain_heads.get("ethereum")
+                block_number = head["block"] if head else None
+                block_label = "Latest Ethereum block number is"
         except Exception as e:
             app.logger.error(f"Ethereum block query failed: {str(e)}")
-            answer = "Something went wrong with Ethereum block data - try again!"
-        history.insert(0, {"question": user_question, "answer": answer, "wallet_data": None})
+            return {"answer": error}
+        if block_number is None:
+            return {"answer": "Oops! Could not fetch Ethereum block data."}
+        return chat_plan(f"User asked: {user_question}. {block_label} {block_number}. Answer simply.",
+                         "Ethereum block", error)
     elif "solana block" in normalized_question:
-        # Fetches latest Solana slot number from Alchemy
+        # Latest Solana slot number from the chain head tracker, or the slot at a date from our index
+        error = "Something went wrong with Solana block data - try again!"
         try:
-            payload = {"jsonrpc": "2.0", "method": "getSlot", "params": [], "id": 1}
-            response = requests.post(sol_url, json=payload).json()
-            if "result" in response:
-                slot_number = response["result"]
-                prompt = f"User asked: {user_question}. Latest Solana slot number is {slot_number}. Answer simply."
-                ai_response = client.chat.completions.create(
-                    model="gpt-3.5-turbo",
-                    messages=[{"role": "user", "content": prompt}]
-                )
-                answer = ai_response.choices[0].message.content
+            asked_time = parse_question_date(user_question)
+            if asked_time:
+                slot_number = sol_block_index.block_at(asked_time)
+                asked_day = datetime.fromtimestamp(asked_time, tz=timezone.utc).strftime('%Y-%m-%d')
+                slot_label = f"The last Solana slot on {asked_day} was"
             else:
-                answer = "Oops! Could not fetch Solana block data."
+                head = chain_heads.get("solana")
+                slot_number = head["slot"] if head else None
+                slot_label = "Latest Solana slot number is"
         except Exception as e:
             app.logger.error(f"Solana block query failed: {str(e)}")
-            answer = "Something went wrong with Solana block data - try again!"
-        history.insert(0, {"question": user_question, "answer": answer, "wallet_data": None})
+            return {"answer": error}
+        if slot_number is None:
+            return {"answer": "Oops! Could not fetch Solana block data."}
+        return chat_plan(f"User asked: {user_question}. {slot_label} {slot_number}. Answer simply.",
+                         "Solana block", error)
     elif "gas" in normalized_question:
-        # Fetches current Ethereum gas price from Alchemy
+        # Current Ethereum gas price from the chain head tracker
+        error = "Something went wrong with gas price data - try again!"
         try:
-            payload = {"jsonrpc": "2.0", "method": "eth_gasPrice", "params": [], "id": 1}
-            response = requests.post(eth_url, json=payload).json()
-            if "result" in response:
-                gas_price = int(response["result"], 16) / 1e9  # Convert from Wei to Gwei
-                prompt = f"User asked: {user_question}. Current Ethereum gas price is {gas_price} Gwei. Answer simply."
-                ai_response = client.chat.completions.create(
-                    model="gpt-3.5-turbo",
-                    messages=[{"role": "user", "content": prompt}]
-                )
-                answer = ai_response.choices[0].message.content
-            else:
-                answer = "Oops! Could not fetch gas price data."
+            gas_price_wei = chain_heads.value("ethereum", "gas_price")
         except Exception as e:
             app.logger.error(f"Gas price query failed: {str(e)}")
-            answer = "Something went wrong with gas price data - try again!"
-        history.insert(0, {"question": user_question, "answer": answer, "wallet_data": None})
+            return {"answer": error}
+        if gas_price_wei is None:
+            return {"answer": "Oops! Could not fetch gas price data."}
+        gas_price = gas_price_wei / 1e9  # Convert from Wei to Gwei
+        return chat_plan(f"User asked: {user_question}. Current Ethereum gas price is {gas_price} Gwei. Answer simply.",
+                         "Gas price", error)
     elif "transactions" in normalized_question:
-        # Fetches transaction count in the latest Ethereum block from Alchemy
+        # Transaction count in the latest Ethereum block from the chain head tracker
+        error = "Something went wrong with transaction data - try again!"
         try:
-            block_payload = {"jsonrpc": "2.0", "method": "eth_blockNumber", "params": [], "id": 1}
-            block_response = requests.post(eth_url, json=block_payload).json()
-            if "result" in block_response:
-                latest_block = block_response["result"]
-                payload = {"jsonrpc": "2.0", "method": "eth_getBlockByNumber", "params": [latest_block, False], "id": 1}
-                response = requests.post(eth_url, json=payload).json()
-                if "result" in response and "transactions" in response["result"]:
-                    tx_count = len(response["result"]["transactions"])
-                    prompt = f"User asked: {user_question}. The latest Ethereum block has {tx_count} transactions. Answer simply."
-                    ai_response = client.chat.completions.create(
-                        model="gpt-3.5-turbo",
-                        messages=[{"role": "user", "content": prompt}]
-                    )
-                    answer = ai_response.choices[0].message.content
-                else:
-                    answer = "Oops! Could not fetch transaction data."
-            else:
-                answer = "Oops! Could not fetch block data."
+            head = chain_heads.get("ethereum")
         except Exception as e:
             app.logger.error(f"Transaction count query failed: {str(e)}")
-            answer = "Something went wrong with transaction data - try again!"
-        history.insert(0, {"question": user_question, "answer": answer, "wallet_data": None})
-    else:
-        # Default to ChatGPT for general crypto questions
-        try:
-            response = client.chat.completions.create(
-                model="gpt-4",
-                messages=[{"role": "user", "content": f"Answer about crypto: {user_question}"}],
-                max_tokens=100
-            )
-            answer = response.choices[0].message.content
-        except Exception as e:
-            app.logger.error(f"ChatGPT query failed: {str(e)}")
-            answer = f"Error: {str(e)}"
-        history.insert(0, {"question": user_question, "answer": answer, "wallet_data": None})
+            return {"answer": error}
+        if not head:
+            return {"answer": "Oops! Could not fetch block data."}
+        if "tx_count" not in head:
+            return {"answer": "Oops! Could not fetch transaction data."}
+        return chat_plan(f"User asked: {user_question}. The latest Ethereum block has {head['tx_count']} transactions. "
+                         "Answer simply.", "Transaction count", error)
+    # Default to ChatGPT for general crypto questions
+    return chat_plan(f"Answer about crypto: {user_question}", "ChatGPT", None, route="chat")
+
+
+def price_answer(coin, price):
+    # Final wording for a price question
+    return f"Current {coin.capitalize()} price: ${price} USD."
+
+
+def trending_answer(trends):
+    # Final wording for a trending question
+    return "Here is what is trending in crypto:\n" + "\n".join([f"{t['topic']} ({t['snippet']})" for t in trends])
+
+
+def chat_failed(plan, e):
+    # Logs a failed OpenAI step and returns what the user should see
+    app.logger.error(f"{plan['label']} query failed: {str(e)}")
+    return plan["error"] or f"Error: {str(e)}"
+
+
+def answer_query(plan):
+    # Runs the slow step of a query plan with the blocking clients
+    if "answer" in plan:
+        return plan["answer"]
+    if "price" in plan:
+        return price_answer(plan["price"], get_crypto_price(plan["price"]))
+    if "trending" in plan:
+        return trending_answer(get_trending_crypto())
+    try:
+        return llm.complete(plan["chat"]["route"], plan["chat"]["prompt"], caller="query")
+    except Exception as e:
+        return chat_failed(plan, e)
+
+
+def question_intent(user_question):
+    # Short, fixed label for a question in query_history, anything unrecognised counts as chat
+    normalized_question = normalize_question(user_question)
+    if normalized_question in QUERY_INTENTS:
+        return normalized_question
+    return next((intent for intent in ("trending", "transactions") if intent in normalized_question), "chat")
+
+
+def remember_answer(user, question, answer):
+    # Queues a question and answer for the users history, returns the HISTORY_SHOWN they see
+    record_query(user.id, question, answer, question_intent(question))
+    user._history = None  # Reread so the new answer, still queued, is on top
+    return user.history
+
+
+@app.route("/api/query", methods=["POST"])
+@login_required
+@rate_limited("query")
+def query():
+    # Handles user questions about crypto with real-time blockchain data
+    # Answers with prices, block sizes, gas prices, or ChatGPT; no wallet analytics since users use MetaMask
+    user_question = request.form.get("question", "").strip()
+    answer = answer_query(plan_query(user_question))
+    history = remember_answer(current_user, user_question, answer)
+    return jsonify({"answer": answer, "question": user_question, "history": history})
 
-    save_user_history(current_user.email, history)
-    current_user.history = history[:3]
-    return jsonify({"answer": answer, "question": user_question, "history": history[:3]})
+
+@app.route("/api/history", methods=["GET"])
+@login_required
+def query_history():
+    # Pages through the users questions, newest first
+    # Pass the next_before value from one page as ?before= to get the next one
+    try:
+        limit = min(max(int(request.args.get("limit", HISTORY_PAGE_SIZE)), 1), HISTORY_MAX_PAGE_SIZE)
+        before = float(request.args["before"]) if request.args.get("before") else None
+    except ValueError:
+        return jsonify({"error": "Invalid limit or before"}), 400
+    items = get_history(current_user.id, limit + 1, before)  # One extra tells us if there is another page
+    next_before = items[limit - 1]["ts"] if len(items) > limit else None
+    return jsonify({"history": items[:limit], "next_before": next_before})
 
 
 @app.route("/api/subscribe", methods=["POST"])
@@ -1550,7 +2160,7 @@ def subscribe():
     # Starts a Stripe subscription
     # Sends user to Stripe Checkout for payment
     plan = request.form.get("plan")  # Grabs basic or pro from frontend form
-    price_id = {"basic": "price_1QzXTCKv6dFcpMYlxS712fan", "pro": "price_1QzXY5Kv6dFcpMYluAWw5638"}.get(plan)  # Test Price IDs, swap for live
+    price_id = STRIPE_PRICES.get(plan)  # Test Price IDs live in entitlements.py, swap for live
     if not price_id:
         return jsonify({"error": "Invalid plan"}), 400  # Bad plan? Kick it back
     try:
@@ -1560,6 +2170,9 @@ def subscribe():
             customer=current_user.stripe_customer_id,
             line_items=[{"price": price_id, "quantity": 1}],
             mode="subscription",
+            client_reference_id=str(current_user.id),
+            # Webhook finds the user even without a customer ID
+            subscription_data={"metadata": {"plan": plan, "user_id": str(current_user.id)}},
             success_url=f"{base_url}/success?plan={plan}",
             cancel_url=base_url,
         )
@@ -1582,13 +2195,7 @@ def subscription_status():
     Returns the current subscription status of the logged-in user.
     """
     try:
-        conn = sqlite3.connect("users.db")
-        c = conn.cursor()
-        c.execute("SELECT subscription FROM users WHERE email = ?", (current_user.email,))
-        subscription = c.fetchone()
-        conn.close()
-        app.logger.info(f"Subscription status for {current_user.email}: {subscription[0] if subscription else None}")
-        return jsonify({"subscription": subscription[0] if subscription else None}), 200
+        return jsonify({"subscription": current_user.subscription}), 200  # Entitlement cache, no query per call
     except Exception as e:
         app.logger.error(f"Error fetching subscription status for {current_user.email}: {str(e)}")
         return jsonify({"error": "Failed to fetch subscription status"}), 500
@@ -1598,7 +2205,9 @@ def subscription_status():
 @login_required
 def subscribe_eth():
     """
-    Handles ETH subscription payments by verifying an Ethereum transaction and updating the user's subscription plan.
+    Handles ETH subscription payments by recording the transaction in the payment ledger.
+    The background confirmer upgrades the plan once the transaction has enough confirmations,
+    until then this answers 202 and the frontend submits the same hash again to check on it.
     """
     plan = request.form.get("plan")
     tx_hash = request.form.get("tx_hash")
@@ -1606,65 +2215,52 @@ def subscribe_eth():
         app.logger.error(f"Invalid plan received: {plan}")
         return jsonify({"error": "Invalid plan"}), 400
     expected_amount = Decimal(str(BASIC_PLAN_ETH)) if plan == "basic" else Decimal(str(PRO_PLAN_ETH))
-    app.logger.info(f"Processing {plan} plan subscription, expected amount: {expected_amount} ETH")
     try:
-        tx = w3.eth.get_transaction(tx_hash)
-        amount_sent = Decimal(str(w3.from_wei(tx["value"], "ether")))
-        recipient = tx["to"].lower()
-        sender = tx["from"].lower()
-        app.logger.info(f"Transaction details - Hash: {tx_hash}, Amount: {amount_sent} ETH, To: {recipient}, From: {sender}")
-        if recipient != ETH_PAYMENT_ADDRESS.lower():
-            app.logger.error(f"Recipient mismatch: expected {ETH_PAYMENT_ADDRESS.lower()}, got {recipient}")
-            return jsonify({"error": "Wrong recipient address"}), 400
-        if sender != current_user.email.lower():
-            app.logger.error(f"Sender mismatch: expected {current_user.email.lower()}, got {sender}")
-            return jsonify({"error": "Sender mismatch"}), 400
-        if amount_sent < expected_amount:
-            app.logger.error(f"Insufficient payment: sent {amount_sent} ETH, required {expected_amount} ETH")
-            return jsonify({"error": f"Insufficient payment, sent {amount_sent} ETH, need {expected_amount} ETH"}), 400
-        receipt = w3.eth.wait_for_transaction_receipt(tx_hash, timeout=120)
-        if receipt.status != 1:
-            app.logger.error(f"Transaction failed on blockchain: hash={tx_hash}")
-            return jsonify({"error": "Transaction failed on blockchain"}), 400
-        app.logger.info(f"Transaction confirmed: hash={tx_hash}, block={receipt.blockNumber}")
-        conn = sqlite3.connect("users.db")
-        c = conn.cursor()
-        c.execute("UPDATE users SET subscription = ? WHERE email = ?", (plan, current_user.email))
-        conn.commit()
-        conn.close()
-        app.logger.info(f"ETH subscription successful for {current_user.email}, Plan: {plan}, Tx: {tx_hash}")
-        return jsonify({"success": True, "plan": plan, "message": "Subscription updated"}), 200
+        payment = submit_payment(payments_rpc_url(), current_user.id, current_user.email, plan, tx_hash,
+                                 int(expected_amount * 10**18), ETH_PAYMENT_ADDRESS)
+    except PaymentRejected as e:
+        app.logger.error(f"ETH subscription rejected for {current_user.email}: {str(e)}, Tx: {tx_hash}")
+        return jsonify({"error": str(e)}), e.status
     except Exception as e:
         app.logger.error(f"ETH subscription error for {current_user.email}: {str(e)}")
-        error_details = {
-            "error": "Payment verification failed",
-            "details": str(e),
-            "possible_causes": []
-        }
-        if "timeout" in str(e).lower():
-            error_details["possible_causes"].append("Transaction confirmation took too long (timeout > 120s)")
-        elif "transaction" in str(e).lower():
-            error_details["possible_causes"].append("Invalid or missing transaction hash")
-        else:
-            error_details["possible_causes"].append("Unexpected error, check logs for stack trace")
-        return jsonify(error_details), 500
+        return jsonify({"error": "Payment verification failed", "details": str(e)}), 500
+    app.logger.info(f"ETH subscription for {current_user.email}, Plan: {plan}, Tx: {tx_hash}, "
+                    f"State: {payment['state']}")
+    body, status = payment_result(payment)
+    return jsonify(body), status
 
 @app.route("/api/subscription_success")
 @login_required
 def subscription_success():
     # Confirms a subscription after Stripe payment
-    # Updates the users plan in the database
+    # The plan is set by the Stripe webhook, this only reports whether it has landed yet
     plan = request.args.get("plan")
-    if plan in ["basic", "pro"]:
-        subscriptions = stripe.Subscription.list(customer=current_user.stripe_customer_id)
-        if subscriptions.data and subscriptions.data[0].status == "active":
-            conn = sqlite3.connect("users.db")
-            c = conn.cursor()
-            c.execute("UPDATE users SET subscription = ? WHERE email = ?", (plan, current_user.email))
-            conn.commit()
-            conn.close()
-            return jsonify({"success": True, "message": "Subscription confirmed"})
-    return jsonify({"error": "Subscription not confirmed"}), 500
+    if plan not in ["basic", "pro"]:
+        return jsonify({"error": "Invalid plan"}), 400
+    if current_user.subscription == plan:
+        return jsonify({"success": True, "message": "Subscription confirmed"})
+    # Stripe usually sends the event within seconds of checkout, the frontend asks again
+    return jsonify({"success": False, "pending": True, "message": "Waiting for Stripe to confirm the payment"}), 202
+
+
+@app.route("/api/stripe/webhook", methods=["POST"])
+def stripe_webhook():
+    # Receives signed customer.subscription.* events from Stripe and applies them to entitlements
+    # Answers 2xx once the event is stored, Stripe retries anything else for up to three days
+    payload = request.get_data()
+    try:
+        event = parse_stripe_event(payload, request.headers.get("Stripe-Signature"))
+    except WebhookSignatureError as e:
+        app.logger.warning(f"Stripe webhook rejected: {str(e)}")
+        return jsonify({"error": "Invalid signature"}), 400
+    except ValueError:
+        return jsonify({"error": "Invalid payload"}), 400
+    try:
+        result = apply_stripe_event(event)
+    except Exception as e:
+        app.logger.error(f"Stripe webhook {event['id']} failed: {str(e)}")
+        return jsonify({"error": "Event not applied"}), 500
+    return jsonify({"received": True, "result": result}), 200
 
 @app.route("/api/")
 def home_api():
@@ -1693,7 +2289,7 @@ def update_account():
     if new_account and not is_wallet_address(new_account) and new_account != '':
         return jsonify({"error": "Invalid wallet address"}), 400
     try:
-        conn = sqlite3.connect("users.db")
+        conn = db_connect("users.db")
         c = conn.cursor()
         c.execute("UPDATE users SET email = ? WHERE email = ?", (new_account or current_user.email, current_user.email))
         conn.commit()
@@ -1727,12 +2323,12 @@ def catch_all(path):
         return redirect("https://blockspeak.co", code=302)
 
 
-@app.before_request
-def start_session():
-    # Ensures a session exists for each request
-    # Sets up nonce for MetaMask login
-    if "nonce" not in session:
-        session["nonce"] = None
+@app.route("/metrics")
+def metrics():
+    # Prometheus scrape endpoint, totals from every worker
+    if METRICS_TOKEN and request.headers.get("Authorization") != f"Bearer {METRICS_TOKEN}":
+        return jsonify({"error": "Unauthorized"}), 401
+    return Response(render_metrics(), mimetype="text/plain; version=0.0.4")
 
 # Serve static images
 @app.route("/images/<filename>")
@@ -1742,11 +2338,33 @@ def serve_image(filename):
 # Update __main__ to include cron-like behavior
 if __name__ == "__main__":
     import sys
+    init_storage()  # Every mode reads or writes users.db, nothing else is loaded until a job touches it
     if "--cron" in sys.argv:
-        add_bulk_blog_posts(new_posts_only=True, num_posts=1)
+        queue_blog_posts()  # Producer only, a --worker process writes the posts
+    elif "--forecast" in sys.argv:
+        refresh_forecasts()  # Pull new daily prices and refit every coin, run a few times a day
+    elif "--index" in sys.argv:
+        run_indexer(INDEXER_RPC_URL or eth_rpc)  # Keep contract events in SQLite, run next to the web process
     elif "--auto" in sys.argv:
         while True:
-            run_auto_payments()
-            time.sleep(86400)  # Run daily
+            queue_auto_payments()  # Producer only, a --worker process sends the payments
+            time.sleep(AUTO_PAYMENT_SCAN_SECONDS)
+    elif "--worker" in sys.argv:
+        # python BlockSpeak.py --worker 4 [--drain], --drain exits once the queue is empty, for cron-style runs
+        position = sys.argv.index("--worker") + 1
+        count = int(sys.argv[position]) if position < len(sys.argv) and sys.argv[position].isdigit() else 1
+        ensure_metrics_writer()  # Job counts show up in /metrics on the same machine
+        JobWorkers(max(1, count)).run(drain="--drain" in sys.argv)
+    elif "--jobs" in sys.argv:
+        # Queue status and dead letters, --retry-dead [kind] puts dead jobs back in the queue
+        if "--retry-dead" in sys.argv:
+            position = sys.argv.index("--retry-dead") + 1
+            print(f"Requeued {retry_dead(sys.argv[position] if position < len(sys.argv) else None)} dead jobs")
+        counts, dead = queue_stats()
+        for kind, state, jobs, oldest in counts:
+            oldest_at = datetime.fromtimestamp(oldest, tz=timezone.utc)
+            print(f"{kind:14} {state:8} {jobs:6}  oldest run_at {oldest_at:%Y-%m-%d %H:%M:%S}")
+        for job_id, kind, attempts, error in dead:
+            print(f"dead #{job_id} {kind} after {attempts} attempts: {error}")
     else:
-        app.run(host="0.0.0.0", port=8080, debug=False)
+        create_app().run(host="0.0.0.0", port=int(os.getenv("PORT", 8080)), debug=False)
@@ -0,0 +1,118 @@
+# analytics.py
+# Bulk wallet analytics for BlockSpeak
+# Takes addresses already grouped by chain and fetches them with batch-capable upstream calls:
+# JSON-RPC batches for Ethereum, BlockCypher multi-address lookups for Bitcoin, and
+# getMultipleAccounts for Solana. Chunks run in parallel with a bounded thread pool and
+# every per-address result is cached for a short time.
+
+import logging  # Logs for debugging upstream failures
+import contextvars  # Carries the request trace into pool threads
+from concurrent.futures import ThreadPoolExecutor  # Bounded fan-out across chunks and chains
+from metrics import InstrumentedSession  # Timed HTTP for BlockCypher and the nodes
+from cache import TTLCache  # Short-lived per-address results
+from rpc import rpc_batch  # Batched JSON-RPC for Ethereum and Solana
+from sol_signatures import count_signatures_many  # Exact Solana tx counts from cursors
+from btc import get_btc_balances  # Block-height keyed Bitcoin balance cache
+
+logger = logging.getLogger(__name__)
+
+MAX_WORKERS = 8          # Upstream requests in flight at once for one bulk call
+BTC_CHUNK = 100          # Addresses per job, btc.py splits them into multi-address requests
+SOL_CHUNK = 100          # getMultipleAccounts takes at most 100 keys
+ETH_CHUNK = 100          # Addresses per JSON-RPC batch (2 calls each)
+
+analytics_cache = TTLCache(ttl=60)  # Wallet stats move slowly, a minute is plenty fresh
+# Bulk answers are slimmer than get_wallet_analytics ones (no tokens or 30 day count), so they get their own keys
+BULK_PREFIX = "bulk:"
+
+
+def _summary(chain, balance, symbol, decimals, tx_count, top_tokens):
+    # Builds the same shape get_wallet_analytics returns
+    return {"chain": chain, "balance": f"{balance:.{decimals}f} {symbol}", "tx_count": tx_count, "gas_spent": "N/A",
+            "top_tokens": top_tokens, "hot_wallet": "Yes" if tx_count > 50 else "No"}
+
+
+def fetch_eth_chunk(rpc_url, addresses, session=None):
+    # Balance and transaction count for up to ETH_CHUNK addresses in one JSON-RPC batch
+    calls = []
+    for address in addresses:
+        calls.append(("eth_getBalance", [address, "latest"]))
+        calls.append(("eth_getTransactionCount", [address, "latest"]))
+    results = rpc_batch(rpc_url, calls, session=session)
+    out = {}
+    for i, address in enumerate(addresses):
+        balance_hex, count_hex = results[2 * i], results[2 * i + 1]
+        if balance_hex is None or count_hex is None:
+            out[address] = {"error": "Could not fetch Ethereum analytics"}
+        else:
+            # Token holdings need a portfolio scan per wallet, the single-address endpoint does that
+            out[address] = _summary("Ethereum", int(balance_hex, 16) / 1e18, "ETH", 4, int(count_hex, 16), "N/A")
+    return out
+
+
+def fetch_btc_chunk(addresses, session=None):
+    # Balances for up to BTC_CHUNK addresses, cached per block and fetched via multi-address lookups
+    balances = get_btc_balances(addresses, session=session)
+    out = {}
+    for address in addresses:
+        entry = balances.get(address)
+        if entry is None:
+            out[address] = {"error": "Could not fetch Bitcoin analytics"}
+        else:
+            out[address] = _summary("Bitcoin", entry["balance"] / 1e8, "BTC", 8, entry["n_tx"], "N/A")
+    return out
+
+
+def fetch_sol_chunk(rpc_url, addresses, session=None):
+    # Balances from one getMultipleAccounts call, exact tx counts from the signature cursor cache
+    calls = [("getMultipleAccounts", [addresses, {"encoding": "base64", "dataSlice": {"offset": 0, "length": 0}}])]
+    results = rpc_batch(rpc_url, calls, session=session)
+    counts = count_signatures_many(rpc_url, addresses, session=session)
+    accounts = (results[0] or {}).get("value") or [None] * len(addresses)
+    out = {}
+    for i, address in enumerate(addresses):
+        if results[0] is None or address not in counts:
+            out[address] = {"error": "Could not fetch Solana analytics"}
+            continue
+        lamports = accounts[i]["lamports"] if accounts[i] else 0  # Unfunded accounts come back as null
+        out[address] = _summary("Solana", lamports / 1e9, "SOL", 4, counts[address]["tx_count"], "SOL only")
+        out[address]["tx_count_exact"] = counts[address]["exact"]
+    return out
+
+
+def bulk_wallet_analytics(groups, eth_rpc_url, sol_rpc_url, max_workers=MAX_WORKERS):
+    # groups: {"ethereum": [...], "bitcoin": [...], "solana": [...]} of valid addresses
+    # Returns {address: analytics}, answering from cache where possible
+    results = {}
+    jobs = []
+    session = InstrumentedSession()  # Keeps connections alive across chunks to the same host
+    for chain, addresses in groups.items():
+        found = analytics_cache.get_many([BULK_PREFIX + a for a in addresses])
+        cached = {key[len(BULK_PREFIX):]: value for key, value in found.items()}
+        results.update(cached)
+        todo = [a for a in dict.fromkeys(addresses) if a not in cached]  # Drop duplicates, keep order
+        if chain == "ethereum":
+            jobs += [(fetch_eth_chunk, (eth_rpc_url, todo[i:i + ETH_CHUNK], session))
+                     for i in range(0, len(todo), ETH_CHUNK)]
+        elif chain == "bitcoin":
+            jobs += [(fetch_btc_chunk, (todo[i:i + BTC_CHUNK], session)) for i in range(0, len(todo), BTC_CHUNK)]
+        elif chain == "solana":
+            jobs += [(fetch_sol_chunk, (sol_rpc_url, todo[i:i + SOL_CHUNK], session))
+                     for i in range(0, len(todo), SOL_CHUNK)]
+    if not jobs:
+        return results
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(jobs))) as pool:
+        # Chunk spans join the request trace
+        futures = [(pool.submit(contextvars.copy_context().run, fn, *args), fn, args) for fn, args in jobs]
+        for future, fn, args in futures:
+            chunk = args[1] if fn is not fetch_btc_chunk else args[0]
+            try:
+                fetched = future.result()
+            except Exception as e:
+                logger.error(f"Bulk analytics chunk failed in {fn.__name__}: {str(e)}")
+                fetched = {address: {"error": "Could not fetch wallet analytics"} for address in chunk}
+            for address, analytics in fetched.items():
+                if "error" not in analytics:
+                    analytics_cache.set(BULK_PREFIX + address, analytics)  # Only cache real answers
+                results[address] = analytics
+    return results
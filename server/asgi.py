@@ -0,0 +1,317 @@
+# asgi.py
+# Async serving mode for BlockSpeak
+# Run with: uvicorn asgi:app --host 0.0.0.0 --port 8080 (from the server folder)
+# The I/O-heavy routes (/api/, /api/query, /api/prices, /api/coin_graph, analytics and proposals) run here
+# as coroutines with async HTTP, OpenAI and web3 clients, so one process can wait on hundreds of upstream
+# calls at once instead of one per sync worker. Every other route is the unchanged Flask view, mounted
+# underneath through a WSGI bridge. Login, sessions, CORS and CSP headers still come from Flask.
+
+import json  # DAO ABI artifact
+import time  # Route and upstream timings
+import asyncio  # Runs upstream calls side by side
+import logging  # Logs for debugging async upstream failures
+import httpx  # Async HTTP client for CoinCap and RSS
+from a2wsgi import WSGIMiddleware  # Serves the Flask app inside the ASGI server
+from web3 import AsyncWeb3  # Async web3 for proposal reads
+from rpc_pool import async_web3_provider  # Same provider pool as the sync w3
+from werkzeug.test import EnvironBuilder  # Builds a WSGI environ so Flask can read the session cookie
+from flask_login import current_user  # The user Flask-Login loads for the request
+from starlette.applications import Starlette  # The ASGI app
+from starlette.routing import Route  # Async routes
+from starlette.routing import Mount  # Everything else goes to Flask
+from starlette.responses import JSONResponse  # JSON answers
+from starlette.concurrency import run_in_threadpool  # SQLite and the remaining sync helpers
+from contextlib import asynccontextmanager  # Opens and closes the shared clients
+from datetime import timedelta  # Top coins cache age
+import BlockSpeak  # The Flask app, its config and the shared query logic
+from metrics import registry as metrics_registry  # Same registry the Flask routes record into
+from limits import in_flight  # Same in-flight count the Flask routes shed on
+from limits import rejection_body  # 429 body
+from metrics import record_upstream  # Upstream latency for the async HTTP client
+from metrics import upstream_name  # Upstream label from a URL
+from tracing import start_trace  # Request trace for each async route
+from tracing import finish_trace  # Reports slow async requests
+from tracing import span  # Backoff sleeps and feed parsing
+
+logger = logging.getLogger(__name__)
+
+MAX_CONNECTIONS = 200  # Open upstream connections per process
+
+flask_app = BlockSpeak.create_app()
+coin_graph_cache = BlockSpeak.coin_graph_cache  # Same cache as the Flask route
+clients = {}  # "http" is created on startup inside the running event loop, "w3" on first use
+route_paths = {}  # endpoint -> path template, filled once the routes exist
+
+
+async def mark_upstream_start(request):
+    # httpx request hook, notes when the call went out
+    request.extensions["started"] = time.perf_counter()
+
+
+async def record_upstream_response(response):
+    # httpx response hook, same upstream metrics as the sync session
+    started = response.request.extensions.get("started")
+    if started is not None:
+        record_upstream(upstream_name(str(response.request.url)), time.perf_counter() - started,
+                        response.status_code >= 400, started)
+
+
+@asynccontextmanager
+async def lifespan(app):
+    # Opens pooled async clients once per process and closes them on shutdown
+    clients["http"] = httpx.AsyncClient(timeout=30, limits=httpx.Limits(max_connections=MAX_CONNECTIONS),
+                                        event_hooks={"request": [mark_upstream_start],
+                                                     "response": [record_upstream_response]})
+    yield
+    await clients["http"].aclose()
+    await BlockSpeak.llm.aclose()  # The async OpenAI client, if a question built it
+
+
+def flask_context(request):
+    # Runs Flask's session loading, user loader and after_request hooks for an async request
+    # Returns (user, headers) so auth, cookies, CORS and CSP match the Flask routes exactly
+    environ = EnvironBuilder(
+        path=request.url.path,
+        method=request.method,
+        query_string=request.url.query,
+        headers=list(request.headers.items()),
+        base_url=f"{request.url.scheme}://{request.url.netloc}",
+        environ_overrides={"blockspeak.async": True},  # The route times itself, Flask shouldnt count it again
+    ).get_environ()
+    with flask_app.request_context(environ):
+        flask_app.preprocess_request()  # before_request hooks, like metrics and table setup
+        user = current_user._get_current_object()
+        response = flask_app.process_response(flask_app.response_class())
+    headers = {k: v for k, v in response.headers.items() if k.lower() not in ("content-type", "content-length")}
+    return user, headers
+
+
+def route(login=False, limit=None):
+    # Wraps an async handler(request, user) with Flask auth and headers, like @login_required for Starlette
+    # limit names the cost group for rate limits and load shedding, like @rate_limited on the Flask route
+    def decorator(handler):
+        async def endpoint(request):
+            started = time.perf_counter()
+            path = route_paths.get(endpoint, request.url.path)
+            # Spans from this task and its threads
+            trace = start_trace(f"{request.method} {path}", request.headers.get("x-request-id"))
+            status = 500
+            in_flight.enter()
+            try:
+                user, headers = await run_in_threadpool(flask_context, request)
+                headers["X-Trace-Id"] = trace.trace_id
+                if login and not user.is_authenticated:
+                    status = 401
+                    return JSONResponse({"error": "Unauthorized"}, status_code=401, headers=headers)
+                if limit:
+                    # May be a Redis call
+                    rejection = await run_in_threadpool(BlockSpeak.admission.check, limit, user.id, user.subscription)
+                    if rejection:
+                        status = 429
+                        headers["Retry-After"] = str(rejection[1])
+                        return JSONResponse(rejection_body(*rejection), status_code=429, headers=headers)
+                result = await handler(request, user)
+                status = 200
+                if isinstance(result, tuple):
+                    result, status = result
+                labels = (("route", path), ("method", request.method), ("status", str(status)))
+                metrics_registry.observe("http_request_duration_seconds", time.perf_counter() - started, labels)
+                return JSONResponse(result, status_code=status, headers=headers)
+            finally:
+                in_flight.leave()
+                finish_trace(trace, status)
+        return endpoint
+    return decorator
+
+
+async def fetch_json(url, **kwargs):
+    # GET and decode JSON with the shared connection pool
+    response = await clients["http"].get(url, **kwargs)
+    return response.json()
+
+
+async def get_crypto_price(coin):
+    # Async twin of BlockSpeak.get_crypto_price
+    try:
+        response = await fetch_json(f"{BlockSpeak.COINCAP_API_URL}/assets/{coin}")
+        return f"{float(response['data']['priceUsd']):.2f}"
+    except Exception as e:
+        logger.error(f"CoinCap price fetch failed for {coin}: {str(e)}")
+        return "Price unavailable"
+
+
+async def get_trending_crypto():
+    # Async twin of BlockSpeak.get_trending_crypto
+    try:
+        response = await fetch_json(f"{BlockSpeak.COINCAP_API_URL}/assets?limit=3")
+        return BlockSpeak.trending_from_assets(response["data"])
+    except Exception as e:
+        logger.error(f"CoinCap trending fetch failed: {str(e)}")
+        return BlockSpeak.TRENDS_FALLBACK
+
+
+async def get_news_items():
+    # Async twin of BlockSpeak.get_news_items, same feeds, retries and backoff
+    for url in BlockSpeak.NEWS_FEEDS:
+        for attempt in range(3):
+            try:
+                response = await clients["http"].get(url, headers=BlockSpeak.NEWS_HEADERS)
+                response.raise_for_status()
+                with span("rss:parse"):
+                    # feedparser is CPU work
+                    items = await run_in_threadpool(BlockSpeak.news_from_feed, response.content)
+                if not items:
+                    logger.warning(f"No entries found in feed: {url}")
+                    continue
+                return items
+            except httpx.HTTPError as e:
+                logger.error(f"Attempt {attempt + 1} for {url} failed: {str(e)}")
+                if attempt < 2:
+                    with span("rss:backoff"):
+                        await asyncio.sleep(2 ** attempt)
+    logger.error("All RSS fetch attempts failed for both URLs.")
+    return BlockSpeak.NEWS_FALLBACK
+
+
+async def get_top_coins():
+    # Async twin of BlockSpeak.get_top_coins, sharing its file cache with the sync workers
+    cached = BlockSpeak.read_top_coins_cache(timedelta(minutes=15))
+    if cached is not None:
+        return cached
+    try:
+        response = await fetch_json(f"{BlockSpeak.COINCAP_API_URL}/assets")
+        coins = BlockSpeak.top_coins_from_assets(response["data"])
+        BlockSpeak.write_top_coins_cache(coins)
+        return coins
+    except Exception as e:
+        logger.error(f"CoinCap top coins failed: {str(e)}")
+        return BlockSpeak.TOP_COINS_FALLBACK
+
+
+async def answer_query(plan):
+    # Async twin of BlockSpeak.answer_query
+    if "answer" in plan:
+        return plan["answer"]
+    if "price" in plan:
+        return BlockSpeak.price_answer(plan["price"], await get_crypto_price(plan["price"]))
+    if "trending" in plan:
+        return BlockSpeak.trending_answer(await get_trending_crypto())
+    try:
+        return await BlockSpeak.llm.acomplete(plan["chat"]["route"], plan["chat"]["prompt"], caller="query")
+    except Exception as e:
+        return BlockSpeak.chat_failed(plan, e)
+
+
+@route()
+async def home_api(request, user):
+    # News, trends and top coins fetched side by side instead of one after another
+    news_items, trends, top_coins = await asyncio.gather(get_news_items(), get_trending_crypto(), get_top_coins())
+    # One SQLite read for history, and at most one entitlement reload, kept off the event loop
+    history, subscription = ([], "free")
+    if user.is_authenticated:
+        history, subscription = await run_in_threadpool(lambda: (user.history, user.subscription))
+    return {
+        "history": history, "news_items": news_items, "trends": trends,
+        "x_profiles": BlockSpeak.get_x_profiles(), "top_coins": top_coins,
+        "stripe_key": BlockSpeak.STRIPE_PUBLISHABLE_KEY, "subscription": subscription
+    }
+
+
+@route()
+async def get_prices(request, user):
+    return {"top_coins": await get_top_coins()}
+
+
+@route()
+async def coin_graph(request, user):
+    # 7-day graph per coin, cached for every user instead of per session
+    coin_id = request.path_params["coin_id"]
+    graph = coin_graph_cache.get(coin_id)
+    if graph is not None:
+        return graph
+    try:
+        graph = BlockSpeak.coin_graph_from_history(await fetch_json(BlockSpeak.coin_graph_url(coin_id)))
+    except httpx.HTTPError as e:
+        logger.error(f"Graph API request failed for {coin_id}: {str(e)}")
+        return {"error": f"Failed to fetch price data for {coin_id}"}, 500
+    except ValueError:
+        logger.error(f"Graph API returned invalid JSON for {coin_id}")
+        return {"error": f"Invalid response from price API for {coin_id}"}, 500
+    coin_graph_cache.set(coin_id, graph)
+    return graph
+
+
+@route(login=True, limit="query")
+async def query(request, user):
+    # Same answers as the Flask route, the OpenAI and CoinCap step just doesnt hold a thread
+    user_question = (await request.form()).get("question", "").strip()
+    plan = await run_in_threadpool(BlockSpeak.plan_query, user_question)  # Local lookups, may touch SQLite
+    answer = await answer_query(plan)
+    history = await run_in_threadpool(BlockSpeak.remember_answer, user, user_question, answer)
+    return {"answer": answer, "question": user_question, "history": history}
+
+
+@route(login=True, limit="analytics")
+async def get_analytics(request, user):
+    # Wallet stats, the per-chain lookups are already batched so they run on the thread pool
+    analytics = await run_in_threadpool(BlockSpeak.get_wallet_analytics, request.path_params["address"])
+    return analytics if "error" not in analytics else ({"error": analytics["error"]}, 400)
+
+
+dao_abi = None  # Loaded on first use
+
+
+async def read_proposals(dao_address):
+    # Every getProposal call in flight at once instead of one round trip per proposal
+    global dao_abi
+    if dao_abi is None:
+        with open("../skillchain_contracts/artifacts/contracts/DAO.sol/DAO.json") as f:
+            dao_abi = json.load(f)["abi"]
+    if "w3" not in clients:
+        # Picks the provider per call, not once per process
+        clients["w3"] = AsyncWeb3(async_web3_provider(BlockSpeak.eth_rpc))
+    w3 = clients["w3"]
+    dao_contract = w3.eth.contract(address=w3.to_checksum_address(dao_address), abi=dao_abi)
+    proposal_count = await dao_contract.functions.proposalCount().call()
+    proposals = await asyncio.gather(*[dao_contract.functions.getProposal(i).call() for i in range(proposal_count)])
+    return [{
+        "id": i,
+        "description": proposal[0],
+        "proposer": proposal[1],
+        "yesVotes": str(proposal[2]),
+        "noVotes": str(proposal[3]),
+        "active": proposal[4],
+        "executed": proposal[5]
+    } for i, proposal in enumerate(proposals)]
+
+
+@route(login=True)
+async def get_proposals(request, user):
+    # Indexed proposals when the indexer is caught up, otherwise concurrent contract reads
+    dao_address = (await request.form()).get("dao_address")
+    if not dao_address or not BlockSpeak.is_wallet_address(dao_address):
+        return {"error": "Valid DAO address required"}, 400
+    if await run_in_threadpool(BlockSpeak.is_indexed, dao_address):
+        return {"proposals": await run_in_threadpool(BlockSpeak.get_indexed_proposals, dao_address)}
+    await run_in_threadpool(BlockSpeak.register_contract, dao_address, "dao")
+    try:
+        return {"proposals": await read_proposals(dao_address)}
+    except Exception as e:
+        logger.error(f"Get proposals failed: {str(e)}")
+        return {"error": f"Failed to fetch proposals: {str(e)}"}, 500
+
+
+app = Starlette(
+    routes=[
+        Route("/api/", home_api, methods=["GET"]),
+        Route("/api/prices", get_prices, methods=["GET"]),
+        Route("/api/coin_graph/{coin_id}", coin_graph, methods=["GET"]),
+        Route("/api/query", query, methods=["POST"]),
+        Route("/api/analytics/{address}", get_analytics, methods=["GET"]),
+        Route("/api/get_proposals", get_proposals, methods=["POST"]),
+        Mount("/", app=WSGIMiddleware(flask_app)),  # Every other route, and CORS preflights, stay on Flask
+    ],
+    lifespan=lifespan,
+)
+# Flask-style templates like /api/coin_graph/<coin_id>, so both servers report the same route labels
+route_paths.update({r.endpoint: r.path.replace("{", "<").replace("}", ">") for r in app.routes if isinstance(r, Route)})
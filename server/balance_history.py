@@ -0,0 +1,134 @@
+# balance_history.py
+# Daily wallet balance history for BlockSpeak
+# Balances are stored per address and day in SQLite and filled in incrementally, so the first
+# 30-day chart costs about 30 archive calls and every repeat costs at most one call per new day.
+# Day -> block number lookups are shared by every wallet, so they are only ever searched once.
+
+from db import connect as db_connect  # Timed SQLite, stores balances and day -> block lookups
+import logging  # Logs for debugging archive lookups
+import threading  # Guards the in-memory block memo and per-day searches
+from datetime import datetime  # Time handling for daily buckets
+from datetime import timedelta  # Helps walk back through days
+from datetime import timezone  # Ensures times are UTC
+
+logger = logging.getLogger(__name__)
+
+HISTORY_DAYS = 30  # Days shown on the balance chart
+
+# Global memo of (chain, day) -> block number, backed by the block_by_day table
+_block_by_day = {}
+_block_lock = threading.Lock()  # Guards the two dicts, held only for dictionary reads and writes
+_day_locks = {}  # (chain, day) -> lock held while that one day is looked up and searched
+
+
+def init_balance_tables(db_path="users.db"):
+    # Creates the balance_history and block_by_day tables if they dont exist
+    conn = db_connect(db_path)
+    c = conn.cursor()
+    c.execute('''CREATE TABLE IF NOT EXISTS balance_history (
+        address TEXT NOT NULL,
+        chain TEXT NOT NULL,
+        day TEXT NOT NULL,
+        block_number INTEGER NOT NULL,
+        balance TEXT NOT NULL,
+        PRIMARY KEY (address, chain, day))''')
+    c.execute('''CREATE TABLE IF NOT EXISTS block_by_day (
+        chain TEXT NOT NULL,
+        day TEXT NOT NULL,
+        block_number INTEGER NOT NULL,
+        PRIMARY KEY (chain, day))''')
+    conn.commit()
+    conn.close()
+
+
+def _day_end(day):
+    # Unix time of midnight at the end of a YYYY-MM-DD day
+    start = datetime.strptime(day, "%Y-%m-%d").replace(tzinfo=timezone.utc)
+    return int((start + timedelta(days=1)).timestamp())
+
+
+def find_block_before(w3, timestamp, lo=0, hi=None):
+    # Binary search for the last block mined before `timestamp`
+    # lo/hi let callers narrow the range with blocks they already know about
+    if hi is None:
+        hi = w3.eth.block_number
+    if w3.eth.get_block(hi)["timestamp"] < timestamp:
+        return hi
+    while lo < hi:
+        mid = (lo + hi + 1) // 2
+        if w3.eth.get_block(mid)["timestamp"] < timestamp:
+            lo = mid
+        else:
+            hi = mid - 1
+    return lo
+
+
+def block_for_day(w3, chain, day, db_path="users.db", index=None):
+    # Last block of a day, memoized in memory and in SQLite for every worker and wallet
+    # With a BlockTimestampIndex the search reuses its samples instead of bisecting from scratch
+    # Only callers asking for the same day wait on each other, the global lock never covers SQLite or RPC
+    key = (chain, day)
+    if key in _block_by_day:
+        return _block_by_day[key]
+    with _block_lock:
+        day_lock = _day_locks.setdefault(key, threading.Lock())
+    try:
+        with day_lock:
+            if key in _block_by_day:
+                return _block_by_day[key]
+            conn = db_connect(db_path)
+            try:
+                c = conn.cursor()
+                c.execute("SELECT block_number FROM block_by_day WHERE chain = ? AND day = ?", (chain, day))
+                row = c.fetchone()
+                if row:
+                    block_number = row[0]
+                else:
+                    if index is not None:
+                        block_number = index.block_at(_day_end(day) - 1) or 0  # None means before genesis
+                    else:
+                        # Narrow the search with the closest days we already resolved
+                        with _block_lock:
+                            known = sorted((d, b) for (ch, d), b in _block_by_day.items() if ch == chain)
+                        lo = max([b for d, b in known if d < day], default=0)
+                        hi = min([b for d, b in known if d > day], default=None)
+                        block_number = find_block_before(w3, _day_end(day), lo=lo, hi=hi)
+                    c.execute("INSERT OR REPLACE INTO block_by_day (chain, day, block_number) VALUES (?, ?, ?)",
+                              (chain, day, block_number))
+                    conn.commit()
+            finally:
+                conn.close()
+            with _block_lock:
+                _block_by_day[key] = block_number
+            return block_number
+    finally:
+        with _block_lock:
+            _day_locks.pop(key, None)  # Later callers hit the memo, a failed day gets a fresh lock next time
+
+
+def get_balance_history(w3, address, chain="ethereum", days=HISTORY_DAYS, db_path="users.db", index=None):
+    # Returns [{"date", "block", "balance"}] for the last `days` finished days, oldest first
+    # Only days missing from balance_history are fetched, everything else comes from SQLite
+    checksum_address = w3.to_checksum_address(address)
+    today = datetime.now(timezone.utc).replace(hour=0, minute=0, second=0, microsecond=0)
+    wanted = [(today - timedelta(days=x)).strftime("%Y-%m-%d") for x in range(days, 0, -1)]
+    conn = db_connect(db_path)
+    c = conn.cursor()
+    c.execute("SELECT day, block_number, balance FROM balance_history WHERE address = ? AND chain = ? AND day >= ?",
+              (checksum_address, chain, wanted[0]))
+    stored = {row[0]: (row[1], int(row[2])) for row in c.fetchall()}
+    missing = [day for day in wanted if day not in stored]
+    if missing:
+        logger.info(f"Balance history for {checksum_address}: fetching {len(missing)} new days")
+    new_rows = []
+    for day in missing:
+        block_number = block_for_day(w3, chain, day, db_path=db_path, index=index)
+        balance_wei = int(w3.eth.get_balance(checksum_address, block_identifier=block_number))
+        stored[day] = (block_number, balance_wei)
+        new_rows.append((checksum_address, chain, day, block_number, str(balance_wei)))  # Text keeps wei exact
+    if new_rows:
+        c.executemany("INSERT OR REPLACE INTO balance_history (address, chain, day, block_number, balance) "
+                      "VALUES (?, ?, ?, ?, ?)", new_rows)
+        conn.commit()
+    conn.close()
+    return [{"date": day, "block": stored[day][0], "balance": stored[day][1] / 1e18} for day in wanted]
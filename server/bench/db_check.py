@@ -0,0 +1,250 @@
+# db_check.py
+# Storage checks for BlockSpeak on SQLite and PostgreSQL
+# Builds the app's schema in a scratch database through db.connect, then runs every statement shape
+# the app depends on and checks both backends answer the same: INSERT OR IGNORE and INSERT OR
+# REPLACE (with and without a column list), lastrowid from the serial id, rowcount, unique
+# violations as sqlite3.IntegrityError, BEGIN IMMEDIATE serialising writers, PRAGMA table_info,
+# DELETE ... RETURNING, integer aggregates, and translations staying right across CREATE and ALTER.
+# Exits 1 if any check fails, so the same run gates both backends.
+# Usage (from the server folder):
+#   python bench/db_check.py
+#   python bench/db_check.py --database-url postgresql://localhost/blockspeak_check   # an empty scratch database
+
+import os  # Environment for the app modules
+import sys  # Exit status and the import path
+import time  # Expiry times
+import uuid  # Keys unique to one run
+import shutil  # Cleans up the scratch folder
+import sqlite3  # Error types both backends raise
+import argparse  # Command line flags
+import tempfile  # Scratch folder for the SQLite run
+import threading  # Concurrent writers
+
+SERVER_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, SERVER_DIR)
+
+CHECKS = []
+RUN = uuid.uuid4().hex[:8]  # Suffix for rows a check writes, so a reused scratch database doesnt clash
+
+
+def check(fn):
+    CHECKS.append(fn)
+    return fn
+
+
+def expect(value, wanted, what):
+    if value != wanted:
+        raise AssertionError(f"{what}: got {value!r}, expected {wanted!r}")
+
+
+@check
+def schema_is_idempotent(app):
+    app.storage_ready.clear()
+    app.init_storage()  # A second run over the existing tables, like every worker start
+    conn = app.db_connect()
+    columns = [row[1] for row in conn.execute("PRAGMA table_info(blog_posts)").fetchall()]
+    conn.close()
+    if "inline_image" not in columns or "slug" not in columns:
+        raise AssertionError(f"PRAGMA table_info(blog_posts) gave {columns}")
+
+
+@check
+def lastrowid_and_unique_violations(app):
+    conn = app.db_connect()
+    c = conn.cursor()
+    c.execute("INSERT INTO users (email, password) VALUES (?, ?)", (f"check-a-{RUN}@example.com", "x"))
+    first = c.lastrowid
+    c.execute("INSERT INTO users (email, password) VALUES (?, ?)", (f"check-b-{RUN}@example.com", "x"))
+    expect(c.lastrowid, first + 1, "lastrowid of the next insert")
+    conn.commit()
+    try:
+        c.execute("INSERT INTO users (email, password) VALUES (?, ?)", (f"check-a-{RUN}@example.com", "x"))
+        raise AssertionError("Duplicate email was accepted")
+    except sqlite3.IntegrityError:
+        pass
+    conn.rollback()
+    count = conn.execute("SELECT COUNT(*) FROM users WHERE email LIKE ?", (f"check-_-{RUN}@%",)).fetchone()[0]
+    expect(count, 2, "users after a failed insert")
+    conn.close()
+
+
+@check
+def job_queue_dedupe_and_claim(app):
+    import jobs
+    job_id = jobs.enqueue("db_check", {"n": 1}, dedupe_key=f"db_check:{RUN}")
+    if not isinstance(job_id, int):
+        raise AssertionError(f"enqueue returned {job_id!r}")
+    expect(jobs.enqueue("db_check", {"n": 1}, dedupe_key=f"db_check:{RUN}"), None, "enqueue of a duplicate dedupe_key")
+    jobs.register("db_check", lambda payload: None)
+    job = jobs.claim("db-check", ["db_check"])
+    expect((job["id"], job["attempts"], job["payload"]), (job_id, 1, {"n": 1}), "claimed job")
+    expect(jobs.claim("db-check", ["db_check"]), None, "second claim")
+    expect(jobs.complete(job), True, "complete")
+    expect(jobs.complete(job), False, "complete of a settled job")
+
+
+@check
+def insert_or_ignore(app):
+    conn = app.db_connect()
+    for _ in range(2):
+        c = conn.execute("INSERT OR IGNORE INTO indexer_addresses (address, kind) VALUES (?, ?)",
+                         (f"0xcheck{RUN}", "payment"))
+    expect(c.rowcount, 0, "rowcount of an ignored insert")
+    conn.commit()
+    count = conn.execute("SELECT COUNT(*) FROM indexer_addresses WHERE address = ?", (f"0xcheck{RUN}",)).fetchone()[0]
+    expect(count, 1, "rows")
+    conn.close()
+
+
+@check
+def insert_or_replace_and_delete_returning(app):
+    import sessions
+    store = sessions.SQLiteStore()
+    key = f"check:{RUN}"
+    store.set(key, "one", 60)
+    store.set(key, "two", 60)
+    expect(store.get(key)[0], "two", "value after a replace")
+    expect(store.pop(key), "two", "pop")
+    expect(store.pop(key), None, "second pop")
+
+
+@check
+def insert_or_replace_without_columns(app):
+    conn = app.db_connect()
+    conn.execute("INSERT OR REPLACE INTO indexer_state VALUES (1, ?, ?)", (100, 1.0))
+    conn.execute("INSERT OR REPLACE INTO indexer_state VALUES (1, ?, ?)", (200, 2.0))
+    conn.commit()
+    expect(conn.execute("SELECT last_block, updated_at FROM indexer_state").fetchall(), [(200, 2.0)], "indexer_state")
+    conn.close()
+
+
+@check
+def begin_immediate_serialises_writers(app):
+    conn = app.db_connect()
+    conn.execute("INSERT OR REPLACE INTO kv_store (key, value, expires_at) VALUES (?, ?, ?)",
+                 (f"counter:{RUN}", "0", time.time() + 600))
+    conn.commit()
+    conn.close()
+    errors = []
+
+    def bump():
+        for _ in range(20):
+            conn = app.db_connect(timeout=30)
+            try:
+                c = conn.cursor()
+                c.execute("BEGIN IMMEDIATE")
+                value = int(c.execute("SELECT value FROM kv_store WHERE key = ?", (f"counter:{RUN}",)).fetchone()[0])
+                c.execute("UPDATE kv_store SET value = ? WHERE key = ?", (str(value + 1), f"counter:{RUN}"))
+                conn.commit()
+            except Exception as e:
+                errors.append(e)
+            finally:
+                conn.close()
+
+    threads = [threading.Thread(target=bump) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    if errors:
+        raise AssertionError(f"{len(errors)} writers failed, first: {errors[0]}")
+    conn = app.db_connect()
+    value = conn.execute("SELECT value FROM kv_store WHERE key = ?", (f"counter:{RUN}",)).fetchone()[0]
+    expect(value, "160", "counter after 8 x 20 increments")
+    conn.close()
+
+
+@check
+def stripe_event_applied_once(app):
+    import entitlements
+    from stripe_events import make_event
+    conn = app.db_connect()
+    c = conn.cursor()
+    c.execute("INSERT INTO users (email, password, stripe_customer_id) VALUES (?, ?, ?)",
+              (f"check-stripe-{RUN}@example.com", "x", f"cus_{RUN}"))
+    conn.commit()
+    conn.close()
+    event = make_event("customer.subscription.updated", f"cus_{RUN}", "pro", f"sub_{RUN}")
+    expect(entitlements.apply_event(event), "applied", "first delivery")
+    expect(entitlements.apply_event(event), "duplicate", "second delivery")
+
+
+@check
+def integer_aggregates(app):
+    import indexer
+    dao = f"0xdao{RUN}"
+    conn = app.db_connect()
+    conn.execute("INSERT OR IGNORE INTO dao_proposals (dao, proposal_id, description, proposer, block_number) "
+                 "VALUES (?, ?, ?, ?, ?)",
+                 (dao, 1, "Check", "0xme", 1))
+    for voter, vote in (("0xa", 1), ("0xb", 1), ("0xc", 0)):
+        conn.execute("INSERT OR IGNORE INTO dao_votes VALUES (?, ?, ?, ?, ?, ?)",
+                     (dao, 1, voter, vote, "0xtx" + voter, 1))
+    conn.commit()
+    conn.close()
+    proposals = indexer.get_indexed_proposals(dao)
+    expect((proposals[0]["yesVotes"], proposals[0]["noVotes"]), ("2", "1"), "vote tallies")
+
+
+@check
+def translations_follow_create_and_alter(app):
+    # The same statement text before and after the schema changes, a translation cached from the old
+    # catalog would lose lastrowid or leave the new column out of the upsert
+    conn = app.db_connect()
+    conn.execute("DROP TABLE IF EXISTS db_check_items")
+    conn.commit()
+    insert = "INSERT INTO db_check_items (name) VALUES (?)"
+    try:
+        conn.execute(insert, ("early",))
+        raise AssertionError("Insert into a missing table was accepted")
+    except sqlite3.OperationalError:
+        conn.rollback()
+    conn.execute("CREATE TABLE db_check_items (name TEXT)")  # No id column yet
+    conn.execute(insert, ("plain",))
+    conn.execute("DROP TABLE db_check_items")
+    conn.execute("CREATE TABLE db_check_items (id INTEGER PRIMARY KEY AUTOINCREMENT, name TEXT)")
+    conn.commit()
+    expect(conn.execute(insert, ("first",)).lastrowid, 1, "lastrowid once the table has an id")
+    conn.execute("ALTER TABLE db_check_items ADD COLUMN note TEXT")
+    conn.commit()
+    conn.execute("INSERT OR REPLACE INTO db_check_items VALUES (?, ?, ?)", (1, "again", "noted"))
+    conn.commit()
+    expect(conn.execute("SELECT id, name, note FROM db_check_items").fetchall(), [(1, "again", "noted")],
+           "row after ALTER")
+    conn.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Check the storage layer against SQLite or Postgres")
+    parser.add_argument("--database-url", default=None,
+                        help="Scratch Postgres database, SQLite in a temp folder without it")
+    args = parser.parse_args()
+    os.environ.pop("DATABASE_URL", None)
+    if args.database_url:
+        os.environ["DATABASE_URL"] = args.database_url
+    os.environ.setdefault("SECRET_KEY", "db-check")
+    os.environ.setdefault("APP_ENV", "development")
+    os.environ.setdefault("ETH_PAYMENT_ADDRESS", "0x" + "ab" * 20)
+    workdir = tempfile.mkdtemp(prefix="blockspeak-db-check-")
+    os.chdir(workdir)  # users.db for the SQLite run lands here
+    try:
+        import db  # Reads DATABASE_URL at import, so only after it is set
+        import BlockSpeak as app  # The app's schema and connection helper
+        app.init_storage()
+        print(f"Backend: {db.BACKEND}")
+        failed = 0
+        for fn in CHECKS:
+            try:
+                fn(app)
+                print(f"  ok    {fn.__name__}")
+            except Exception as e:
+                failed += 1
+                print(f"  FAIL  {fn.__name__}: {type(e).__name__}: {e}")
+        print(f"{len(CHECKS) - failed}/{len(CHECKS)} checks passed")
+        sys.exit(1 if failed else 0)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
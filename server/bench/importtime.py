@@ -0,0 +1,98 @@
+# importtime.py
+# Import-time budget check for BlockSpeak
+# Imports the app in a fresh interpreter with python -X importtime and fails when the import takes
+# longer than the budget or pulls in a library that should only load on first use (web3, openai,
+# stripe, ...). Then it loads the lazy modules that run setup code on first use (--setup) in another
+# fresh interpreter, so a setup hook that breaks on the installed library version, like a client
+# class stripe moved, fails here instead of on the first signup.
+# Run it before merging anything that adds module-level imports or clients.
+# Usage (from the server folder):
+#   python bench/importtime.py
+#   python bench/importtime.py --budget-ms 800 --top 15
+#   python bench/importtime.py --module asgi --heavy ""
+
+import os  # Paths and the child environment
+import re  # Parses the importtime lines
+import sys  # Python interpreter and exit code
+import argparse  # Command line flags
+import subprocess  # Fresh interpreter, so nothing is cached from this process
+
+SERVER_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# Libraries the app loads on first use, importing the app must not load them
+HEAVY = "web3,openai,stripe,feedparser,eth_account,eth_abi,eth_utils,numpy,redis,coincurve"
+# Lazy modules with a setup hook, as module.attribute, loaded once to run the hook
+SETUP = "BlockSpeak.stripe"
+LINE_RE = re.compile(r"^import time:\s+(\d+)\s+\|\s+(\d+)\s+\|(\s*)(\S+)$")
+
+
+def measure(module):
+    # Returns [(module name, self us, cumulative us, depth)] for everything `import module` loaded
+    env = dict(os.environ, PYTHONPATH=SERVER_DIR)
+    env.setdefault("ETH_PAYMENT_ADDRESS", "0x" + "ab" * 20)  # Required at import
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"],
+                            cwd=SERVER_DIR, env=env, capture_output=True, text=True)
+    if result.returncode != 0:
+        raise SystemExit(f"import {module} failed:\n{result.stderr[-2000:]}")
+    rows = []
+    for line in result.stderr.splitlines():
+        match = LINE_RE.match(line)
+        if match:
+            rows.append((match.group(4), int(match.group(1)), int(match.group(2)), len(match.group(3)) // 2))
+    # Children print before their parent, so the modules own tree is the run of deeper rows right before it
+    end = next(i for i, row in enumerate(rows) if row[0] == module and row[3] == 0)
+    start = end
+    while start > 0 and rows[start - 1][3] > 0:
+        start -= 1
+    return rows[start:end + 1]
+
+
+def check_setup(targets):
+    # Loads each lazy module in a fresh interpreter, returns [(target, error)] for those whose setup failed
+    env = dict(os.environ, PYTHONPATH=SERVER_DIR)
+    env.setdefault("ETH_PAYMENT_ADDRESS", "0x" + "ab" * 20)
+    failures = []
+    for target in targets:
+        module, _, attr = target.rpartition(".")
+        code = f"import {module}; {module}.{attr}.__name__"  # Any attribute access imports it and runs setup
+        result = subprocess.run([sys.executable, "-c", code], cwd=SERVER_DIR, env=env, capture_output=True, text=True)
+        if result.returncode != 0:
+            failures.append((target, (result.stderr.strip().splitlines() or ["failed"])[-1]))
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Check how long importing the app takes")
+    parser.add_argument("--module", default="BlockSpeak")
+    parser.add_argument("--budget-ms", type=float, default=1000, help="Fail above this cumulative import time")
+    parser.add_argument("--heavy", default=HEAVY, help="Comma separated top-level packages that must stay unloaded")
+    parser.add_argument("--top", type=int, default=10, help="Slowest imports to list")
+    parser.add_argument("--setup", default=SETUP, help="Comma separated lazy modules whose setup hook must run cleanly")
+    args = parser.parse_args()
+
+    rows = measure(args.module)
+    total_ms = rows[-1][2] / 1000
+    print(f"import {args.module}: {total_ms:.0f}ms (budget {args.budget_ms:.0f}ms)")
+    print("Slowest direct imports:")
+    direct = sorted((row for row in rows if row[3] == 1), key=lambda row: -row[2])
+    for name, _, cumulative, _ in direct[:args.top]:
+        print(f"  {cumulative / 1000:8.1f}ms  {name}")
+
+    heavy = {name.strip() for name in args.heavy.split(",") if name.strip()}
+    loaded = sorted({name.split(".")[0] for name, _, _, _ in rows} & heavy)
+    failed = False
+    if loaded:
+        print(f"FAIL: loaded at import time: {', '.join(loaded)}")
+        failed = True
+    if total_ms > args.budget_ms:
+        print(f"FAIL: over budget by {total_ms - args.budget_ms:.0f}ms")
+        failed = True
+    for target, error in check_setup([name.strip() for name in args.setup.split(",") if name.strip()]):
+        print(f"FAIL: setup of {target} raised {error}")
+        failed = True
+    if not failed:
+        print("OK")
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,80 @@
+# jobs.py
+# Job queue benchmark for BlockSpeak
+# Fills a scratch database with jobs that sleep for a while (standing in for an LLM call or an image
+# download), then drains it with 1, 2, 4... worker threads and prints jobs per second for each, so
+# you can see throughput follow the worker count. --fail makes a share of runs raise to exercise
+# retries and backoff, --crash leaves that many jobs claimed by a worker that "dies" to show they are
+# picked up again once the lease runs out. Every run checks each job ran to completion exactly once.
+# Usage (from the server folder):
+#   python bench/jobs.py
+#   python bench/jobs.py --jobs 1000 --job-seconds 0.02 --workers 1,4,16
+#   python bench/jobs.py --fail 0.2 --crash 10
+
+import os  # The server folder
+import sys  # Lets the bench import the app modules
+import time  # Throughput timing
+import random  # --fail
+import shutil  # Cleans up the scratch database
+import argparse  # Command line flags
+import tempfile  # Scratch database folder
+import threading  # Shared run counts
+from collections import Counter  # Completed runs per job
+
+SERVER_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, SERVER_DIR)
+
+import jobs  # noqa: E402 The queue under test
+from jobs import JobWorkers  # noqa: E402 Consumers
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the job queue with sleeping jobs")
+    parser.add_argument("--jobs", type=int, default=400)
+    parser.add_argument("--job-seconds", type=float, default=0.05, help="How long each job sleeps")
+    parser.add_argument("--workers", default="1,2,4,8", help="Comma separated worker counts to try")
+    parser.add_argument("--fail", type=float, default=0.0, help="Share of runs that raise and are retried")
+    parser.add_argument("--crash", type=int, default=0, help="Jobs left claimed by a worker that never finishes them")
+    args = parser.parse_args()
+
+    jobs.BACKOFF_SECONDS = 0.05  # Retries within the run instead of after 30 seconds
+    lease = 2.0  # Short lease so crashed jobs come back quickly
+    completed = Counter()
+    lock = threading.Lock()
+
+    def sleeper(payload):
+        time.sleep(args.job_seconds)
+        if random.random() < args.fail:
+            raise RuntimeError("Injected failure")
+        with lock:
+            completed[payload["n"]] += 1
+
+    jobs.register("bench_sleep", sleeper)
+    print(f"{args.jobs} jobs of {args.job_seconds * 1000:.0f}ms, fail {args.fail}, crash {args.crash}")
+    for count in [int(n) for n in args.workers.split(",") if n.strip()]:
+        workdir = tempfile.mkdtemp(prefix="blockspeak-jobs-")
+        db_path = os.path.join(workdir, "jobs.db")
+        try:
+            jobs.init_job_tables(db_path)
+            for n in range(args.jobs):
+                jobs.enqueue("bench_sleep", {"n": n}, priority=n % 3, dedupe_key=f"bench:{n}", max_attempts=20,
+                             db_path=db_path)
+            duplicates = sum(jobs.enqueue("bench_sleep", {"n": n}, dedupe_key=f"bench:{n}", db_path=db_path) is not None
+                             for n in range(args.jobs))
+            for _ in range(args.crash):
+                jobs.claim("crashed-worker", ["bench_sleep"], lease, db_path)  # Claimed, never completed
+            completed.clear()
+            started = time.perf_counter()
+            JobWorkers(count, ["bench_sleep"], db_path, lease_seconds=lease, poll_seconds=0.05).run(drain=True)
+            wall = time.perf_counter() - started
+            counts, dead = jobs.queue_stats(db_path)
+            states = {state: total for _, state, total, _ in counts}
+            missing = args.jobs - len(completed)
+            twice = sum(1 for runs in completed.values() if runs > 1)
+            print(f"  {count:3} workers  {args.jobs / wall:8.1f} jobs/s  {wall:6.2f}s  done {states.get('done', 0)}  "
+                  f"dead {len(dead)}  missing {missing}  ran twice {twice}  re-queued duplicates {duplicates}")
+        finally:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
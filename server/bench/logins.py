@@ -0,0 +1,105 @@
+# logins.py
+# Login crypto benchmark for BlockSpeak
+# Runs password checks and MetaMask signature recoveries the old way (inline on the request threads,
+# werkzeug's default hash, eth_account recovery) and the new way (crypto_pool processes with
+# PASSWORD_HASH_METHOD, fastest recovery backend), and prints logins per second and logins per CPU
+# core-second for each. CPU time includes the pool processes, so the per-core numbers are comparable.
+# Usage (from the server folder):
+#   python bench/logins.py
+#   python bench/logins.py --threads 16 --workers 4 --logins 400
+#   PASSWORD_HASH_METHOD=pbkdf2:sha256:260000 python bench/logins.py --modes password_before,password_after
+
+import os  # CPU count and the server folder
+import sys  # Lets the bench import the app modules
+import time  # Wall clock
+import argparse  # Command line flags
+import resource  # CPU time of this process and the finished pool processes
+from concurrent.futures import ThreadPoolExecutor  # Request threads
+from werkzeug.security import generate_password_hash  # Hashes to check against
+from werkzeug.security import check_password_hash  # The old inline check
+from eth_account import Account  # Signs the MetaMask messages
+from eth_account.messages import encode_defunct  # Same message format as the app
+
+SERVER_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, SERVER_DIR)
+
+import crypto_pool  # noqa: E402 The new code paths, importable once SERVER_DIR is on the path
+
+PASSWORD = "bench-password"
+MESSAGE = "Log in to BlockSpeak: 0123456789abcdef0123456789abcdef"
+
+
+def cpu_seconds():
+    # User plus system time of this process and of child processes that have exited
+    own = resource.getrusage(resource.RUSAGE_SELF)
+    children = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return own.ru_utime + own.ru_stime + children.ru_utime + children.ru_stime
+
+
+def measure(name, login, total, threads, pool=None):
+    # Runs login() total times from `threads` threads, returns the summary row
+    started_cpu = cpu_seconds()
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+        list(executor.map(lambda _: login(), range(total)))
+    wall = time.perf_counter() - started
+    if pool and pool.executor:
+        pool.executor.shutdown(wait=True)  # Finished children count in RUSAGE_CHILDREN
+        pool.pid = None
+    cpu = cpu_seconds() - started_cpu
+    return {"mode": name, "logins": total, "per_second": total / wall, "per_core_second": total / cpu if cpu else None,
+            "cpu_seconds": cpu, "wall_seconds": wall}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark login password hashing and signature recovery")
+    parser.add_argument("--logins", type=int, default=200, help="Logins per mode")
+    parser.add_argument("--threads", type=int, default=8, help="Concurrent request threads")
+    parser.add_argument("--workers", type=int, default=crypto_pool.CRYPTO_WORKERS, help="Crypto pool processes")
+    parser.add_argument("--before-method", default=None,
+                        help="Hash method before the change, werkzeug's default if unset")
+    parser.add_argument("--modes", default="password_before,password_after,metamask_before,metamask_after")
+    args = parser.parse_args()
+
+    before_hash = generate_password_hash(PASSWORD, **({"method": args.before_method} if args.before_method else {}))
+    after_hash = generate_password_hash(PASSWORD, method=crypto_pool.PASSWORD_HASH_METHOD)
+    account = Account.create()
+    signature = "0x" + bytes(account.sign_message(encode_defunct(text=MESSAGE)).signature).hex()
+    pool = crypto_pool.CryptoPool(workers=args.workers, queue=args.logins + args.threads)
+
+    def password_after():
+        assert pool.run("verify_password", crypto_pool._check_password, after_hash, PASSWORD,
+                        crypto_pool.PASSWORD_HASH_METHOD)[0]
+
+    def metamask_after():
+        if crypto_pool.RECOVER_BACKEND == "coincurve":
+            address = pool.run("recover_signer", crypto_pool._recover_coincurve, MESSAGE, signature, inline=True)
+        else:
+            address = pool.run("recover_signer", crypto_pool._recover_python, MESSAGE, signature)
+        assert address == account.address
+
+    modes = {
+        "password_before": (lambda: check_password_hash(before_hash, PASSWORD), None),
+        "password_after": (password_after, pool),
+        "metamask_before": (lambda: Account.recover_message(encode_defunct(text=MESSAGE), signature=signature), None),
+        "metamask_after": (metamask_after, pool),
+    }
+    names = [name.strip() for name in args.modes.split(",") if name.strip()]
+    unknown = [name for name in names if name not in modes]
+    if unknown:
+        raise SystemExit(f"Unknown modes: {', '.join(unknown)}")
+
+    print(f"{os.cpu_count()} cores, {args.threads} threads, {args.workers} pool processes, "
+          f"before method {before_hash.split('$')[0]}, after method {crypto_pool.PASSWORD_HASH_METHOD}, "
+          f"recovery backend {crypto_pool.RECOVER_BACKEND}")
+    for name in names:
+        login, mode_pool = modes[name]
+        login()  # Warm up imports and, for the pool, its processes
+        row = measure(name, login, args.logins, args.threads, mode_pool)
+        per_core = f"{row['per_core_second']:.1f}" if row["per_core_second"] else "n/a"
+        print(f"  {name:16} {row['per_second']:8.1f} logins/s  {per_core:>8} logins/core-s  "
+              f"({row['cpu_seconds']:.2f} CPU s over {row['wall_seconds']:.2f} s)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,126 @@
+# rpc_pool.py
+# Provider pool benchmark for BlockSpeak
+# Starts two stub Ethereum nodes with their own latency, failure and slow-request rates, then sends
+# the same reads straight to the first one (what BlockSpeak did before the pool) and through an
+# RpcPool of both, and prints latency percentiles, errors, hedges, failovers and each provider's share.
+# --outage-at takes the first node down partway through a run to show failover.
+# Usage (from the server folder):
+#   python bench/rpc_pool.py
+#   python bench/rpc_pool.py --latency-a 0.04 --slow-a 0.05 --latency-b 0.06 --fail-b 0.02
+#   python bench/rpc_pool.py --outage-at 0.5 --requests 2000
+
+import os  # The server folder
+import sys  # Lets the bench import the app modules
+import math  # Percentile ranks
+import time  # Latency timing
+import argparse  # Command line flags
+import threading  # Shared counters
+from concurrent.futures import ThreadPoolExecutor  # Concurrent callers
+from stubs import StubServer  # Fake nodes with injectable faults, next to this script
+
+SERVER_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, SERVER_DIR)
+
+from rpc import rpc_call  # noqa: E402 Same call path as the app
+from rpc_pool import RpcPool  # noqa: E402 The pool under test
+from metrics import registry  # noqa: E402 Hedge and failover counters
+
+ADDRESS = "0x" + "ab" * 20
+
+
+def percentile(samples, share):
+    if not samples:
+        return None
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, max(0, math.ceil(share * len(ordered)) - 1))]
+
+
+def run(name, endpoint, total, concurrency, outage_at=None, stub=None):
+    latencies = []
+    errors = [0]
+    done = [0]
+    lock = threading.Lock()
+
+    def one(_):
+        with lock:
+            done[0] += 1
+            if outage_at is not None and done[0] == int(total * outage_at):
+                stub.fail["eth"] = 1.0  # The first node starts answering 503 to everything
+        started = time.perf_counter()
+        try:
+            rpc_call(endpoint, "eth_getBalance", [ADDRESS, "latest"])
+            with lock:
+                latencies.append(time.perf_counter() - started)
+        except Exception:
+            with lock:
+                errors[0] += 1
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        list(executor.map(one, range(total)))
+    wall = time.perf_counter() - started
+    p50, p95, p99 = (percentile(latencies, share) for share in (0.5, 0.95, 0.99))
+    print(f"  {name:8} p50 {p50 * 1000:7.1f}ms  p95 {p95 * 1000:7.1f}ms  p99 {p99 * 1000:7.1f}ms  "
+          f"errors {errors[0]:4}  {total / wall:7.1f} req/s" if latencies else f"  {name:8} every request failed")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the Ethereum provider pool against two stub nodes")
+    parser.add_argument("--requests", type=int, default=1000)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--latency-a", type=float, default=0.04, help="Seconds the first node takes")
+    parser.add_argument("--latency-b", type=float, default=0.06, help="Seconds the second node takes")
+    parser.add_argument("--fail-a", type=float, default=0.0, help="Share of 503s from the first node")
+    parser.add_argument("--fail-b", type=float, default=0.0, help="Share of 503s from the second node")
+    parser.add_argument("--slow-a", type=float, default=0.05, help="Share of slow answers from the first node")
+    parser.add_argument("--slow-b", type=float, default=0.0, help="Share of slow answers from the second node")
+    parser.add_argument("--outage-at", type=float, default=None,
+                        help="Share of the run after which the first node fails everything")
+    args = parser.parse_args()
+
+    stub_a = StubServer(0, {"eth": args.latency_a}, {"eth": args.fail_a}, {"eth": args.slow_a}).start()
+    stub_b = StubServer(0, {"eth": args.latency_b}, {"eth": args.fail_b}, {"eth": args.slow_b}).start()
+    url_a = f"http://127.0.0.1:{stub_a.port}/eth"
+    url_b = f"http://127.0.0.1:{stub_b.port}/eth"
+    print(f"node a {args.latency_a * 1000:.0f}ms fail {args.fail_a} slow {args.slow_a}, "
+          f"node b {args.latency_b * 1000:.0f}ms fail {args.fail_b} slow {args.slow_b}, "
+          f"{args.requests} eth_getBalance at concurrency {args.concurrency}")
+    try:
+        run("direct", url_a, args.requests, args.concurrency, args.outage_at, stub_a)
+        stub_a.fail["eth"] = args.fail_a  # Back up for the pool run
+        pool = RpcPool([("a", url_a), ("b", url_b)], probe_seconds=1)
+        run("pool", pool, args.requests, args.concurrency, args.outage_at, stub_a)
+        for name in ("rpc_hedged_total", "rpc_failover_total"):
+            print(f"  {name}: {registry_total(name)}")
+        shares = registry_by_provider("rpc_provider_requests_total")
+        print("  attempts per provider: "
+              + ", ".join(f"{provider} {count}" for provider, count in sorted(shares.items())))
+        for stats in pool.stats():
+            latency = f"{stats['latency'] * 1000:.1f}ms" if stats["latency"] else "n/a"
+            p95 = f"{stats['p95'] * 1000:.1f}ms" if stats["p95"] else "n/a"
+            print(f"  {stats['name']}: latency {latency}, p95 {p95}, error rate {stats['error_rate']}, "
+                  f"available {stats['available']}")
+    finally:
+        stub_a.stop()
+        stub_b.stop()
+
+
+def registry_total(name):
+    return sum(value for _, value in registry_values(name))
+
+
+def registry_by_provider(name):
+    totals = {}
+    for labels, value in registry_values(name):
+        provider = dict(labels).get("provider")
+        totals[provider] = totals.get(provider, 0) + value
+    return totals
+
+
+def registry_values(name):
+    # (labels, value) pairs of one counter in this process
+    return list(registry.metrics[name]["values"].items())
+
+
+if __name__ == "__main__":
+    main()
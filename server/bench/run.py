@@ -0,0 +1,272 @@
+# run.py
+# Load test for the BlockSpeak API against local stub upstreams
+# Starts bench/stubs.py, boots the app with every upstream pointed at the stubs and a throwaway
+# database, drives the main routes at a fixed concurrency and writes p50/p95/p99 latency and
+# throughput per route to JSON. Keep the JSON from main as the baseline for performance changes.
+# Usage (from the server folder):
+#   python bench/run.py --server flask --concurrency 16 --requests 400
+#   python bench/run.py --server gunicorn --workers 4 --threads 8 --out bench/gunicorn.json
+#   python bench/run.py --server uvicorn --latency openai=1.5 --scenarios home,query_chat
+#   python bench/run.py --server gunicorn --database-url postgresql://localhost/blockspeak_bench
+
+import os  # Paths and the app environment
+import sys  # Python interpreter for the app process
+import json  # Results file
+import math  # Percentile ranks
+import time  # Latency timing
+import uuid  # Unique bench users
+import shutil  # Cleans up the throwaway run folder
+import argparse  # Command line flags
+import tempfile  # Throwaway run folder with its own users.db
+import threading  # Shared request counter
+import subprocess  # Runs the app in its own process, like production
+from datetime import datetime  # Timestamp in the results
+from datetime import timezone  # Ensures times are UTC
+from concurrent.futures import ThreadPoolExecutor  # Concurrent clients
+import requests  # HTTP client for the load
+from eth_account import Account  # Signs MetaMask-style logins
+from eth_account.messages import encode_defunct  # Same message format as the app
+from stubs import StubServer  # Fake upstreams
+from stubs import parse_latency  # GROUP=SECONDS flags
+
+SERVER_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+REPO_DIR = os.path.dirname(SERVER_DIR)
+BENCH_DAO = "0x" + "da" * 20  # The stub node answers proposal reads for any address
+STARTUP_SECONDS = 60
+
+
+def server_command(args):
+    # Command line that starts the app the way the chosen server would in production
+    if args.server == "flask":
+        return [sys.executable, os.path.join(SERVER_DIR, "BlockSpeak.py")]
+    if args.server == "gunicorn":
+        return ["gunicorn", "-w", str(args.workers), "-k", "gthread", "--threads", str(args.threads),
+                "-b", f"127.0.0.1:{args.port}", "BlockSpeak:create_app()"]
+    if args.server == "uvicorn":
+        return ["uvicorn", "asgi:app", "--host", "127.0.0.1", "--port", str(args.port),
+                "--workers", str(args.workers), "--no-access-log"]
+    raise SystemExit(f"Unknown server {args.server}")
+
+
+def start_app(args, stubs, run_dir):
+    # Boots the app in run_dir so users.db and caches are throwaway, returns the process
+    os.symlink(os.path.join(REPO_DIR, "skillchain_contracts"),
+               os.path.join(os.path.dirname(run_dir), "skillchain_contracts"))
+    env = dict(os.environ, **stubs.env())
+    env.pop("DATABASE_URL", None)  # SQLite in the run folder unless --database-url asks for Postgres
+    if args.database_url:
+        env["DATABASE_URL"] = args.database_url
+    env.update({
+        "PYTHONPATH": SERVER_DIR,
+        "PORT": str(args.port),
+        "SECRET_KEY": "bench-secret",
+        "APP_ENV": "development",
+        "ETH_PAYMENT_ADDRESS": env.get("ETH_PAYMENT_ADDRESS", "0x" + "ab" * 20),
+    })
+    log = open(os.path.join(run_dir, "app.log"), "w")
+    process = subprocess.Popen(server_command(args), cwd=run_dir, env=env, stdout=log, stderr=subprocess.STDOUT)
+    base_url = f"http://127.0.0.1:{args.port}"
+    deadline = time.time() + STARTUP_SECONDS
+    while time.time() < deadline:
+        if process.poll() is not None:
+            raise SystemExit(f"App exited during startup, see {log.name}")
+        try:
+            if requests.get(f"{base_url}/api/prices", timeout=2).status_code == 200:
+                return process
+        except requests.RequestException:
+            pass
+        time.sleep(0.5)
+    process.terminate()
+    raise SystemExit(f"App did not answer within {STARTUP_SECONDS}s, see {log.name}")
+
+
+class PlainHttpSession(requests.Session):
+    # requests.Session that keeps sending Flask's Secure session cookie over plain http
+    # Cleared after send returns, a response hook runs before the session stores the response's cookies
+    def send(self, request, **kwargs):
+        response = super().send(request, **kwargs)
+        for cookie in self.cookies:
+            cookie.secure = False
+        return response
+
+
+def client_session():
+    return PlainHttpSession()
+
+
+def logged_in_session(base_url):
+    # A fresh bench user with an email login (register may fail at Stripe, the user row is still created)
+    session = client_session()
+    email = f"bench-{uuid.uuid4().hex[:12]}@example.com"
+    session.post(f"{base_url}/api/register", data={"email": email, "password": "bench-password"})
+    response = session.post(f"{base_url}/api/login", data={"email": email, "password": "bench-password"})
+    if response.status_code != 200:
+        raise SystemExit(f"Bench login failed: {response.status_code} {response.text[:200]}")
+    return session
+
+
+def metamask_login(base_url, session):
+    # Nonce, signature and /login/metamask with a brand new wallet, only the login POST is timed
+    fresh = client_session()
+    nonce = fresh.get(f"{base_url}/nonce").text
+    account = Account.create()
+    signed = account.sign_message(encode_defunct(text=f"Log in to BlockSpeak: {nonce}"))
+    signature = "0x" + bytes(signed.signature).hex()
+    started = time.perf_counter()
+    response = fresh.post(f"{base_url}/login/metamask",
+                          json={"address": account.address, "signature": signature, "nonce": nonce})
+    return response, time.perf_counter() - started
+
+
+# name -> (needs login, callable(base_url, session) returning a response or (response, seconds))
+SCENARIOS = {
+    "home": (False, lambda base, s: s.get(f"{base}/api/")),
+    "prices": (False, lambda base, s: s.get(f"{base}/api/prices")),
+    "blog_posts": (False, lambda base, s: s.get(f"{base}/api/blog-posts", params={"page": 1})),
+    "coin_graph": (False, lambda base, s: s.get(f"{base}/api/coin_graph/bitcoin")),
+    "query_price": (True, lambda base, s: s.post(f"{base}/api/query", data={"question": "What is the bitcoin price?"})),
+    "query_gas": (True, lambda base, s: s.post(f"{base}/api/query",
+                                               data={"question": "What is the gas price right now?"})),
+    "query_chat": (True, lambda base, s: s.post(f"{base}/api/query", data={"question": "What is a DAO?"})),
+    "metamask_login": (False, metamask_login),
+    "get_proposals": (True, lambda base, s: s.post(f"{base}/api/get_proposals", data={"dao_address": BENCH_DAO})),
+}
+
+
+def percentile(sorted_values, pct):
+    # Nearest-rank percentile of an already sorted list
+    if not sorted_values:
+        return None
+    rank = max(1, math.ceil(pct / 100 * len(sorted_values)))
+    return sorted_values[rank - 1]
+
+
+def ms(seconds):
+    # Seconds to rounded milliseconds, None stays None
+    return round(seconds * 1000, 2) if seconds is not None else None
+
+
+def run_scenario(base_url, name, total, concurrency, warmup):
+    # Fires `total` requests with `concurrency` clients and summarizes their latency
+    needs_login, action = SCENARIOS[name]
+    sessions = [logged_in_session(base_url) if needs_login else client_session() for _ in range(concurrency)]
+    for i in range(warmup):
+        action(base_url, sessions[i % concurrency])  # Fills caches and connection pools first
+
+    latencies = []
+    errors = {}
+    lock = threading.Lock()
+    remaining = [total]
+
+    def worker(session):
+        while True:
+            with lock:
+                if remaining[0] <= 0:
+                    return
+                remaining[0] -= 1
+            started = time.perf_counter()
+            try:
+                result = action(base_url, session)
+                response, elapsed = result if isinstance(result, tuple) else (result, time.perf_counter() - started)
+                status = response.status_code
+            except requests.RequestException as e:
+                elapsed, status = time.perf_counter() - started, type(e).__name__
+            with lock:
+                latencies.append(elapsed)
+                if not isinstance(status, int) or status >= 400:
+                    errors[str(status)] = errors.get(str(status), 0) + 1
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(worker, sessions))
+    wall = time.perf_counter() - started
+
+    latencies.sort()
+    return {
+        "requests": len(latencies),
+        "errors": errors,
+        "throughput_rps": round(len(latencies) / wall, 2) if wall else None,
+        "mean_ms": ms(sum(latencies) / len(latencies)) if latencies else None,
+        "p50_ms": ms(percentile(latencies, 50)),
+        "p95_ms": ms(percentile(latencies, 95)),
+        "p99_ms": ms(percentile(latencies, 99)),
+        "max_ms": ms(latencies[-1]) if latencies else None,
+    }
+
+
+def git_commit():
+    # Commit the numbers belong to, so baselines can be compared later
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=REPO_DIR, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the BlockSpeak API with stubbed upstreams")
+    parser.add_argument("--server", choices=["flask", "gunicorn", "uvicorn"], default="flask")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--workers", type=int, default=2, help="gunicorn or uvicorn worker processes")
+    parser.add_argument("--threads", type=int, default=8, help="gunicorn threads per worker")
+    parser.add_argument("--concurrency", type=int, default=16, help="Clients sending requests at the same time")
+    parser.add_argument("--requests", type=int, default=400, help="Requests per scenario")
+    parser.add_argument("--warmup", type=int, default=10, help="Untimed requests per scenario")
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS),
+                        help="Comma separated, from: " + ", ".join(SCENARIOS))
+    parser.add_argument("--stub-port", type=int, default=9100)
+    parser.add_argument("--latency", action="append", metavar="GROUP=SECONDS",
+                        help="Stub latency override, like openai=1.0")
+    parser.add_argument("--out", default=os.path.join(SERVER_DIR, "bench", "results.json"))
+    parser.add_argument("--database-url", default=None,
+                        help="Run against this Postgres database instead of SQLite, use a scratch one")
+    parser.add_argument("--keep", action="store_true", help="Keep the run folder (database and app.log)")
+    args = parser.parse_args()
+
+    names = [name.strip() for name in args.scenarios.split(",") if name.strip()]
+    unknown = [name for name in names if name not in SCENARIOS]
+    if unknown:
+        raise SystemExit(f"Unknown scenarios: {', '.join(unknown)}")
+
+    stubs = StubServer(args.stub_port, parse_latency(args.latency)).start()
+    workdir = tempfile.mkdtemp(prefix="blockspeak-bench-")
+    run_dir = os.path.join(workdir, "server")
+    os.makedirs(run_dir)
+    process = None
+    try:
+        process = start_app(args, stubs, run_dir)
+        base_url = f"http://127.0.0.1:{args.port}"
+        results = {}
+        for name in names:
+            print(f"Running {name}: {args.requests} requests, {args.concurrency} concurrent")
+            results[name] = run_scenario(base_url, name, args.requests, args.concurrency, args.warmup)
+            summary = results[name]
+            print(f"  p50 {summary['p50_ms']}ms  p95 {summary['p95_ms']}ms  p99 {summary['p99_ms']}ms  "
+                  f"{summary['throughput_rps']} req/s  errors {summary['errors'] or 0}")
+        report = {
+            "generated_at": datetime.now(timezone.utc).isoformat(),
+            "commit": git_commit(),
+            "server": args.server,
+            "workers": args.workers if args.server != "flask" else 1,
+            "threads": args.threads if args.server == "gunicorn" else None,
+            "database": "postgres" if args.database_url else "sqlite",
+            "concurrency": args.concurrency,
+            "requests_per_scenario": args.requests,
+            "stub_latency_s": stubs.latency,
+            "scenarios": results,
+        }
+        with open(args.out, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"Results written to {args.out}")
+    finally:
+        if process:
+            process.terminate()
+            process.wait(timeout=10)
+        stubs.stop()
+        if args.keep:
+            print(f"Run folder kept at {workdir}")
+        else:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
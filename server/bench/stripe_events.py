@@ -0,0 +1,95 @@
+# stripe_events.py
+# Sends locally generated, signed Stripe webhook events to a BlockSpeak server
+# Builds customer.subscription.* events the way Stripe sends them, signs them with
+# STRIPE_WEBHOOK_SECRET and posts them to /api/stripe/webhook, so subscription sync can be tried
+# without a Stripe account or the Stripe CLI. --repeat sends the same event again to check replays
+# are ignored, --shuffle sends a run of events out of order like Stripe sometimes does.
+# Usage (from the server folder, with the same STRIPE_WEBHOOK_SECRET as the server):
+#   python bench/stripe_events.py --customer cus_123 --plan pro
+#   python bench/stripe_events.py --customer cus_123 --type customer.subscription.deleted
+#   python bench/stripe_events.py --customer cus_123 --plan basic --repeat 3 --shuffle
+
+import os  # The server folder
+import sys  # Lets the script import the app modules
+import json  # Event payloads
+import time  # Event created times
+import uuid  # Event and subscription IDs
+import random  # --shuffle
+import argparse  # Command line flags
+import requests  # Posts the events
+
+SERVER_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, SERVER_DIR)
+
+from entitlements import sign_payload  # noqa: E402 Same Stripe-Signature scheme the server checks
+from entitlements import STRIPE_PRICES  # noqa: E402 Prices the server maps to plans
+from entitlements import STRIPE_WEBHOOK_SECRET  # noqa: E402 Default signing secret
+
+
+def make_event(event_type, customer, plan, subscription_id, status="active", created=None):
+    # A Stripe event wrapping a subscription object, only the fields BlockSpeak reads plus a few for realism
+    created = int(time.time() if created is None else created)
+    return {
+        "id": f"evt_{uuid.uuid4().hex[:24]}",
+        "object": "event",
+        "type": event_type,
+        "created": created,
+        "livemode": False,
+        "data": {"object": {
+            "id": subscription_id,
+            "object": "subscription",
+            "customer": customer,
+            "status": status,
+            "current_period_end": created + 30 * 86400,
+            "items": {"data": [{"price": {"id": STRIPE_PRICES[plan]}}]},
+            "metadata": {"plan": plan},
+        }},
+    }
+
+
+def send(url, event, secret):
+    # Posts one event, returns (status code, body)
+    payload = json.dumps(event).encode()
+    headers = {"Content-Type": "application/json", "Stripe-Signature": sign_payload(payload, secret)}
+    response = requests.post(url, data=payload, timeout=10, headers=headers)
+    return response.status_code, response.text.strip()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Send signed Stripe webhook events to a local server")
+    parser.add_argument("--url", default="http://127.0.0.1:8080/api/stripe/webhook")
+    parser.add_argument("--secret", default=STRIPE_WEBHOOK_SECRET,
+                        help="Signing secret, STRIPE_WEBHOOK_SECRET by default")
+    parser.add_argument("--customer", required=True, help="stripe_customer_id of a user in users.db")
+    parser.add_argument("--plan", choices=sorted(STRIPE_PRICES), default="basic")
+    parser.add_argument("--type", default="customer.subscription.updated")
+    parser.add_argument("--status", default="active", help="Subscription status, like active, past_due or canceled")
+    parser.add_argument("--subscription", default=None, help="Subscription ID, a new one by default")
+    parser.add_argument("--repeat", type=int, default=1, help="Times each event is sent")
+    parser.add_argument("--shuffle", action="store_true",
+                        help="Send created, updated to the other plan and deleted, out of order")
+    args = parser.parse_args()
+    if not args.secret:
+        raise SystemExit("Set STRIPE_WEBHOOK_SECRET or pass --secret")
+
+    subscription_id = args.subscription or f"sub_{uuid.uuid4().hex[:24]}"
+    if args.shuffle:
+        now = int(time.time())
+        other = "pro" if args.plan == "basic" else "basic"
+        events = [
+            make_event("customer.subscription.created", args.customer, args.plan, subscription_id, "active", now - 2),
+            make_event("customer.subscription.updated", args.customer, other, subscription_id, "active", now - 1),
+            make_event("customer.subscription.deleted", args.customer, other, subscription_id, "canceled", now),
+        ]
+        random.shuffle(events)
+    else:
+        events = [make_event(args.type, args.customer, args.plan, subscription_id, args.status)]
+
+    for event in events:
+        for _ in range(args.repeat):
+            status, body = send(args.url, event, args.secret)
+            print(f"{event['type']:34} {event['id']}  {status} {body}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,361 @@
+# stubs.py
+# Local stand-ins for every upstream BlockSpeak talks to, used by the benchmark harness
+# One threaded HTTP server answers CoinCap, Ethereum and Solana JSON-RPC, OpenAI, RSS, Unsplash,
+# BlockCypher and blockchain.info on their own path prefixes. Each group has a configurable latency,
+# so a run can model a slow OpenAI or a fast node without touching the network. Faults can be injected
+# per group too: a share of requests answered 503, and a share that take SLOW_FACTOR times as long.
+# Run on its own with: python bench/stubs.py --port 9100 --latency openai=0.8 --fail eth=0.1 --slow eth=0.05
+
+import json  # Every stub answers JSON except RSS
+import time  # Simulated latency and a moving chain head
+import random  # Small price moves so the live feed has diffs to send
+import hashlib  # Deterministic fake hashes and signatures
+import argparse  # Command line flags when run on its own
+import threading  # Serves in the background next to the load driver
+from http.server import ThreadingHTTPServer  # One thread per connection, like a real upstream
+from http.server import BaseHTTPRequestHandler  # Request parsing
+from urllib.parse import urlparse  # Splits path and query
+from urllib.parse import parse_qs  # CoinCap query parameters
+from eth_abi import encode as abi_encode  # eth_call answers for DAO reads, ships with web3
+from eth_utils import keccak  # Function selectors, ships with web3
+
+# Seconds each upstream group waits before answering, roughly what production sees
+DEFAULT_LATENCY = {
+    "coincap": 0.08,
+    "eth": 0.04,
+    "sol": 0.05,
+    "openai": 0.6,
+    "rss": 0.25,
+    "unsplash": 0.15,
+    "btc": 0.1,
+}
+
+SLOW_FACTOR = 10       # How much longer a --slow request takes than the group latency
+BLOCK_SECONDS = 12     # Fake Ethereum block time
+SLOT_SECONDS = 0.4     # Fake Solana slot time
+TXS_PER_BLOCK = 150    # Transactions in every fake block
+SIGNATURES = 240       # Signatures every fake Solana wallet has
+PROPOSALS = 12         # Proposals every fake DAO has
+
+COINS = [
+    ("bitcoin", "BTC", "Bitcoin", 64000.0, 1.26e12),
+    ("ethereum", "ETH", "Ethereum", 3100.0, 3.7e11),
+    ("tether", "USDT", "Tether", 1.0, 1.1e11),
+    ("binance-coin", "BNB", "BNB", 560.0, 8.2e10),
+    ("solana", "SOL", "Solana", 145.0, 6.6e10),
+    ("usd-coin", "USDC", "USDC", 1.0, 3.3e10),
+    ("xrp", "XRP", "XRP", 0.52, 2.9e10),
+    ("dogecoin", "DOGE", "Dogecoin", 0.12, 1.7e10),
+    ("cardano", "ADA", "Cardano", 0.38, 1.3e10),
+    ("polkadot", "DOT", "Polkadot", 5.9, 8.5e9),
+    ("chainlink", "LINK", "Chainlink", 13.5, 8.0e9),
+    ("litecoin", "LTC", "Litecoin", 71.0, 5.3e9),
+]
+
+SELECTOR_PROPOSAL_COUNT = keccak(text="proposalCount()")[:4].hex()
+SELECTOR_GET_PROPOSAL = keccak(text="getProposal(uint256)")[:4].hex()
+
+
+def fake_hash(*parts):
+    # 32-byte hex hash that is stable for the same inputs
+    return "0x" + hashlib.sha256(":".join(str(p) for p in parts).encode()).hexdigest()
+
+
+class Upstreams:
+    # The fake state behind every stub: prices that drift, a chain head that moves with the clock
+    def __init__(self):
+        self.started = time.time()
+        self.prices = {coin[0]: coin[3] for coin in COINS}
+        self.lock = threading.Lock()
+
+    def eth_head(self):
+        return 19000000 + int((time.time() - self.started) / BLOCK_SECONDS)
+
+    def block_time(self, number):
+        return int(self.started) - (self.eth_head() - number) * BLOCK_SECONDS
+
+    def sol_slot(self):
+        return 260000000 + int((time.time() - self.started) / SLOT_SECONDS)
+
+    def asset(self, coin):
+        # One CoinCap asset, with a small random walk on every read
+        coin_id, symbol, name, _, market_cap = coin
+        with self.lock:
+            self.prices[coin_id] *= 1 + random.uniform(-0.0005, 0.0005)
+            price = self.prices[coin_id]
+        return {"id": coin_id, "rank": str(COINS.index(coin) + 1), "symbol": symbol, "name": name,
+                "priceUsd": f"{price:.8f}", "marketCapUsd": f"{market_cap:.2f}",
+                "volumeUsd24Hr": f"{market_cap / 30:.2f}", "changePercent24Hr": f"{random.uniform(-3, 3):.4f}"}
+
+    def block(self, number):
+        # Enough of an Ethereum block for raw JSON-RPC readers and web3s formatters
+        return {
+            "number": hex(number), "hash": fake_hash("block", number), "parentHash": fake_hash("block", number - 1),
+            "nonce": "0x0000000000000000", "sha3Uncles": fake_hash("uncles"), "logsBloom": "0x" + "00" * 256,
+            "transactionsRoot": fake_hash("txroot", number), "stateRoot": fake_hash("state", number),
+            "receiptsRoot": fake_hash("receipts", number), "miner": "0x" + "00" * 20, "difficulty": "0x0",
+            "totalDifficulty": "0x0", "extraData": "0x", "size": "0x1000", "gasLimit": hex(30000000),
+            "gasUsed": hex(15000000), "timestamp": hex(self.block_time(number)), "uncles": [],
+            "baseFeePerGas": hex(20 * 10**9), "mixHash": fake_hash("mix", number),
+            "transactions": [fake_hash("tx", number, i) for i in range(TXS_PER_BLOCK)],
+        }
+
+    def eth(self, method, params):
+        # Ethereum JSON-RPC, one call
+        if method == "eth_blockNumber":
+            return hex(self.eth_head())
+        if method == "eth_getBlockByNumber":
+            tag = params[0]
+            number = self.eth_head() if tag in ("latest", "pending", "safe", "finalized") else int(tag, 16)
+            return self.block(min(number, self.eth_head()))
+        if method == "eth_gasPrice":
+            return hex(22 * 10**9)
+        if method == "eth_getBalance":
+            return hex(3 * 10**18)
+        if method == "eth_getTransactionCount":
+            return hex(420)
+        if method == "eth_getCode":
+            return "0x6080"
+        if method == "eth_getLogs":
+            return []
+        if method in ("eth_chainId", "net_version"):
+            return "0x7a69" if method == "eth_chainId" else "31337"
+        if method == "web3_clientVersion":
+            return "BlockSpeakStub/1.0"
+        if method == "eth_call":
+            data = params[0].get("data") or params[0].get("input") or "0x"
+            selector = data[2:10]
+            if selector == SELECTOR_PROPOSAL_COUNT:
+                return "0x" + abi_encode(["uint256"], [PROPOSALS]).hex()
+            if selector == SELECTOR_GET_PROPOSAL:
+                proposal_id = int(data[10:74], 16)
+                fields = [f"Stub proposal {proposal_id}", "0x" + "11" * 20, 3, 1,
+                          proposal_id % 2 == 0, proposal_id % 2 == 1]
+                return "0x" + abi_encode(["string", "address", "uint256", "uint256", "bool", "bool"], fields).hex()
+            return "0x" + "00" * 32  # balanceOf and anything else reads as zero
+        raise ValueError(f"Method {method} not supported by the stub")
+
+    def sol(self, method, params):
+        # Solana JSON-RPC, one call
+        slot = self.sol_slot()
+        if method == "getSlot":
+            return slot
+        if method == "getBlockTime":
+            return int(self.started + (params[0] - 260000000) * SLOT_SECONDS)
+        if method == "getBalance":
+            return {"context": {"slot": slot}, "value": 12 * 10**9}
+        if method == "getMultipleAccounts":
+            account = {"lamports": 12 * 10**9, "owner": "11111111111111111111111111111111",
+                       "data": ["", "base64"], "executable": False}
+            return {"context": {"slot": slot}, "value": [account for _ in params[0]]}
+        if method == "getSignaturesForAddress":
+            options = params[1] if len(params) > 1 else {}
+            limit = options.get("limit", 1000)
+            before = options.get("before")
+            signatures = [fake_hash("sig", params[0], i) for i in range(SIGNATURES)]
+            if options.get("until") in signatures:
+                signatures = signatures[:signatures.index(options["until"])]
+            if before in signatures:
+                signatures = signatures[signatures.index(before) + 1:]
+            return [{"signature": s, "slot": slot - i, "blockTime": int(time.time()) - i, "err": None}
+                    for i, s in enumerate(signatures[:limit])]
+        raise ValueError(f"Method {method} not supported by the stub")
+
+
+def rss_feed():
+    # A small RSS document feedparser can read
+    items = "".join(f"<item><title>Stub headline {i}</title><link>https://example.com/news/{i}</link></item>"
+                    for i in range(5))
+    return f'<?xml version="1.0"?><rss version="2.0"><channel><title>Stub</title>{items}</channel></rss>'.encode()
+
+
+def make_handler(upstreams, latency, fail, slow):
+    # Builds the request handler class bound to one fake state, latency table and fault rates
+
+    class StubHandler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"  # Keep-alive, like real upstreams behind a pooled client
+
+        def log_message(self, *args):
+            pass  # The load driver reports latency, per-request logs would only slow the stub down
+
+        def _send(self, status, body, content_type="application/json"):
+            if not isinstance(body, bytes):
+                body = json.dumps(body).encode()
+            self.send_response(status)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def _wait(self, group):
+            slow_down = SLOW_FACTOR if random.random() < slow.get(group, 0) else 1
+            time.sleep(latency.get(group, 0) * slow_down)
+
+        def _body(self):
+            length = int(self.headers.get("Content-Length") or 0)
+            return json.loads(self.rfile.read(length) or b"null")
+
+        def do_GET(self):
+            url = urlparse(self.path)
+            parts = url.path.strip("/").split("/")
+            query = parse_qs(url.query)
+            if parts[0] == "coincap":
+                self._wait("coincap")
+                return self._coincap(parts[2:], query)
+            if parts[0] == "rss":
+                self._wait("rss")
+                return self._send(200, rss_feed(), "application/rss+xml")
+            if parts[:2] == ["unsplash", "photos"]:
+                self._wait("unsplash")
+                return self._send(200, {"urls": {"regular": f"http://{self.headers['Host']}/unsplash/image.jpg"}})
+            if parts[:2] == ["unsplash", "image.jpg"]:
+                return self._send(200, b"\xff\xd8\xff\xd9", "image/jpeg")
+            if parts[0] == "btc":
+                self._wait("btc")
+                return self._send(200, {"height": 840000 + int((time.time() - upstreams.started) / 600)})
+            if parts[0] == "blockcypher":
+                self._wait("btc")
+                if len(parts) >= 3 and parts[1] == "addrs":
+                    entries = [{"address": a, "balance": 150000000, "n_tx": 77} for a in parts[2].split(";")]
+                    return self._send(200, entries if len(entries) > 1 else entries[0])
+                return self._send(200, {"height": 840000})
+            return self._send(404, {"error": "Not found"})
+
+        def do_POST(self):
+            parts = urlparse(self.path).path.strip("/").split("/")
+            if parts[0] in ("eth", "sol"):
+                self._wait(parts[0])
+                body = self._body()  # Read even when failing, or the keep-alive connection gets out of step
+                if random.random() < fail.get(parts[0], 0):
+                    return self._send(503, {"error": "Injected failure"})
+                return self._rpc(parts[0], body)
+            if parts[0] == "openai" and parts[-1] == "completions":
+                self._wait("openai")
+                return self._chat(self._body())
+            return self._send(404, {"error": "Not found"})
+
+        def _coincap(self, path, query):
+            if path == ["assets"]:
+                coins = COINS
+                if "ids" in query:
+                    ids = query["ids"][0].split(",")
+                    coins = [c for c in COINS if c[0] in ids]
+                if "limit" in query:
+                    coins = coins[:int(query["limit"][0])]
+                return self._send(200, {"data": [upstreams.asset(c) for c in coins],
+                                        "timestamp": int(time.time() * 1000)})
+            coin = next((c for c in COINS if path and c[0] == path[1]), None) if len(path) >= 2 else None
+            if coin is None:
+                return self._send(404, {"error": "coin not found"})
+            if len(path) == 2:
+                return self._send(200, {"data": upstreams.asset(coin), "timestamp": int(time.time() * 1000)})
+            start = int(query.get("start", [int((time.time() - 7 * 86400) * 1000)])[0])
+            end = int(query.get("end", [int(time.time() * 1000)])[0])
+            day = 86400 * 1000
+            points = [{"priceUsd": f"{coin[3] * (1 + 0.01 * ((t // day) % 7 - 3)):.8f}", "time": t}
+                      for t in range(start - start % day, end, day)]
+            return self._send(200, {"data": points})
+
+        def _rpc(self, chain, payload):
+            handler = upstreams.eth if chain == "eth" else upstreams.sol
+
+            def answer(call):
+                try:
+                    result = handler(call["method"], call.get("params") or [])
+                    return {"jsonrpc": "2.0", "id": call.get("id"), "result": result}
+                except Exception as e:
+                    return {"jsonrpc": "2.0", "id": call.get("id"), "error": {"code": -32601, "message": str(e)}}
+
+            if isinstance(payload, list):
+                return self._send(200, [answer(call) for call in payload])
+            return self._send(200, answer(payload))
+
+        def _chat(self, payload):
+            prompt = payload["messages"][-1]["content"]
+            content = f"Stub answer ({len(prompt)} characters of prompt)."
+            return self._send(200, {
+                "id": "chatcmpl-stub", "object": "chat.completion", "created": int(time.time()),
+                "model": payload.get("model", "stub"),
+                "choices": [{"index": 0, "message": {"role": "assistant", "content": content},
+                             "finish_reason": "stop"}],
+                "usage": {"prompt_tokens": len(prompt) // 4, "completion_tokens": 8,
+                          "total_tokens": len(prompt) // 4 + 8},
+            })
+
+    return StubHandler
+
+
+class StubServer:
+    # Runs every stub upstream on one local port in a background thread
+    def __init__(self, port=9100, latency=None, fail=None, slow=None):
+        self.latency = dict(DEFAULT_LATENCY, **(latency or {}))
+        # Group -> share of requests answered 503, change it while running to model an outage
+        self.fail = dict(fail or {})
+        self.slow = dict(slow or {})  # Group -> share of requests that take SLOW_FACTOR times as long
+        handler = make_handler(Upstreams(), self.latency, self.fail, self.slow)
+        self.server = ThreadingHTTPServer(("127.0.0.1", port), handler)
+        self.server.daemon_threads = True
+        self.port = self.server.server_address[1]
+        self.thread = None
+
+    def start(self):
+        self.thread = threading.Thread(target=self.server.serve_forever, name="bench-stubs", daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def env(self):
+        # Environment that points BlockSpeak at these stubs instead of the real services
+        base = f"http://127.0.0.1:{self.port}"
+        return {
+            "NETWORK": "hardhat",
+            "ETH_RPC_URL": f"{base}/eth",
+            "ETH_HEAD_RPC_URL": f"{base}/eth",
+            "INDEXER_RPC_URL": f"{base}/eth",
+            "SOL_RPC_URL": f"{base}/sol",
+            "SOL_HEAD_RPC_URL": f"{base}/sol",
+            "BTC_HEAD_URL": f"{base}/btc/latestblock",
+            "BLOCKCYPHER_URL": f"{base}/blockcypher",
+            "COINCAP_API_URL": f"{base}/coincap/v2",
+            "NEWS_FEEDS": f"{base}/rss/coinjournal,{base}/rss/cointelegraph",
+            "UNSPLASH_API_URL": f"{base}/unsplash",
+            "UNSPLASH_API_KEY": "bench",
+            "OPENAI_BASE_URL": f"{base}/openai/v1",  # Read by the OpenAI SDK itself
+            "OPENAI_API_KEY": "bench",
+        }
+
+
+def parse_latency(pairs):
+    # ["openai=0.8", "eth=0.01"] -> {"openai": 0.8, "eth": 0.01}, also used for --fail and --slow rates
+    latency = {}
+    for pair in pairs or []:
+        group, _, seconds = pair.partition("=")
+        if group not in DEFAULT_LATENCY:
+            raise SystemExit(f"Unknown upstream {group}, pick from {', '.join(DEFAULT_LATENCY)}")
+        latency[group] = float(seconds)
+    return latency
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serve stub upstreams for BlockSpeak")
+    parser.add_argument("--port", type=int, default=9100)
+    parser.add_argument("--latency", action="append", metavar="GROUP=SECONDS", help="Override one upstream latency")
+    parser.add_argument("--fail", action="append", metavar="GROUP=RATE",
+                        help="Share of POSTs to eth or sol answered 503")
+    parser.add_argument("--slow", action="append", metavar="GROUP=RATE",
+                        help="Share of requests that take SLOW_FACTOR times the latency")
+    args = parser.parse_args()
+    stubs = StubServer(args.port, parse_latency(args.latency), parse_latency(args.fail),
+                       parse_latency(args.slow)).start()
+    print(f"Stub upstreams on http://127.0.0.1:{stubs.port}, latency {stubs.latency}, fail {stubs.fail}, "
+          f"slow {stubs.slow}")
+    print("Point BlockSpeak at them with:")
+    for key, value in stubs.env().items():
+        print(f"  {key}={value}")
+    try:
+        stubs.thread.join()
+    except KeyboardInterrupt:
+        stubs.stop()
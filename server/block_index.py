@@ -0,0 +1,177 @@
+# block_index.py
+# Block timestamp index for BlockSpeak
+# Answers "which block (or Solana slot) was current at time T" from a local, sparse list of
+# (block_number, timestamp) samples. Gaps are closed with interpolation search using a bounded
+# number of RPC probes, every probe is remembered, and the samples are saved to disk.
+# Once a time range is warm, lookups are a bisect over in-memory lists with no RPC at all.
+
+import os  # For file paths and atomic replace
+import json  # Samples are persisted as JSON
+import time  # For head caching and save throttling
+import bisect  # Fast lookups over the sorted samples
+import logging  # Logs for debugging probes
+import threading  # Guards samples shared between request threads
+from metrics import upstream_session  # Pooled, timed HTTP for Solana JSON-RPC
+
+logger = logging.getLogger(__name__)
+
+MAX_PROBES = 24      # Upper bound on RPC calls for one cold lookup
+HEAD_TTL = 12        # Seconds we trust the cached chain head, about one Ethereum block
+SAVE_EVERY = 30      # Seconds between writes of new samples to disk
+SKIPPED_SLOT_TRIES = 5  # Solana slots can be skipped, try a few neighbours before giving up
+
+
+class BlockTimestampIndex:
+    # Sparse, persisted index of block timestamps for one chain
+    # fetch_time(n) returns the timestamp of block n (or None if it has none, like a skipped slot)
+    # fetch_head() returns (number, timestamp) of the latest block
+    def __init__(self, chain, fetch_time, fetch_head, path=None):
+        self.chain = chain
+        self.fetch_time = fetch_time
+        self.fetch_head = fetch_head
+        self.path = path or f"block_index_{chain}.json"
+        self.numbers = []  # Sorted block numbers
+        self.times = []    # Timestamps matching self.numbers
+        self.lock = threading.Lock()  # Held only to read or insert samples, never across an RPC call
+        self.save_lock = threading.Lock()  # One writer for the samples file
+        self.genesis_probed = False  # Block 0 (or the first slot with a time) is only asked for once
+        self.head = None
+        self.head_checked = 0.0
+        self.dirty = False
+        self.saved_at = time.time()
+        self.probes = 0  # Total RPC probes, handy when tuning
+        self._load()
+
+    def _load(self):
+        # Reads saved samples, a missing or broken file just means a cold index
+        if not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, "r") as f:
+                data = json.load(f)
+            pairs = sorted(zip(data["numbers"], data["times"]))
+            self.numbers = [n for n, _ in pairs]
+            self.times = [t for _, t in pairs]
+        except (ValueError, KeyError, OSError) as e:
+            logger.warning(f"Ignoring unreadable block index {self.path}: {str(e)}")
+
+    def save(self, force=False):
+        # Writes samples to disk atomically, throttled so busy lookups dont thrash the file
+        with self.save_lock:
+            with self.lock:
+                if not self.dirty or (not force and time.time() - self.saved_at < SAVE_EVERY):
+                    return
+                data = {"chain": self.chain, "numbers": list(self.numbers), "times": list(self.times)}
+                self.dirty = False
+                self.saved_at = time.time()
+            tmp_path = f"{self.path}.tmp"
+            with open(tmp_path, "w") as f:
+                json.dump(data, f)
+            os.replace(tmp_path, self.path)
+
+    def _add(self, number, timestamp):
+        # Inserts one sample, keeping both lists sorted by block number, callers hold self.lock
+        i = bisect.bisect_left(self.numbers, number)
+        if i < len(self.numbers) and self.numbers[i] == number:
+            return
+        self.numbers.insert(i, number)
+        self.times.insert(i, timestamp)
+        self.dirty = True
+
+    def _probe(self, number):
+        # One RPC call for a block timestamp, stepping past skipped Solana slots
+        for offset in range(SKIPPED_SLOT_TRIES):
+            timestamp = self.fetch_time(number + offset)  # Outside the lock, other lookups keep going
+            with self.lock:
+                self.probes += 1
+                if timestamp is not None:
+                    self._add(number + offset, timestamp)
+            if timestamp is not None:
+                return number + offset, timestamp
+        return None, None
+
+    def _latest(self):
+        # Chain head, cached for a few seconds
+        with self.lock:
+            if self.head is not None and time.time() - self.head_checked <= HEAD_TTL:
+                return self.head
+        head = self.fetch_head()
+        with self.lock:
+            self.head = head
+            self.head_checked = time.time()
+            self._add(*head)
+        return head
+
+    def block_at(self, timestamp):
+        # Returns the last block with a timestamp <= `timestamp`, or None if it is before block 0
+        with self.lock:
+            past_samples = not self.numbers or timestamp >= self.times[-1]
+        if past_samples:
+            head_number, head_time = self._latest()
+            if timestamp >= head_time:
+                return head_number
+        with self.lock:
+            before_samples = not self.genesis_probed and timestamp < self.times[0] and self.numbers[0] > 0
+        if before_samples:
+            self._probe(0)
+            self.genesis_probed = True
+        try:
+            return self._search(timestamp)
+        finally:
+            self.save()
+
+    def _search(self, timestamp):
+        # Interpolation search between the two samples around `timestamp`
+        for attempt in range(MAX_PROBES + 1):
+            with self.lock:
+                # Timestamps are non-decreasing with block number, so bisect over times is safe
+                i = bisect.bisect_right(self.times, timestamp)
+                if i == 0:
+                    return None
+                lo_number, lo_time = self.numbers[i - 1], self.times[i - 1]
+                if i == len(self.numbers):
+                    return lo_number
+                hi_number, hi_time = self.numbers[i], self.times[i]
+            if hi_number - lo_number <= 1 or attempt == MAX_PROBES:
+                return lo_number
+            # Guess by linear interpolation, fall back to the midpoint every other probe so a
+            # lumpy stretch of block times cant make us crawl
+            if attempt % 2 == 0 and hi_time > lo_time:
+                guess = lo_number + int((timestamp - lo_time) * (hi_number - lo_number) / (hi_time - lo_time))
+            else:
+                guess = (lo_number + hi_number) // 2
+            guess = min(max(guess, lo_number + 1), hi_number - 1)
+            probed, _ = self._probe(guess)
+            if probed is None or probed >= hi_number:
+                # A run of skipped slots, nothing else to learn between these samples
+                return lo_number
+        return None
+
+
+def ethereum_index(w3, path=None):
+    # Index backed by the apps Web3 connection (Hardhat locally, Mainnet in production)
+    def fetch_time(number):
+        return int(w3.eth.get_block(number)["timestamp"])
+
+    def fetch_head():
+        block = w3.eth.get_block("latest")
+        return int(block["number"]), int(block["timestamp"])
+
+    return BlockTimestampIndex("ethereum", fetch_time, fetch_head, path=path)
+
+
+def solana_index(rpc_url, path=None):
+    # Index of Solana slots, using getBlockTime and getSlot over JSON-RPC
+    def call(method, params):
+        payload = {"jsonrpc": "2.0", "method": method, "params": params, "id": 1}
+        response = upstream_session.post(rpc_url, json=payload, timeout=10).json()
+        return response.get("result")
+
+    def fetch_time(slot):
+        return call("getBlockTime", [slot])  # None for skipped or pruned slots
+
+    def fetch_head():
+        slot = call("getSlot", [])
+        return int(slot), int(call("getBlockTime", [slot]) or time.time())
+
+    return BlockTimestampIndex("solana", fetch_time, fetch_head, path=path)
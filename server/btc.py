@@ -0,0 +1,169 @@
+# btc.py
+# Bitcoin address validation and cached balance lookups for BlockSpeak
+# Addresses are checked locally (base58check for 1.../3..., bech32/bech32m for bc1...) so bad input
+# never reaches BlockCypher. Balances are cached per address until a new block is mined, and
+# misses are fetched together through BlockCypher's multi-address endpoint.
+
+import os  # Upstream URL override for local stubs
+import hashlib  # Double SHA-256 for base58check
+import logging  # Logs for debugging BlockCypher failures
+import requests  # RequestException from BlockCypher
+from metrics import upstream_session  # Pooled, timed HTTP for BlockCypher
+from cache import TTLCache  # Balance and chain height caches
+
+logger = logging.getLogger(__name__)
+
+BLOCKCYPHER_URL = os.getenv("BLOCKCYPHER_URL", "https://api.blockcypher.com/v1/btc/main")
+BTC_CHUNK = 100  # Addresses per multi-address request
+HEIGHT_TTL = 30  # Seconds we trust the last seen block height, blocks come every ~10 minutes
+BALANCE_TTL = 1800  # Seconds a balance entry is kept, a few blocks, after that it can never match the height again
+
+BASE58_ALPHABET = "123456789ABCDEFGHJKLMNPQRSTUVWXYZabcdefghijkmnopqrstuvwxyz"
+BASE58_INDEX = {ch: i for i, ch in enumerate(BASE58_ALPHABET)}
+MAINNET_VERSIONS = {0x00, 0x05}  # P2PKH (1...) and P2SH (3...)
+BECH32_CHARSET = "qpzry9x8gf2tvdw0s3jn54khce6mua7l"
+BECH32_CONST = 1
+BECH32M_CONST = 0x2bc830a3
+
+# address -> (block height when fetched, {"balance", "n_tx"}), capped and expired so it cant grow without bound
+balance_cache = TTLCache(ttl=BALANCE_TTL)
+height_cache = TTLCache(ttl=HEIGHT_TTL)
+height_source = None  # Optional callable returning the latest height, e.g. a chain head tracker
+
+
+def _is_base58check(address):
+    # Decodes a legacy address and checks its version byte and 4-byte checksum
+    number = 0
+    for ch in address:
+        if ch not in BASE58_INDEX:
+            return False
+        number = number * 58 + BASE58_INDEX[ch]
+    leading_zeros = len(address) - len(address.lstrip("1"))
+    body = number.to_bytes((number.bit_length() + 7) // 8, "big") if number else b""
+    raw = b"\x00" * leading_zeros + body
+    if len(raw) != 25 or raw[0] not in MAINNET_VERSIONS:
+        return False
+    checksum = hashlib.sha256(hashlib.sha256(raw[:-4]).digest()).digest()[:4]
+    return checksum == raw[-4:]
+
+
+def _bech32_polymod(values):
+    # BIP-173 checksum over 5-bit groups
+    generator = [0x3b6a57b2, 0x26508e6d, 0x1ea119fa, 0x3d4233dd, 0x2a1462b3]
+    chk = 1
+    for value in values:
+        top = chk >> 25
+        chk = (chk & 0x1ffffff) << 5 ^ value
+        for i in range(5):
+            chk ^= generator[i] if (top >> i) & 1 else 0
+    return chk
+
+
+def _convert_bits(data, from_bits, to_bits):
+    # Regroups 5-bit words into bytes, rejecting non-zero padding
+    acc = 0
+    bits = 0
+    out = []
+    max_value = (1 << to_bits) - 1
+    for value in data:
+        acc = (acc << from_bits) | value
+        bits += from_bits
+        while bits >= to_bits:
+            bits -= to_bits
+            out.append((acc >> bits) & max_value)
+    if bits >= from_bits or (acc << (to_bits - bits)) & max_value:
+        return None
+    return out
+
+
+def _is_segwit(address):
+    # Checks a bc1 address: bech32 for witness v0, bech32m for v1+ (BIP-173 and BIP-350)
+    if address.lower() != address and address.upper() != address:
+        return False  # Mixed case is never valid
+    address = address.lower()
+    sep = address.rfind("1")
+    if address[:sep] != "bc" or sep + 7 > len(address) or len(address) > 90:
+        return False
+    data = [BECH32_CHARSET.find(ch) for ch in address[sep + 1:]]
+    if -1 in data:
+        return False
+    hrp = address[:sep]
+    const = _bech32_polymod([ord(x) >> 5 for x in hrp] + [0] + [ord(x) & 31 for x in hrp] + data)
+    version = data[0]
+    program = _convert_bits(data[1:-6], 5, 8)
+    if program is None or version > 16 or not 2 <= len(program) <= 40:
+        return False
+    if version == 0:
+        return const == BECH32_CONST and len(program) in (20, 32)
+    return const == BECH32M_CONST
+
+
+def is_valid_btc_address(address):
+    # Full local validation of a mainnet Bitcoin address, no network calls
+    if not isinstance(address, str) or not 26 <= len(address) <= 90:
+        return False
+    if address[:3].lower() == "bc1":
+        return _is_segwit(address)
+    if address[0] in "13" and len(address) <= 35:
+        return _is_base58check(address)
+    return False
+
+
+def set_height_source(source):
+    # Lets the app feed heights from its chain head tracker instead of asking BlockCypher
+    global height_source
+    height_source = source
+
+
+def latest_height(session=None):
+    # Current Bitcoin block height, from the configured source or BlockCypher, cached briefly
+    height = height_cache.get("btc")
+    if height is not None:
+        return height
+    try:
+        if height_source:
+            height = height_source()
+        if height is None:
+            http = session or upstream_session
+            height = http.get(BLOCKCYPHER_URL, timeout=10).json()["height"]
+    except Exception as e:
+        logger.warning(f"Bitcoin height lookup failed: {str(e)}")
+        return None
+    height_cache.set("btc", height)
+    return height
+
+
+def _fetch_chunk(addresses, session=None):
+    # One BlockCypher multi-address request, returns {address: {"balance", "n_tx"}}
+    http = session or upstream_session
+    response = http.get(f"{BLOCKCYPHER_URL}/addrs/{';'.join(addresses)}/balance", timeout=20)
+    response.raise_for_status()
+    data = response.json()
+    entries = data if isinstance(data, list) else [data]  # A single address comes back as an object
+    return {e["address"]: {"balance": e.get("balance", 0), "n_tx": e.get("n_tx", 0)}
+            for e in entries if "address" in e and "error" not in e}
+
+
+def get_btc_balances(addresses, session=None):
+    # Returns {address: {"balance" (satoshis), "n_tx"}}, free for addresses already fetched at this height
+    height = latest_height(session=session)
+    found = {}
+    missing = []
+    for address in dict.fromkeys(addresses):
+        entry = balance_cache.get(address)
+        if entry and height is not None and entry[0] == height:
+            found[address] = entry[1]
+        else:
+            missing.append(address)
+    for start in range(0, len(missing), BTC_CHUNK):
+        chunk = missing[start:start + BTC_CHUNK]
+        try:
+            fetched = _fetch_chunk(chunk, session=session)
+        except (requests.RequestException, ValueError) as e:
+            logger.error(f"BlockCypher balance lookup failed for {len(chunk)} addresses: {str(e)}")
+            continue
+        for address, stats in fetched.items():
+            if height is not None:
+                balance_cache.set(address, (height, stats))
+            found[address] = stats
+    return found
@@ -0,0 +1,52 @@
+# cache.py
+# Small in-process TTL cache for BlockSpeak
+# Used for short-lived upstream results like wallet analytics, so repeat lookups within a
+# minute dont go back to BlockCypher, Alchemy or our node.
+
+import time  # For expiry times
+import threading  # Request threads share one cache
+
+
+class TTLCache:
+    # Dictionary with per-entry expiry and a size cap, safe to share between threads
+    def __init__(self, ttl, max_size=10000):
+        self.ttl = ttl  # Default seconds an entry stays fresh
+        self.max_size = max_size
+        self.data = {}  # key -> (expires_at, value)
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, default=None):
+        # Returns the cached value, or default if missing or expired
+        entry = self.data.get(key)
+        if entry and entry[0] > time.time():
+            self.hits += 1
+            return entry[1]
+        self.misses += 1
+        return default
+
+    def get_many(self, keys):
+        # Returns {key: value} for every key that is still fresh
+        found = {}
+        for key in keys:
+            value = self.get(key)
+            if value is not None:
+                found[key] = value
+        return found
+
+    def set(self, key, value, ttl=None):
+        # Stores a value, dropping expired (then oldest) entries when the cache is full
+        with self.lock:
+            if len(self.data) >= self.max_size and key not in self.data:
+                now = time.time()
+                for stale in [k for k, (expires_at, _) in self.data.items() if expires_at <= now]:
+                    del self.data[stale]
+                if len(self.data) >= self.max_size:
+                    del self.data[min(self.data, key=lambda k: self.data[k][0])]
+            self.data[key] = (time.time() + (self.ttl if ttl is None else ttl), value)
+
+    def delete(self, key):
+        # Forgets one entry
+        with self.lock:
+            self.data.pop(key, None)
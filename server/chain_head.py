@@ -0,0 +1,98 @@
+# chain_head.py
+# Chain head tracker for BlockSpeak
+# One background poll loop per chain keeps the latest Ethereum block and gas price, Solana slot and
+# Bitcoin height in memory. query(), fee logic and analytics read from here, so a user question about
+# the latest block or gas costs zero upstream calls. Point the URLs at a local Hardhat node or a stub
+# JSON-RPC server to test it.
+
+import time  # For poll intervals and freshness
+import logging  # Logs for debugging poll failures
+import threading  # One daemon thread per chain
+from metrics import InstrumentedSession  # Timed HTTP for JSON-RPC and blockchain.info
+from rpc import rpc_batch  # Block and gas price in one round trip
+from rpc import rpc_call  # Solana slot
+
+logger = logging.getLogger(__name__)
+
+POLL_SECONDS = {"ethereum": 4, "solana": 2, "bitcoin": 30}  # Roughly a third of each chains block time
+STALE_SECONDS = 120  # Older data than this is treated as missing
+FIRST_POLL_WAIT = 3  # Seconds a reader waits for the very first poll after startup
+
+
+class ChainHeadTracker:
+    # Keeps the latest head per chain in memory, filled by background poll loops
+    # sources: {"ethereum": rpc_url, "solana": rpc_url, "bitcoin": latestblock_url}, any can be left out
+    def __init__(self, sources, intervals=None):
+        self.sources = {chain: url for chain, url in sources.items() if url}
+        self.intervals = dict(POLL_SECONDS, **(intervals or {}))
+        self.heads = {}  # chain -> dict of latest values plus "updated"
+        self.ready = {chain: threading.Event() for chain in self.sources}
+        self.lock = threading.Lock()
+        self.threads = {}
+        self.stopping = threading.Event()
+        self.session = InstrumentedSession()  # Reuses connections between polls
+
+    def start(self):
+        # Starts one poll thread per chain, safe to call many times (and after a gunicorn fork)
+        with self.lock:
+            for chain in self.sources:
+                thread = self.threads.get(chain)
+                if thread and thread.is_alive():
+                    continue
+                thread = threading.Thread(target=self._loop, args=(chain,), name=f"chain-head-{chain}", daemon=True)
+                self.threads[chain] = thread
+                thread.start()
+
+    def stop(self):
+        # Stops all poll loops, used by tests and one-shot scripts
+        self.stopping.set()
+
+    def _loop(self, chain):
+        # Polls one chain until stopped, backing off while the upstream is failing
+        failures = 0
+        while not self.stopping.is_set():
+            try:
+                self.poll(chain)
+                failures = 0
+            except Exception as e:
+                failures += 1
+                logger.warning(f"Chain head poll for {chain} failed ({failures} in a row): {str(e)}")
+            self.stopping.wait(self.intervals[chain] * min(2 ** failures, 16))
+
+    def poll(self, chain):
+        # Fetches the latest head for one chain and stores it
+        url = self.sources[chain]
+        if chain == "ethereum":
+            calls = [("eth_getBlockByNumber", ["latest", False]), ("eth_gasPrice", [])]
+            block, gas_price = rpc_batch(url, calls, session=self.session)
+            if block is None or gas_price is None:
+                raise ValueError("Node returned no block or gas price")
+            head = {"block": int(block["number"], 16), "timestamp": int(block["timestamp"], 16),
+                    "tx_count": len(block.get("transactions", [])), "gas_price": int(gas_price, 16)}
+        elif chain == "solana":
+            head = {"slot": int(rpc_call(url, "getSlot", [], session=self.session))}
+        elif chain == "bitcoin":
+            head = {"height": int(self.session.get(url, timeout=10).json()["height"])}
+        else:
+            raise ValueError(f"Unknown chain {chain}")
+        head["updated"] = time.time()
+        self.heads[chain] = head  # Single dict assignment, readers never see half an update
+        self.ready[chain].set()
+        return head
+
+    def get(self, chain):
+        # Latest head for a chain, or None if we have nothing fresh
+        if chain not in self.sources:
+            return None
+        if not self.threads.get(chain) or not self.threads[chain].is_alive():
+            self.start()
+        self.ready[chain].wait(FIRST_POLL_WAIT)
+        head = self.heads.get(chain)
+        if not head or time.time() - head["updated"] > STALE_SECONDS:
+            return None
+        return head
+
+    def value(self, chain, key, default=None):
+        # One field from the latest head, like value("ethereum", "gas_price")
+        head = self.get(chain)
+        return head.get(key, default) if head else default
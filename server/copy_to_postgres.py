@@ -0,0 +1,113 @@
+# copy_to_postgres.py
+# Copies BlockSpeak's SQLite database into PostgreSQL
+# Creates every table and index of users.db in the database at DATABASE_URL, through db.py's
+# SQLite to Postgres translation so the schema is the one the app itself creates there, copies the
+# rows in batches, moves the id sequences past the copied ids and prints row counts on both sides.
+# Rows already in Postgres are kept, so a second run only adds what is new: copy once while the app
+# runs, stop it, copy again, then start every instance with DATABASE_URL set.
+# Usage (from the server folder):
+#   DATABASE_URL=postgresql://blockspeak@localhost/blockspeak python copy_to_postgres.py
+#   python copy_to_postgres.py --sqlite /data/users.db --database-url postgresql://... --batch 5000
+
+import os  # DATABASE_URL for db.py
+import re  # Makes the stored CREATE statements idempotent
+import sys  # Exit status
+import time  # Copy timing
+import sqlite3  # The source database
+import argparse  # Command line flags
+
+CREATE_RE = re.compile(r"^\s*CREATE\s+(TABLE|INDEX|UNIQUE\s+INDEX)\s+(?!IF\s)", re.IGNORECASE)
+
+
+def source_schema(source):
+    # (tables as (name, CREATE sql), index CREATE statements) of the SQLite file, SQLite's own tables skipped
+    rows = source.execute("SELECT type, name, sql FROM sqlite_master "
+                          "WHERE sql IS NOT NULL AND name NOT LIKE 'sqlite_%' ORDER BY rowid").fetchall()
+    tables = [(name, CREATE_RE.sub(r"CREATE \1 IF NOT EXISTS ", sql)) for kind, name, sql in rows if kind == "table"]
+    indexes = [CREATE_RE.sub(r"CREATE \1 IF NOT EXISTS ", sql) for kind, name, sql in rows if kind == "index"]
+    return tables, indexes
+
+
+def copy_table(source, db, table, batch):
+    # Copies one table in batches, returns rows read from SQLite
+    columns = [row[1] for row in source.execute(f'PRAGMA table_info("{table}")')]
+    insert = f"INSERT OR IGNORE INTO {table} ({', '.join(columns)}) VALUES ({', '.join('?' * len(columns))})"
+    rows = source.execute(f"SELECT {', '.join(columns)} FROM {table}")
+    copied = 0
+    while True:
+        chunk = rows.fetchmany(batch)
+        if not chunk:
+            return copied
+        target = db.connect()
+        try:
+            target.executemany(insert, chunk)
+            target.commit()
+        finally:
+            target.close()
+        copied += len(chunk)
+
+
+def reset_sequence(db, table):
+    # Next id after the highest copied one, so new users and posts dont collide with copied rows
+    target = db.connect()
+    try:
+        serial = target.table_info(table)[2]
+        if serial:
+            target.execute(f"SELECT setval(pg_get_serial_sequence(?, ?), "
+                           f"(SELECT COALESCE(MAX({serial}), 0) + 1 FROM {table}), false)", (table, serial))
+            target.commit()
+    finally:
+        target.close()
+
+
+def count(conn, table):
+    return conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Copy users.db into a PostgreSQL database")
+    parser.add_argument("--sqlite", default="users.db", help="SQLite file to copy from")
+    parser.add_argument("--database-url", default=os.getenv("DATABASE_URL"),
+                        help="postgresql:// URL, DATABASE_URL by default")
+    parser.add_argument("--batch", type=int, default=1000, help="Rows per insert batch and commit")
+    args = parser.parse_args()
+    if not (args.database_url or "").startswith(("postgres://", "postgresql://")):
+        raise SystemExit("Set DATABASE_URL or pass --database-url with a postgresql:// URL")
+    if not os.path.exists(args.sqlite):
+        raise SystemExit(f"No SQLite database at {args.sqlite}")
+
+    os.environ["DATABASE_URL"] = args.database_url
+    import db  # Reads DATABASE_URL at import, so only after it is set
+
+    source = sqlite3.connect(f"file:{args.sqlite}?mode=ro", uri=True)
+    tables, indexes = source_schema(source)
+    target = db.connect()
+    for _, sql in tables:
+        target.execute(sql)
+    for sql in indexes:
+        target.execute(sql)
+    target.commit()
+    target.close()
+    print(f"Schema ready: {len(tables)} tables, {len(indexes)} indexes")
+
+    mismatched = []
+    for table, _ in tables:
+        started = time.perf_counter()
+        copied = copy_table(source, db, table, args.batch)
+        reset_sequence(db, table)
+        target = db.connect()
+        in_postgres = count(target, table)
+        target.close()
+        if in_postgres < count(source, table):
+            mismatched.append(table)
+        elapsed = time.perf_counter() - started
+        print(f"  {table:28} {copied:8} rows copied in {elapsed:6.1f}s, {in_postgres} in Postgres")
+    source.close()
+    if mismatched:
+        print(f"Fewer rows in Postgres than in SQLite for: {', '.join(mismatched)}")
+        sys.exit(1)
+    print("Done, start the app with DATABASE_URL set to use Postgres")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,156 @@
+# crypto_pool.py
+# CPU-heavy login crypto for BlockSpeak, kept off the request threads
+# Password hashing (PBKDF2) and, without coincurve, MetaMask signature recovery run in a small
+# process pool per app process, so a burst of logins uses CRYPTO_WORKERS cores instead of every
+# request thread. At most CRYPTO_QUEUE jobs wait at once, past that callers get CryptoBusy and the
+# route answers 503 right away instead of stalling unrelated API calls behind a login spike.
+# With coincurve installed, signature recovery is a C call of about 0.1ms and runs inline.
+# Compare inline and pooled logins per second with: python bench/logins.py
+
+import os  # Settings and the worker pid
+import time  # Job timings
+import logging  # Logs for debugging pool failures
+import threading  # Guards the pool and bounds the queue
+import importlib.util  # Checks for coincurve without importing it
+import multiprocessing  # Spawned workers, forking a threaded server process isnt safe
+from concurrent.futures import ProcessPoolExecutor  # The worker processes
+from concurrent.futures import TimeoutError as FutureTimeout  # A job that took too long
+from concurrent.futures.process import BrokenProcessPool  # A worker process died
+from werkzeug.security import generate_password_hash  # PBKDF2 password hashes
+from werkzeug.security import check_password_hash  # Checks a password against a stored hash
+from metrics import registry  # Job timings and rejected jobs
+from tracing import record_span  # Crypto time shows up in request traces
+from lazy import lazy_module  # Signature libraries load on first MetaMask login
+
+logger = logging.getLogger(__name__)
+
+eth_utils = lazy_module("eth_utils")  # keccak and checksum addresses for the coincurve path
+coincurve = lazy_module("coincurve")  # libsecp256k1 bindings, optional
+eth_account = lazy_module("eth_account")  # Fallback signature recovery
+eth_messages = lazy_module("eth_account.messages")  # encode_defunct for the fallback
+
+# Full werkzeug method string, stored hashes with any other method are rehashed on the next login
+PASSWORD_HASH_METHOD = os.getenv("PASSWORD_HASH_METHOD", "pbkdf2:sha256:600000")
+CRYPTO_WORKERS = int(os.getenv("CRYPTO_WORKERS", "2"))  # Processes per app process, 0 runs everything inline
+CRYPTO_QUEUE = int(os.getenv("CRYPTO_QUEUE", "32"))  # Jobs running or waiting before logins get a 503
+CRYPTO_TIMEOUT = float(os.getenv("CRYPTO_TIMEOUT", "10"))  # Seconds a request waits for its job
+
+RECOVER_BACKEND = "coincurve" if importlib.util.find_spec("coincurve") else "eth_account"
+
+
+class CryptoBusy(Exception):
+    # Too many crypto jobs queued, the caller should answer 503 with Retry-After
+    pass
+
+
+def needs_rehash(stored, method=PASSWORD_HASH_METHOD):
+    # True when a hash was made with another method or cost than the configured one
+    return stored.split("$", 1)[0] != method
+
+
+def _hash_password(password, method):
+    return generate_password_hash(password, method=method)
+
+
+def _check_password(stored, password, method):
+    # (valid, new hash or None), the rehash happens in the same job to save a round trip
+    if not check_password_hash(stored, password):
+        return False, None
+    return True, generate_password_hash(password, method=method) if needs_rehash(stored, method) else None
+
+
+def _recover_coincurve(text, signature):
+    # EIP-191 personal_sign recovery with libsecp256k1, same result as Account.recover_message
+    data = text.encode()
+    digest = eth_utils.keccak(b"\x19Ethereum Signed Message:\n" + str(len(data)).encode() + data)
+    raw = bytes.fromhex(signature[2:] if signature.startswith("0x") else signature)
+    if len(raw) != 65:
+        raise ValueError("Signature must be 65 bytes")
+    v = raw[64] - 27 if raw[64] >= 27 else raw[64]
+    if v not in (0, 1):
+        raise ValueError("Invalid signature v")
+    public_key = coincurve.PublicKey.from_signature_and_message(raw[:64] + bytes([v]), digest, hasher=None)
+    return eth_utils.to_checksum_address(eth_utils.keccak(public_key.format(compressed=False)[1:])[-20:])
+
+
+def _recover_python(text, signature):
+    # eth_account on its default backend, slow pure Python without coincurve
+    return eth_account.Account.recover_message(eth_messages.encode_defunct(text=text), signature=signature)
+
+
+def _warm():
+    # Runs once in each worker process so the first login doesnt pay for imports
+    if RECOVER_BACKEND == "eth_account":
+        try:
+            eth_messages.encode_defunct  # Imports eth_account and its curve backend
+        except ImportError as e:
+            logger.warning(f"Signature recovery unavailable in crypto pool: {str(e)}")  # Password jobs still work
+
+
+class CryptoPool:
+    # Lazily started process pool with a bounded number of jobs in flight
+    def __init__(self, workers=CRYPTO_WORKERS, queue=CRYPTO_QUEUE):
+        self.workers = workers
+        self.slots = threading.BoundedSemaphore(queue)
+        self.lock = threading.Lock()
+        self.executor = None
+        self.pid = None  # Process the executor belongs to, a gunicorn fork starts its own
+
+    def _get_executor(self):
+        with self.lock:
+            if self.pid != os.getpid():
+                self.pid = os.getpid()
+                self.executor = ProcessPoolExecutor(self.workers, mp_context=multiprocessing.get_context("spawn"),
+                                                    initializer=_warm)
+                logger.info(f"Crypto pool started with {self.workers} processes")
+            return self.executor
+
+    def run(self, op, fn, *args, inline=False):
+        # Runs fn(*args) in the pool, or right here for inline jobs and CRYPTO_WORKERS=0
+        started = time.perf_counter()
+        try:
+            if inline or not self.workers:
+                return fn(*args)
+            if not self.slots.acquire(blocking=False):
+                registry.inc("crypto_rejected_total", (("op", op),))
+                raise CryptoBusy(op)
+            try:
+                future = self._get_executor().submit(fn, *args)
+            except BaseException:
+                self.slots.release()
+                raise
+            # The permit follows the job, not the caller: a timed out job keeps its worker busy until it ends
+            future.add_done_callback(lambda _: self.slots.release())
+            try:
+                return future.result(timeout=CRYPTO_TIMEOUT)
+            except FutureTimeout:
+                raise CryptoBusy(op)
+            except BrokenProcessPool:
+                logger.error("Crypto pool worker died, restarting the pool")
+                with self.lock:
+                    self.pid = None
+                raise
+        finally:
+            duration = time.perf_counter() - started
+            registry.observe("crypto_job_duration_seconds", duration, (("op", op),))
+            record_span(f"crypto:{op}", started, duration)
+
+
+pool = CryptoPool()
+
+
+def hash_password(password):
+    # New hash with the configured method and cost
+    return pool.run("hash_password", _hash_password, password, PASSWORD_HASH_METHOD)
+
+
+def verify_password(stored, password):
+    # (valid, new hash to store or None) for a login attempt
+    return pool.run("verify_password", _check_password, stored, password, PASSWORD_HASH_METHOD)
+
+
+def recover_signer(text, signature):
+    # Checksummed address that signed text with personal_sign
+    if RECOVER_BACKEND == "coincurve":
+        return pool.run("recover_signer", _recover_coincurve, text, signature, inline=True)
+    return pool.run("recover_signer", _recover_python, text, signature)
@@ -0,0 +1,437 @@
+# db.py
+# Database connections for BlockSpeak with per-statement timings
+# Drop-in for sqlite3.connect: the connection and its cursors time every execute and record it in
+# metrics by statement type and table, like sqlite_query_duration_seconds{op="SELECT",table="users"}.
+# With DATABASE_URL set to a postgres:// URL, connect() hands out connections from a per-worker pool
+# to that PostgreSQL database instead, so several instances behind a load balancer share one store.
+# The app keeps writing SQLite SQL: each statement is translated once (? placeholders, INSERT OR
+# IGNORE/REPLACE, BEGIN IMMEDIATE, PRAGMA table_info, SQLite column types) and psycopg2 errors are
+# raised as the sqlite3 errors the callers already catch. db_path only names the SQLite file, with
+# Postgres every table lives in the one database. Copy an existing users.db with copy_to_postgres.py.
+
+import os  # Settings and the worker pid
+import re  # Pulls the statement type and table out of the SQL
+import time  # Statement timings
+import sqlite3  # The database itself, and the error types both backends raise
+import threading  # Guards the connection pool
+from metrics import registry  # Where the timings go
+from tracing import record_span  # Statements show up in request traces too
+from lazy import lazy_module  # psycopg2 is only imported when DATABASE_URL points at Postgres
+
+DATABASE_URL = os.getenv("DATABASE_URL", "")
+BACKEND = "postgres" if DATABASE_URL.startswith(("postgres://", "postgresql://")) else "sqlite"
+POOL_SIZE = int(os.getenv("DATABASE_POOL_SIZE", "10"))  # Postgres connections per worker process
+CONNECT_TIMEOUT = 10  # Seconds to open a new Postgres connection
+IDLE_CHECK_SECONDS = 30  # A pooled connection idle this long gets a SELECT 1 before it is handed out
+BATCH_PAGE_SIZE = 100  # Rows per round trip in executemany on Postgres
+WRITE_LOCK = 4242  # Advisory lock key that stands in for SQLite's database-wide write lock
+
+# First word and first table of a statement, like ("SELECT", "users")
+STATEMENT_RE = re.compile(r"^\s*(\w+)")
+TABLE_RE = re.compile(r"\b(?:FROM|INTO|UPDATE|TABLE(?:\s+IF\s+NOT\s+EXISTS)?|INDEX\s+IF\s+NOT\s+EXISTS\s+\w+\s+ON)"
+                      r"\s+(\w+)", re.IGNORECASE)
+MAX_LABELS = 1000  # Distinct SQL strings we remember labels for
+
+_labels = {}  # SQL string -> label tuple, so the regexes run once per statement text
+
+
+def _setup_psycopg2(module):
+    # SUM and AVG of integers are NUMERIC in Postgres, return them as int or float like SQLite does
+    extensions = module.extensions
+    extensions.register_type(extensions.new_type(extensions.DECIMAL.values, "SQLITE_NUMERIC", _numeric))
+
+
+def _numeric(value, cursor):
+    if value is None:
+        return None
+    try:
+        return int(value)
+    except ValueError:
+        return float(value)
+
+
+psycopg2 = lazy_module("psycopg2", setup=_setup_psycopg2)
+psycopg2_extras = lazy_module("psycopg2.extras")  # execute_batch for executemany
+
+
+def statement_labels(sql):
+    # ("op", "table") labels for a statement, cached because the app reuses the same SQL strings
+    labels = _labels.get(sql)
+    if labels is None:
+        op = STATEMENT_RE.match(sql)
+        table = TABLE_RE.search(sql)
+        labels = (("op", op.group(1).upper() if op else "OTHER"), ("table", table.group(1) if table else ""))
+        if len(_labels) < MAX_LABELS:
+            _labels[sql] = labels
+    return labels
+
+
+def _timed(method, sql, *args):
+    started = time.perf_counter()
+    try:
+        return method(sql, *args)
+    finally:
+        duration = time.perf_counter() - started
+        labels = statement_labels(sql)
+        registry.observe("sqlite_query_duration_seconds", duration, labels)
+        record_span(f"{BACKEND}:{labels[0][1]} {labels[1][1]}", started, duration)
+
+
+class TimedCursor(sqlite3.Cursor):
+    # Cursor whose execute and executemany are timed
+    def execute(self, sql, *args):
+        return _timed(super().execute, sql, *args)
+
+    def executemany(self, sql, *args):
+        return _timed(super().executemany, sql, *args)
+
+
+class TimedConnection(sqlite3.Connection):
+    # Connection that hands out timed cursors, conn.execute goes through one too
+    def cursor(self, factory=TimedCursor):
+        return super().cursor(factory)
+
+    def execute(self, sql, *args):
+        return self.cursor().execute(sql, *args)
+
+    def executemany(self, sql, *args):
+        return self.cursor().executemany(sql, *args)
+
+
+def connect(db_path="users.db", **kwargs):
+    # Same arguments as sqlite3.connect, with Postgres timeout is how long to wait for a pooled connection
+    if BACKEND == "postgres":
+        return PostgresConnection(postgres_pool(), kwargs.get("timeout", 5.0))
+    return sqlite3.connect(db_path, factory=TimedConnection, **kwargs)
+
+
+# SQLite to Postgres translation, each distinct SQL string is translated once per process
+
+QUOTED_RE = re.compile(r"('(?:[^']|'')*'|\"[^\"]*\")")  # String literals and quoted names, left as they are
+RESERVED_RE = re.compile(r"\b(interval|timestamp)\b")  # Our column names that are type keywords in Postgres
+PLACEHOLDER_RE = re.compile(r"\?")
+OR_IGNORE_RE = re.compile(r"^(\s*)INSERT\s+OR\s+IGNORE\s+INTO\b", re.IGNORECASE)
+OR_REPLACE_RE = re.compile(r"^(\s*)INSERT\s+OR\s+REPLACE\s+INTO\s+(\w+)\s*(?:\(([^)]*)\))?", re.IGNORECASE)
+INSERT_RE = re.compile(r"^\s*INSERT\s+INTO\s+(\w+)", re.IGNORECASE)
+PRAGMA_RE = re.compile(r"^\s*PRAGMA\s+table_info\s*\(\s*(\w+)\s*\)\s*;?\s*$", re.IGNORECASE)
+BEGIN_RE = re.compile(r"^\s*BEGIN\s+(IMMEDIATE|EXCLUSIVE)(\s+TRANSACTION)?\s*;?\s*$", re.IGNORECASE)
+DDL_RE = re.compile(r"^\s*(CREATE|ALTER)\s+(TABLE|INDEX|UNIQUE\s+INDEX)\b", re.IGNORECASE)
+COLUMN_TYPES = [
+    (re.compile(r"\bINTEGER\s+PRIMARY\s+KEY\s+AUTOINCREMENT\b", re.IGNORECASE), "BIGSERIAL PRIMARY KEY"),
+    # Same "YYYY-MM-DD HH:MM:SS" text SQLite stores, so created_at reads and sorts the same on both
+    (re.compile(r"\bTIMESTAMP\s+DEFAULT\s+CURRENT_TIMESTAMP\b", re.IGNORECASE),
+     "TEXT DEFAULT to_char(now() AT TIME ZONE 'UTC', 'YYYY-MM-DD HH24:MI:SS')"),
+    (re.compile(r"\bINTEGER\b", re.IGNORECASE), "BIGINT"),
+    (re.compile(r"\bREAL\b", re.IGNORECASE), "DOUBLE PRECISION"),
+    (re.compile(r"\bBLOB\b", re.IGNORECASE), "BYTEA"),
+    (re.compile(r"\bADD\s+COLUMN\s+(?!IF\s)", re.IGNORECASE), "ADD COLUMN IF NOT EXISTS "),
+]
+LOCK_SQL = f"SELECT pg_advisory_xact_lock({WRITE_LOCK})"
+# PRAGMA table_info rows: (cid, name, type, notnull, default, pk), pk is always 0 here, callers only read names
+PRAGMA_SQL = '''SELECT ordinal_position - 1, column_name, data_type, CASE WHEN is_nullable = 'NO' THEN 1 ELSE 0 END,
+        column_default, 0
+    FROM information_schema.columns WHERE table_schema = current_schema() AND table_name = '{table}'
+    ORDER BY ordinal_position'''
+# Columns of a table with whether each is in the primary key and whether it is a serial
+TABLE_INFO_SQL = '''SELECT a.attname, i.indrelid IS NOT NULL, pg_get_serial_sequence(%s, a.attname) IS NOT NULL
+    FROM pg_attribute a
+    LEFT JOIN pg_index i ON i.indrelid = a.attrelid AND i.indisprimary AND a.attnum = ANY(i.indkey)
+    WHERE a.attrelid = to_regclass(%s) AND a.attnum > 0 AND NOT a.attisdropped
+    ORDER BY a.attnum'''
+
+_translated = {}  # SQLite SQL -> (Postgres SQL, serial column to return or None, is DDL)
+_tables = {}  # Table -> (columns, primary key columns, serial column or None) from the catalog
+
+
+def translate(sql, table_info):
+    # (Postgres SQL, serial column or None, is DDL) for one SQLite statement
+    # table_info(table) gives (columns, primary key columns, serial column) for INSERT OR REPLACE and lastrowid
+    pragma = PRAGMA_RE.match(sql)
+    if pragma:
+        return PRAGMA_SQL.format(table=pragma.group(1).lower()), None, False
+    if BEGIN_RE.match(sql):
+        # Postgres opens the transaction by itself, the lock serialises writers the way SQLite's does until commit
+        return LOCK_SQL, None, False
+    ddl = bool(DDL_RE.match(sql))
+    if ddl:
+        for pattern, replacement in COLUMN_TYPES:
+            sql = pattern.sub(replacement, sql)
+        # Under the write lock, two workers starting at once cant both create a table or add a column
+        sql = f"{LOCK_SQL}; {sql}"
+    elif OR_IGNORE_RE.match(sql):
+        sql = OR_IGNORE_RE.sub(r"\1INSERT INTO", sql, count=1).rstrip().rstrip(";") + " ON CONFLICT DO NOTHING"
+    else:
+        replace = OR_REPLACE_RE.match(sql)
+        if replace:
+            columns, key, _ = table_info(replace.group(2).lower())
+            listed = [name.strip().lower() for name in replace.group(3).split(",")] if replace.group(3) else columns
+            updates = [name for name in listed if name not in key]
+            # Columns left out of the list keep their value, where SQLite would reset them to the default
+            assignments = ", ".join(f"{name} = EXCLUDED.{name}" for name in updates)
+            action = f"DO UPDATE SET {assignments}" if updates else "DO NOTHING"
+            listing = f" ({replace.group(3)})" if replace.group(3) else ""
+            sql = f"{replace.group(1)}INSERT INTO {replace.group(2)}{listing} {sql[replace.end():].strip().rstrip(';')}"
+            sql += f" ON CONFLICT ({', '.join(key)}) {action}"
+    serial = None
+    insert = INSERT_RE.match(sql)
+    if insert and " RETURNING " not in sql.upper():
+        serial = table_info(insert.group(1).lower())[2]
+    return _placeholders(sql), serial, ddl
+
+
+def _placeholders(sql):
+    # ? to %s and keyword column names quoted outside string literals, % doubled everywhere for psycopg2
+    parts = QUOTED_RE.split(sql)
+    for i in range(0, len(parts), 2):
+        parts[i] = RESERVED_RE.sub(r'"\1"', PLACEHOLDER_RE.sub("%s", parts[i].replace("%", "%%")))
+    for i in range(1, len(parts), 2):
+        parts[i] = parts[i].replace("%", "%%")
+    return "".join(parts)
+
+
+class PostgresPool:
+    # Connections to DATABASE_URL for one worker process, opened on demand up to size
+    def __init__(self, url, size):
+        self.url = url
+        self.pid = os.getpid()
+        self.idle = []  # (connection, released at), most recently used last
+        self.slots = threading.BoundedSemaphore(size)
+        self.lock = threading.RLock()  # Reentrant, a connection dropped during GC returns itself from __del__
+
+    def acquire(self, timeout):
+        # A live connection, waits up to timeout seconds when all of them are in use
+        if not self.slots.acquire(timeout=timeout):
+            raise sqlite3.OperationalError(f"No free database connection after {timeout}s, raise DATABASE_POOL_SIZE")
+        try:
+            while True:
+                with self.lock:
+                    raw, released_at = self.idle.pop() if self.idle else (None, 0)
+                if raw is None:
+                    return psycopg2.connect(self.url, connect_timeout=CONNECT_TIMEOUT)
+                if not raw.closed and (time.monotonic() - released_at < IDLE_CHECK_SECONDS or _alive(raw)):
+                    return raw
+                _discard(raw)  # The server or a proxy closed it while it sat idle
+        except Exception as e:
+            self.slots.release()
+            if isinstance(e, psycopg2.Error):
+                raise sqlite3.OperationalError(f"Could not connect to the database: {str(e).strip()}") from e
+            raise
+
+    def release(self, raw, broken=False):
+        # Back to the idle list with anything uncommitted rolled back, like closing a sqlite3 connection
+        try:
+            if not broken and not raw.closed:
+                try:
+                    raw.rollback()
+                    with self.lock:
+                        self.idle.append((raw, time.monotonic()))
+                    return
+                except psycopg2.Error:
+                    pass
+            _discard(raw)
+        finally:
+            self.slots.release()
+
+    def close_idle(self):
+        with self.lock:
+            idle, self.idle = self.idle, []
+        for raw, _ in idle:
+            _discard(raw)
+
+
+def _alive(raw):
+    try:
+        with raw.cursor() as c:
+            c.execute("SELECT 1")
+        raw.rollback()
+        return True
+    except psycopg2.Error:
+        return False
+
+
+def _discard(raw):
+    try:
+        raw.close()
+    except psycopg2.Error:
+        pass
+
+
+_pool = None
+_pool_lock = threading.Lock()
+_inherited = []  # A parent's pools, kept referenced so a child never closes connections the parent is using
+
+
+def postgres_pool():
+    # This process's pool, a forked worker opens its own connections
+    global _pool
+    pool = _pool
+    if pool is None or pool.pid != os.getpid():
+        with _pool_lock:
+            if _pool is None or _pool.pid != os.getpid():
+                if _pool is not None:
+                    _inherited.append(_pool)
+                _pool = PostgresPool(DATABASE_URL, POOL_SIZE)
+            pool = _pool
+    return pool
+
+
+def _close_idle_before_fork():
+    # gunicorn --preload forks workers after the master has touched the database, dont share its sockets
+    if _pool is not None and _pool.pid == os.getpid():
+        _pool.close_idle()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(before=_close_idle_before_fork)
+
+
+class PostgresConnection:
+    # sqlite3.Connection look-alike that holds one pooled Postgres connection until close()
+    def __init__(self, pool, timeout=5.0):
+        self.pool = pool
+        self.raw = None
+        self.raw = pool.acquire(timeout)
+        self.row_factory = None
+        self.broken = False
+
+    def cursor(self):
+        return PostgresCursor(self)
+
+    def execute(self, sql, *args):
+        return self.cursor().execute(sql, *args)
+
+    def executemany(self, sql, *args):
+        return self.cursor().executemany(sql, *args)
+
+    def commit(self):
+        try:
+            self.raw.commit()
+        except psycopg2.Error as e:
+            raise self.failed(e) from e
+
+    def rollback(self):
+        try:
+            self.raw.rollback()
+        except psycopg2.Error as e:
+            raise self.failed(e) from e
+
+    def close(self):
+        raw, self.raw = self.raw, None
+        if raw is not None:
+            self.pool.release(raw, self.broken)
+
+    def __del__(self):
+        # A connection the caller never closed (an exception on the way) goes back to the pool, like sqlite3 closes it
+        self.close()
+
+    def failed(self, e):
+        # The sqlite3 error for a psycopg2 one, the aborted transaction is rolled back so the connection stays usable
+        # SQLite would keep the statements before the failed one, every caller here gives up on the transaction anyway
+        if isinstance(e, (psycopg2.OperationalError, psycopg2.InterfaceError)):
+            self.broken = True  # Lost connection, dont pool it again
+        else:
+            try:
+                self.raw.rollback()
+            except psycopg2.Error:
+                self.broken = True
+        kind = sqlite3.IntegrityError if isinstance(e, psycopg2.IntegrityError) else sqlite3.OperationalError
+        return kind(str(e).strip())
+
+    def translate(self, sql):
+        translated = _translated.get(sql)
+        if translated is None:
+            missing = []  # Tables the catalog didnt know yet, like an INSERT run before its CREATE TABLE
+
+            def table_info(table):
+                info = self.table_info(table)
+                if not info[0]:
+                    missing.append(table)
+                return info
+
+            translated = translate(sql, table_info)
+            if not missing and len(_translated) < MAX_LABELS:
+                _translated[sql] = translated
+        return translated
+
+    def table_info(self, table):
+        info = _tables.get(table)
+        if info is None:
+            with self.raw.cursor() as c:
+                c.execute(TABLE_INFO_SQL, (table, table))
+                rows = c.fetchall()
+            info = ([row[0] for row in rows], [row[0] for row in rows if row[1]],
+                    next((row[0] for row in rows if row[2]), None))
+            if rows:
+                _tables[table] = info
+        return info
+
+
+class PostgresCursor:
+    # sqlite3.Cursor look-alike, statements are translated and timed like the SQLite ones
+    def __init__(self, connection):
+        self.connection = connection
+        self.raw = connection.raw.cursor()
+        self.lastrowid = None
+
+    def execute(self, sql, params=()):
+        return _timed(self._execute, sql, params)
+
+    def executemany(self, sql, seq_of_params):
+        return _timed(self._executemany, sql, seq_of_params)
+
+    def _execute(self, sql, params):
+        self.lastrowid = None
+        try:
+            pg_sql, serial, ddl = self.connection.translate(sql)
+            if serial:
+                # Postgres has no last_insert_rowid(), the new id comes back from the INSERT itself
+                self.raw.execute(f"{pg_sql} RETURNING {serial}", tuple(params))
+                row = self.raw.fetchone()
+                self.lastrowid = row[0] if row else None
+            else:
+                self.raw.execute(pg_sql, tuple(params))
+            if ddl:
+                # Column lists may have changed, and the translations built from them
+                _tables.clear()
+                _translated.clear()
+        except psycopg2.Error as e:
+            raise self.connection.failed(e) from e
+        return self
+
+    def _executemany(self, sql, seq_of_params):
+        try:
+            pg_sql, _, _ = self.connection.translate(sql)
+            # execute_batch sends BATCH_PAGE_SIZE rows per round trip, rowcount only covers the last page
+            psycopg2_extras.execute_batch(self.raw, pg_sql, [tuple(params) for params in seq_of_params],
+                                          page_size=BATCH_PAGE_SIZE)
+        except psycopg2.Error as e:
+            raise self.connection.failed(e) from e
+        return self
+
+    def _row(self, row):
+        factory = self.connection.row_factory
+        return factory(self, row) if factory and row is not None else row
+
+    def fetchone(self):
+        if self.raw.description is None:
+            return None  # Not a query, sqlite3 answers None where psycopg2 would raise
+        return self._row(self.raw.fetchone())
+
+    def fetchall(self):
+        if self.raw.description is None:
+            return []
+        return [self._row(row) for row in self.raw.fetchall()]
+
+    def __iter__(self):
+        return iter(self.fetchall())
+
+    @property
+    def description(self):
+        return self.raw.description
+
+    @property
+    def rowcount(self):
+        return self.raw.rowcount
+
+    def close(self):
+        self.raw.close()
@@ -0,0 +1,279 @@
+# entitlements.py
+# Subscription entitlements for BlockSpeak, kept current by Stripe webhooks
+# Stripe tells us about every subscription change with a signed customer.subscription.* event sent to
+# /api/stripe/webhook. Each event is stored by its id in the same transaction that applies it to the
+# entitlements table, so a redelivered or replayed event changes nothing, and an event older than the
+# one already applied to a subscription is ignored because Stripe doesnt promise ordering. Plan checks
+# read an in-process snapshot of the paid users that each worker reloads from SQLite every few seconds,
+# so no request ever waits on the Stripe API, and cancellations and lapses reach every worker quickly.
+# Send signed test events to a running server with: python bench/stripe_events.py
+
+import os  # Webhook secret
+import hmac  # Stripe-Signature check
+import json  # Event payloads
+import time  # Signature tolerance, period ends and snapshot age
+import hashlib  # HMAC-SHA256
+import logging  # Logs for debugging webhook problems
+import threading  # Guards the snapshot reload
+from db import connect as db_connect  # Timed SQLite connections
+from metrics import registry  # Webhook events by type and result
+
+logger = logging.getLogger(__name__)
+
+STRIPE_WEBHOOK_SECRET = os.getenv("STRIPE_WEBHOOK_SECRET")  # whsec_... from the Stripe dashboard or stripe listen
+SIGNATURE_TOLERANCE = 300  # Seconds a signed payload stays valid, same as Stripe's libraries
+REFRESH_SECONDS = float(os.getenv("ENTITLEMENT_REFRESH_SECONDS", "5"))  # Longest a worker serves an old plan
+PERIOD_GRACE = 3 * 86400  # Paid access past current_period_end when the renewal event hasnt arrived
+
+# Stripe price -> plan, the subscribe route sends users to these prices (test IDs, swap for live)
+STRIPE_PRICES = {"basic": "price_1QzXTCKv6dFcpMYlxS712fan", "pro": "price_1QzXY5Kv6dFcpMYluAWw5638"}
+PRICE_PLANS = {price: plan for plan, price in STRIPE_PRICES.items()}
+PAID_STATUSES = ("active", "trialing")  # Subscription statuses that grant the plan, past_due and later lapse it
+PLAN_RANK = {"free": 0, "basic": 1, "pro": 2}
+
+
+class WebhookSignatureError(ValueError):
+    # The Stripe-Signature header is missing, stale or doesnt match the payload
+    pass
+
+
+def init_entitlement_tables(db_path="users.db"):
+    # Creates the processed events and entitlements tables, and copies in plans paid before them once
+    conn = db_connect(db_path)
+    c = conn.cursor()
+    c.execute('''CREATE TABLE IF NOT EXISTS stripe_events (
+        id TEXT PRIMARY KEY,
+        type TEXT NOT NULL,
+        created INTEGER,
+        received_at REAL NOT NULL,
+        result TEXT)''')
+    c.execute('''CREATE TABLE IF NOT EXISTS entitlements (
+        user_id INTEGER PRIMARY KEY,
+        plan TEXT NOT NULL DEFAULT 'free',
+        source TEXT NOT NULL,
+        status TEXT,
+        stripe_subscription_id TEXT,
+        current_period_end INTEGER,
+        event_created INTEGER,
+        updated_at REAL NOT NULL)''')
+    # users.subscription was the only record before this table, those plans carry over without an end date
+    c.execute('''INSERT OR IGNORE INTO entitlements (user_id, plan, source, status, updated_at)
+        SELECT id, subscription, 'legacy', 'active', ? FROM users WHERE subscription IN ('basic', 'pro')''',
+              (time.time(),))
+    conn.commit()
+    conn.close()
+
+
+def sign_payload(payload, secret=None, timestamp=None):
+    # Stripe-Signature header for a payload, lets tests and bench/stripe_events.py make real-looking events
+    secret = secret or STRIPE_WEBHOOK_SECRET
+    timestamp = int(time.time() if timestamp is None else timestamp)
+    payload = payload.encode() if isinstance(payload, str) else payload
+    digest = hmac.new(secret.encode(), str(timestamp).encode() + b"." + payload, hashlib.sha256).hexdigest()
+    return f"t={timestamp},v1={digest}"
+
+
+def verify_signature(payload, header, secret=None, tolerance=SIGNATURE_TOLERANCE):
+    # Same check as stripe.Webhook.construct_event without importing stripe on the webhook path
+    secret = secret or STRIPE_WEBHOOK_SECRET
+    if not secret:
+        raise WebhookSignatureError("STRIPE_WEBHOOK_SECRET is not set")
+    if not header:
+        raise WebhookSignatureError("Missing Stripe-Signature header")
+    timestamp = None
+    signatures = []
+    for part in header.split(","):
+        key, _, value = part.strip().partition("=")
+        if key == "t" and value.isdigit():
+            timestamp = int(value)
+        elif key == "v1":
+            signatures.append(value)
+    if timestamp is None or not signatures:
+        raise WebhookSignatureError("Malformed Stripe-Signature header")
+    if abs(time.time() - timestamp) > tolerance:
+        raise WebhookSignatureError("Stripe-Signature timestamp outside the tolerance")
+    expected = sign_payload(payload, secret, timestamp).split("v1=", 1)[1]
+    if not any(hmac.compare_digest(expected, signature) for signature in signatures):
+        raise WebhookSignatureError("No Stripe-Signature matches the payload")
+
+
+def parse_event(payload, header, secret=None):
+    # Verified event dict from a webhook request body
+    verify_signature(payload, header, secret)
+    event = json.loads(payload)
+    if not isinstance(event, dict) or not event.get("id") or not event.get("type"):
+        raise ValueError("Not a Stripe event")
+    return event
+
+
+def subscription_plan(subscription):
+    # basic or pro for a Stripe subscription object, from its price or the plan we put in its metadata
+    for item in (subscription.get("items") or {}).get("data") or []:
+        plan = PRICE_PLANS.get((item.get("price") or {}).get("id"))
+        if plan:
+            return plan
+    plan = (subscription.get("metadata") or {}).get("plan")
+    return plan if plan in STRIPE_PRICES else None
+
+
+def apply_event(event, db_path="users.db"):
+    # Records and applies one verified event in a single transaction, returns what happened to it
+    conn = db_connect(db_path, timeout=30)
+    try:
+        c = conn.cursor()
+        c.execute("BEGIN IMMEDIATE")  # Two deliveries of one event on two workers apply it once
+        c.execute("INSERT OR IGNORE INTO stripe_events (id, type, created, received_at) VALUES (?, ?, ?, ?)",
+                  (event["id"], event["type"], event.get("created"), time.time()))
+        if c.rowcount != 1:
+            conn.rollback()
+            result = "duplicate"
+        else:
+            result = _apply(c, event) if event["type"].startswith("customer.subscription.") else "ignored"
+            c.execute("UPDATE stripe_events SET result = ? WHERE id = ?", (result, event["id"]))
+            conn.commit()
+    except Exception:
+        conn.rollback()  # Nothing is stored, Stripe retries the event and it applies then
+        raise
+    finally:
+        conn.close()
+    registry.inc("stripe_webhook_events_total", (("type", event["type"]), ("result", result)))
+    if result == "applied":
+        entitlement_cache.invalidate()  # This worker sees it now, the others on their next reload
+    return result
+
+
+def _apply(c, event):
+    subscription = (event.get("data") or {}).get("object") or {}
+    created = int(event.get("created") or 0)
+    user_id = _find_user(c, subscription)
+    if user_id is None:
+        logger.warning(f"Stripe event {event['id']} is for a customer we dont know: {subscription.get('customer')}")
+        return "unknown_customer"
+    c.execute("SELECT stripe_subscription_id, event_created, plan, source FROM entitlements WHERE user_id = ?",
+              (user_id,))
+    current = c.fetchone()
+    status = subscription.get("status")
+    if event["type"] == "customer.subscription.deleted":
+        status = "canceled"
+    plan = subscription_plan(subscription) if status in PAID_STATUSES else "free"
+    if plan is None:
+        logger.warning(f"Stripe event {event['id']} has a price we dont sell, leaving user {user_id} as is")
+        return "unknown_price"
+    if current and current[0] == subscription.get("id") and (current[1] or 0) > created:
+        return "stale"  # A newer event for this subscription already landed
+    # An old subscription ending doesnt take away the one or the ETH payment that replaced it
+    replaced = current and current[0] != subscription.get("id") and current[3] != "legacy" and current[2] != "free"
+    if replaced and plan == "free":
+        return "superseded"
+    c.execute('''INSERT INTO entitlements (user_id, plan, source, status, stripe_subscription_id, current_period_end,
+            event_created, updated_at)
+        VALUES (?, ?, 'stripe', ?, ?, ?, ?, ?)
+        ON CONFLICT(user_id) DO UPDATE SET plan = excluded.plan, source = excluded.source, status = excluded.status,
+            stripe_subscription_id = excluded.stripe_subscription_id, current_period_end = excluded.current_period_end,
+            event_created = excluded.event_created, updated_at = excluded.updated_at''',
+              (user_id, plan, status, subscription.get("id"), subscription.get("current_period_end"), created,
+               time.time()))
+    # Kept in step for anything still reading it
+    c.execute("UPDATE users SET subscription = ? WHERE id = ?", (plan, user_id))
+    logger.info(f"Stripe {event['type']} for user {user_id}: {plan} ({status})")
+    return "applied"
+
+
+def _find_user(c, subscription):
+    # Our user for a subscription, by Stripe customer, or the user_id the checkout session put in metadata
+    if subscription.get("customer"):
+        c.execute("SELECT id FROM users WHERE stripe_customer_id = ?", (subscription["customer"],))
+        row = c.fetchone()
+        if row:
+            return row[0]
+    user_id = (subscription.get("metadata") or {}).get("user_id")
+    if user_id and str(user_id).isdigit():
+        c.execute("SELECT id FROM users WHERE id = ?", (int(user_id),))
+        row = c.fetchone()
+        if row:
+            return row[0]
+    return None
+
+
+def grant(user_id, plan, source, period_end=None, db_path="users.db"):
+    # Sets a plan that didnt come from Stripe, like an ETH payment
+    conn = db_connect(db_path, timeout=30)
+    grant_with_cursor(conn.cursor(), user_id, plan, source, period_end)
+    conn.commit()
+    conn.close()
+    entitlement_cache.invalidate()
+
+
+def grant_with_cursor(c, user_id, plan, source, period_end=None):
+    # grant() inside the callers transaction, the caller commits and then invalidates entitlement_cache
+    c.execute('''INSERT INTO entitlements (user_id, plan, source, status, current_period_end, updated_at)
+        VALUES (?, ?, ?, 'active', ?, ?)
+        ON CONFLICT(user_id) DO UPDATE SET plan = excluded.plan, source = excluded.source, status = excluded.status,
+            stripe_subscription_id = NULL, current_period_end = excluded.current_period_end,
+            updated_at = excluded.updated_at''',
+              (user_id, plan, source, period_end, time.time()))
+    c.execute("UPDATE users SET subscription = ? WHERE id = ?", (plan, user_id))
+
+
+class EntitlementCache:
+    # {user_id: (plan, current_period_end)} for every paid user, reloaded from SQLite when older than REFRESH_SECONDS
+    def __init__(self, db_path="users.db", refresh_seconds=REFRESH_SECONDS):
+        self.db_path = db_path
+        self.refresh_seconds = refresh_seconds
+        self.plans = None  # None until the first load
+        self.loaded_at = 0.0
+        self.lock = threading.Lock()  # One reload at a time, other threads keep reading the old snapshot
+
+    def plan(self, user_id):
+        # free, basic or pro, never touches Stripe and only touches SQLite when the snapshot is old
+        plans = self.plans
+        if plans is None or time.monotonic() - self.loaded_at > self.refresh_seconds:
+            plans = self._reload(wait=plans is None)
+        entry = plans.get(user_id)
+        if entry is None:
+            return "free"
+        plan, period_end = entry
+        if period_end and period_end + PERIOD_GRACE < time.time():
+            return "free"  # Lapsed and no renewal event came, even if a webhook was lost
+        return plan
+
+    def invalidate(self):
+        # Next lookup reloads
+        self.loaded_at = 0.0
+
+    def _reload(self, wait):
+        if not self.lock.acquire(blocking=wait):
+            return self.plans  # Another thread is reloading, the old snapshot is fine meanwhile
+        try:
+            if self.plans is not None and time.monotonic() - self.loaded_at <= self.refresh_seconds:
+                return self.plans  # Reloaded while we waited
+            conn = db_connect(self.db_path)
+            try:
+                rows = conn.execute("SELECT user_id, plan, current_period_end FROM entitlements "
+                                    "WHERE plan != 'free'").fetchall()
+            finally:
+                conn.close()
+            self.plans = {row[0]: (row[1], row[2]) for row in rows}
+            self.loaded_at = time.monotonic()
+            return self.plans
+        except Exception as e:
+            if self.plans is None:
+                raise
+            logger.error(f"Entitlement reload failed, keeping the last snapshot: {str(e)}")
+            self.loaded_at = time.monotonic()  # Try again after another REFRESH_SECONDS, not on every request
+            return self.plans
+        finally:
+            self.lock.release()
+
+
+entitlement_cache = EntitlementCache()
+
+
+def plan_for(user_id):
+    # The plan a user has right now
+    return entitlement_cache.plan(user_id)
+
+
+def has_plan(user_id, plan):
+    # True when the user's plan is plan or better, like has_plan(id, "basic") for paid features
+    return PLAN_RANK[plan_for(user_id)] >= PLAN_RANK[plan]
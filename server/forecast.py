@@ -0,0 +1,288 @@
+# forecast.py
+# Price forecasting engine for BlockSpeak
+# Keeps a local copy of daily CoinCap price history in SQLite and fits simple trend models with NumPy.
+# All tracked coins are fitted together in one batched pass, and the results are stored so that
+# answering "predict bitcoin price in 7 days" is a dictionary lookup, not an API call plus a model fit.
+# Run it on a schedule with: python BlockSpeak.py --forecast
+
+import sqlite3  # Stores price history and precomputed forecasts next to users
+import logging  # Logs for debugging fetches and fits
+import threading  # Guards the in-memory forecast table and background refreshes
+import time  # For reload throttling
+from datetime import datetime  # Time handling for daily buckets
+from datetime import timedelta  # Helps walk back through days
+from datetime import timezone  # Ensures times are UTC
+from lazy import lazy_module  # numpy is only needed when fitting
+import requests  # RequestException from CoinCap fetches
+from metrics import upstream_session  # Timed HTTP session for CoinCap history
+from metrics import InstrumentedSession  # Pooled session for a full refresh
+from db import connect as db_connect  # Timed SQLite connections
+from market_data import COINCAP_API_URL  # CoinCap base URL, overridable for benchmarks
+
+
+np = lazy_module("numpy")  # Vectorized model fitting across all coins at once, imported by the first fit
+
+logger = logging.getLogger(__name__)
+
+# Coins we keep history and forecasts for, CoinCap asset ids
+TRACKED_COINS = ["bitcoin", "ethereum", "solana", "tether", "binance-coin", "xrp", "cardano", "dogecoin", "polkadot",
+                 "litecoin"]
+COINCAP_HISTORY_URL = COINCAP_API_URL + "/assets/{coin}/history"
+BACKFILL_DAYS = 365  # How far back we go the first time we see a coin
+FIT_WINDOW = 90      # Days of history the models are fitted on
+HOLDOUT_DAYS = 7     # Days held back to pick the best model per coin
+MAX_HORIZON = 30     # We precompute forecasts for 1..30 days ahead
+EWMA_ALPHA = 0.3     # Smoothing for the EWMA level model
+AR_ORDER = 3         # Lags for the AR model on log returns
+RELOAD_SECONDS = 600  # Web workers re-read the forecast table at most every 10 minutes
+MODELS = ["linear", "log_trend", "ewma", "ar"]
+
+# In-memory forecast table: coin -> {"generated_at", "model", "last_price", "prices"}
+_forecasts = {}
+_forecasts_loaded_at = 0.0
+_forecast_lock = threading.Lock()
+_refresh_thread = None
+
+
+def init_forecast_tables(db_path="users.db"):
+    # Creates the price_history and price_forecasts tables if they dont exist
+    conn = db_connect(db_path)
+    c = conn.cursor()
+    c.execute('''CREATE TABLE IF NOT EXISTS price_history (
+        coin TEXT NOT NULL,
+        day TEXT NOT NULL,
+        price REAL NOT NULL,
+        PRIMARY KEY (coin, day))''')
+    c.execute('''CREATE TABLE IF NOT EXISTS price_forecasts (
+        coin TEXT NOT NULL,
+        horizon INTEGER NOT NULL,
+        price REAL NOT NULL,
+        model TEXT NOT NULL,
+        last_price REAL NOT NULL,
+        generated_at TEXT NOT NULL,
+        PRIMARY KEY (coin, horizon))''')
+    conn.commit()
+    conn.close()
+
+
+def _day(ts):
+    # Turns a datetime into our YYYY-MM-DD bucket key
+    return ts.strftime("%Y-%m-%d")
+
+
+def update_price_history(coin, db_path="users.db", session=None):
+    # Fetches only the days we dont have yet for a coin from CoinCap /history
+    # Returns how many new days were stored
+    http = session or upstream_session
+    now = datetime.now(timezone.utc)
+    conn = db_connect(db_path)
+    c = conn.cursor()
+    c.execute("SELECT MAX(day) FROM price_history WHERE coin = ?", (coin,))
+    last_day = c.fetchone()[0]
+    if last_day:
+        start = datetime.strptime(last_day, "%Y-%m-%d").replace(tzinfo=timezone.utc) + timedelta(days=1)
+    else:
+        start = now - timedelta(days=BACKFILL_DAYS)
+    # Todays candle is still moving, only store finished days
+    end = now.replace(hour=0, minute=0, second=0, microsecond=0)
+    if start >= end:
+        conn.close()
+        return 0
+    url = COINCAP_HISTORY_URL.format(coin=coin)
+    params = {"interval": "d1", "start": int(start.timestamp() * 1000), "end": int(end.timestamp() * 1000)}
+    try:
+        response = http.get(url, params=params, timeout=15)
+        response.raise_for_status()
+        points = response.json().get("data", [])
+        rows = [(coin, _day(datetime.fromtimestamp(p["time"] / 1000, tz=timezone.utc)), float(p["priceUsd"]))
+                for p in points]
+        c.executemany("INSERT OR REPLACE INTO price_history (coin, day, price) VALUES (?, ?, ?)", rows)
+        conn.commit()
+        return len(rows)
+    except (requests.RequestException, ValueError, KeyError) as e:
+        logger.error(f"CoinCap history fetch failed for {coin}: {str(e)}")
+        return 0
+    finally:
+        conn.close()
+
+
+def load_price_matrix(coins, window, db_path="users.db"):
+    # Loads the last `window` days for every coin into one (coins x days) array
+    # Missing days are forward-filled, coins without enough history come back as NaN rows
+    end = datetime.now(timezone.utc).replace(hour=0, minute=0, second=0, microsecond=0) - timedelta(days=1)
+    days = [_day(end - timedelta(days=x)) for x in range(window)][::-1]
+    index = {d: i for i, d in enumerate(days)}
+    matrix = np.full((len(coins), window), np.nan)
+    conn = db_connect(db_path)
+    c = conn.cursor()
+    placeholders = ",".join("?" for _ in coins)
+    c.execute(f"SELECT coin, day, price FROM price_history WHERE coin IN ({placeholders}) AND day >= ?",
+              (*coins, days[0]))
+    rows = c.fetchall()
+    conn.close()
+    row_of = {coin: i for i, coin in enumerate(coins)}
+    for coin, day, price in rows:
+        if day in index:
+            matrix[row_of[coin], index[day]] = price
+    # Forward-fill gaps along the time axis, all coins at once
+    valid = ~np.isnan(matrix)
+    last_seen = np.where(valid, np.arange(window), 0)
+    np.maximum.accumulate(last_seen, axis=1, out=last_seen)
+    filled = matrix[np.arange(len(coins))[:, None], last_seen]
+    # Rows that start with a gap cant be filled backwards, drop them from the fit
+    usable = (valid.sum(axis=1) >= window // 2) & ~np.isnan(filled).any(axis=1)
+    filled[~usable] = np.nan
+    return filled, usable
+
+
+def _trend_fit(y, horizons):
+    # Least-squares line through each row of y, evaluated at future steps
+    n = y.shape[1]
+    t = np.arange(n, dtype=float)
+    t_mean = t.mean()
+    y_mean = y.mean(axis=1, keepdims=True)
+    slope = ((t - t_mean) * (y - y_mean)).sum(axis=1, keepdims=True) / ((t - t_mean) ** 2).sum()
+    intercept = y_mean - slope * t_mean
+    return intercept + slope * (n - 1 + horizons[None, :])
+
+
+def _ewma_fit(y, horizons):
+    # Exponentially weighted level, projected flat
+    level = y[:, 0].copy()
+    for i in range(1, y.shape[1]):
+        level = EWMA_ALPHA * y[:, i] + (1 - EWMA_ALPHA) * level
+    return np.repeat(level[:, None], len(horizons), axis=1)
+
+
+def _ar_fit(y, horizons):
+    # AR(p) on daily log returns, fitted for every coin with one batched solve
+    returns = np.diff(np.log(y), axis=1)
+    n_obs = returns.shape[1] - AR_ORDER
+    # Design tensor: (coins, observations, lags + intercept)
+    lags = np.stack([returns[:, AR_ORDER - k - 1:AR_ORDER - k - 1 + n_obs] for k in range(AR_ORDER)], axis=2)
+    X = np.concatenate([np.ones(lags.shape[:2] + (1,)), lags], axis=2)
+    target = returns[:, AR_ORDER:]
+    XtX = np.einsum("cij,cik->cjk", X, X) + 1e-8 * np.eye(AR_ORDER + 1)
+    Xty = np.einsum("cij,ci->cj", X, target)
+    coef = np.linalg.solve(XtX, Xty[:, :, None])[:, :, 0]
+    # Roll the recursion forward for all coins at once
+    history = list(returns[:, -AR_ORDER:].T)
+    path = []
+    for _ in range(int(horizons.max())):
+        recent = np.stack(history[-AR_ORDER:][::-1], axis=1)
+        step = coef[:, 0] + (coef[:, 1:] * recent).sum(axis=1)
+        history.append(step)
+        path.append(step)
+    cumulative = np.cumsum(np.stack(path, axis=1), axis=1)
+    return y[:, -1:] * np.exp(cumulative[:, horizons.astype(int) - 1])
+
+
+def _fit_models(y, horizons):
+    # Runs every model on the same (coins x days) block, returns model -> (coins x horizons)
+    return {
+        "linear": _trend_fit(y, horizons),
+        "log_trend": np.exp(_trend_fit(np.log(y), horizons)),
+        "ewma": _ewma_fit(y, horizons),
+        "ar": _ar_fit(y, horizons),
+    }
+
+
+def fit_forecasts(prices):
+    # Picks the best model per coin on a holdout week, then refits on the full window
+    # Returns (model index per coin, forecast array coins x MAX_HORIZON)
+    train, holdout = prices[:, :-HOLDOUT_DAYS], prices[:, -HOLDOUT_DAYS:]
+    backtest = _fit_models(train, np.arange(1, HOLDOUT_DAYS + 1, dtype=float))
+    errors = np.stack([np.abs(backtest[m] - holdout).mean(axis=1) / holdout.mean(axis=1) for m in MODELS])
+    errors = np.nan_to_num(errors, nan=np.inf)
+    best = errors.argmin(axis=0)
+    full = _fit_models(prices, np.arange(1, MAX_HORIZON + 1, dtype=float))
+    stacked = np.stack([full[m] for m in MODELS])  # (models, coins, horizons)
+    chosen = stacked[best, np.arange(prices.shape[0])]
+    # Prices cant go negative, a linear trend sometimes thinks they can
+    return best, np.clip(chosen, 0, None)
+
+
+def refresh_forecasts(db_path="users.db", coins=None, session=None):
+    # Full scheduled pass: pull new history for every coin, fit all coins together, store results
+    coins = coins or TRACKED_COINS
+    init_forecast_tables(db_path)
+    http = session or InstrumentedSession()
+    for coin in coins:
+        added = update_price_history(coin, db_path=db_path, session=http)
+        logger.info(f"Price history for {coin}: {added} new days")
+    prices, usable = load_price_matrix(coins, FIT_WINDOW, db_path=db_path)
+    fit_coins = [coin for coin, ok in zip(coins, usable) if ok]
+    if not fit_coins:
+        logger.warning("No coins have enough history to forecast yet")
+        return 0
+    best, forecast = fit_forecasts(prices[usable])
+    generated_at = datetime.now(timezone.utc).isoformat()
+    rows = []
+    for i, coin in enumerate(fit_coins):
+        last_price = float(prices[usable][i, -1])
+        for h in range(MAX_HORIZON):
+            rows.append((coin, h + 1, float(forecast[i, h]), MODELS[best[i]], last_price, generated_at))
+    conn = db_connect(db_path)
+    c = conn.cursor()
+    c.executemany("INSERT OR REPLACE INTO price_forecasts (coin, horizon, price, model, last_price, generated_at) "
+                  "VALUES (?, ?, ?, ?, ?, ?)", rows)
+    conn.commit()
+    conn.close()
+    logger.info(f"Forecasts refreshed for {len(fit_coins)} coins")
+    _load_forecasts(db_path, force=True)
+    return len(fit_coins)
+
+
+def _load_forecasts(db_path="users.db", force=False):
+    # Pulls the precomputed table into memory, throttled so lookups stay O(1)
+    global _forecasts, _forecasts_loaded_at
+    if not force and time.time() - _forecasts_loaded_at < RELOAD_SECONDS:
+        return
+    with _forecast_lock:
+        if not force and time.time() - _forecasts_loaded_at < RELOAD_SECONDS:
+            return
+        table = {}
+        try:
+            conn = db_connect(db_path)
+            c = conn.cursor()
+            c.execute("SELECT coin, horizon, price, model, last_price, generated_at "
+                      "FROM price_forecasts ORDER BY coin, horizon")
+            for coin, horizon, price, model, last_price, generated_at in c.fetchall():
+                entry = table.setdefault(coin, {"generated_at": generated_at, "model": model, "last_price": last_price,
+                                                "prices": [0.0] * MAX_HORIZON})
+                if 1 <= horizon <= MAX_HORIZON:
+                    entry["prices"][horizon - 1] = price
+            conn.close()
+        except sqlite3.OperationalError as e:
+            logger.warning(f"Forecast table not readable yet: {str(e)}")
+        _forecasts = table
+        _forecasts_loaded_at = time.time()
+
+
+def refresh_in_background(db_path="users.db"):
+    # Kicks off one refresh thread if none is running, used when a worker finds no forecasts at all
+    global _refresh_thread
+    with _forecast_lock:
+        if _refresh_thread and _refresh_thread.is_alive():
+            return
+        _refresh_thread = threading.Thread(target=refresh_forecasts, kwargs={"db_path": db_path}, daemon=True)
+        _refresh_thread.start()
+
+
+def get_forecast(coin, days, db_path="users.db"):
+    # O(1) lookup of a precomputed forecast, returns None if we dont have one
+    _load_forecasts(db_path)
+    entry = _forecasts.get(coin)
+    if not entry:
+        if not _forecasts:
+            refresh_in_background(db_path)  # Nothing computed yet, start warming up for the next ask
+        return None
+    days = max(1, min(MAX_HORIZON, int(days)))
+    return {
+        "coin": coin,
+        "days": days,
+        "price": entry["prices"][days - 1],
+        "last_price": entry["last_price"],
+        "model": entry["model"],
+        "generated_at": entry["generated_at"],
+    }
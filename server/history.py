@@ -0,0 +1,161 @@
+# history.py
+# Query history for BlockSpeak
+# Every answered question is one row in query_history, indexed by (user_id, ts), instead of a JSON
+# blob on the users row that was rewritten on every question and parsed on every request. Rows are
+# queued in memory and a background thread inserts them in batches, so /api/query never waits on a
+# write. Reads merge in the rows still queued, so a user sees their answer right away on the worker
+# that served it, other workers see it after the next flush (FLUSH_SECONDS).
+
+import os  # Worker pid, the writer thread restarts after a gunicorn fork
+import json  # Old users.history blobs
+import time  # Row timestamps
+import atexit  # Writes whatever is still queued when the process exits
+import logging  # Logs for debugging write failures
+import threading  # The writer thread
+from db import connect as db_connect  # Timed SQLite connections
+
+logger = logging.getLogger(__name__)
+
+FLUSH_SECONDS = 1.0  # Longest a row waits in memory
+BATCH_SIZE = 200  # Rows that wake the writer early
+MAX_PENDING = 10000  # Rows kept while the database is unwritable, oldest are dropped past this
+PAGE_SIZE = 20  # Default /api/history page
+MAX_PAGE_SIZE = 100  # Largest page a client can ask for
+
+INSERT_SQL = "INSERT INTO query_history (user_id, ts, intent, question, answer) VALUES (?, ?, ?, ?, ?)"
+
+
+def init_history_tables(db_path="users.db"):
+    # Creates the history table, and moves any old users.history blobs into it once
+    conn = db_connect(db_path)
+    c = conn.cursor()
+    c.execute('''CREATE TABLE IF NOT EXISTS query_history (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id INTEGER NOT NULL,
+        ts REAL NOT NULL,
+        intent TEXT,
+        question TEXT NOT NULL,
+        answer TEXT)''')
+    c.execute("CREATE INDEX IF NOT EXISTS idx_query_history_user_ts ON query_history (user_id, ts)")
+    _migrate_blobs(c)
+    conn.commit()
+    conn.close()
+
+
+def _migrate_blobs(c):
+    # Old databases kept the last 3 questions as JSON in users.history, newest first
+    c.execute("PRAGMA table_info(users)")
+    if "history" not in [col[1] for col in c.fetchall()]:
+        return
+    c.execute("SELECT id, history FROM users WHERE history IS NOT NULL AND history != '[]'")
+    now = time.time()
+    moved = 0
+    for user_id, blob in c.fetchall():
+        # Emptying the blob first claims it, a second worker starting at the same time skips it
+        c.execute("UPDATE users SET history = '[]' WHERE id = ? AND history = ?", (user_id, blob))
+        if c.rowcount != 1:
+            continue
+        try:
+            items = [item for item in json.loads(blob) if isinstance(item, dict) and item.get("question")]
+        except ValueError:
+            items = []
+        c.executemany(INSERT_SQL, [(user_id, now - i, None, item["question"], item.get("answer"))
+                                   for i, item in enumerate(items)])
+        moved += 1
+    if moved:
+        logger.info(f"Moved query history of {moved} users into query_history")
+
+
+class HistoryWriter:
+    # Queues history rows and inserts them in batches from a background thread
+    def __init__(self, db_path="users.db", flush_seconds=FLUSH_SECONDS, batch_size=BATCH_SIZE):
+        self.db_path = db_path
+        self.flush_seconds = flush_seconds
+        self.batch_size = batch_size
+        self.pending = []  # (user_id, ts, intent, question, answer) rows, oldest first
+        self.writing = []  # The batch being inserted right now, still visible to reads
+        self.lock = threading.Lock()  # Guards pending and writing
+        self.flush_lock = threading.Lock()  # One flush at a time, the thread and atexit can overlap
+        self.wake = threading.Event()
+        self.pid = None  # Process the writer thread runs in
+        atexit.register(self.flush)
+
+    def add(self, user_id, question, answer, intent=None):
+        row = (user_id, time.time(), intent, question, answer)
+        with self.lock:
+            self.pending.append(row)
+            if len(self.pending) > MAX_PENDING:
+                del self.pending[:len(self.pending) - MAX_PENDING]
+                logger.warning("Query history queue full, dropping the oldest rows")
+            if self.pid != os.getpid():
+                self.pid = os.getpid()
+                threading.Thread(target=self._loop, name="history-writer", daemon=True).start()
+            if len(self.pending) >= self.batch_size:
+                self.wake.set()
+        return row
+
+    def queued(self, user_id):
+        # Rows for a user that arent in the database yet
+        with self.lock:
+            return [row for row in self.writing + self.pending if row[0] == user_id]
+
+    def flush(self):
+        # Inserts everything queued so far in one transaction, returns the row count
+        with self.flush_lock:
+            with self.lock:
+                if not self.pending:
+                    return 0
+                self.writing, self.pending = self.pending, []
+            batch = self.writing
+            try:
+                conn = db_connect(self.db_path, timeout=30)
+                try:
+                    conn.executemany(INSERT_SQL, batch)
+                    conn.commit()
+                finally:
+                    conn.close()
+            except Exception:
+                with self.lock:
+                    self.pending[:0] = batch  # Back in front, tried again on the next flush
+                raise
+            finally:
+                with self.lock:
+                    self.writing = []
+            return len(batch)
+
+    def _loop(self):
+        while True:
+            self.wake.wait(self.flush_seconds)
+            self.wake.clear()
+            try:
+                self.flush()
+            except Exception as e:
+                logger.error(f"Query history write failed: {str(e)}")
+
+
+history_writer = HistoryWriter()
+
+
+def record_query(user_id, question, answer, intent=None):
+    # Queues one answered question, returns immediately
+    return history_writer.add(user_id, question, answer, intent)
+
+
+def get_history(user_id, limit=PAGE_SIZE, before=None, db_path="users.db"):
+    # Newest first, at most limit entries older than `before` (the ts of the last entry on the previous page)
+    if user_id is None:
+        return []
+    sql = "SELECT user_id, ts, intent, question, answer FROM query_history WHERE user_id = ?"
+    params = [user_id]
+    if before is not None:
+        sql += " AND ts < ?"
+        params.append(before)
+    conn = db_connect(db_path)
+    queued = history_writer.queued(user_id)  # Read before the query, a flush in between shows up in rows
+    rows = conn.execute(sql + " ORDER BY ts DESC LIMIT ?", params + [limit]).fetchall()
+    conn.close()
+    stored = {(row[1], row[3]) for row in rows}
+    rows += [row for row in queued if (before is None or row[1] < before) and (row[1], row[3]) not in stored]
+    rows.sort(key=lambda row: row[1], reverse=True)
+    return [{"question": row[3], "answer": row[4], "intent": row[2], "ts": row[1], "wallet_data": None}
+            for row in rows[:limit]]
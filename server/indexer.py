@@ -0,0 +1,428 @@
+# indexer.py
+# Contract event indexer for BlockSpeak
+# Scans eth_getLogs in block-range chunks for every RecurringPayment and DAO contract we know about
+# and materializes payments, cancellations, members, proposals and votes into SQLite. A checkpointed
+# cursor means each block is only scanned once, and recent block hashes are kept so a chain reorg
+# rolls the affected rows back and rescans them. Read endpoints answer from these tables with
+# indexed lookups instead of one RPC call per proposal or contract.
+
+import time  # For checkpoint timestamps and the run loop
+import logging  # Logs for debugging scans and reorgs
+import requests  # RequestException from the node
+from lazy import lazy_module  # eth_abi and eth_utils load on the first scan
+from rpc import rpc_call  # Single JSON-RPC calls like eth_getLogs
+from rpc import rpc_batch  # Batched block hash checks
+from rpc import RpcError  # Raised when a log range is too big
+from db import connect as db_connect  # Timed SQLite, stores the cursor, block hashes and indexed events
+from metrics import InstrumentedSession  # Shared HTTP session for JSON-RPC, timed per upstream
+
+logger = logging.getLogger(__name__)
+
+eth_abi = lazy_module("eth_abi")  # Decodes event data, ships with web3
+eth_utils = lazy_module("eth_utils")  # Event topic hashes, ships with web3
+
+CHUNK_BLOCKS = 2000    # Blocks per eth_getLogs call, Alchemy and Infura both accept this
+ADDRESS_BATCH = 500    # Contract addresses per eth_getLogs filter
+REORG_WINDOW = 64      # Recent blocks whose hashes we keep to detect reorgs
+REORG_RETRIES = 2      # Extra lookups for stored blocks a lagging provider didnt return
+POLL_SECONDS = 12      # About one Ethereum block between scans in --index mode
+STALE_SECONDS = 120    # Reads fall back to RPC if the indexer has not checkpointed for this long
+
+
+def _topic(signature):
+    # topic0 for an event signature, like "Voted(uint256,address,bool)"
+    return "0x" + eth_utils.keccak(text=signature).hex()
+
+
+# Event signature -> (event name, types of the non-indexed fields in data)
+EVENT_SIGNATURES = {
+    "PaymentSent(address,uint256,uint256)": ("PaymentSent", ["uint256", "uint256"]),
+    "Cancelled(address,uint256)": ("Cancelled", ["uint256"]),
+    "MemberJoined(address)": ("MemberJoined", ["address"]),
+    "ProposalCreated(uint256,string,address)": ("ProposalCreated", ["uint256", "string", "address"]),
+    "Voted(uint256,address,bool)": ("Voted", ["uint256", "address", "bool"]),
+    "ProposalExecuted(uint256,bool)": ("ProposalExecuted", ["uint256", "bool"]),
+}
+EVENTS = {}  # topic0 -> (event name, types), filled by events() on the first scan
+
+
+def events():
+    # topic0 lookup table, hashed once per process
+    if not EVENTS:
+        EVENTS.update({_topic(signature): event for signature, event in EVENT_SIGNATURES.items()})
+    return EVENTS
+
+
+# Tables whose rows come from logs, everything at or after a reorged block is deleted from these
+EVENT_TABLES = ["contract_payments", "contract_cancellations", "dao_members", "dao_proposals", "dao_votes"]
+
+
+def init_indexer_tables(db_path="users.db"):
+    # Creates the daos, indexer bookkeeping and indexed event tables if they dont exist
+    conn = db_connect(db_path)
+    c = conn.cursor()
+    c.execute('''CREATE TABLE IF NOT EXISTS daos (
+        address TEXT PRIMARY KEY,
+        name TEXT,
+        description TEXT,
+        owner TEXT,
+        created_by TEXT,
+        created_block INTEGER,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP)''')
+    c.execute('''CREATE TABLE IF NOT EXISTS indexer_addresses (
+        address TEXT PRIMARY KEY,
+        kind TEXT NOT NULL,
+        start_block INTEGER,
+        backfilled INTEGER DEFAULT 0)''')
+    c.execute('''CREATE TABLE IF NOT EXISTS indexer_state (
+        id INTEGER PRIMARY KEY CHECK (id = 1),
+        last_block INTEGER NOT NULL,
+        updated_at REAL NOT NULL)''')
+    c.execute('''CREATE TABLE IF NOT EXISTS indexer_blocks (
+        block_number INTEGER PRIMARY KEY,
+        block_hash TEXT NOT NULL)''')
+    c.execute('''CREATE TABLE IF NOT EXISTS contract_payments (
+        tx_hash TEXT NOT NULL,
+        log_index INTEGER NOT NULL,
+        contract TEXT NOT NULL,
+        recipient TEXT,
+        amount TEXT NOT NULL,
+        timestamp INTEGER NOT NULL,
+        block_number INTEGER NOT NULL,
+        PRIMARY KEY (tx_hash, log_index))''')
+    c.execute("CREATE INDEX IF NOT EXISTS idx_contract_payments ON contract_payments (contract, timestamp)")
+    c.execute('''CREATE TABLE IF NOT EXISTS contract_cancellations (
+        contract TEXT PRIMARY KEY,
+        owner TEXT,
+        timestamp INTEGER NOT NULL,
+        block_number INTEGER NOT NULL)''')
+    c.execute('''CREATE TABLE IF NOT EXISTS dao_members (
+        dao TEXT NOT NULL,
+        member TEXT NOT NULL,
+        block_number INTEGER NOT NULL,
+        PRIMARY KEY (dao, member))''')
+    c.execute('''CREATE TABLE IF NOT EXISTS dao_proposals (
+        dao TEXT NOT NULL,
+        proposal_id INTEGER NOT NULL,
+        description TEXT,
+        proposer TEXT,
+        executed INTEGER DEFAULT 0,
+        passed INTEGER,
+        executed_block INTEGER,
+        block_number INTEGER NOT NULL,
+        PRIMARY KEY (dao, proposal_id))''')
+    c.execute('''CREATE TABLE IF NOT EXISTS dao_votes (
+        dao TEXT NOT NULL,
+        proposal_id INTEGER NOT NULL,
+        voter TEXT NOT NULL,
+        vote INTEGER NOT NULL,
+        tx_hash TEXT,
+        block_number INTEGER NOT NULL,
+        PRIMARY KEY (dao, proposal_id, voter))''')
+    conn.commit()
+    conn.close()
+
+
+def register_contract(address, kind, start_block=None, db_path="users.db"):
+    # Adds a contract to the scan set, kind is "payment" or "dao"
+    # start_block is the deployment block if known, otherwise the indexer looks it up
+    conn = db_connect(db_path)
+    conn.execute("INSERT OR IGNORE INTO indexer_addresses (address, kind, start_block) VALUES (?, ?, ?)",
+                 (address.lower(), kind, start_block))
+    conn.commit()
+    conn.close()
+
+
+def record_dao(address, name, description, owner, created_by, created_block, db_path="users.db"):
+    # Saves a DAO we deployed and starts indexing it from its deployment block
+    conn = db_connect(db_path)
+    conn.execute("INSERT OR REPLACE INTO daos (address, name, description, owner, created_by, created_block) "
+                 "VALUES (?, ?, ?, ?, ?, ?)",
+                 (address.lower(), name, description, owner.lower(), created_by, created_block))
+    # The constructor makes the owner a member without an event
+    conn.execute("INSERT OR IGNORE INTO dao_members (dao, member, block_number) VALUES (?, ?, ?)",
+                 (address.lower(), owner.lower(), created_block))
+    conn.commit()
+    conn.close()
+    register_contract(address, "dao", created_block, db_path=db_path)
+
+
+def register_known_contracts(db_path="users.db"):
+    # Puts every row of the contracts and daos tables into the scan set, for contracts made before the indexer
+    conn = db_connect(db_path)
+    conn.execute("INSERT OR IGNORE INTO indexer_addresses (address, kind) "
+                 "SELECT lower(address), 'payment' FROM contracts")
+    conn.execute("INSERT OR IGNORE INTO indexer_addresses (address, kind, start_block) "
+                 "SELECT address, 'dao', created_block FROM daos")
+    conn.commit()
+    conn.close()
+
+
+def find_deployment_block(rpc_url, address, head, session=None):
+    # Binary search for the first block where the address has code, about 25 calls on Mainnet
+    low, high = 0, head
+    while low < high:
+        mid = (low + high) // 2
+        code = rpc_call(rpc_url, "eth_getCode", [address, hex(mid)], session=session)
+        if code and code != "0x":
+            high = mid
+        else:
+            low = mid + 1
+    return low
+
+
+def next_payment_after(timestamp, interval, day):
+    # Mirrors RecurringPayment.calculateNextPayment, integer math included
+    if day:
+        next_month = timestamp + 30 * 86400
+        month = (next_month % 31556952) // 2629746 + 1
+        if day > 28 and month == 2:
+            day = 28
+        if day > 30 and month in (4, 6, 9, 11):
+            day = 30
+        return next_month - ((next_month % 86400) % day) + day * 86400
+    return timestamp + (interval or 0)
+
+
+def _get_logs(rpc_url, addresses, from_block, to_block, session):
+    # eth_getLogs for one range, halving the range when the node says the answer is too big
+    span = to_block - from_block + 1
+    logs = []
+    start = from_block
+    while start <= to_block:
+        end = min(start + span - 1, to_block)
+        try:
+            logs.extend(rpc_call(rpc_url, "eth_getLogs", [{
+                "address": addresses,
+                "fromBlock": hex(start),
+                "toBlock": hex(end),
+                "topics": [list(events())],
+            }], session=session, timeout=30) or [])
+        except RpcError as e:
+            if span == 1:
+                raise
+            span = max(1, span // 2)
+            logger.info(f"eth_getLogs {start}-{end} rejected ({str(e)}), retrying with {span} blocks")
+            continue
+        start = end + 1
+    return logs
+
+
+def _apply_log(c, log):
+    # Writes one decoded log into its table, every insert is idempotent so rescans are safe
+    event = events().get(log["topics"][0])
+    if not event or log.get("removed"):
+        return
+    name, types = event
+    values = eth_abi.decode(types, bytes.fromhex(log["data"][2:]))
+    contract = log["address"].lower()
+    block = int(log["blockNumber"], 16)
+    tx_hash = log["transactionHash"]
+    log_index = int(log["logIndex"], 16)
+    if name == "PaymentSent":
+        recipient = "0x" + log["topics"][1][-40:]
+        c.execute("INSERT OR IGNORE INTO contract_payments VALUES (?, ?, ?, ?, ?, ?, ?)",
+                  (tx_hash, log_index, contract, recipient, str(values[0]), values[1], block))
+    elif name == "Cancelled":
+        owner = "0x" + log["topics"][1][-40:]
+        c.execute("INSERT OR IGNORE INTO contract_cancellations VALUES (?, ?, ?, ?)",
+                  (contract, owner, values[0], block))
+    elif name == "MemberJoined":
+        c.execute("INSERT OR IGNORE INTO dao_members VALUES (?, ?, ?)", (contract, values[0].lower(), block))
+    elif name == "ProposalCreated":
+        c.execute("INSERT OR IGNORE INTO dao_proposals (dao, proposal_id, description, proposer, block_number) "
+                  "VALUES (?, ?, ?, ?, ?)",
+                  (contract, values[0], values[1], values[2].lower(), block))
+    elif name == "Voted":
+        c.execute("INSERT OR IGNORE INTO dao_votes VALUES (?, ?, ?, ?, ?, ?)",
+                  (contract, values[0], values[1].lower(), int(values[2]), tx_hash, block))
+    elif name == "ProposalExecuted":
+        c.execute("UPDATE dao_proposals SET executed = 1, passed = ?, executed_block = ? "
+                  "WHERE dao = ? AND proposal_id = ?",
+                  (int(values[1]), block, contract, values[0]))
+
+
+def _scan(conn, rpc_url, addresses, from_block, to_block, session, checkpoint=True):
+    # Walks [from_block, to_block] in chunks, committing events, block hashes and the cursor together
+    for start in range(from_block, to_block + 1, CHUNK_BLOCKS):
+        end = min(start + CHUNK_BLOCKS - 1, to_block)
+        logs = []
+        for i in range(0, len(addresses), ADDRESS_BATCH):
+            logs.extend(_get_logs(rpc_url, addresses[i:i + ADDRESS_BATCH], start, end, session))
+        logs.sort(key=lambda log: (int(log["blockNumber"], 16), int(log["logIndex"], 16)))
+        c = conn.cursor()
+        for log in logs:
+            _apply_log(c, log)
+            c.execute("INSERT OR REPLACE INTO indexer_blocks VALUES (?, ?)",
+                      (int(log["blockNumber"], 16), log["blockHash"]))
+        if checkpoint:
+            # The chunk end hash lets the next run notice a reorg even when the chunk had no logs
+            block = rpc_call(rpc_url, "eth_getBlockByNumber", [hex(end), False], session=session)
+            if block:
+                c.execute("INSERT OR REPLACE INTO indexer_blocks VALUES (?, ?)", (end, block["hash"]))
+            c.execute("INSERT OR REPLACE INTO indexer_state VALUES (1, ?, ?)", (end, time.time()))
+            c.execute("DELETE FROM indexer_blocks WHERE block_number < ?", (end - REORG_WINDOW,))
+        conn.commit()
+        if logs:
+            logger.info(f"Indexed {len(logs)} contract events in blocks {start}-{end}")
+
+
+def _check_reorg(conn, rpc_url, last_block, session):
+    # Compares stored hashes with the node, rolls back to just after the newest block that still matches
+    # Only blocks with logs and chunk ends have a stored hash, so anything after the last match may have changed
+    stored = conn.execute("SELECT block_number, block_hash FROM indexer_blocks "
+                          "WHERE block_number > ? ORDER BY block_number",
+                          (last_block - REORG_WINDOW,)).fetchall()
+    if not stored:
+        return last_block
+    calls = [("eth_getBlockByNumber", [hex(number), False]) for number, _ in stored]
+    blocks = rpc_batch(rpc_url, calls, session=session)
+    for _ in range(REORG_RETRIES):
+        missing = [i for i, block in enumerate(blocks) if block is None]
+        if not missing:
+            break
+        for i, block in zip(missing, rpc_batch(rpc_url, [calls[i] for i in missing], session=session)):
+            blocks[i] = block
+    if None in blocks:
+        # A provider behind the others doesnt have these blocks yet, that is not a reorg, try again next pass
+        raise RpcError(f"Node did not return {blocks.count(None)} indexed blocks, skipping this pass")
+    matched = None
+    for (number, block_hash), block in zip(stored, blocks):
+        if block["hash"] != block_hash:
+            # Nothing after the last match can be trusted, or the whole window when nothing matched
+            from_block = matched + 1 if matched is not None else last_block - REORG_WINDOW + 1
+            logger.warning(f"Reorg detected at block {number}, rolling back indexed events from block {from_block}")
+            rollback(conn, from_block)
+            return from_block - 1
+        matched = number
+    return last_block
+
+
+def rollback(conn, from_block):
+    # Forgets everything indexed at or after from_block so it gets rescanned from the canonical chain
+    c = conn.cursor()
+    for table in EVENT_TABLES:
+        c.execute(f"DELETE FROM {table} WHERE block_number >= ?", (from_block,))
+    c.execute("UPDATE dao_proposals SET executed = 0, passed = NULL, executed_block = NULL "
+              "WHERE executed_block >= ?", (from_block,))
+    c.execute("DELETE FROM indexer_blocks WHERE block_number >= ?", (from_block,))
+    c.execute("UPDATE indexer_state SET last_block = ?, updated_at = ? WHERE id = 1", (from_block - 1, time.time()))
+    conn.commit()
+
+
+def sync(rpc_url, db_path="users.db", session=None):
+    # One indexer pass: resolve new contracts, check for reorgs, backfill, then scan to the chain head
+    session = session or InstrumentedSession()
+    head = int(rpc_call(rpc_url, "eth_blockNumber", [], session=session), 16)
+    conn = db_connect(db_path, timeout=30)
+    try:
+        for (address,) in conn.execute("SELECT address FROM indexer_addresses WHERE start_block IS NULL").fetchall():
+            try:
+                start = find_deployment_block(rpc_url, address, head, session=session)
+            except (RpcError, requests.RequestException) as e:
+                logger.warning(f"Deployment block lookup failed for {address}: {str(e)}")
+                continue
+            conn.execute("UPDATE indexer_addresses SET start_block = ? WHERE address = ?", (start, address))
+            conn.commit()
+
+        state = conn.execute("SELECT last_block FROM indexer_state WHERE id = 1").fetchone()
+        if state is None:
+            first = conn.execute("SELECT MIN(start_block) FROM indexer_addresses "
+                                 "WHERE start_block IS NOT NULL").fetchone()[0]
+            if first is None:
+                return None  # Nothing to index yet
+            conn.execute("INSERT INTO indexer_state VALUES (1, ?, ?)", (first - 1, time.time()))
+            conn.execute("UPDATE indexer_addresses SET backfilled = 1 WHERE start_block IS NOT NULL")
+            conn.commit()
+            last_block = first - 1
+        else:
+            last_block = _check_reorg(conn, rpc_url, state[0], session)
+
+        # Contracts added since the last pass only need the range the cursor already covered
+        pending = conn.execute("SELECT address, start_block FROM indexer_addresses "
+                               "WHERE backfilled = 0 AND start_block IS NOT NULL").fetchall()
+        if pending:
+            _scan(conn, rpc_url, [a for a, _ in pending], min(s for _, s in pending), last_block, session,
+                  checkpoint=False)
+            conn.executemany("UPDATE indexer_addresses SET backfilled = 1 WHERE address = ?",
+                             [(a,) for a, _ in pending])
+            conn.commit()
+
+        addresses = [row[0] for row in conn.execute("SELECT address FROM indexer_addresses WHERE backfilled = 1")]
+        if last_block < head:
+            _scan(conn, rpc_url, addresses, last_block + 1, head, session)
+        else:
+            conn.execute("UPDATE indexer_state SET updated_at = ? WHERE id = 1", (time.time(),))
+            conn.commit()
+        return head
+    finally:
+        conn.close()
+
+
+def run_forever(rpc_url, db_path="users.db", poll_seconds=POLL_SECONDS):
+    # The --index loop, keeps the tables a block or two behind the chain head
+    session = InstrumentedSession()
+    register_known_contracts(db_path=db_path)
+    while True:
+        try:
+            sync(rpc_url, db_path=db_path, session=session)
+        except Exception as e:
+            logger.error(f"Indexer pass failed: {str(e)}")
+        time.sleep(poll_seconds)
+
+
+def is_indexed(address, db_path="users.db"):
+    # True when the address is fully backfilled and the indexer checkpointed recently
+    conn = db_connect(db_path)
+    row = conn.execute("SELECT a.backfilled, s.updated_at FROM indexer_addresses a, indexer_state s "
+                       "WHERE a.address = ? AND s.id = 1",
+                       (address.lower(),)).fetchone()
+    conn.close()
+    return bool(row and row[0] and time.time() - row[1] < STALE_SECONDS)
+
+
+def get_indexed_proposals(dao_address, db_path="users.db"):
+    # Proposals with vote tallies for one DAO, shaped like the old RPC answer
+    conn = db_connect(db_path)
+    rows = conn.execute('''SELECT p.proposal_id, p.description, p.proposer, p.executed,
+                                  COALESCE(SUM(v.vote), 0), COUNT(v.voter)
+                           FROM dao_proposals p
+                           LEFT JOIN dao_votes v ON v.dao = p.dao AND v.proposal_id = p.proposal_id
+                           WHERE p.dao = ?
+                           GROUP BY p.proposal_id, p.description, p.proposer, p.executed
+                           ORDER BY p.proposal_id''', (dao_address.lower(),)).fetchall()
+    conn.close()
+    return [{
+        "id": row[0],
+        "description": row[1],
+        "proposer": row[2],
+        "yesVotes": str(row[4]),
+        "noVotes": str(row[5] - row[4]),
+        "active": not row[3],  # The contract closes a proposal exactly when it is executed
+        "executed": bool(row[3]),
+    } for row in rows]
+
+
+def get_contract_states(addresses, db_path="users.db"):
+    # Indexed payment state per RecurringPayment contract:
+    # {address: {"payment_count", "last_payment", "next_payment", "cancelled"}}
+    # Addresses are passed as stored in the contracts table, next_payment is None until we see a payment
+    if not addresses:
+        return {}
+    conn = db_connect(db_path)
+    states = {}
+    for address in addresses:
+        key = address.lower()
+        count, last = conn.execute("SELECT COUNT(*), MAX(timestamp) FROM contract_payments WHERE contract = ?",
+                                   (key,)).fetchone()
+        terms = conn.execute("SELECT interval, day FROM contracts WHERE address = ?", (address,)).fetchone()
+        cancelled = conn.execute("SELECT 1 FROM contract_cancellations WHERE contract = ?",
+                                 (key,)).fetchone() is not None
+        states[address] = {
+            "payment_count": count,
+            "last_payment": last,
+            "next_payment": next_payment_after(last, terms[0], terms[1]) if last and terms else None,
+            "cancelled": cancelled,
+        }
+    conn.close()
+    return states
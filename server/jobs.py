@@ -0,0 +1,315 @@
+# jobs.py
+# Durable job queue for BlockSpeak's background work
+# Jobs are rows in a jobs table next to everything else (users.db, or Postgres through db.py), so a
+# queued job survives restarts and every worker process sees the same queue. A worker claims the
+# most urgent due job under the database write lock and holds it on a lease that a heartbeat thread
+# keeps extending while the job runs. A finished job is marked done, a failed one goes back to the
+# queue with exponential backoff until max_attempts and then to the dead letters (state dead, with
+# its last error) until someone retries it. A worker that crashes stops renewing its leases, so its
+# jobs are claimed again once they expire: delivery is at least once and handlers check before they
+# act. Producers pass a dedupe_key like "auto_payment:0xabc:1767225600", so running a producer twice,
+# or again after a crash, queues the work once. Each kind can cap how many of it run at once across
+# every worker, like one auto-payment at a time because they share a signer and its nonce.
+# Run consumers with: python BlockSpeak.py --worker 4    Queue status: python BlockSpeak.py --jobs
+# Throughput and crash recovery against a scratch database: python bench/jobs.py
+
+import os  # Worker names
+import json  # Payloads
+import time  # Run times, leases and backoff
+import random  # Backoff jitter
+import signal  # SIGTERM finishes the running jobs and stops
+import socket  # Worker names
+import logging  # Logs for debugging failed jobs
+import threading  # Consumer and heartbeat threads
+from db import connect as db_connect  # Timed connections, SQLite or Postgres
+from metrics import registry  # Jobs by outcome and their run time
+
+logger = logging.getLogger(__name__)
+
+LEASE_SECONDS = 300  # A claimed job is given back to the queue if its worker goes quiet this long
+HEARTBEAT_SECONDS = 60  # How often a worker renews the leases of the jobs it is running
+POLL_SECONDS = 1.0  # Idle wait before looking for work again, doubles up to MAX_POLL_SECONDS
+MAX_POLL_SECONDS = 5.0
+MAX_ATTEMPTS = 5  # Runs before a job is dead-lettered, a run lost to a crash counts too
+BACKOFF_SECONDS = 30  # Wait before the first retry, doubles on every attempt up to MAX_BACKOFF
+MAX_BACKOFF = 3600
+KEEP_DONE_SECONDS = 7 * 86400  # Finished jobs are deleted after a week, dead ones are kept
+PURGE_SECONDS = 3600  # How often a worker deletes old finished jobs
+
+QUEUED, RUNNING, DONE, DEAD = "queued", "running", "done", "dead"
+
+_handlers = {}  # kind -> (handler(payload), most running at once or None)
+
+
+class PermanentJobError(Exception):
+    # Raised by a handler for a job that can never succeed, it goes to the dead letters without retries
+    pass
+
+
+def register(kind, handler, max_running=None):
+    # handler(payload) runs one job of this kind, raising fails it, max_running caps it across all workers
+    _handlers[kind] = (handler, max_running)
+
+
+def init_job_tables(db_path="users.db"):
+    # Creates the queue, one row per job from queued until it is purged
+    conn = db_connect(db_path)
+    c = conn.cursor()
+    c.execute('''CREATE TABLE IF NOT EXISTS jobs (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        kind TEXT NOT NULL,
+        payload TEXT NOT NULL,
+        priority INTEGER NOT NULL DEFAULT 0,
+        state TEXT NOT NULL,
+        dedupe_key TEXT UNIQUE,
+        attempts INTEGER NOT NULL DEFAULT 0,
+        max_attempts INTEGER NOT NULL,
+        run_at REAL NOT NULL,
+        lease_until REAL,
+        worker TEXT,
+        last_error TEXT,
+        created_at REAL NOT NULL,
+        updated_at REAL NOT NULL)''')
+    c.execute("CREATE INDEX IF NOT EXISTS idx_jobs_due ON jobs (state, run_at)")
+    conn.commit()
+    conn.close()
+
+
+def enqueue(kind, payload=None, priority=0, delay=0, dedupe_key=None, max_attempts=MAX_ATTEMPTS, db_path="users.db"):
+    # Queues a job, higher priority runs first, returns its id or None if dedupe_key was already queued
+    now = time.time()
+    conn = db_connect(db_path, timeout=30)
+    c = conn.cursor()
+    c.execute('''INSERT OR IGNORE INTO jobs (kind, payload, priority, state, dedupe_key, max_attempts, run_at,
+            created_at, updated_at)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)''',
+              (kind, json.dumps(payload or {}), priority, QUEUED, dedupe_key, max_attempts, now + delay, now, now))
+    job_id = c.lastrowid if c.rowcount == 1 else None
+    conn.commit()
+    conn.close()
+    return job_id
+
+
+def claim(worker, kinds, lease_seconds=LEASE_SECONDS, db_path="users.db"):
+    # The most urgent due job of these kinds as a dict, now leased to worker, or None
+    # A running job whose lease ran out is claimed like a queued one, its worker died or hung
+    now = time.time()
+    conn = db_connect(db_path, timeout=30)
+    try:
+        c = conn.cursor()
+        c.execute("BEGIN IMMEDIATE")  # Two workers never claim the same job
+        c.execute("SELECT kind, COUNT(*) FROM jobs WHERE state = ? AND lease_until >= ? GROUP BY kind", (RUNNING, now))
+        running = dict(c.fetchall())
+        kinds = [kind for kind in kinds if _handlers[kind][1] is None or running.get(kind, 0) < _handlers[kind][1]]
+        while kinds:
+            c.execute(f'''SELECT * FROM jobs WHERE kind IN ({", ".join("?" * len(kinds))})
+                AND ((state = ? AND run_at <= ?) OR (state = ? AND lease_until < ?))
+                ORDER BY priority DESC, run_at, id LIMIT 1''', (*kinds, QUEUED, now, RUNNING, now))
+            row = c.fetchone()
+            if row is None:
+                break
+            job = _row_dict(c, row)
+            if job["state"] == RUNNING:
+                logger.warning(f"Job {job['id']} ({job['kind']}) lost its worker {job['worker']}, "
+                               f"attempt {job['attempts']}")
+                if job["attempts"] >= job["max_attempts"]:
+                    error = f"Worker {job['worker']} stopped during attempt {job['attempts']}"
+                    c.execute("UPDATE jobs SET state = ?, last_error = ?, lease_until = NULL, updated_at = ? "
+                              "WHERE id = ?", (DEAD, error, now, job["id"]))
+                    registry.inc("jobs_total", (("kind", job["kind"]), ("outcome", DEAD)))
+                    continue
+            c.execute("UPDATE jobs SET state = ?, attempts = attempts + 1, lease_until = ?, worker = ?, updated_at = ? "
+                      "WHERE id = ?",
+                      (RUNNING, now + lease_seconds, worker, now, job["id"]))
+            conn.commit()
+            job.update(state=RUNNING, attempts=job["attempts"] + 1, worker=worker, payload=json.loads(job["payload"]))
+            return job
+        conn.commit()
+        return None
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+
+
+def _settle(job, state, error=None, run_at=None, db_path="users.db"):
+    # Moves a claimed job on, only if it is still this attempt's, a worker that lost its lease changes nothing
+    conn = db_connect(db_path, timeout=30)
+    c = conn.cursor()
+    c.execute('''UPDATE jobs SET state = ?, last_error = ?, run_at = COALESCE(?, run_at), lease_until = NULL,
+            updated_at = ?
+        WHERE id = ? AND state = ? AND attempts = ?''',
+              (state, error, run_at, time.time(), job["id"], RUNNING, job["attempts"]))
+    settled = c.rowcount == 1
+    conn.commit()
+    conn.close()
+    return settled
+
+
+def complete(job, db_path="users.db"):
+    # Marks a claimed job done, False if its lease had already run out and someone else took it
+    return _settle(job, DONE, db_path=db_path)
+
+
+def fail(job, error, permanent=False, db_path="users.db"):
+    # Requeues a claimed job with backoff, or dead-letters it, returns the new state or None if the lease was lost
+    if permanent or job["attempts"] >= job["max_attempts"]:
+        return DEAD if _settle(job, DEAD, error, db_path=db_path) else None
+    delay = min(MAX_BACKOFF, BACKOFF_SECONDS * 2 ** (job["attempts"] - 1)) * random.uniform(0.75, 1.25)
+    return QUEUED if _settle(job, QUEUED, error, time.time() + delay, db_path) else None
+
+
+def renew(jobs, lease_seconds=LEASE_SECONDS, db_path="users.db"):
+    # Extends the leases of jobs this process is running
+    conn = db_connect(db_path, timeout=30)
+    conn.executemany("UPDATE jobs SET lease_until = ? WHERE id = ? AND state = ? AND attempts = ?",
+                     [(time.time() + lease_seconds, job["id"], RUNNING, job["attempts"]) for job in jobs])
+    conn.commit()
+    conn.close()
+
+
+def has_work(kinds, db_path="users.db"):
+    # Anything queued (due or waiting out a backoff) or running for these kinds
+    conn = db_connect(db_path)
+    row = conn.execute(f"SELECT 1 FROM jobs WHERE kind IN ({', '.join('?' * len(kinds))}) AND state IN (?, ?) LIMIT 1",
+                       (*kinds, QUEUED, RUNNING)).fetchone()
+    conn.close()
+    return row is not None
+
+
+def purge_done(older_than=KEEP_DONE_SECONDS, db_path="users.db"):
+    conn = db_connect(db_path, timeout=30)
+    c = conn.cursor()
+    c.execute("DELETE FROM jobs WHERE state = ? AND updated_at < ?", (DONE, time.time() - older_than))
+    purged = c.rowcount
+    conn.commit()
+    conn.close()
+    return purged
+
+
+def retry_dead(kind=None, db_path="users.db"):
+    # Puts dead-lettered jobs back in the queue with fresh attempts, returns how many
+    conn = db_connect(db_path, timeout=30)
+    c = conn.cursor()
+    sql = "UPDATE jobs SET state = ?, attempts = 0, run_at = ?, updated_at = ? WHERE state = ?"
+    params = [QUEUED, time.time(), time.time(), DEAD]
+    if kind:
+        sql += " AND kind = ?"
+        params.append(kind)
+    c.execute(sql, params)
+    retried = c.rowcount
+    conn.commit()
+    conn.close()
+    return retried
+
+
+def queue_stats(db_path="users.db"):
+    # [(kind, state, jobs, oldest run_at)] for --jobs, plus the latest error of every dead job
+    conn = db_connect(db_path)
+    counts = conn.execute("SELECT kind, state, COUNT(*), MIN(run_at) FROM jobs "
+                          "GROUP BY kind, state ORDER BY kind, state").fetchall()
+    dead = conn.execute("SELECT id, kind, attempts, last_error FROM jobs WHERE state = ? "
+                        "ORDER BY updated_at DESC LIMIT 20", (DEAD,)).fetchall()
+    conn.close()
+    return counts, dead
+
+
+class JobWorkers:
+    # n consumer threads in this process, plus one thread renewing their leases
+    def __init__(self, n, kinds=None, db_path="users.db", lease_seconds=LEASE_SECONDS, poll_seconds=POLL_SECONDS):
+        self.n = n
+        self.kinds = list(kinds or sorted(_handlers))
+        self.db_path = db_path
+        self.lease_seconds = lease_seconds
+        self.poll_seconds = poll_seconds
+        self.name = f"{socket.gethostname()}:{os.getpid()}"
+        self.running = {}  # Consumer name -> the job it is running
+        self.lock = threading.Lock()
+        self.stopping = threading.Event()
+
+    def run(self, drain=False):
+        # Consumes until Ctrl+C or SIGTERM, which let running jobs finish, or with drain until the queue is empty
+        if not self.kinds:
+            raise ValueError("No job handlers registered")
+        if threading.current_thread() is threading.main_thread():
+            signal.signal(signal.SIGTERM, lambda signum, frame: self.stop())
+        threads = [threading.Thread(target=self._consume, args=(f"{self.name}:{i}", drain), name=f"job-worker-{i}",
+                                    daemon=True)
+                   for i in range(self.n)]
+        for thread in threads:
+            thread.start()
+        threading.Thread(target=self._heartbeat, name="job-heartbeat", daemon=True).start()
+        logger.info(f"{self.n} job workers consuming {', '.join(self.kinds)}")
+        try:
+            while any(thread.is_alive() for thread in threads):
+                for thread in threads:
+                    thread.join(timeout=1)
+        except KeyboardInterrupt:
+            self.stop()
+            for thread in threads:
+                thread.join()
+
+    def stop(self):
+        logger.info("Job workers stopping after their current jobs")
+        self.stopping.set()
+
+    def _consume(self, name, drain):
+        wait = self.poll_seconds
+        while not self.stopping.is_set():
+            try:
+                job = claim(name, self.kinds, self.lease_seconds, self.db_path)
+                if job is None and drain and not has_work(self.kinds, self.db_path):
+                    return
+            except Exception as e:
+                logger.warning(f"Job claim failed: {str(e)}")
+                job = None
+            if job is None:
+                self.stopping.wait(wait)
+                wait = min(wait * 2, MAX_POLL_SECONDS)
+                continue
+            wait = self.poll_seconds
+            self.run_job(name, job)
+
+    def run_job(self, name, job):
+        # Runs one claimed job and records how it ended
+        with self.lock:
+            self.running[name] = job
+        started = time.perf_counter()
+        try:
+            _handlers[job["kind"]][0](job["payload"])
+            outcome = DONE if complete(job, self.db_path) else "lost"
+        except PermanentJobError as e:
+            outcome = fail(job, str(e), permanent=True, db_path=self.db_path) or "lost"
+        except Exception as e:
+            logger.warning(f"Job {job['id']} ({job['kind']}) attempt {job['attempts']}/{job['max_attempts']} "
+                           f"failed: {str(e)}")
+            outcome = fail(job, f"{type(e).__name__}: {str(e)}", db_path=self.db_path) or "lost"
+        finally:
+            with self.lock:
+                self.running.pop(name, None)
+        if outcome == DEAD:
+            logger.error(f"Job {job['id']} ({job['kind']}) dead-lettered after {job['attempts']} attempts")
+        elif outcome == "lost":
+            logger.warning(f"Job {job['id']} ({job['kind']}) finished after its lease ran out, another worker owns it")
+        registry.inc("jobs_total", (("kind", job["kind"]), ("outcome", outcome)))
+        registry.observe("job_duration_seconds", time.perf_counter() - started, (("kind", job["kind"]),))
+        return outcome
+
+    def _heartbeat(self):
+        purged_at = 0.0
+        while not self.stopping.wait(min(HEARTBEAT_SECONDS, self.lease_seconds / 3)):
+            try:
+                with self.lock:
+                    jobs = list(self.running.values())
+                if jobs:
+                    renew(jobs, self.lease_seconds, self.db_path)
+                if time.time() - purged_at > PURGE_SECONDS:
+                    purged_at = time.time()
+                    purge_done(db_path=self.db_path)
+            except Exception as e:
+                logger.warning(f"Job heartbeat failed: {str(e)}")
+
+
+def _row_dict(cursor, row):
+    return {col[0]: value for col, value in zip(cursor.description, row)}
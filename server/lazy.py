@@ -0,0 +1,48 @@
+# lazy.py
+# On-first-use loading for BlockSpeak's heavy libraries and clients
+# web3, openai, stripe, feedparser, eth_account and numpy are most of our import time, and the
+# mainnet web3 setup makes a network round trip. A LazyObject stands in for a module or client and
+# builds the real thing the first time an attribute is read, so the web process, --cron and --auto
+# only pay for what they actually touch. Check startup with: python bench/importtime.py
+
+import importlib  # Imports a module by name when first needed
+import threading  # Two request threads shouldnt build the same client twice
+
+
+class LazyObject:
+    # Proxy that calls factory() on first attribute access and forwards everything to the result
+    def __init__(self, factory, name=None):
+        object.__setattr__(self, "_factory", factory)
+        object.__setattr__(self, "_name", name or getattr(factory, "__name__", "object"))
+        object.__setattr__(self, "_target", None)
+        object.__setattr__(self, "_lock", threading.Lock())
+
+    def _resolve(self):
+        target = object.__getattribute__(self, "_target")
+        if target is None:
+            with object.__getattribute__(self, "_lock"):
+                target = object.__getattribute__(self, "_target")
+                if target is None:
+                    target = object.__getattribute__(self, "_factory")()
+                    object.__setattr__(self, "_target", target)
+        return target
+
+    def __getattr__(self, attr):
+        return getattr(self._resolve(), attr)
+
+    def __setattr__(self, attr, value):
+        setattr(self._resolve(), attr, value)
+
+    def __repr__(self):
+        target = object.__getattribute__(self, "_target")
+        return repr(target) if target is not None else f"<lazy {object.__getattribute__(self, '_name')}>"
+
+
+def lazy_module(name, setup=None):
+    # Module that is imported on first use, setup(module) runs once right after the import
+    def load():
+        module = importlib.import_module(name)
+        if setup:
+            setup(module)
+        return module
+    return LazyObject(load, name)
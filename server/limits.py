@@ -0,0 +1,249 @@
+# limits.py
+# Rate limiting and load shedding for BlockSpeak's expensive routes
+# Every expensive route belongs to a cost group (query, chain_write, analytics). Admission takes one
+# token from the user's bucket for that group and one from the bucket shared by everyone on the same
+# subscription tier, so one free account cant drain the OpenAI or Alchemy quota and free accounts
+# together cant starve paying ones. Buckets live in Redis (REDIS_URL) so every worker and node shares
+# them, with an in-memory fallback per process. Before any bucket is touched, requests are shed with a
+# 429 when this process is too busy (free sheds first, then basic, pro only at full capacity) or when
+# an upstream the group needs has its circuit breaker open (pro still gets through to probe it).
+
+import os  # Settings
+import time  # Bucket refills and breaker windows
+import math  # Retry-After rounding
+import logging  # Logs for debugging Redis failures
+import threading  # Guards the in-process state
+from metrics import registry  # Rejections by group, tier and reason
+from metrics import upstream_listeners  # Feeds the circuit breakers
+from lazy import lazy_module  # redis is only imported when REDIS_URL is set
+
+logger = logging.getLogger(__name__)
+
+redis = lazy_module("redis")
+
+TIERS = ("free", "basic", "pro")
+
+# Cost group -> tier -> (tokens per minute, burst) for one user
+USER_LIMITS = {
+    "query": {"free": (5, 10), "basic": (20, 40), "pro": (60, 120)},
+    "chain_write": {"free": (1, 3), "basic": (5, 10), "pro": (20, 40)},
+    "analytics": {"free": (10, 20), "basic": (30, 60), "pro": (120, 240)},
+}
+# Cost group -> tier -> (tokens per minute, burst) shared by every user of the tier, None means no cap
+TIER_LIMITS = {
+    "query": {"free": (120, 240), "basic": (600, 1200), "pro": None},
+    "chain_write": {"free": (20, 40), "basic": (100, 200), "pro": None},
+    "analytics": {"free": (300, 600), "basic": (1200, 2400), "pro": None},
+}
+# Cost group -> upstream labels (see metrics.UPSTREAMS) whose breaker sheds the group
+# A tuple inside is a set of interchangeable upstreams, like the Ethereum providers in rpc_pool.py,
+# it only sheds the group when every one of them is open
+ETH_PROVIDERS = ("alchemy", "infura")
+GROUP_UPSTREAMS = {
+    "query": ("openai",),
+    "chain_write": (ETH_PROVIDERS, "hardhat"),
+    "analytics": (ETH_PROVIDERS, "blockcypher", "blockchain_info"),
+}
+
+MAX_IN_FLIGHT = int(os.getenv("MAX_IN_FLIGHT", "32"))  # Requests this process handles well at once
+SHED_AT = {"free": 0.5, "basic": 0.8, "pro": 1.0}  # Share of MAX_IN_FLIGHT at which each tier is shed
+BREAKER_WINDOW = 30  # Seconds of upstream calls a breaker looks at
+BREAKER_MIN_CALLS = 20  # Calls in a window before a breaker may open
+BREAKER_FAILURE_RATIO = 0.5  # Failed share of calls that opens it
+BREAKER_OPEN_SECONDS = 30  # How long it stays open
+REDIS_RETRY_SECONDS = 30  # After a Redis error, use the in-memory buckets this long
+MAX_MEMORY_BUCKETS = 50000  # Full, idle buckets are dropped past this
+
+# Atomic check-and-take over several buckets: KEYS are buckets, ARGV is rate/s and burst per key,
+# then the cost. Takes from all of them or none, returns the seconds until all would have enough.
+TAKE_SCRIPT = """
+local now = redis.call("TIME")
+now = tonumber(now[1]) + tonumber(now[2]) / 1000000
+local cost = tonumber(ARGV[#ARGV])
+local states = {}
+local wait = 0
+for i, key in ipairs(KEYS) do
+    local rate = tonumber(ARGV[2 * i - 1])
+    local burst = tonumber(ARGV[2 * i])
+    local state = redis.call("HMGET", key, "tokens", "ts")
+    local tokens = tonumber(state[1]) or burst
+    local ts = tonumber(state[2]) or now
+    tokens = math.min(burst, tokens + math.max(0, now - ts) * rate)
+    if tokens < cost then
+        wait = math.max(wait, (cost - tokens) / rate)
+    end
+    states[i] = {tokens, rate, burst}
+end
+for i, key in ipairs(KEYS) do
+    local tokens = states[i][1]
+    if wait == 0 then
+        tokens = tokens - cost
+    end
+    redis.call("HSET", key, "tokens", tostring(tokens), "ts", tostring(now))
+    redis.call("EXPIRE", key, math.ceil(states[i][3] / states[i][2]) + 1)
+end
+return tostring(wait)
+"""
+
+
+class MemoryBuckets:
+    # Token buckets in this process, {key: [tokens, updated]}
+    def __init__(self):
+        self.buckets = {}
+        self.lock = threading.Lock()
+
+    def take(self, specs, cost=1):
+        # specs is [(key, rate per second, burst)], returns 0 when taken or the seconds to wait
+        now = time.monotonic()
+        with self.lock:
+            if len(self.buckets) > MAX_MEMORY_BUCKETS:
+                self._prune(now, {key for key, _, _ in specs})
+            levels = []
+            wait = 0.0
+            for key, rate, burst in specs:
+                tokens, updated = self.buckets.get(key, (burst, now))
+                tokens = min(burst, tokens + (now - updated) * rate)
+                if tokens < cost:
+                    wait = max(wait, (cost - tokens) / rate)
+                levels.append(tokens)
+            for (key, _, _), tokens in zip(specs, levels):
+                self.buckets[key] = [tokens - cost if not wait else tokens, now]
+            return wait
+
+    def _prune(self, now, keep):
+        # Buckets that havent been used for 10 minutes are full again, forgetting them changes nothing
+        self.buckets = {key: state for key, state in self.buckets.items() if key in keep or now - state[1] < 600}
+
+
+class RedisBuckets:
+    # Same buckets in Redis, shared by every worker and node, falls back to memory while Redis is down
+    def __init__(self, url, prefix="ratelimit:"):
+        self.url = url
+        self.prefix = prefix
+        self.client = None
+        self.script = None
+        self.fallback = MemoryBuckets()
+        self.down_until = 0.0
+
+    def take(self, specs, cost=1):
+        if time.monotonic() < self.down_until:
+            return self.fallback.take(specs, cost)
+        try:
+            if self.client is None:
+                self.client = redis.Redis.from_url(self.url)
+                self.script = self.client.register_script(TAKE_SCRIPT)
+            args = [value for _, rate, burst in specs for value in (rate, burst)] + [cost]
+            return float(self.script(keys=[self.prefix + key for key, _, _ in specs], args=args))
+        except Exception as e:
+            logger.warning(f"Rate limit store unavailable, using in-process buckets for {REDIS_RETRY_SECONDS}s: "
+                           f"{str(e)}")
+            self.down_until = time.monotonic() + REDIS_RETRY_SECONDS
+            return self.fallback.take(specs, cost)
+
+
+class CircuitBreakers:
+    # Per-upstream failure ratio over a fixed window, fed by every recorded upstream call
+    def __init__(self):
+        self.windows = {}  # upstream -> [window start, calls, failures]
+        self.open_until = {}  # upstream -> monotonic time it closes again
+        self.lock = threading.Lock()
+
+    def record(self, upstream, seconds, failed=False):
+        now = time.monotonic()
+        with self.lock:
+            window = self.windows.get(upstream)
+            if window is None or now - window[0] > BREAKER_WINDOW:
+                window = self.windows[upstream] = [now, 0, 0]
+            window[1] += 1
+            window[2] += 1 if failed else 0
+            tripped = window[1] >= BREAKER_MIN_CALLS and window[2] / window[1] >= BREAKER_FAILURE_RATIO
+            if tripped and now >= self.open_until.get(upstream, 0):
+                self.open_until[upstream] = now + BREAKER_OPEN_SECONDS
+                self.windows[upstream] = [now, 0, 0]  # Judged on fresh calls once it closes
+                logger.warning(f"Circuit breaker open for {upstream}: {window[2]}/{window[1]} calls failed")
+
+    def open_for(self, upstreams):
+        # Seconds until every listed breaker is closed, 0 when none is open
+        # A tuple of alternatives counts as open until the first of them closes
+        now = time.monotonic()
+        waits = [min(self.open_until.get(alternative, 0) for alternative in upstream) if isinstance(upstream, tuple)
+                 else self.open_until.get(upstream, 0) for upstream in upstreams]
+        return max([until - now for until in waits] + [0])
+
+
+class InFlight:
+    # Requests this process is handling right now
+    def __init__(self):
+        self.count = 0
+        self.lock = threading.Lock()
+
+    def enter(self):
+        with self.lock:
+            self.count += 1
+
+    def leave(self):
+        with self.lock:
+            self.count -= 1
+
+
+def make_buckets(redis_url=None):
+    # Redis when a URL is configured, otherwise per-process buckets
+    if redis_url:
+        return RedisBuckets(redis_url)
+    logger.info("Rate limits kept per process, set REDIS_URL to share them across workers")
+    return MemoryBuckets()
+
+
+class Admission:
+    # Decides whether an expensive request runs now, returns None or (reason, retry after seconds)
+    def __init__(self, buckets, breakers, in_flight, max_in_flight=MAX_IN_FLIGHT):
+        self.buckets = buckets
+        self.breakers = breakers
+        self.in_flight = in_flight
+        self.max_in_flight = max_in_flight
+
+    def check(self, group, user_key, tier, cost=1):
+        tier = tier if tier in TIERS else "free"
+        rejection = self._shed(group, tier)
+        if rejection is None:
+            specs = [(f"{group}:user:{user_key}",) + _per_second(USER_LIMITS[group][tier])]
+            if TIER_LIMITS[group][tier]:
+                specs.append((f"{group}:tier:{tier}",) + _per_second(TIER_LIMITS[group][tier]))
+            wait = self.buckets.take(specs, cost)
+            rejection = ("rate_limited", wait) if wait else None
+        if rejection:
+            registry.inc("admission_rejected_total", (("group", group), ("tier", tier), ("reason", rejection[0])))
+            return rejection[0], max(1, math.ceil(rejection[1]))
+        return None
+
+    def _shed(self, group, tier):
+        # Load shedding, checked first so a shed request doesnt use up tokens
+        if self.in_flight.count > self.max_in_flight * SHED_AT[tier]:
+            return "overloaded", 1
+        if tier != "pro":
+            wait = self.breakers.open_for(GROUP_UPSTREAMS.get(group, ()))
+            if wait > 0:
+                return "upstream_unavailable", wait
+        return None
+
+
+def _per_second(limit):
+    per_minute, burst = limit
+    return per_minute / 60, burst
+
+
+breakers = CircuitBreakers()
+upstream_listeners.append(breakers.record)
+in_flight = InFlight()
+
+
+REJECTION_MESSAGES = {
+    "rate_limited": "You're sending requests too quickly for your plan, try again shortly",
+    "overloaded": "We're very busy right now, try again in a moment",
+    "upstream_unavailable": "A service this feature needs is having trouble, try again shortly",
+}
+
+
+def rejection_body(reason, retry_after):
+    # JSON body of a 429, the Retry-After header carries the same number
+    return {"error": REJECTION_MESSAGES[reason], "reason": reason, "retry_after": retry_after}
@@ -0,0 +1,122 @@
+# live_feed.py
+# Live price and chain head broadcast for BlockSpeak
+# One background thread fetches prices and chain heads, works out what changed, and pushes that diff
+# to every connected browser over Server-Sent Events. New clients get one full snapshot, then only
+# diffs. However many dashboards are open, the server does one upstream fetch per tick.
+
+import json  # Events are JSON encoded
+import time  # For tick pacing and heartbeats
+import queue  # One bounded queue per connected client
+import logging  # Logs for debugging feed failures
+import threading  # Producer thread and subscriber bookkeeping
+
+logger = logging.getLogger(__name__)
+
+TICK_SECONDS = 15       # How often the producer looks for changes
+HEARTBEAT_SECONDS = 20  # Comment lines that keep proxies from closing idle streams
+CLIENT_QUEUE = 50       # Events buffered per client before we drop a slow one
+
+
+def diff_state(old, new):
+    # Returns only what changed between two {section: {key: {field: value}}} states
+    # A key that disappeared is sent as None
+    changes = {}
+    for section, items in new.items():
+        before = old.get(section, {})
+        section_changes = {}
+        for key, fields in items.items():
+            previous = before.get(key) or {}
+            changed = {f: v for f, v in fields.items() if previous.get(f) != v}
+            if changed:
+                section_changes[key] = changed
+        for key in before:
+            if key not in items:
+                section_changes[key] = None
+        if section_changes:
+            changes[section] = section_changes
+    return changes
+
+
+class LiveFeed:
+    # Fans one producer out to many SSE clients
+    # sources: {section: callable returning {key: {field: value}}}, e.g. {"prices": ..., "heads": ...}
+    def __init__(self, sources, tick_seconds=TICK_SECONDS):
+        self.sources = sources
+        self.tick_seconds = tick_seconds
+        self.state = {}
+        self.version = 0
+        self.subscribers = set()
+        self.lock = threading.Lock()
+        self.thread = None
+
+    def _ensure_running(self):
+        # Starts the producer on first subscriber, once per process
+        with self.lock:
+            if self.thread and self.thread.is_alive():
+                return
+            self.thread = threading.Thread(target=self._run, name="live-feed", daemon=True)
+            self.thread.start()
+
+    def _run(self):
+        # Producer loop: one fetch per source per tick, only while someone is listening
+        while True:
+            if self.subscribers:
+                self.tick()
+            time.sleep(self.tick_seconds)
+
+    def tick(self):
+        # Fetches every source once and publishes the diff
+        new_state = dict(self.state)
+        for section, fetch in self.sources.items():
+            try:
+                new_state[section] = fetch() or {}
+            except Exception as e:
+                logger.warning(f"Live feed source {section} failed: {str(e)}")
+        changes = diff_state(self.state, new_state)
+        if not changes:
+            return
+        with self.lock:
+            self.state = new_state
+            self.version += 1
+            event = self._format("diff", {"version": self.version, "changes": changes})
+            for subscriber in list(self.subscribers):
+                try:
+                    subscriber.put_nowait(event)
+                except queue.Full:
+                    # A client that cant keep up is dropped, it reconnects and gets a fresh snapshot
+                    self.subscribers.discard(subscriber)
+                    with subscriber.mutex:
+                        subscriber.queue.clear()
+                    subscriber.put_nowait(None)
+
+    @staticmethod
+    def _format(event, data):
+        # One SSE frame
+        return f"event: {event}\ndata: {json.dumps(data, separators=(',', ':'))}\n\n"
+
+    def stream(self):
+        # Generator for one client: snapshot first, then diffs, with heartbeats in between
+        self._ensure_running()
+        subscriber = queue.Queue(maxsize=CLIENT_QUEUE)
+        with self.lock:
+            first_client = not self.subscribers
+            self.subscribers.add(subscriber)
+        if first_client:
+            self.tick()  # Nobody was listening, so our state may be empty or old
+        try:
+            with self.lock:
+                snapshot = self._format("snapshot", {"version": self.version, "state": self.state})
+            yield "retry: 5000\n\n"  # Browsers reconnect after 5s if the stream drops
+            yield snapshot
+            while True:
+                try:
+                    event = subscriber.get(timeout=HEARTBEAT_SECONDS)
+                except queue.Empty:
+                    yield ": keep-alive\n\n"
+                    continue
+                if event is None:
+                    return
+                yield event
+        finally:
+            with self.lock:
+                self.subscribers.discard(subscriber)
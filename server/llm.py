@@ -0,0 +1,339 @@
+# llm.py
+# One gateway for every LLM call BlockSpeak makes
+# Callers name a route ("restate", "chat", "blog_post") instead of a model. ROUTES maps each route to
+# the cheapest model that answers it well, with its token, timeout and retry limits, and MODELS caps
+# every model's concurrent calls and tokens per minute. Identical prompts already in flight share one
+# call. Prompt and completion tokens and latency land in /metrics by model, route and caller.
+# Spend and tail latency are tuned here, or per deploy in LLM_CONFIG_FILE, for example:
+#   {"routes": {"chat": {"model": "gpt-4o-mini"}}, "models": {"gpt-4o": {"tokens_per_minute": 20000}}}
+# LLM_PROVIDER=mock answers locally without OpenAI, for tests and benchmarks.
+
+import os  # Settings
+import json  # Config file and dedup keys
+import time  # Latency and budget waits
+import asyncio  # Async callers from asgi.py
+import hashlib  # Dedup keys
+import logging  # Logs for debugging rejected calls
+import threading  # Guards the in-flight maps and model slots
+from concurrent.futures import Future  # Shared result for deduplicated sync calls
+from metrics import registry  # Tokens, latency and rejections
+from metrics import timed  # OpenAI calls count as upstream calls too
+from tracing import record_span  # LLM time shows up in request traces
+from lazy import lazy_module  # openai is only imported for the first real call
+
+logger = logging.getLogger(__name__)
+
+openai = lazy_module("openai")
+
+LLM_PROVIDER = os.getenv("LLM_PROVIDER", "openai")  # "openai" or "mock"
+LLM_CONFIG_FILE = os.getenv("LLM_CONFIG_FILE", "llm_config.json")
+MOCK_LATENCY = float(os.getenv("LLM_MOCK_LATENCY", "0.05"))  # Seconds the mock provider takes per answer
+
+# Model -> limits for this deployment, shared across workers when the token buckets are in Redis
+MODELS = {
+    "gpt-4o-mini": {"concurrency": 16, "tokens_per_minute": 200000},
+    "gpt-4o": {"concurrency": 8, "tokens_per_minute": 60000},
+}
+DEFAULT_MODEL_LIMITS = {"concurrency": 4, "tokens_per_minute": 20000}  # A model only named in the config file
+
+# Route -> model and request settings, callers can override max_tokens and sampling options per call
+# timeout is one OpenAI attempt, queue_timeout is how long a call may wait for a slot or token budget
+ROUTES = {
+    # Rewords numbers we already have
+    "restate": {"model": "gpt-4o-mini", "max_tokens": 150, "timeout": 10, "retries": 1, "queue_timeout": 2},
+    # Open crypto questions
+    "chat": {"model": "gpt-4o", "max_tokens": 100, "timeout": 15, "retries": 1, "queue_timeout": 5},
+    # Scheduled, can wait
+    "blog_post": {"model": "gpt-4o", "max_tokens": 1200, "timeout": 120, "retries": 2, "queue_timeout": 60},
+}
+
+
+class LLMBusy(Exception):
+    # No slot or token budget within the route's queue_timeout
+    pass
+
+
+def load_config(path=LLM_CONFIG_FILE):
+    # MODELS and ROUTES with the config file's entries merged over them
+    models = {name: dict(limits) for name, limits in MODELS.items()}
+    routes = {name: dict(settings) for name, settings in ROUTES.items()}
+    if os.path.exists(path):
+        try:
+            with open(path) as f:
+                overrides = json.load(f)
+        except (OSError, ValueError) as e:
+            logger.warning(f"Ignoring LLM config file: {str(e)}")
+            return models, routes
+        for name, limits in overrides.get("models", {}).items():
+            models.setdefault(name, dict(DEFAULT_MODEL_LIMITS)).update(limits)
+        for name, settings in overrides.get("routes", {}).items():
+            routes.setdefault(name, dict(ROUTES["chat"])).update(settings)
+        logger.info(f"LLM config loaded from {path}")
+    return models, routes
+
+
+def estimate_tokens(text):
+    # About 4 characters per token for English, good enough to reserve budget before the call
+    return len(text) // 4 + 1
+
+
+class OpenAIProvider:
+    # Real OpenAI calls, sync and async clients are built on first use
+    def __init__(self, api_key):
+        self.api_key = api_key
+        self.client = None
+        self.aclient = None
+        self.lock = threading.Lock()
+        self.ready = bool(api_key)
+
+    def complete(self, model, messages, timeout, retries, **options):
+        # (text, prompt tokens, completion tokens)
+        if self.client is None:
+            with self.lock:
+                if self.client is None:
+                    self.client = openai.OpenAI(api_key=self.api_key)
+        with timed("openai"):
+            response = self.client.with_options(max_retries=retries).chat.completions.create(
+                model=model, messages=messages, timeout=timeout, **options)
+        return response.choices[0].message.content, response.usage.prompt_tokens, response.usage.completion_tokens
+
+    async def acomplete(self, model, messages, timeout, retries, **options):
+        if self.aclient is None:
+            self.aclient = openai.AsyncOpenAI(api_key=self.api_key)  # Built inside the running event loop
+        with timed("openai"):
+            response = await self.aclient.with_options(max_retries=retries).chat.completions.create(
+                model=model, messages=messages, timeout=timeout, **options)
+        return response.choices[0].message.content, response.usage.prompt_tokens, response.usage.completion_tokens
+
+    async def aclose(self):
+        if self.aclient is not None:
+            await self.aclient.close()
+            self.aclient = None
+
+
+class MockProvider:
+    # Local stand-in for tests and benchmarks, echoes the prompt back after MOCK_LATENCY seconds
+    ready = True
+
+    def __init__(self, latency=MOCK_LATENCY):
+        self.latency = latency
+
+    def _answer(self, model, messages, max_tokens=None, **options):
+        prompt = messages[-1]["content"]
+        text = f"[{model}] " + " ".join(prompt.split()[:max_tokens or 50])
+        return text, estimate_tokens(prompt), estimate_tokens(text)
+
+    def complete(self, model, messages, timeout, retries, **options):
+        time.sleep(self.latency)
+        return self._answer(model, messages, **options)
+
+    async def acomplete(self, model, messages, timeout, retries, **options):
+        await asyncio.sleep(self.latency)
+        return self._answer(model, messages, **options)
+
+    async def aclose(self):
+        pass
+
+
+def make_provider(api_key=None, name=LLM_PROVIDER):
+    if name == "mock":
+        logger.info("LLM calls answered by the local mock provider")
+        return MockProvider()
+    return OpenAIProvider(api_key)
+
+
+class ModelSlots:
+    # Concurrent calls allowed for one model in this process, shared by sync and async callers
+    def __init__(self, limit):
+        self.limit = limit
+        self.used = 0
+        self.cond = threading.Condition()
+
+    def acquire(self, timeout):
+        deadline = time.monotonic() + timeout
+        with self.cond:
+            while self.used >= self.limit:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                self.cond.wait(remaining)
+            self.used += 1
+            return True
+
+    def try_acquire(self):
+        with self.cond:
+            if self.used >= self.limit:
+                return False
+            self.used += 1
+            return True
+
+    async def aacquire(self, timeout):
+        # Polls with backoff, a threading.Condition cant be awaited
+        deadline = time.monotonic() + timeout
+        delay = 0.005
+        while not self.try_acquire():
+            if time.monotonic() >= deadline:
+                return False
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, 0.1)
+        return True
+
+    def release(self):
+        with self.cond:
+            self.used -= 1
+            self.cond.notify()
+
+
+class LLMGateway:
+    # Routing, limits, dedup and accounting in front of a provider
+    def __init__(self, provider, buckets):
+        self.provider = provider
+        self.buckets = buckets  # Token buckets from limits.make_buckets, one per model for tokens per minute
+        self.models, self.routes = load_config()
+        self.slots = {}
+        self.lock = threading.Lock()
+        self.pending = {}  # Dedup key -> Future for sync callers
+        self.apending = {}  # Dedup key -> asyncio Future for async callers, only touched from the event loop
+
+    @property
+    def ready(self):
+        return self.provider.ready
+
+    def _prepare(self, route, prompt, options):
+        # (model, messages, request options, settings) for one call, and its dedup key
+        settings = dict(self.routes[route])
+        settings.update(options)
+        model = settings.pop("model")
+        timing = {name: settings.pop(name) for name in ("timeout", "retries", "queue_timeout")}
+        messages = [{"role": "user", "content": prompt}]
+        key = hashlib.sha256(json.dumps([model, messages, settings], sort_keys=True).encode()).hexdigest()
+        return model, messages, settings, timing, key
+
+    def _model_slots(self, model):
+        with self.lock:
+            if model not in self.slots:
+                self.slots[model] = ModelSlots(self.models.get(model, DEFAULT_MODEL_LIMITS)["concurrency"])
+            return self.slots[model]
+
+    def _take_budget(self, model, tokens):
+        # Seconds to wait before tokens fit this models per-minute budget, 0 once they are taken
+        tpm = self.models.get(model, DEFAULT_MODEL_LIMITS)["tokens_per_minute"]
+        return self.buckets.take([(f"llm:{model}", tpm / 60, tpm)], tokens)
+
+    def _reject(self, model, route, reason):
+        registry.inc("llm_rejected_total", (("model", model), ("route", route), ("reason", reason)))
+        logger.warning(f"LLM call for {route} on {model} rejected: {reason}")
+        return LLMBusy(f"{model} {reason}")
+
+    def _record(self, model, route, caller, started, reserved, prompt_tokens, completion_tokens):
+        # Token and latency accounting, returns the part of the reserved budget the call didnt use
+        duration = time.perf_counter() - started
+        labels = (("model", model), ("route", route), ("caller", caller))
+        registry.inc("llm_tokens_total", labels + (("kind", "prompt"),), prompt_tokens)
+        registry.inc("llm_tokens_total", labels + (("kind", "completion"),), completion_tokens)
+        registry.observe("llm_request_duration_seconds", duration, labels)
+        record_span(f"llm:{route}", started, duration)
+        return max(0, reserved - prompt_tokens - completion_tokens)
+
+    def complete(self, route, prompt, caller="app", **options):
+        # Text of one completion, blocking, raises LLMBusy or the providers error
+        model, messages, settings, timing, key = self._prepare(route, prompt, options)
+        with self.lock:
+            future = self.pending.get(key)
+            owner = future is None
+            if owner:
+                future = self.pending[key] = Future()
+        if not owner:
+            registry.inc("llm_deduplicated_total", (("model", model), ("route", route)))
+            return future.result(timeout=timing["queue_timeout"] + timing["timeout"] * (timing["retries"] + 1))
+        try:
+            text = self._call(model, messages, settings, timing, route, caller)
+            future.set_result(text)
+            return text
+        except Exception as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self.lock:
+                self.pending.pop(key, None)
+
+    def _call(self, model, messages, settings, timing, route, caller):
+        started = time.perf_counter()
+        deadline = time.monotonic() + timing["queue_timeout"]
+        reserved = estimate_tokens(messages[-1]["content"]) + settings.get("max_tokens", 0)
+        while True:
+            wait = self._take_budget(model, reserved)
+            if not wait:
+                break
+            if time.monotonic() + wait > deadline:
+                raise self._reject(model, route, "tokens_per_minute")
+            time.sleep(wait)
+        slots = self._model_slots(model)
+        if not slots.acquire(max(0, deadline - time.monotonic())):
+            self._take_budget(model, -reserved)  # Negative cost gives the reservation back
+            raise self._reject(model, route, "concurrency")
+        try:
+            text, prompt_tokens, completion_tokens = self.provider.complete(model, messages, timing["timeout"],
+                                                                            timing["retries"], **settings)
+        except Exception:
+            self._take_budget(model, -reserved)
+            raise
+        finally:
+            slots.release()
+        unused = self._record(model, route, caller, started, reserved, prompt_tokens, completion_tokens)
+        if unused:
+            self._take_budget(model, -unused)
+        return text
+
+    async def acomplete(self, route, prompt, caller="app", **options):
+        # Async twin of complete for asgi.py
+        model, messages, settings, timing, key = self._prepare(route, prompt, options)
+        future = self.apending.get(key)
+        if future is not None:
+            registry.inc("llm_deduplicated_total", (("model", model), ("route", route)))
+            # Same bound as the sync path, shielded so a waiter leaving doesnt cancel the call for the others
+            wait = timing["queue_timeout"] + timing["timeout"] * (timing["retries"] + 1)
+            return await asyncio.wait_for(asyncio.shield(future), wait)
+        future = self.apending[key] = asyncio.get_running_loop().create_future()
+        try:
+            text = await self._acall(model, messages, settings, timing, route, caller)
+            future.set_result(text)
+            return text
+        except BaseException as e:
+            # A cancelled owner (client gone, ASGI timeout) still answers its waiters, with an error they can handle
+            future.set_exception(e if isinstance(e, Exception) else LLMBusy(f"{model} cancelled"))
+            future.exception()  # Marks it retrieved, nobody else may be waiting
+            raise
+        finally:
+            self.apending.pop(key, None)
+
+    async def _acall(self, model, messages, settings, timing, route, caller):
+        started = time.perf_counter()
+        deadline = time.monotonic() + timing["queue_timeout"]
+        reserved = estimate_tokens(messages[-1]["content"]) + settings.get("max_tokens", 0)
+        while True:
+            wait = await asyncio.to_thread(self._take_budget, model, reserved)  # May be a Redis round trip
+            if not wait:
+                break
+            if time.monotonic() + wait > deadline:
+                raise self._reject(model, route, "tokens_per_minute")
+            await asyncio.sleep(wait)
+        slots = self._model_slots(model)
+        if not await slots.aacquire(max(0, deadline - time.monotonic())):
+            await asyncio.to_thread(self._take_budget, model, -reserved)
+            raise self._reject(model, route, "concurrency")
+        try:
+            text, prompt_tokens, completion_tokens = await self.provider.acomplete(model, messages, timing["timeout"],
+                                                                                   timing["retries"], **settings)
+        except Exception:
+            await asyncio.to_thread(self._take_budget, model, -reserved)
+            raise
+        finally:
+            slots.release()
+        unused = self._record(model, route, caller, started, reserved, prompt_tokens, completion_tokens)
+        if unused:
+            await asyncio.to_thread(self._take_budget, model, -unused)
+        return text
+
+    async def aclose(self):
+        await self.provider.aclose()
@@ -0,0 +1,38 @@
+# market_data.py
+# Cached spot prices for BlockSpeak
+# One CoinCap /assets?ids=... call prices a whole list of coins, and the answers are kept for a
+# minute so portfolio valuations and other features dont each go back to CoinCap.
+
+import os  # Upstream URL overrides for local stubs
+import logging  # Logs for debugging CoinCap failures
+import requests  # RequestException from CoinCap
+from metrics import upstream_session  # Pooled, timed HTTP for CoinCap
+from cache import TTLCache  # Shared price cache
+
+logger = logging.getLogger(__name__)
+
+COINCAP_API_URL = os.getenv("COINCAP_API_URL", "https://api.coincap.io/v2")  # Point at a stub for benchmarks
+COINCAP_ASSETS_URL = f"{COINCAP_API_URL}/assets"
+PRICE_TTL = 60  # Seconds a spot price stays fresh
+
+price_cache = TTLCache(ttl=PRICE_TTL)
+
+
+def get_usd_prices(coin_ids, session=None):
+    # Returns {coin_id: price_usd} for every id CoinCap knows, fetching only the ones not cached
+    coin_ids = list(dict.fromkeys(coin_ids))
+    prices = price_cache.get_many(coin_ids)
+    missing = [coin_id for coin_id in coin_ids if coin_id not in prices]
+    if not missing:
+        return prices
+    http = session or upstream_session
+    try:
+        response = http.get(COINCAP_ASSETS_URL, params={"ids": ",".join(missing)}, timeout=10)
+        response.raise_for_status()
+        for asset in response.json().get("data", []):
+            if asset.get("priceUsd") is not None:
+                prices[asset["id"]] = float(asset["priceUsd"])
+                price_cache.set(asset["id"], prices[asset["id"]])
+    except (requests.RequestException, ValueError) as e:
+        logger.error(f"CoinCap price lookup failed for {missing}: {str(e)}")
+    return prices
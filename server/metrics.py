@@ -0,0 +1,276 @@
+# metrics.py
+# In-process metrics for BlockSpeak with a Prometheus text endpoint
+# Counters and histograms live in plain dictionaries behind one lock, so recording a value costs a
+# dictionary lookup and a bisect. Every process writes its totals to a small JSON snapshot file in
+# METRICS_DIR, and /metrics adds up the files, so the numbers are right however many gunicorn
+# workers are running. Also holds the shared HTTP session that times every upstream call.
+
+import os  # Snapshot directory and worker pid
+import json  # Snapshot files
+import time  # Timings and snapshot ages
+import bisect  # Finds the histogram bucket
+import logging  # Logs for debugging snapshot writes
+import tempfile  # Default snapshot directory
+import threading  # Guards the registry and runs the snapshot writer
+from contextlib import contextmanager  # timed() helper
+from urllib.parse import urlparse  # Upstream name from a URL
+import requests  # Base class for the instrumented session
+from tracing import record_span  # Upstream calls show up in request traces too
+
+logger = logging.getLogger(__name__)
+
+METRICS_DIR = os.getenv("METRICS_DIR", os.path.join(tempfile.gettempdir(), "blockspeak-metrics"))
+SNAPSHOT_SECONDS = 5        # How often each worker flushes its totals to disk
+STALE_SNAPSHOT = 3600       # Files from workers that stopped writing an hour ago are dropped
+HTTP_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+SQL_BUCKETS = (0.0001, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.05, 0.1, 0.5, 1)
+JOB_BUCKETS = (0.1, 0.5, 1, 5, 10, 30, 60, 120, 300, 600)
+
+# Host fragment -> upstream label, first match wins
+UPSTREAMS = [
+    ("coincap", "coincap"),
+    ("alchemy", "alchemy"),
+    ("infura", "infura"),
+    ("openai", "openai"),
+    ("stripe", "stripe"),
+    ("blockcypher", "blockcypher"),
+    ("blockchain.info", "blockchain_info"),
+    ("unsplash", "unsplash"),
+    ("coinjournal", "rss"),
+    ("cointelegraph", "rss"),
+    ("127.0.0.1:8545", "hardhat"),
+]
+
+
+class Registry:
+    # All metrics of one process: {name: {"type", "help", "buckets", "values": {label tuple: value}}}
+    def __init__(self):
+        self.metrics = {}
+        self.lock = threading.Lock()
+        self.collectors = []  # Callables returning {(name, labels): value} for counters kept elsewhere
+
+    def counter(self, name, help_text):
+        self.metrics.setdefault(name, {"type": "counter", "help": help_text, "values": {}})
+
+    def histogram(self, name, help_text, buckets=HTTP_BUCKETS):
+        self.metrics.setdefault(name, {"type": "histogram", "help": help_text, "buckets": buckets, "values": {}})
+
+    def inc(self, name, labels=(), amount=1):
+        # labels is a tuple of (key, value) pairs, kept in a fixed order by the caller
+        values = self.metrics[name]["values"]
+        with self.lock:
+            values[labels] = values.get(labels, 0) + amount
+
+    def observe(self, name, value, labels=()):
+        metric = self.metrics[name]
+        buckets = metric["buckets"]
+        with self.lock:
+            entry = metric["values"].get(labels)
+            if entry is None:
+                entry = metric["values"][labels] = [0] * (len(buckets) + 3)  # buckets, +Inf, sum, count
+            entry[bisect.bisect_left(buckets, value)] += 1
+            entry[-2] += value
+            entry[-1] += 1
+
+    def add_collector(self, collector):
+        # Registers a callable whose counters are read at snapshot time, like cache hit counts
+        self.collectors.append(collector)
+
+    def snapshot(self):
+        # JSON-safe copy of every metric in this process
+        with self.lock:
+            data = {name: {"type": m["type"], "help": m["help"], "buckets": m.get("buckets"),
+                           "values": [[list(labels), value if m["type"] == "counter" else list(value)]
+                                      for labels, value in m["values"].items()]}
+                    for name, m in self.metrics.items()}
+        for collector in self.collectors:
+            try:
+                for (name, labels), value in collector().items():
+                    data[name]["values"].append([list(labels), value])  # Collected names are registered counters
+            except Exception as e:
+                logger.warning(f"Metrics collector failed: {str(e)}")
+        return data
+
+
+registry = Registry()
+registry.histogram("http_request_duration_seconds", "Time spent handling a request, by route, method and status")
+registry.histogram("upstream_request_duration_seconds", "Time spent waiting on an upstream service")
+registry.counter("upstream_errors_total", "Upstream calls that failed or returned an error status")
+registry.histogram("sqlite_query_duration_seconds", "SQLite statement time, by statement type and table",
+                   buckets=SQL_BUCKETS)
+registry.counter("cache_hits_total", "In-process cache lookups that found a fresh entry")
+registry.counter("cache_misses_total", "In-process cache lookups that went upstream")
+registry.histogram("crypto_job_duration_seconds",
+                   "Password hashing and signature recovery time, including the wait for a worker")
+registry.counter("crypto_rejected_total", "Login crypto jobs turned away because the queue was full")
+registry.counter("admission_rejected_total", "Expensive requests answered 429, by cost group, tier and reason")
+registry.counter("llm_tokens_total", "LLM prompt and completion tokens, by model, route and caller")
+registry.histogram("llm_request_duration_seconds", "LLM call time including the wait for a slot or token budget")
+registry.counter("llm_rejected_total", "LLM calls turned away for concurrency or tokens per minute")
+registry.counter("llm_deduplicated_total", "LLM calls that shared an identical prompt already in flight")
+registry.counter("eth_payments_total", "ETH payment ledger transitions, by the state a payment moved to")
+registry.counter("rpc_provider_requests_total", "Ethereum JSON-RPC attempts per pool provider, by outcome")
+registry.counter("rpc_hedged_total",
+                 "Reads also sent to the next provider because the best one was slower than its p95")
+registry.counter("rpc_failover_total", "Reads retried on the next provider after one failed")
+registry.counter("stripe_webhook_events_total",
+                 "Stripe webhook events, by type and result (applied, duplicate, stale...)")
+registry.counter("jobs_total",
+                 "Background jobs that finished a run, by kind and outcome (done, queued for retry, dead, lost)")
+registry.histogram("job_duration_seconds", "Background job run time, by kind", buckets=JOB_BUCKETS)
+
+_writer = {"pid": None}  # The pid the snapshot writer thread belongs to, restarts after a gunicorn fork
+
+
+def _snapshot_path(pid):
+    return os.path.join(METRICS_DIR, f"worker-{pid}.json")
+
+
+def write_snapshot():
+    # Saves this processes totals atomically so the scrape never reads half a file
+    os.makedirs(METRICS_DIR, exist_ok=True)
+    path = _snapshot_path(os.getpid())
+    tmp = f"{path}.tmp"
+    with open(tmp, "w") as f:
+        json.dump(registry.snapshot(), f)
+    os.replace(tmp, path)
+
+
+def _writer_loop():
+    while True:
+        time.sleep(SNAPSHOT_SECONDS)
+        try:
+            write_snapshot()
+        except OSError as e:
+            logger.warning(f"Metrics snapshot failed: {str(e)}")
+
+
+def ensure_writer():
+    # Starts the snapshot thread once per process, called from the request hooks
+    pid = os.getpid()
+    if _writer["pid"] == pid:
+        return
+    _writer["pid"] = pid
+    threading.Thread(target=_writer_loop, name="metrics-writer", daemon=True).start()
+
+
+def _merge(total, snapshot):
+    # Adds one workers snapshot into the running total
+    for name, metric in snapshot.items():
+        merged = total.setdefault(name, {"type": metric["type"], "help": metric["help"],
+                                         "buckets": metric["buckets"], "values": {}})
+        for labels, value in metric["values"]:
+            key = tuple(tuple(pair) for pair in labels)
+            if metric["type"] == "counter":
+                merged["values"][key] = merged["values"].get(key, 0) + value
+            else:
+                current = merged["values"].get(key)
+                merged["values"][key] = value if current is None else [a + b for a, b in zip(current, value)]
+
+
+def _format_labels(labels, extra=()):
+    pairs = list(labels) + list(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{k}="{str(v)}"' for k, v in pairs) + "}"
+
+
+def render():
+    # Prometheus text format for every worker that wrote a snapshot recently
+    write_snapshot()  # Our own numbers are always current
+    total = {}
+    now = time.time()
+    for filename in os.listdir(METRICS_DIR):
+        if not filename.endswith(".json"):
+            continue
+        path = os.path.join(METRICS_DIR, filename)
+        try:
+            if now - os.path.getmtime(path) > STALE_SNAPSHOT:
+                os.remove(path)  # That worker is gone
+                continue
+            with open(path) as f:
+                _merge(total, json.load(f))
+        except (OSError, ValueError):
+            continue  # Being replaced right now, the next scrape gets it
+    lines = []
+    for name in sorted(total):
+        metric = total[name]
+        lines.append(f"# HELP {name} {metric['help']}")
+        lines.append(f"# TYPE {name} {metric['type']}")
+        for labels, value in sorted(metric["values"].items()):
+            if metric["type"] == "counter":
+                lines.append(f"{name}{_format_labels(labels)} {value}")
+                continue
+            cumulative = 0
+            for bound, count in zip(list(metric["buckets"]) + ["+Inf"], value[:-2]):
+                cumulative += count
+                lines.append(f"{name}_bucket{_format_labels(labels, [('le', bound)])} {cumulative}")
+            lines.append(f"{name}_sum{_format_labels(labels)} {value[-2]}")
+            lines.append(f"{name}_count{_format_labels(labels)} {value[-1]}")
+    return "\n".join(lines) + "\n"
+
+
+def upstream_name(url):
+    # Short label for an upstream URL, like "coincap" or "alchemy"
+    host = urlparse(url).netloc
+    for fragment, name in UPSTREAMS:
+        if fragment in host:
+            return name
+    return host or "unknown"
+
+
+upstream_listeners = []  # Callables(upstream, seconds, failed) told about every call, like circuit breakers
+
+
+def record_upstream(upstream, seconds, failed=False, started=None):
+    if started is not None:
+        record_span(f"upstream:{upstream}", started, seconds)
+    labels = (("upstream", upstream),)
+    registry.observe("upstream_request_duration_seconds", seconds, labels)
+    if failed:
+        registry.inc("upstream_errors_total", labels)
+    for listener in upstream_listeners:
+        listener(upstream, seconds, failed)
+
+
+@contextmanager
+def timed(upstream):
+    # Times a block that talks to an upstream through its own SDK, like OpenAI or Stripe
+    started = time.perf_counter()
+    failed = False
+    try:
+        yield
+    except Exception:
+        failed = True
+        raise
+    finally:
+        record_upstream(upstream, time.perf_counter() - started, failed, started)
+
+
+class InstrumentedSession(requests.Session):
+    # requests.Session that records latency and errors for every call, labelled by upstream
+    def send(self, request, **kwargs):
+        upstream = upstream_name(request.url)
+        started = time.perf_counter()
+        try:
+            response = super().send(request, **kwargs)
+        except requests.RequestException:
+            record_upstream(upstream, time.perf_counter() - started, True, started)
+            raise
+        record_upstream(upstream, time.perf_counter() - started, response.status_code >= 400, started)
+        return response
+
+
+# Shared pooled session for modules that dont get one passed in
+upstream_session = InstrumentedSession()
+
+
+def cache_collector(caches):
+    # Collector for TTLCache hit and miss counters, caches is {label: TTLCache}
+    def collect():
+        values = {}
+        for label, cache in caches.items():
+            values[("cache_hits_total", (("cache", label),))] = cache.hits
+            values[("cache_misses_total", (("cache", label),))] = cache.misses
+        return values
+    return collect
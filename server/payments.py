@@ -0,0 +1,254 @@
+# payments.py
+# ETH subscription payments for BlockSpeak
+# Every tx_hash a user submits gets one row in eth_payments, the ledger of what we have seen and
+# credited: pending (waiting to be mined and confirmed), confirmed (mined and succeeded, plan not
+# granted yet), credited (plan granted) or failed (reverted, dropped, wrong recipient or too little).
+# Submitting a hash again answers from its row at once, and a hash can only ever be credited once,
+# to the user who sent it. Requests never wait for a receipt: a background confirmer in each worker
+# looks up the receipts of every pending payment in one JSON-RPC batch per new block, and the workers
+# claim a block's batch through SQLite so only one of them makes the calls.
+
+import os  # Settings and the worker pid
+import re  # tx hash format
+import time  # Timestamps and the poll loop
+import logging  # Logs for debugging payment problems
+import threading  # The confirmer thread
+from db import connect as db_connect  # Timed SQLite connections
+from metrics import InstrumentedSession  # Timed HTTP for JSON-RPC
+from metrics import registry  # Payments by state
+from rpc import rpc_call  # Transaction lookup at submit time
+from rpc import rpc_batch  # Receipts for every pending payment at once
+from entitlements import grant_with_cursor  # Plan grant in the same transaction as the credit
+from entitlements import entitlement_cache  # Reloads once a credit is committed
+
+logger = logging.getLogger(__name__)
+
+CONFIRMATIONS = int(os.getenv("ETH_PAYMENT_CONFIRMATIONS", "3"))  # Blocks on top of a payment before it counts
+POLL_SECONDS = 4  # How often the confirmer looks for a new block, a third of Ethereum's block time
+DROPPED_AFTER = 3600  # Seconds a payment can stay unmined before we check whether the node still has it
+
+TX_HASH_RE = re.compile(r"^0x[0-9a-fA-F]{64}$")
+PENDING, CONFIRMED, CREDITED, FAILED = "pending", "confirmed", "credited", "failed"
+
+
+class PaymentRejected(Exception):
+    # A submission that doesnt get a ledger row, like someone elses transaction
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.status = status
+
+
+def init_payment_tables(db_path="users.db"):
+    # Creates the payment ledger, one row per transaction hash
+    conn = db_connect(db_path)
+    c = conn.cursor()
+    c.execute('''CREATE TABLE IF NOT EXISTS eth_payments (
+        tx_hash TEXT PRIMARY KEY,
+        user_id INTEGER NOT NULL,
+        plan TEXT NOT NULL,
+        sender TEXT NOT NULL,
+        amount_wei TEXT NOT NULL,
+        state TEXT NOT NULL,
+        error TEXT,
+        block_number INTEGER,
+        checked_block INTEGER DEFAULT 0,
+        submitted_at REAL NOT NULL,
+        updated_at REAL NOT NULL)''')
+    c.execute("CREATE INDEX IF NOT EXISTS idx_eth_payments_state ON eth_payments (state)")
+    conn.commit()
+    conn.close()
+
+
+def get_payment(tx_hash, db_path="users.db"):
+    # The ledger row for a hash as a dict, or None
+    conn = db_connect(db_path)
+    conn.row_factory = _row_dict
+    row = conn.execute("SELECT * FROM eth_payments WHERE tx_hash = ?", (tx_hash.lower(),)).fetchone()
+    conn.close()
+    return row
+
+
+def submit_payment(rpc_url, user_id, sender, plan, tx_hash, expected_wei, pay_to, db_path="users.db"):
+    # Ledger row for a submitted payment, the stored one for a hash we already know
+    # Checks the transaction once with eth_getTransactionByHash, the confirmer does the rest
+    if not TX_HASH_RE.match(tx_hash or ""):
+        raise PaymentRejected("Invalid transaction hash")
+    tx_hash = tx_hash.lower()
+    payment = get_payment(tx_hash, db_path)
+    if payment is None:
+        tx = rpc_call(rpc_url, "eth_getTransactionByHash", [tx_hash])
+        if tx is None:
+            raise PaymentRejected("Transaction not found yet, try again once it has been broadcast", 404)
+        if (tx.get("from") or "").lower() != sender.lower():
+            # Not stored, so the real sender can still submit it
+            raise PaymentRejected("Sender mismatch")
+        amount = int(tx.get("value") or "0x0", 16)
+        error = None
+        if (tx.get("to") or "").lower() != pay_to.lower():
+            error = "Wrong recipient address"
+        elif amount < expected_wei:
+            error = f"Insufficient payment, sent {amount / 10**18} ETH, need {expected_wei / 10**18} ETH"
+        now = time.time()
+        conn = db_connect(db_path, timeout=30)
+        conn.execute('''INSERT OR IGNORE INTO eth_payments (tx_hash, user_id, plan, sender, amount_wei, state, error,
+                submitted_at, updated_at)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)''',
+                     (tx_hash, user_id, plan, sender.lower(), str(amount), FAILED if error else PENDING, error,
+                      now, now))
+        conn.commit()
+        conn.close()
+        registry.inc("eth_payments_total", (("state", FAILED if error else PENDING),))
+        payment = get_payment(tx_hash, db_path)  # A concurrent submit of the same hash may have won, both see its row
+    if payment["user_id"] != user_id:
+        raise PaymentRejected("Transaction already used", 409)
+    if payment["plan"] != plan and payment["state"] != FAILED:
+        raise PaymentRejected(f"Transaction already submitted for the {payment['plan']} plan", 409)
+    return payment
+
+
+class PaymentConfirmer:
+    # Background loop that moves pending payments to confirmed or failed, and confirmed ones to credited
+    # rpc_url and head_block are callables so the node URL and block source resolve on first use
+    def __init__(self, rpc_url, head_block=None, confirmations=CONFIRMATIONS, db_path="users.db",
+                 poll_seconds=POLL_SECONDS):
+        self.rpc_url = rpc_url
+        self.head_block = head_block  # Latest block from the chain head tracker, None falls back to eth_blockNumber
+        self.confirmations = confirmations
+        self.db_path = db_path
+        self.poll_seconds = poll_seconds
+        self.session = InstrumentedSession()
+        self.last_block = None
+        self.pid = None
+        self.lock = threading.Lock()
+
+    def ensure_started(self):
+        # Starts the loop once per worker process, called from the request hooks
+        if self.pid == os.getpid():
+            return
+        with self.lock:
+            if self.pid != os.getpid():
+                self.pid = os.getpid()
+                self.last_block = None
+                threading.Thread(target=self._loop, name="payment-confirmer", daemon=True).start()
+
+    def _loop(self):
+        failures = 0
+        while True:
+            try:
+                self.run_once()
+                failures = 0
+            except Exception as e:
+                failures += 1
+                logger.warning(f"Payment confirmer pass failed ({failures} in a row): {str(e)}")
+            time.sleep(self.poll_seconds * min(2 ** failures, 16))
+
+    def run_once(self):
+        # One pass: credit anything confirmed, then check pending payments if there is a new block
+        self.credit()
+        if not self._has_pending():
+            return 0
+        block = self.head_block() if self.head_block else None
+        if block is None:
+            block = int(rpc_call(self.rpc_url(), "eth_blockNumber", [], session=self.session), 16)
+        if block == self.last_block:
+            return 0
+        self.last_block = block
+        checked = self.check(block)
+        self.credit()
+        return checked
+
+    def _has_pending(self):
+        conn = db_connect(self.db_path)
+        row = conn.execute("SELECT 1 FROM eth_payments WHERE state = ? LIMIT 1", (PENDING,)).fetchone()
+        conn.close()
+        return row is not None
+
+    def check(self, block):
+        # Claims this block's pending payments for this worker and looks up all their receipts in one batch
+        conn = db_connect(self.db_path, timeout=30)
+        try:
+            c = conn.cursor()
+            c.execute("BEGIN IMMEDIATE")
+            c.execute("SELECT tx_hash, submitted_at FROM eth_payments WHERE state = ? AND checked_block < ?",
+                      (PENDING, block))
+            claimed = c.fetchall()
+            c.executemany("UPDATE eth_payments SET checked_block = ? WHERE tx_hash = ?",
+                          [(block, tx_hash) for tx_hash, _ in claimed])
+            conn.commit()
+        finally:
+            conn.close()
+        if not claimed:
+            return 0  # Another worker has this block
+        now = time.time()
+        old = [tx_hash for tx_hash, submitted_at in claimed if now - submitted_at > DROPPED_AFTER]
+        calls = [("eth_getTransactionReceipt", [tx_hash]) for tx_hash, _ in claimed]
+        # Long-unmined ones, is the node still holding them
+        calls += [("eth_getTransactionByHash", [tx_hash]) for tx_hash in old]
+        results = rpc_batch(self.rpc_url(), calls, session=self.session)
+        receipts = dict(zip([tx_hash for tx_hash, _ in claimed], results))
+        still_known = dict(zip(old, results[len(claimed):]))
+        updates = []
+        for tx_hash, _ in claimed:
+            receipt = receipts[tx_hash]
+            if receipt is None:
+                if tx_hash in still_known and still_known[tx_hash] is None:
+                    updates.append((FAILED, "Transaction was dropped without being mined", None, tx_hash))
+                continue
+            mined_in = int(receipt["blockNumber"], 16)
+            if int(receipt.get("status") or "0x0", 16) != 1:
+                updates.append((FAILED, "Transaction failed on blockchain", mined_in, tx_hash))
+            elif block - mined_in + 1 >= self.confirmations:
+                updates.append((CONFIRMED, None, mined_in, tx_hash))
+        if updates:
+            conn = db_connect(self.db_path, timeout=30)
+            conn.executemany("UPDATE eth_payments SET state = ?, error = ?, block_number = ?, updated_at = ? "
+                             "WHERE tx_hash = ? AND state = 'pending'",
+                             [(state, error, mined_in, now, tx_hash) for state, error, mined_in, tx_hash in updates])
+            conn.commit()
+            conn.close()
+            for state, error, _, tx_hash in updates:
+                registry.inc("eth_payments_total", (("state", state),))
+                logger.info(f"ETH payment {tx_hash} {state}{': ' + error if error else ''}")
+        return len(claimed)
+
+    def credit(self):
+        # Grants the plan for every confirmed payment, each in the transaction that marks it credited
+        conn = db_connect(self.db_path, timeout=30)
+        try:
+            rows = conn.execute("SELECT tx_hash, user_id, plan FROM eth_payments WHERE state = ?",
+                                (CONFIRMED,)).fetchall()
+            credited = 0
+            for tx_hash, user_id, plan in rows:
+                c = conn.cursor()
+                c.execute("BEGIN IMMEDIATE")
+                c.execute("UPDATE eth_payments SET state = ?, updated_at = ? WHERE tx_hash = ? AND state = ?",
+                          (CREDITED, time.time(), tx_hash, CONFIRMED))
+                if c.rowcount == 1:  # Another worker didnt get there first
+                    grant_with_cursor(c, user_id, plan, "eth")
+                    credited += 1
+                    registry.inc("eth_payments_total", (("state", CREDITED),))
+                    logger.info(f"ETH payment {tx_hash} credited, user {user_id} is now on {plan}")
+                conn.commit()
+            if credited:
+                entitlement_cache.invalidate()
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            conn.close()
+        return credited
+
+
+def payment_result(payment):
+    # (JSON body, status) for a ledger row, what subscribe_eth answers for a new or repeated submission
+    state = payment["state"]
+    body = {"tx_hash": payment["tx_hash"], "plan": payment["plan"], "state": state}
+    if state == CREDITED:
+        return dict(body, success=True, message="Subscription updated"), 200
+    if state == FAILED:
+        return dict(body, success=False, error=payment["error"]), 400
+    return dict(body, success=False, pending=True, message="Waiting for the transaction to be confirmed"), 202
+
+
+def _row_dict(cursor, row):
+    return {col[0]: value for col, value in zip(cursor.description, row)}
@@ -0,0 +1,71 @@
+# portfolio.py
+# ERC-20 token portfolio scanning for BlockSpeak
+# Reads balanceOf for every token in our local registry with one JSON-RPC batch, decodes the
+# answers together and ranks holdings by USD value using cached prices from market_data.
+
+import json  # Token registry lives in a JSON file
+import logging  # Logs for debugging registry and RPC problems
+from rpc import rpc_batch  # All balanceOf calls in one round trip
+from market_data import get_usd_prices  # Cached CoinCap prices
+
+logger = logging.getLogger(__name__)
+
+REGISTRY_PATH = "token_registry.json"
+BALANCE_OF = "0x70a08231"  # balanceOf(address) selector
+PORTFOLIO_BATCH = 500  # Calls per batch, so a few hundred tokens is still one round trip
+
+_registry = None
+
+
+def load_token_registry(path=REGISTRY_PATH):
+    # Loads the token list once, each entry has symbol, address, decimals and coincap_id
+    global _registry
+    if _registry is None:
+        try:
+            with open(path, "r") as f:
+                _registry = json.load(f)["tokens"]
+        except (OSError, ValueError, KeyError) as e:
+            logger.error(f"Token registry unreadable at {path}: {str(e)}")
+            _registry = []
+    return _registry
+
+
+def _decode_uint(result):
+    # eth_call answers are 0x-prefixed hex, empty ("0x") when the address has no contract code
+    if not result or result == "0x":
+        return 0
+    return int(result[:66], 16)  # First 32-byte word is the balance
+
+
+def get_token_portfolio(rpc_url, address, eth_balance=0.0, tokens=None, session=None):
+    # Returns holdings sorted by USD value, ETH included, tokens with zero balance left out
+    tokens = tokens if tokens is not None else load_token_registry()
+    padded = address.lower().replace("0x", "").rjust(64, "0")
+    calls = [("eth_call", [{"to": token["address"], "data": BALANCE_OF + padded}, "latest"]) for token in tokens]
+    raw = rpc_batch(rpc_url, calls, session=session, batch_size=PORTFOLIO_BATCH) if calls else []
+    held = []
+    for token, result in zip(tokens, raw):
+        amount = _decode_uint(result)
+        if amount:
+            held.append((token, amount / 10 ** token["decimals"]))
+    coincap_ids = [token["coincap_id"] for token, _ in held if token.get("coincap_id")]
+    prices = get_usd_prices(["ethereum"] + coincap_ids, session=session)
+    holdings = []
+    if eth_balance:
+        holdings.append({"symbol": "ETH", "balance": eth_balance, "usd_value": eth_balance * prices.get("ethereum", 0)})
+    for token, balance in held:
+        price = prices.get(token.get("coincap_id"))
+        usd_value = balance * price if price is not None else None
+        holdings.append({"symbol": token["symbol"], "balance": balance, "usd_value": usd_value})
+    # Priced holdings first by value, unpriced ones after
+    holdings.sort(key=lambda h: (h["usd_value"] is None, -(h["usd_value"] or 0)))
+    return holdings
+
+
+def format_top_tokens(holdings, limit=3):
+    # Turns holdings into the short top_tokens string the dashboard shows
+    tokens = [h for h in holdings if h["symbol"] != "ETH"]
+    if not tokens:
+        return "ETH only"
+    parts = [f"{h['symbol']} ({h['balance']:.2f})" for h in tokens[:limit]]
+    return "ETH, " + ", ".join(parts)
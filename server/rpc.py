@@ -0,0 +1,48 @@
+# rpc.py
+# JSON-RPC helpers for BlockSpeak
+# One place to make single and batched JSON-RPC calls to Ethereum and Solana nodes, so a
+# lookup for hundreds of addresses is a handful of HTTP round trips instead of hundreds.
+# Anywhere a node URL goes, an RpcPool (rpc_pool.py) works too and picks the provider per call.
+
+from metrics import upstream_session  # Pooled, timed HTTP transport for JSON-RPC
+
+BATCH_SIZE = 100  # Calls per HTTP request, well under Alchemy and Hardhat limits
+
+
+class RpcError(Exception):
+    # Raised when a node answers with a JSON-RPC error instead of a result
+    pass
+
+
+def rpc_call(url, method, params=None, session=None, timeout=10):
+    # Sends one JSON-RPC call and returns its result
+    payload = {"jsonrpc": "2.0", "method": method, "params": params or [], "id": 1}
+    response = _post(url, payload, session, timeout)
+    if "error" in response:
+        raise RpcError(f"{method} failed: {response['error']}")
+    return response.get("result")
+
+
+def rpc_batch(url, calls, session=None, timeout=20, batch_size=BATCH_SIZE):
+    # Sends many (method, params) calls as JSON-RPC batches
+    # Returns results in the same order as calls, with None for any call the node rejected
+    results = [None] * len(calls)
+    for start in range(0, len(calls), batch_size):
+        chunk = calls[start:start + batch_size]
+        payload = [{"jsonrpc": "2.0", "method": method, "params": params, "id": start + i}
+                   for i, (method, params) in enumerate(chunk)]
+        response = _post(url, payload, session, timeout)
+        if isinstance(response, dict):
+            # Some nodes answer a whole batch with a single error object
+            raise RpcError(f"Batch rejected: {response.get('error', response)}")
+        for item in response:  # Batch answers may come back in any order, match them by id
+            if "result" in item and isinstance(item.get("id"), int) and 0 <= item["id"] < len(calls):
+                results[item["id"]] = item["result"]
+    return results
+
+
+def _post(url, payload, session, timeout):
+    # One HTTP round trip to a node URL, or through a provider pool
+    if isinstance(url, str):
+        return (session or upstream_session).post(url, json=payload, timeout=timeout).json()
+    return url.post(payload, session=session, timeout=timeout)
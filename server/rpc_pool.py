@@ -0,0 +1,308 @@
+# rpc_pool.py
+# Ethereum JSON-RPC provider pool for BlockSpeak
+# Every Ethereum node we can use (Alchemy, Infura, a local Hardhat) is a provider with a running
+# health score built from real traffic and a background probe: latency (EWMA and p95 of recent
+# calls), error rate, cooldowns after failures in a row, and how many blocks it lags the best head.
+# Reads go to the best provider and, when it hasnt answered within its own p95, to the next one as
+# well, the first answer wins (a hedged request). A provider that errors or times out is skipped on
+# the next call and retried after its cooldown. Writes, and the pending nonce they depend on, stick
+# to one provider until it fails, so a transaction and its nonce never land on different nodes.
+# rpc_call and rpc_batch take a pool wherever they take a URL, and web3_provider() and
+# async_web3_provider() plug it into web3 and AsyncWeb3.
+# Try it against two local stubs with injected latency and failures: python bench/rpc_pool.py
+
+import os  # Worker pid, threads dont survive a gunicorn fork
+import json  # web3 request encoding
+import asyncio  # Runs pool calls off the event loop for the async web3
+import time  # Latency and cooldowns
+import logging  # Logs for debugging failovers
+import itertools  # Request ids for web3
+import threading  # Guards provider stats, runs the prober
+from collections import deque  # Recent latencies for p95
+from concurrent.futures import ThreadPoolExecutor  # Hedged attempts run side by side
+from concurrent.futures import wait  # First answer wins
+from concurrent.futures import FIRST_COMPLETED  # Same
+from metrics import InstrumentedSession  # Timed HTTP per provider
+from metrics import registry  # Attempts, hedges and failovers
+
+logger = logging.getLogger(__name__)
+
+# Methods that read chain state, safe to send to two providers at once
+READ_METHODS = frozenset([
+    "eth_blockNumber", "eth_chainId", "net_version", "web3_clientVersion", "eth_syncing",
+    "eth_getBalance", "eth_getCode", "eth_getStorageAt", "eth_call", "eth_estimateGas",
+    "eth_getBlockByNumber", "eth_getBlockByHash", "eth_getLogs", "eth_getTransactionByHash",
+    "eth_getTransactionReceipt", "eth_gasPrice", "eth_maxPriorityFeePerGas", "eth_feeHistory",
+])
+
+LATENCY_WINDOW = 200  # Recent successful calls kept per provider for p95
+EWMA_ALPHA = 0.2  # Weight of the newest sample in the latency and error averages
+HEDGE_DEFAULT = 0.5  # Seconds before a hedge while a provider has too few samples for a p95
+HEDGE_MIN = 0.05  # Never hedge sooner, a fast provider would otherwise double our traffic
+HEDGE_MAX = 2.0  # Never wait longer
+MIN_SAMPLES = 20  # Samples before p95 is trusted
+FAILURES_TO_COOLDOWN = 3  # Failures in a row that take a provider out of rotation
+COOLDOWN_SECONDS = 10  # First cooldown, doubles on every cooldown in a row up to MAX_COOLDOWN
+MAX_COOLDOWN = 120
+MAX_LAG = 3  # Blocks behind the best head before a provider is scored down
+LAG_PENALTY = 1.0  # Seconds added to the score per block of lag past MAX_LAG
+PROBE_SECONDS = 15  # Background eth_blockNumber on every provider
+
+
+def is_read(call):
+    # True for calls any provider can answer, the pending nonce belongs with the writes it is for
+    if call["method"] == "eth_getTransactionCount":
+        return (call.get("params") or ["", "latest"])[-1] != "pending"
+    return call["method"] in READ_METHODS
+
+
+class ProviderUnavailable(ConnectionError):
+    # A provider answered with an HTTP error or not at all, the pool tries the next one
+    # A ConnectionError so web3's is_connected() reports False instead of raising
+    pass
+
+
+class RpcProvider:
+    # One node and its running health numbers
+    def __init__(self, name, url):
+        self.name = name
+        self.url = url
+        self.latencies = deque(maxlen=LATENCY_WINDOW)
+        self.latency = None  # EWMA seconds of successful calls
+        self.error_rate = 0.0  # EWMA of failures, 0 to 1
+        self.failures = 0  # In a row
+        self.cooldowns = 0  # In a row
+        self.cooldown_until = 0.0
+        self.head = None  # Latest block from the prober
+        self.lock = threading.Lock()
+
+    def record(self, seconds, failed):
+        with self.lock:
+            self.error_rate += EWMA_ALPHA * ((1.0 if failed else 0.0) - self.error_rate)
+            if failed:
+                self.failures += 1
+                if self.failures >= FAILURES_TO_COOLDOWN:
+                    self.cooldown_until = time.monotonic() + min(COOLDOWN_SECONDS * 2 ** self.cooldowns, MAX_COOLDOWN)
+                    self.cooldowns += 1
+                    self.failures = 0
+                    logger.warning(f"RPC provider {self.name} out of rotation for "
+                                   f"{self.cooldown_until - time.monotonic():.0f}s")
+                return
+            self.failures = 0
+            self.cooldowns = 0
+            self.latencies.append(seconds)
+            self.latency = seconds if self.latency is None else self.latency + EWMA_ALPHA * (seconds - self.latency)
+
+    def available(self):
+        return time.monotonic() >= self.cooldown_until
+
+    def p95(self):
+        # p95 of recent successful calls, None until there are MIN_SAMPLES
+        samples = sorted(self.latencies)
+        if len(samples) < MIN_SAMPLES:
+            return None
+        return samples[min(len(samples) - 1, int(len(samples) * 0.95))]
+
+    def hedge_delay(self):
+        p95 = self.p95()
+        return HEDGE_DEFAULT if p95 is None else min(HEDGE_MAX, max(HEDGE_MIN, p95))
+
+    def score(self, best_head=None):
+        # Expected seconds per call, lower is better
+        latency = HEDGE_DEFAULT if self.latency is None else self.latency
+        lag = (best_head - self.head) if best_head is not None and self.head is not None else 0
+        return latency * (1 + 4 * self.error_rate) + max(0, lag - MAX_LAG) * LAG_PENALTY
+
+    def stats(self):
+        return {"name": self.name, "available": self.available(), "latency": self.latency, "p95": self.p95(),
+                "error_rate": round(self.error_rate, 3), "head": self.head}
+
+
+class RpcPool:
+    # Picks, hedges and fails over between providers, rpc.py calls post() when given a pool instead of a URL
+    def __init__(self, providers, session=None, max_workers=32, probe_seconds=PROBE_SECONDS):
+        if not providers:
+            raise ValueError("An RPC pool needs at least one provider")
+        self.providers = [provider if isinstance(provider, RpcProvider) else RpcProvider(*provider)
+                          for provider in providers]
+        self.session = session or InstrumentedSession()
+        self.max_workers = max_workers
+        self.executor = None
+        self.sticky = None  # Provider that takes writes
+        self.lock = threading.Lock()
+        self.probe_seconds = probe_seconds
+        self.pid = None  # Process the executor and prober belong to
+
+    def _start(self):
+        # Executor and prober once per process, they start on first use so a forked worker gets its own
+        with self.lock:
+            if self.pid == os.getpid():
+                return
+            self.pid = os.getpid()
+            self.executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="rpc-pool")
+            if len(self.providers) > 1 and self.probe_seconds:
+                threading.Thread(target=self._probe_loop, name="rpc-pool-prober", daemon=True).start()
+
+    def ranked(self):
+        # Providers best first, ones in cooldown only when every provider is cooling down
+        if self.pid != os.getpid():
+            self._start()
+        heads = [p.head for p in self.providers if p.head is not None]
+        best_head = max(heads) if heads else None
+        available = [p for p in self.providers if p.available()]
+        if not available:
+            return sorted(self.providers, key=lambda p: p.cooldown_until)
+        return sorted(available, key=lambda p: p.score(best_head))
+
+    def best(self):
+        return self.ranked()[0]
+
+    @property
+    def url(self):
+        # Best provider's URL right now, for logs and clients that need a plain endpoint
+        return self.best().url
+
+    def post(self, payload, session=None, timeout=10):
+        # Sends one JSON-RPC payload (a call or a batch), hedged when every call in it is a read
+        http = session or self.session
+        if all(is_read(call) for call in (payload if isinstance(payload, list) else [payload])):
+            return self._hedged(payload, http, timeout)
+        return self._sticky(payload, http, timeout)
+
+    def _attempt(self, provider, payload, http, timeout):
+        started = time.perf_counter()
+        try:
+            response = http.post(provider.url, json=payload, timeout=timeout)
+            if response.status_code == 429 or response.status_code >= 500:
+                raise ProviderUnavailable(f"{provider.name} answered HTTP {response.status_code}")
+            body = response.json()
+        except Exception as e:
+            provider.record(time.perf_counter() - started, failed=True)
+            registry.inc("rpc_provider_requests_total", (("provider", provider.name), ("outcome", "failed")))
+            raise e if isinstance(e, ProviderUnavailable) else ProviderUnavailable(f"{provider.name}: {str(e)}")
+        provider.record(time.perf_counter() - started, failed=False)
+        registry.inc("rpc_provider_requests_total", (("provider", provider.name), ("outcome", "ok")))
+        return body
+
+    def _hedged(self, payload, http, timeout):
+        # Best provider first, the next one after the first's p95 or right away on an error, first answer wins
+        ranked = self.ranked()
+        if len(ranked) == 1:
+            return self._attempt(ranked[0], payload, http, timeout)  # Nothing to hedge with, skip the thread hop
+        pending = {}
+        error = None
+        hedged = False
+
+        def launch(index):
+            provider = ranked[index]
+            pending[self.executor.submit(self._attempt, provider, payload, http, timeout)] = provider
+
+        launch(0)
+        next_index = 1
+        while pending:
+            can_hedge = not hedged and next_index < len(ranked)
+            done, _ = wait(pending, timeout=ranked[0].hedge_delay() if can_hedge else None, return_when=FIRST_COMPLETED)
+            if not done:
+                hedged = True
+                registry.inc("rpc_hedged_total", (("provider", ranked[next_index].name),))
+                launch(next_index)
+                next_index += 1
+                continue
+            for future in done:
+                provider = pending.pop(future)
+                try:
+                    body = future.result()
+                except ProviderUnavailable as e:
+                    error = e
+                    if next_index < len(ranked):
+                        registry.inc("rpc_failover_total", (("provider", provider.name),))
+                        launch(next_index)
+                        next_index += 1
+                    continue
+                return body  # Any other attempt still running finishes in the background and only updates its stats
+        raise error
+
+    def _sticky(self, payload, http, timeout):
+        # Writes go to one provider until it fails, they are never hedged or resent
+        ranked = self.ranked()
+        with self.lock:
+            if self.sticky is None or not self.sticky.available():
+                self.sticky = ranked[0]
+                logger.info(f"RPC writes now go to {self.sticky.name}")
+            provider = self.sticky
+        try:
+            return self._attempt(provider, payload, http, timeout)
+        except ProviderUnavailable:
+            with self.lock:
+                if self.sticky is provider:
+                    self.sticky = None  # The next write picks the best provider again
+            raise
+
+    def _probe_loop(self):
+        # Keeps heads and latency current for every provider, including ones traffic isnt reaching
+        while True:
+            for provider in self.providers:
+                try:
+                    payload = {"jsonrpc": "2.0", "method": "eth_blockNumber", "params": [], "id": 1}
+                    body = self._attempt(provider, payload, self.session, 5)
+                    provider.head = int(body["result"], 16)
+                except Exception as e:
+                    logger.debug(f"RPC probe of {provider.name} failed: {str(e)}")
+            time.sleep(self.probe_seconds)
+
+    def stats(self):
+        return [provider.stats() for provider in self.providers]
+
+
+def pool_from_env(value, defaults, session=None):
+    # RpcPool from "name=url,name=url" (ETH_RPC_URLS), or from the (name, url) defaults with a URL set
+    if value:
+        providers = []
+        for i, part in enumerate(part.strip() for part in value.split(",")):
+            name, _, url = part.partition("=")
+            if not url or "/" in name or ":" in name:
+                name, url = f"node{i}", part  # A bare URL, which may have its own "=" in the query string
+            if url:
+                providers.append((name, url))
+    else:
+        providers = [(name, url) for name, url in defaults if url]
+    return RpcPool(providers, session=session)
+
+
+def web3_provider(pool):
+    # web3 provider that sends every request through the pool, web3 is imported here on first use
+    from web3.providers import JSONBaseProvider
+
+    class PoolProvider(JSONBaseProvider):
+        request_ids = itertools.count(1)
+
+        @property
+        def endpoint_uri(self):
+            return pool.url
+
+        def make_request(self, method, params):
+            payload = json.loads(self.encode_rpc_request(method, params))  # web3's encoder handles HexBytes and friends
+            payload["id"] = next(self.request_ids)
+            return pool.post(payload)
+
+    return PoolProvider()
+
+
+def async_web3_provider(pool):
+    # AsyncWeb3 provider that sends every request through the pool on a thread, so async reads get
+    # the same ranking, hedging and failover as the sync ones instead of one fixed provider URL
+    from web3.providers.async_base import AsyncJSONBaseProvider
+
+    class AsyncPoolProvider(AsyncJSONBaseProvider):
+        request_ids = itertools.count(1)
+
+        @property
+        def endpoint_uri(self):
+            return pool.url
+
+        async def make_request(self, method, params):
+            payload = json.loads(self.encode_rpc_request(method, params))
+            payload["id"] = next(self.request_ids)
+            return await asyncio.to_thread(pool.post, payload)
+
+    return AsyncPoolProvider()
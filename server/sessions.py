@@ -0,0 +1,200 @@
+# sessions.py
+# Server-side sessions and MetaMask login nonces for BlockSpeak
+# The session cookie only carries a random session ID, the data lives in Redis (REDIS_URL) or, for
+# local runs, a key-value table in users.db. Sessions are only written when a view changes them, so
+# most responses send no Set-Cookie at all. Login nonces live in the same store with a short TTL and
+# are consumed exactly once, so a nonce issued by one worker or node can be used on another.
+
+import time  # Expiry times
+import json  # Nonce values
+import secrets  # Session IDs and nonces
+import logging  # Logs for debugging store failures
+from flask.sessions import SessionInterface  # Flask's hook for custom session backends
+from flask.sessions import SessionMixin  # Gives our dict the session flags Flask expects
+from flask.sessions import session_json_serializer  # Same tagged JSON the cookie sessions used
+from werkzeug.datastructures import CallbackDict  # Marks the session modified on every change
+from db import connect as db_connect  # Timed SQLite connections
+from lazy import lazy_module  # redis is only imported when REDIS_URL is set
+
+logger = logging.getLogger(__name__)
+
+redis = lazy_module("redis")
+
+NONCE_TTL = 300  # Seconds a MetaMask login nonce stays valid
+PURGE_SECONDS = 60  # How often one worker clears expired rows from the SQLite store
+
+
+class SQLiteStore:
+    # Key-value store with expiry in users.db, fine for one machine with several workers
+    def __init__(self, db_path="users.db"):
+        self.db_path = db_path
+        self.purged = 0.0
+        conn = db_connect(db_path)
+        conn.execute('''CREATE TABLE IF NOT EXISTS kv_store (
+            key TEXT PRIMARY KEY,
+            value TEXT NOT NULL,
+            expires_at REAL NOT NULL)''')
+        conn.commit()
+        conn.close()
+
+    def get(self, key):
+        # (value, seconds left) for a live key, (None, None) otherwise
+        now = time.time()
+        conn = db_connect(self.db_path)
+        row = conn.execute("SELECT value, expires_at FROM kv_store WHERE key = ? AND expires_at > ?",
+                           (key, now)).fetchone()
+        conn.close()
+        return (row[0], row[1] - now) if row else (None, None)
+
+    def set(self, key, value, ttl):
+        now = time.time()
+        conn = db_connect(self.db_path)
+        conn.execute("INSERT OR REPLACE INTO kv_store (key, value, expires_at) VALUES (?, ?, ?)",
+                     (key, value, now + ttl))
+        if now - self.purged > PURGE_SECONDS:
+            self.purged = now
+            conn.execute("DELETE FROM kv_store WHERE expires_at <= ?", (now,))
+        conn.commit()
+        conn.close()
+
+    def pop(self, key):
+        # Returns and deletes a live value in one statement, so two workers cant both consume it
+        conn = db_connect(self.db_path)
+        row = conn.execute("DELETE FROM kv_store WHERE key = ? AND expires_at > ? RETURNING value",
+                           (key, time.time())).fetchone()
+        conn.commit()
+        conn.close()
+        return row[0] if row else None
+
+    def delete(self, key):
+        conn = db_connect(self.db_path)
+        conn.execute("DELETE FROM kv_store WHERE key = ?", (key,))
+        conn.commit()
+        conn.close()
+
+    def expire(self, key, ttl):
+        conn = db_connect(self.db_path)
+        conn.execute("UPDATE kv_store SET expires_at = ? WHERE key = ?", (time.time() + ttl, key))
+        conn.commit()
+        conn.close()
+
+
+class RedisStore:
+    # Same interface on Redis, shared by every worker and node
+    def __init__(self, url):
+        self.client = redis.Redis.from_url(url, decode_responses=True)
+
+    def get(self, key):
+        pipe = self.client.pipeline(transaction=False)  # One round trip for both
+        pipe.get(key)
+        pipe.ttl(key)
+        value, remaining = pipe.execute()
+        return (value, remaining) if value is not None else (None, None)
+
+    def set(self, key, value, ttl):
+        self.client.set(key, value, ex=int(ttl))
+
+    def pop(self, key):
+        pipe = self.client.pipeline()  # MULTI/EXEC, so GET and DEL happen together
+        pipe.get(key)
+        pipe.delete(key)
+        value, _ = pipe.execute()
+        return value
+
+    def delete(self, key):
+        self.client.delete(key)
+
+    def expire(self, key, ttl):
+        self.client.expire(key, int(ttl))
+
+
+def make_store(redis_url=None, db_path="users.db"):
+    # Redis when a URL is configured, otherwise the SQLite table
+    if redis_url:
+        logger.info("Sessions and nonces stored in Redis")
+        return RedisStore(redis_url)
+    logger.info("Sessions and nonces stored in SQLite")
+    return SQLiteStore(db_path)
+
+
+class ServerSession(CallbackDict, SessionMixin):
+    # Session dict that remembers its ID and whether a view changed it
+    def __init__(self, initial=None, sid=None, new=False, refresh=False):
+        def on_update(self):
+            self.modified = True
+        CallbackDict.__init__(self, initial, on_update)
+        self.sid = sid
+        self.new = new
+        self.refresh = refresh  # Close to expiry, extend it even without changes
+        self.loaded_user = (initial or {}).get("_user_id")  # Who was logged in when the request started
+        self.modified = False
+
+
+class ServerSessionInterface(SessionInterface):
+    # Flask session backend that keeps data in a store and only a session ID in the cookie
+    def __init__(self, store, prefix="session:"):
+        self.store = store
+        self.prefix = prefix
+
+    def open_session(self, app, request):
+        sid = request.cookies.get(self.get_cookie_name(app))
+        if sid:
+            try:
+                value, remaining = self.store.get(self.prefix + sid)
+                if value is not None:
+                    lifetime = app.permanent_session_lifetime.total_seconds()
+                    return ServerSession(session_json_serializer.loads(value), sid=sid,
+                                         refresh=remaining < lifetime / 2)
+            except Exception as e:
+                logger.error(f"Session load failed: {str(e)}")
+        return ServerSession(sid=secrets.token_urlsafe(32), new=True)
+
+    def save_session(self, app, session, response):
+        name = self.get_cookie_name(app)
+        domain = self.get_cookie_domain(app)
+        path = self.get_cookie_path(app)
+        key = self.prefix + session.sid
+        if not session:
+            if session.modified and not session.new:
+                self.store.delete(key)  # Logged out or cleared, drop it server-side too
+                response.delete_cookie(name, domain=domain, path=path)
+            return
+        if session.modified and not session.new and session.get("_user_id") != session.loaded_user:
+            self.store.delete(key)  # New ID whenever the logged-in user changes, so a planted ID is useless
+            session.sid = secrets.token_urlsafe(32)
+            session.new = True
+            key = self.prefix + session.sid
+        lifetime = app.permanent_session_lifetime.total_seconds()
+        if session.modified:
+            self.store.set(key, session_json_serializer.dumps(dict(session)), lifetime)
+        elif session.refresh:
+            self.store.expire(key, lifetime)
+        if session.new or (session.permanent and session.modified):
+            response.set_cookie(
+                name, session.sid,
+                expires=self.get_expiration_time(app, session),
+                httponly=self.get_cookie_httponly(app),
+                domain=domain,
+                path=path,
+                secure=self.get_cookie_secure(app),
+                samesite=self.get_cookie_samesite(app),
+            )
+
+
+class NonceStore:
+    # One-time MetaMask login nonces with a short TTL
+    def __init__(self, store, ttl=NONCE_TTL, prefix="nonce:"):
+        self.store = store
+        self.ttl = ttl
+        self.prefix = prefix
+
+    def issue(self):
+        nonce = secrets.token_hex(16)
+        self.store.set(self.prefix + nonce, json.dumps({"issued": time.time()}), self.ttl)
+        return nonce
+
+    def consume(self, nonce):
+        # True exactly once for a nonce we issued that hasnt expired
+        if not nonce or len(nonce) > 64:
+            return False
+        return self.store.pop(self.prefix + nonce) is not None
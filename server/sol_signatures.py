@@ -0,0 +1,157 @@
+# sol_signatures.py
+# Exact Solana transaction counts for BlockSpeak
+# getSignaturesForAddress returns at most 1000 signatures per call, so counting them once is wrong
+# for any busy wallet. We walk the pages with `before` cursors once, remember the newest signature
+# and the running count per address, and afterwards only fetch signatures newer than that cursor.
+
+from db import connect as db_connect  # Timed SQLite, stores cursors and running counts
+import logging  # Logs for debugging scans
+import threading  # One scan per address at a time in this process, through striped locks
+from datetime import datetime  # Timestamps for cursor rows
+from datetime import timezone  # Ensures times are UTC
+from rpc import rpc_call  # Single JSON-RPC calls for follow-up pages
+from rpc import rpc_batch  # First pages for many addresses in one round trip
+
+logger = logging.getLogger(__name__)
+
+PAGE_LIMIT = 1000        # Max signatures Solana returns per page
+BACKFILL_PAGES = 20      # Old pages we walk per request for wallets with huge histories
+MAX_NEW_PAGES = 1000     # Safety stop for the walk down to the stored cursor
+LOCK_STRIPES = 64        # Scan locks shared by hash, so memory stays flat however many addresses we see
+
+_scan_locks = [threading.Lock() for _ in range(LOCK_STRIPES)]
+
+
+def init_signature_tables(db_path="users.db"):
+    # Creates the sol_signature_cursors table if it doesnt exist
+    conn = db_connect(db_path)
+    c = conn.cursor()
+    c.execute('''CREATE TABLE IF NOT EXISTS sol_signature_cursors (
+        address TEXT PRIMARY KEY,
+        newest_signature TEXT,
+        oldest_signature TEXT,
+        tx_count INTEGER NOT NULL DEFAULT 0,
+        complete INTEGER NOT NULL DEFAULT 0,
+        updated_at TEXT)''')
+    conn.commit()
+    conn.close()
+
+
+def _lock_for(address):
+    # Lock for an address's stripe so two requests dont count the same new pages twice
+    return _scan_locks[hash(address) % LOCK_STRIPES]
+
+
+def _read_cursors(addresses, db_path):
+    # {address: (newest, oldest, count, complete)} for addresses we scanned before
+    conn = db_connect(db_path)
+    try:
+        placeholders = ",".join("?" for _ in addresses)
+        rows = conn.execute("SELECT address, newest_signature, oldest_signature, tx_count, complete "
+                            f"FROM sol_signature_cursors WHERE address IN ({placeholders})", addresses).fetchall()
+    finally:
+        conn.close()
+    return {row[0]: (row[1], row[2], row[3], bool(row[4])) for row in rows}
+
+
+def _page(rpc_url, address, before=None, until=None, session=None):
+    # One page of signatures, newest first
+    options = {"limit": PAGE_LIMIT}
+    if before:
+        options["before"] = before
+    if until:
+        options["until"] = until
+    return rpc_call(rpc_url, "getSignaturesForAddress", [address, options], session=session) or []
+
+
+def _scan(rpc_url, address, cursor, first_page, session=None):
+    # Updates one cursor given the first page already fetched (newer than the stored newest signature)
+    newest, oldest, count, complete = cursor
+    page = first_page
+    new_count = len(page)
+    last_seen = page[-1]["signature"] if page else None
+    pages = 1
+    # Walk down to the stored cursor (or the start of history on a first scan)
+    while len(page) == PAGE_LIMIT and pages < (MAX_NEW_PAGES if newest else BACKFILL_PAGES):
+        page = _page(rpc_url, address, before=last_seen, until=newest, session=session)
+        new_count += len(page)
+        pages += 1
+        if page:
+            last_seen = page[-1]["signature"]
+    if newest and len(page) == PAGE_LIMIT:
+        logger.warning(f"Stopped catching up {address} after {pages} pages, count may be low")
+    if newest is None:
+        # First scan: everything we saw is the whole history unless we stopped early
+        newest = first_page[0]["signature"] if first_page else None
+        oldest = last_seen
+        complete = len(page) < PAGE_LIMIT
+        count = new_count
+    else:
+        if first_page:
+            newest = first_page[0]["signature"]
+        count += new_count
+    # Keep backfilling older history a few pages per request until we reach the beginning
+    backfill = 0
+    while not complete and oldest and backfill < BACKFILL_PAGES:
+        page = _page(rpc_url, address, before=oldest, session=session)
+        count += len(page)
+        backfill += 1
+        if page:
+            oldest = page[-1]["signature"]
+        complete = len(page) < PAGE_LIMIT
+    return newest, oldest, count, complete
+
+
+def _update(rpc_url, address, cursor, first_page, db_path, session=None):
+    # Scans one address and stores its new cursor, the caller holds the address's lock
+    current = _read_cursors([address], db_path).get(address, (None, None, 0, False))
+    if current != cursor:
+        # Another request moved the cursor while we waited, our first page may overlap what it counted
+        cursor = current
+        first_page = _page(rpc_url, address, until=cursor[0], session=session)
+    newest, oldest, count, complete = _scan(rpc_url, address, cursor, first_page, session=session)
+    conn = db_connect(db_path)
+    try:
+        conn.execute("INSERT OR REPLACE INTO sol_signature_cursors (address, newest_signature, oldest_signature, "
+                     "tx_count, complete, updated_at) VALUES (?, ?, ?, ?, ?, ?)",
+                     (address, newest, oldest, count, int(complete), datetime.now(timezone.utc).isoformat()))
+        conn.commit()
+    finally:
+        conn.close()
+    return {"tx_count": count, "exact": complete}
+
+
+def count_signatures_many(rpc_url, addresses, db_path="users.db", session=None):
+    # Returns {address: {"tx_count", "exact"}} for many Solana addresses
+    # First pages for every address go out in one JSON-RPC batch, only busy wallets need more calls
+    # Each address is locked only while its own pages are walked, no lock or connection spans the batch
+    addresses = list(dict.fromkeys(addresses))
+    if not addresses:
+        return {}
+    cursors = _read_cursors(addresses, db_path)
+    calls = []
+    for address in addresses:
+        options = {"limit": PAGE_LIMIT}
+        newest = cursors.get(address, (None,))[0]
+        if newest:
+            options["until"] = newest  # Only signatures newer than what we already counted
+        calls.append(("getSignaturesForAddress", [address, options]))
+    first_pages = rpc_batch(rpc_url, calls, session=session)
+    results = {}
+    for address, first_page in zip(addresses, first_pages):
+        cursor = cursors.get(address, (None, None, 0, False))
+        if first_page is None:
+            if address in cursors:
+                results[address] = {"tx_count": cursor[2], "exact": cursor[3]}  # Serve the last known count
+            continue
+        with _lock_for(address):
+            try:
+                results[address] = _update(rpc_url, address, cursor, first_page, db_path, session=session)
+            except Exception as e:
+                logger.error(f"Signature scan failed for {address}: {str(e)}")
+    return results
+
+
+def count_signatures(rpc_url, address, db_path="users.db", session=None):
+    # Exact (or, mid-backfill, lower-bound) transaction count for one Solana address
+    return count_signatures_many(rpc_url, [address], db_path=db_path, session=session).get(address)
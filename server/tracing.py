@@ -0,0 +1,220 @@
+# tracing.py
+# Request-scoped tracing and a sampling profiler for slow requests
+# Every request gets a trace ID (in log lines and the X-Trace-Id header). With tracing on, upstream
+# calls, SQLite statements and backoff sleeps add spans to the request's trace, and any request over
+# trace_slow_ms logs a per-span breakdown and appends its spans to TRACE_DIR/traces.jsonl. With
+# profile_slow_ms set, a sampler thread records the stacks of in-flight requests and requests over that
+# threshold are written as collapsed stacks (TRACE_DIR/*.folded, open with flamegraph.pl or speedscope).
+# Switch it on and off at runtime for every worker by writing TRACE_CONTROL_FILE, for example:
+#   echo '{"tracing": true, "trace_slow_ms": 500, "profile_slow_ms": 2000}' > trace_control.json
+
+import os  # Env defaults, output files and the worker pid
+import re  # Safe file names from route templates
+import sys  # Stack samples from other threads
+import json  # Control file and traces.jsonl
+import time  # Span and request timings
+import uuid  # Trace IDs
+import logging  # Trace IDs on every log line
+import threading  # The sampler thread
+from collections import Counter  # Stack sample counts
+from contextlib import contextmanager  # span() helper
+from contextvars import ContextVar  # The current trace, per thread and per asyncio task
+from datetime import datetime  # Profile file names
+from datetime import timezone  # Ensures times are UTC
+
+logger = logging.getLogger(__name__)
+
+TRACE_DIR = os.getenv("TRACE_DIR", "traces")
+TRACE_CONTROL_FILE = os.getenv("TRACE_CONTROL_FILE", "trace_control.json")
+CONTROL_CHECK_SECONDS = 2  # How often a worker looks at the control file
+PROFILE_INTERVAL = float(os.getenv("PROFILE_INTERVAL_MS", "5")) / 1000  # Seconds between stack samples
+MAX_SPANS = 2000  # Spans kept per trace, a runaway loop shouldnt eat memory
+TRACE_ID_RE = re.compile(r"^[A-Za-z0-9-]{8,64}$")  # Accepted incoming X-Request-ID values
+
+DEFAULTS = {
+    "tracing": os.getenv("TRACING", "0") == "1",
+    "trace_slow_ms": int(os.getenv("TRACE_SLOW_MS", "1000")),
+    "profile_slow_ms": int(os.getenv("PROFILE_SLOW_MS", "0")),  # 0 keeps the profiler off
+}
+settings = dict(DEFAULTS)
+_control = {"checked": 0.0, "mtime": None}
+
+current_trace = ContextVar("current_trace", default=None)
+
+
+class Trace:
+    # One request: ID, route, start time and, when tracing is on, its spans
+    def __init__(self, name, trace_id=None, record=False):
+        self.trace_id = trace_id or uuid.uuid4().hex[:16]
+        self.name = name
+        self.started = time.perf_counter()
+        self.spans = [] if record else None  # [name, offset_ms, duration_ms]
+        self.thread_id = None  # Set when the profiler samples this request
+        self.skip = False  # Long-lived streams are never reported as slow
+
+
+def refresh_settings():
+    # Rereads the control file when it changed, at most every CONTROL_CHECK_SECONDS
+    now = time.monotonic()
+    if now - _control["checked"] < CONTROL_CHECK_SECONDS:
+        return settings
+    _control["checked"] = now
+    try:
+        mtime = os.path.getmtime(TRACE_CONTROL_FILE)
+    except OSError:
+        mtime = None
+    if mtime != _control["mtime"]:
+        _control["mtime"] = mtime
+        updated = dict(DEFAULTS)
+        if mtime is not None:
+            try:
+                with open(TRACE_CONTROL_FILE) as f:
+                    updated.update({k: v for k, v in json.load(f).items() if k in DEFAULTS})
+            except (OSError, ValueError) as e:
+                logger.warning(f"Ignoring trace control file: {str(e)}")
+        settings.update(updated)
+        logger.info(f"Tracing settings: {settings}")
+    return settings
+
+
+def start_trace(name, trace_id=None, sample_thread=False):
+    # Begins a trace for the current request, sample_thread lets the profiler watch this thread
+    config = refresh_settings()
+    if trace_id and not TRACE_ID_RE.match(trace_id):
+        trace_id = None
+    trace = Trace(name, trace_id, record=config["tracing"])
+    current_trace.set(trace)
+    if sample_thread and config["profile_slow_ms"]:
+        trace.thread_id = threading.get_ident()
+        profiler.watch(trace.thread_id)
+    return trace
+
+
+def finish_trace(trace, status=None):
+    # Ends a trace, reporting spans and stack samples when the request was slow
+    duration_ms = (time.perf_counter() - trace.started) * 1000
+    stacks = profiler.unwatch(trace.thread_id) if trace.thread_id is not None else None
+    try:
+        if trace.skip:
+            return
+        if trace.spans is not None and duration_ms >= settings["trace_slow_ms"]:
+            _report_spans(trace, duration_ms, status)
+        if stacks and duration_ms >= settings["profile_slow_ms"]:
+            _write_profile(trace, stacks)
+    finally:
+        current_trace.set(None)  # Cleared last so the report lines still carry the trace ID
+
+
+def current_trace_id():
+    trace = current_trace.get()
+    return trace.trace_id if trace else None
+
+
+def record_span(name, started, duration):
+    # Adds a finished span, started is a perf_counter value and duration is in seconds
+    trace = current_trace.get()
+    if trace is None or trace.spans is None or len(trace.spans) >= MAX_SPANS:
+        return
+    trace.spans.append([name, round((started - trace.started) * 1000, 2), round(duration * 1000, 2)])
+
+
+@contextmanager
+def span(name):
+    # Times a block as one span, for work that isnt already timed by metrics
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_span(name, started, time.perf_counter() - started)
+
+
+def _report_spans(trace, duration_ms, status):
+    # One warning line with the time per span name, plus the full spans in traces.jsonl
+    totals = {}
+    for name, _, ms in trace.spans:
+        total = totals.setdefault(name, [0.0, 0])
+        total[0] += ms
+        total[1] += 1
+    slowest = sorted(totals.items(), key=lambda item: -item[1][0])
+    breakdown = ", ".join(f"{name} {ms:.0f}ms x{count}" for name, (ms, count) in slowest)
+    logger.warning(f"Slow request {trace.name} {status} {duration_ms:.0f}ms: {breakdown or 'no spans'}")
+    try:
+        os.makedirs(TRACE_DIR, exist_ok=True)
+        with open(os.path.join(TRACE_DIR, "traces.jsonl"), "a") as f:
+            f.write(json.dumps({"trace_id": trace.trace_id, "name": trace.name, "status": status,
+                                "duration_ms": round(duration_ms, 2), "at": datetime.now(timezone.utc).isoformat(),
+                                "spans": trace.spans}) + "\n")
+    except OSError as e:
+        logger.warning(f"Could not save trace: {str(e)}")
+
+
+def _write_profile(trace, stacks):
+    # Collapsed stacks, one "frame;frame;frame count" line per distinct stack
+    slug = re.sub(r"[^A-Za-z0-9]+", "_", trace.name).strip("_")[:60]
+    stamp = datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%S")
+    path = os.path.join(TRACE_DIR, f"{stamp}-{slug}-{trace.trace_id}.folded")
+    try:
+        os.makedirs(TRACE_DIR, exist_ok=True)
+        with open(path, "w") as f:
+            f.writelines(f"{stack} {count}\n" for stack, count in stacks.most_common())
+        logger.warning(f"Slow request profile saved to {path}")
+    except OSError as e:
+        logger.warning(f"Could not save profile: {str(e)}")
+
+
+def _collapse(frame):
+    # Root-first "function (file:line)" frames joined with ";"
+    names = []
+    while frame is not None:
+        code = frame.f_code
+        names.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+        frame = frame.f_back
+    return ";".join(reversed(names))
+
+
+class SamplingProfiler:
+    # Samples the stacks of watched request threads, the thread only runs while profiling is on
+    def __init__(self, interval=PROFILE_INTERVAL):
+        self.interval = interval
+        self.watched = {}  # thread id -> Counter of collapsed stacks
+        self.lock = threading.Lock()
+        self.pid = None  # Process the sampler thread runs in, restarts after a gunicorn fork
+
+    def watch(self, thread_id):
+        with self.lock:
+            self.watched[thread_id] = Counter()
+            if self.pid != os.getpid():
+                self.pid = os.getpid()
+                threading.Thread(target=self._loop, name="trace-profiler", daemon=True).start()
+
+    def unwatch(self, thread_id):
+        with self.lock:
+            return self.watched.pop(thread_id, None)
+
+    def _loop(self):
+        while refresh_settings()["profile_slow_ms"]:
+            time.sleep(self.interval)
+            frames = sys._current_frames()
+            with self.lock:
+                for thread_id, stacks in self.watched.items():
+                    frame = frames.get(thread_id)
+                    if frame is not None:
+                        stacks[_collapse(frame)] += 1
+        with self.lock:
+            self.pid = None  # Switched off, the next watch() starts a new thread
+
+
+profiler = SamplingProfiler()
+
+
+def install_log_ids():
+    # Every log record gets a trace_id attribute, "-" outside a request, for %(trace_id)s in formats
+    make_record = logging.getLogRecordFactory()
+
+    def record_with_trace(*args, **kwargs):
+        record = make_record(*args, **kwargs)
+        trace = current_trace.get()
+        record.trace_id = trace.trace_id if trace else "-"
+        return record
+
+    logging.setLogRecordFactory(record_with_trace)